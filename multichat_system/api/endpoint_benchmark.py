@@ -0,0 +1,465 @@
+"""
+Orçamento de consultas e latência por endpoint da API.
+
+Regressões de desempenho na API quase sempre são N+1 acidentais (um
+``SerializerMethodField`` que consulta por linha) ou filtros sem índice.
+Este módulo:
+
+- gera um conjunto de dados realista com ``bulk_create`` (clientes,
+  milhares de chats, até ~1M de mensagens, mídias e consolidação dos
+  relatórios);
+- chama cada endpoint quente pelo cliente de teste do Django, contando as
+  consultas SQL (``CaptureQueriesContext``) e medindo p50/p95;
+- roda ``EXPLAIN`` em cada SELECT executado e aponta varreduras completas
+  nas tabelas grandes, para que índices novos sejam justificados por medição.
+
+Os orçamentos ficam em ``ENDPOINTS``: o número de consultas não pode
+depender do tamanho da página nem do volume de dados. Usado pelo comando
+``benchmark_endpoints`` e pelos testes de ``api/tests.py``.
+
+Autor: Sistema MultiChat
+"""
+
+import contextlib
+import json
+import random
+import re
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from webhook.ingest_benchmark import git_revision, percentile
+
+# Tabelas em que uma varredura completa é problema (as demais são pequenas por cliente)
+LARGE_TABLES = {
+    'core_chat',
+    'core_mensagem',
+    'core_mediafile',
+    'core_messagerollup',
+    'core_webhookevent',
+    'webhook_webhookevent',
+}
+
+VOCABULARIO = [
+    'pedido', 'entrega', 'pagamento', 'boleto', 'orçamento', 'cancelamento', 'troca',
+    'prazo', 'endereço', 'nota', 'fiscal', 'produto', 'suporte', 'obrigado', 'bom', 'dia',
+]
+MEDIA_TIPOS = [
+    ('image', 'imageMessage', 'image/jpeg'),
+    ('audio', 'audioMessage', 'audio/ogg; codecs=opus'),
+    ('document', 'documentMessage', 'application/pdf'),
+    ('video', 'videoMessage', 'video/mp4'),
+]
+
+
+@dataclass
+class Endpoint:
+    """Endpoint medido: ``request(dataset)`` devolve (método, url, dados)."""
+    name: str
+    request: Callable[[Dict], tuple]
+    max_queries: int
+    max_p95_ms: float
+    # Chamado antes de cada requisição medida (ex.: descartar cache para medir o caso frio)
+    before: Optional[Callable[[Dict], None]] = None
+    status: int = 200
+
+
+def _primeiro_chat(dataset: Dict) -> str:
+    return dataset['chat_ids'][0]
+
+
+def _descartar_dashboard(dataset: Dict) -> None:
+    from core import dashboard
+    dashboard.invalidate(dataset['cliente_id'])
+
+
+def _ultima_checagem(dataset: Dict) -> str:
+    return (timezone.now() - timedelta(minutes=10)).isoformat().replace('+00:00', 'Z')
+
+
+# Orçamentos por endpoint (usuário do tipo "cliente", página padrão de 20 itens).
+# Toda requisição autenticada por sessão já custa 3 consultas (sessão, usuário, cliente).
+# p95 calibrado com o conjunto padrão (~1M de mensagens, SQLite); ver --fator-latencia.
+ENDPOINTS: List[Endpoint] = [
+    Endpoint('chats-list', lambda d: ('get', '/api/chats/', None), max_queries=7, max_p95_ms=300),
+    Endpoint('chats-stats', lambda d: ('get', '/api/chats/stats/', None), max_queries=4, max_p95_ms=100),
+    Endpoint(
+        'chats-check-updates',
+        lambda d: ('get', '/api/chats/check-updates/', {'last_check': _ultima_checagem(d)}),
+        max_queries=6, max_p95_ms=100,
+    ),
+    Endpoint(
+        'mensagens-list',
+        lambda d: ('get', '/api/mensagens/', {'chat_id': _primeiro_chat(d)}),
+        max_queries=6, max_p95_ms=100,
+    ),
+    Endpoint(
+        'mensagens-marcar-lidas',
+        lambda d: ('post', '/api/mensagens/marcar-lidas/', {'chat_id': _primeiro_chat(d)}),
+        max_queries=4, max_p95_ms=50,
+    ),
+    Endpoint(
+        'mensagens-search',
+        lambda d: ('get', '/api/mensagens/search/', {'q': 'pedido entrega'}),
+        max_queries=7, max_p95_ms=1000,
+    ),
+    Endpoint(
+        'mensagens-export',
+        lambda d: ('get', '/api/mensagens/export/', {'chat_id': _primeiro_chat(d), 'formato': 'ndjson'}),
+        max_queries=4, max_p95_ms=100,
+    ),
+    Endpoint(
+        'dashboard', lambda d: ('get', '/api/dashboard/', None),
+        max_queries=7, max_p95_ms=800, before=_descartar_dashboard,
+    ),
+    Endpoint('relatorios', lambda d: ('get', '/api/relatorios/', None), max_queries=5, max_p95_ms=100),
+    Endpoint('media-files', lambda d: ('get', '/api/media-files/', None), max_queries=5, max_p95_ms=400),
+]
+
+
+# ----------------------------------------------------------------------
+# Conjunto de dados
+
+
+@contextlib.contextmanager
+def _datas_explicitas():
+    """Desliga ``auto_now_add`` para gravar datas históricas direto no ``bulk_create``."""
+    from core.models import Chat, Mensagem
+    campos = [Chat._meta.get_field('data_inicio'), Mensagem._meta.get_field('data_envio')]
+    anteriores = [campo.auto_now_add for campo in campos]
+    for campo in campos:
+        campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        for campo, valor in zip(campos, anteriores):
+            campo.auto_now_add = valor
+
+
+def _texto(rng: random.Random, n: int) -> str:
+    return ' '.join(rng.choice(VOCABULARIO) for _ in range(rng.randint(3, 12))) + f' #{n}'
+
+
+def _midia(rng: random.Random, n: int):
+    tipo, campo, mimetype = MEDIA_TIPOS[n % len(MEDIA_TIPOS)]
+    dados = {'url': f'https://mmg.whatsapp.net/v/t62/{n}.enc', 'mimetype': mimetype,
+             'mediaKey': f'chave{n}', 'directPath': f'/v/t62/{n}.enc'}
+    if tipo == 'image':
+        dados['caption'] = _texto(rng, n)
+    elif tipo == 'document':
+        dados['fileName'] = f'{rng.choice(VOCABULARIO)}_{n}.pdf'
+    elif tipo == 'audio':
+        dados['seconds'] = rng.randint(1, 90)
+    return tipo, mimetype, json.dumps({campo: dados}, ensure_ascii=False)
+
+
+def seed_dataset(clientes: int = 2, chats: int = 2000, messages_per_chat: int = 500, media_every: int = 10,
+                 days: int = 90, seed: int = 42, batch_size: int = 5000,
+                 progress: Optional[Callable[[str], None]] = None) -> Dict:
+    """
+    Cria ``clientes`` clientes com ``chats`` chats no total e
+    ``messages_per_chat`` mensagens por chat (padrão: ~1M de mensagens),
+    espalhadas pelos últimos ``days`` dias. Uma a cada ``media_every``
+    mensagens é mídia, com o ``MediaFile`` correspondente. Os chats mais
+    recentes recebem mensagens nos últimos minutos (``check-updates``).
+
+    Retorna os identificadores usados pelos endpoints medidos (do primeiro cliente).
+    """
+    from authentication.models import Usuario
+    from core.models import Chat, Cliente, MediaFile, Mensagem, WhatsappInstance
+    from core.rollups import rebuild
+
+    rng = random.Random(seed)
+    agora = timezone.now()
+    inicio = agora - timedelta(days=days)
+    progress = progress or (lambda texto: None)
+
+    chats_por_cliente = max(1, chats // clientes)
+    dataset = {'clientes': [], 'chat_ids': [], 'chats': chats_por_cliente * clientes, 'messages': 0, 'media': 0}
+    contador = 0
+
+    with _datas_explicitas():
+        for c in range(clientes):
+            cliente = Cliente.objects.create(nome=f'Benchmark API {c}', email=f'benchmark{c}@multichat.local')
+            instancia = WhatsappInstance.objects.create(
+                instance_id=f'BENCH-API-{c:04d}', token='benchmark-token', cliente=cliente, status='conectado'
+            )
+            # O dashboard associa o usuário "cliente" ao Cliente pelo e-mail
+            usuario = Usuario.objects.create_user(
+                username=f'bench_cliente_{c}', email=cliente.email, password='benchmark',
+                tipo_usuario='cliente', cliente=cliente,
+            )
+            dataset['clientes'].append({'id': cliente.id, 'usuario_id': usuario.id})
+
+            objetos = []
+            for n in range(chats_por_cliente):
+                aberto_em = inicio + timedelta(seconds=rng.randint(0, days * 86400 // 2))
+                objetos.append(Chat(
+                    cliente=cliente,
+                    chat_id=f'55{c:02d}9{n:08d}@s.whatsapp.net',
+                    chat_name=f'Contato {c}-{n}',
+                    status=rng.choice(['active', 'active', 'closed', 'pending']),
+                    foto_perfil=f'https://pps.whatsapp.net/{c}/{n}.jpg' if n % 3 else None,
+                    data_inicio=aberto_em,
+                    data_fim=aberto_em + timedelta(hours=rng.randint(1, 72)) if n % 4 == 1 else None,
+                ))
+            Chat.objects.bulk_create(objetos, batch_size=batch_size)
+            chats_cliente = list(Chat.objects.filter(cliente=cliente).order_by('id'))
+            progress(f'👥 Cliente {c}: {len(chats_cliente)} chats')
+
+            mensagens, midias = [], []
+            ultimas = {}
+            for posicao, chat in enumerate(chats_cliente):
+                # Os 20 primeiros chats tiveram atividade nos últimos minutos
+                fim_chat = agora - timedelta(minutes=2) if posicao < 20 else agora - timedelta(hours=posicao % 240 + 1)
+                passo = (fim_chat - chat.data_inicio) / max(1, messages_per_chat)
+                for m in range(messages_per_chat):
+                    contador += 1
+                    enviada_em = chat.data_inicio + passo * (m + 1)
+                    from_me = m % 2 == 1
+                    message_id = f'BENCHAPI{contador:012d}'
+                    if contador % media_every == 0:
+                        tipo, mimetype, conteudo = _midia(rng, contador)
+                        midias.append(MediaFile(
+                            cliente=cliente, instance=instancia, chat=chat, message_id=message_id,
+                            sender_name=chat.chat_name, sender_id=chat.chat_id, media_type=tipo,
+                            mimetype=mimetype, download_status='success' if contador % 7 else 'failed',
+                            from_me=from_me, message_timestamp=enviada_em,
+                        ))
+                    else:
+                        tipo, conteudo = 'text', _texto(rng, contador)
+                    mensagens.append(Mensagem(
+                        chat=chat, remetente=instancia.instance_id if from_me else chat.chat_id.split('@')[0],
+                        conteudo=conteudo, tipo=tipo, from_me=from_me, message_id=message_id,
+                        sender_display_name=None if from_me else chat.chat_name,
+                        lida=from_me or m < messages_per_chat - 3, data_envio=enviada_em,
+                    ))
+                    ultimas[chat.id] = enviada_em
+                    if len(mensagens) >= batch_size:
+                        Mensagem.objects.bulk_create(mensagens, batch_size=batch_size)
+                        dataset['messages'] += len(mensagens)
+                        mensagens = []
+                if len(midias) >= batch_size:
+                    MediaFile.objects.bulk_create(midias, batch_size=batch_size)
+                    dataset['media'] += len(midias)
+                    midias = []
+            Mensagem.objects.bulk_create(mensagens, batch_size=batch_size)
+            MediaFile.objects.bulk_create(midias, batch_size=batch_size)
+            dataset['messages'] += len(mensagens)
+            dataset['media'] += len(midias)
+
+            for chat in chats_cliente:
+                chat.last_message_at = ultimas.get(chat.id)
+            Chat.objects.bulk_update(chats_cliente, ['last_message_at'], batch_size=batch_size)
+            if c == 0:
+                dataset['chat_ids'] = [chat.chat_id for chat in chats_cliente[:20]]
+            progress(f'💬 Cliente {c}: {dataset["messages"]} mensagens, {dataset["media"]} mídias até agora')
+
+    rebuild(timezone.localtime(inicio).date(), timezone.localdate())
+    progress('📊 Consolidação dos relatórios recalculada')
+
+    dataset['cliente_id'] = dataset['clientes'][0]['id']
+    dataset['usuario_id'] = dataset['clientes'][0]['usuario_id']
+    return dataset
+
+
+# ----------------------------------------------------------------------
+# EXPLAIN
+
+
+def _explain_sql(sql: str) -> Optional[str]:
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        return f'EXPLAIN QUERY PLAN {sql}'
+    if vendor in ('postgresql', 'mysql'):
+        return f'EXPLAIN {sql}'
+    return None
+
+
+def _full_scans(vendor: str, rows: List[tuple]) -> List[str]:
+    """Tabelas lidas por inteiro segundo o plano (SQLite, PostgreSQL ou MySQL)."""
+    tabelas = []
+    for row in rows:
+        if vendor == 'sqlite':
+            detalhe = str(row[-1])
+            match = re.match(r'SCAN (\w+)(.*)', detalhe)
+            if match and 'USING' not in match.group(2) and 'VIRTUAL TABLE' not in match.group(2):
+                tabelas.append(match.group(1))
+        elif vendor == 'postgresql':
+            match = re.search(r'Seq Scan on (\w+)', str(row[0]))
+            if match:
+                tabelas.append(match.group(1))
+        elif vendor == 'mysql':
+            # (id, select_type, table, partitions, type, ...)
+            if len(row) > 4 and row[4] == 'ALL':
+                tabelas.append(str(row[2]))
+    return tabelas
+
+
+def explain_queries(queries: List[Dict]) -> List[Dict]:
+    """
+    Plano de cada SELECT capturado.
+
+    Returns:
+        Lista de {sql, plan, full_scans} (full_scans só com tabelas de LARGE_TABLES)
+    """
+    planos = []
+    vistos = set()
+    for query in queries:
+        sql = query['sql']
+        if not sql.lstrip().upper().startswith('SELECT') or sql in vistos:
+            continue
+        vistos.add(sql)
+        explain = _explain_sql(sql)
+        if not explain:
+            continue
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(explain)
+                rows = cursor.fetchall()
+        except Exception as e:
+            planos.append({'sql': sql, 'plan': [f'erro: {e}'], 'full_scans': []})
+            continue
+        scans = [tabela for tabela in _full_scans(connection.vendor, rows) if tabela in LARGE_TABLES]
+        planos.append({'sql': sql, 'plan': [' '.join(str(c) for c in row) for row in rows], 'full_scans': scans})
+    return planos
+
+
+# ----------------------------------------------------------------------
+# Medição
+
+
+def _call(client: Client, method: str, url: str, data):
+    if method == 'post':
+        response = client.post(url, data=json.dumps(data or {}), content_type='application/json')
+    else:
+        response = client.get(url, data or {})
+    if getattr(response, 'streaming', False):
+        # Exportação: o custo está em consumir o corpo
+        for _ in response.streaming_content:
+            pass
+    return response
+
+
+def measure_endpoint(client: Client, endpoint: Endpoint, dataset: Dict, iterations: int = 20,
+                     warmup: int = 2, explain: bool = True, latency_factor: float = 1.0) -> Dict:
+    """Mede um endpoint: consultas por requisição, latência e planos das consultas."""
+    method, url, data = endpoint.request(dataset)
+    for _ in range(warmup):
+        if endpoint.before:
+            endpoint.before(dataset)
+        _call(client, method, url, data)
+
+    latencias, consultas, statuses = [], [], set()
+    capturadas = []
+    for _ in range(max(1, iterations)):
+        if endpoint.before:
+            endpoint.before(dataset)
+        with CaptureQueriesContext(connection) as queries:
+            t0 = time.perf_counter()
+            response = _call(client, method, url, data)
+            latencias.append((time.perf_counter() - t0) * 1000)
+        consultas.append(len(queries.captured_queries))
+        statuses.add(response.status_code)
+        capturadas = queries.captured_queries
+
+    ordenadas = sorted(latencias)
+    planos = explain_queries(capturadas) if explain else []
+    full_scans = sorted({tabela for plano in planos for tabela in plano['full_scans']})
+    resultado = {
+        'endpoint': endpoint.name,
+        'url': url,
+        'status_codes': sorted(statuses),
+        'queries': max(consultas),
+        'latency_ms': {
+            'p50': round(percentile(ordenadas, 50), 2),
+            'p95': round(percentile(ordenadas, 95), 2),
+            'max': round(ordenadas[-1], 2),
+        },
+        'full_scans': full_scans,
+        'plans': planos,
+        'budget': {'max_queries': endpoint.max_queries, 'max_p95_ms': endpoint.max_p95_ms},
+    }
+    resultado['violations'] = check_budget(resultado, endpoint, latency_factor)
+    return resultado
+
+
+def check_budget(resultado: Dict, endpoint: Endpoint, latency_factor: float = 1.0) -> List[str]:
+    """Violações do orçamento do endpoint (vazio = dentro do orçamento)."""
+    violacoes = []
+    if resultado['status_codes'] != [endpoint.status]:
+        violacoes.append(f"status {resultado['status_codes']} (esperado {endpoint.status})")
+    if resultado['queries'] > endpoint.max_queries:
+        violacoes.append(f"{resultado['queries']} consultas (orçamento {endpoint.max_queries})")
+    limite = endpoint.max_p95_ms * latency_factor
+    if resultado['latency_ms']['p95'] > limite:
+        violacoes.append(f"p95 {resultado['latency_ms']['p95']}ms (orçamento {limite:g}ms)")
+    if resultado['full_scans']:
+        violacoes.append(f"varredura completa em {', '.join(resultado['full_scans'])}")
+    return violacoes
+
+
+def run(dataset: Dict, endpoints: Optional[List[Endpoint]] = None, iterations: int = 20,
+        warmup: int = 2, explain: bool = True, latency_factor: float = 1.0) -> List[Dict]:
+    """Mede todos os endpoints autenticado como o usuário cliente do conjunto de dados."""
+    from authentication.models import Usuario
+
+    client = Client()
+    client.force_login(Usuario.objects.get(pk=dataset['usuario_id']))
+    resultados = []
+    for endpoint in endpoints or ENDPOINTS:
+        resultados.append(measure_endpoint(client, endpoint, dataset, iterations, warmup, explain, latency_factor))
+    return resultados
+
+
+def compare_endpoints(current: List[Dict], previous: List[Dict], tolerance: float) -> List[Dict]:
+    """
+    Compara consultas e p95 de cada endpoint com a execução anterior.
+
+    Returns:
+        Lista de {endpoint, metric, previous, current, change_pct, regression}
+    """
+    anteriores = {r['endpoint']: r for r in previous}
+    linhas = []
+    for resultado in current:
+        anterior = anteriores.get(resultado['endpoint'])
+        if not anterior:
+            continue
+        for metrica, old, new in (
+            ('queries', anterior['queries'], resultado['queries']),
+            ('p95_ms', anterior['latency_ms']['p95'], resultado['latency_ms']['p95']),
+        ):
+            if not old:
+                continue
+            change = (new - old) / old * 100
+            # Qualquer consulta a mais é regressão; latência tem tolerância
+            regression = new > old if metrica == 'queries' else change > tolerance
+            linhas.append({
+                'endpoint': resultado['endpoint'],
+                'metric': metrica,
+                'previous': old,
+                'current': new,
+                'change_pct': round(change, 1),
+                'regression': regression,
+            })
+    return linhas
+
+
+def build_record(resultados: List[Dict], dataset: Dict, mode: str, label: Optional[str] = None) -> Dict:
+    """Registro JSONL da execução (planos completos ficam de fora, só as varreduras)."""
+    from datetime import datetime
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'label': label,
+        'mode': mode,
+        'vendor': connection.vendor,
+        'dataset': {'chats': dataset.get('chats'), 'messages': dataset['messages'], 'media': dataset['media']},
+        'endpoints': [{k: v for k, v in r.items() if k != 'plans'} for r in resultados],
+    }
@@ -0,0 +1,142 @@
+import contextlib
+import logging
+import os
+import warnings
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from api.endpoint_benchmark import ENDPOINTS, build_record, compare_endpoints, run, seed_dataset
+from webhook.ingest_benchmark import load_previous, save_result
+
+
+class Command(BaseCommand):
+    help = 'Benchmark dos endpoints quentes da API: consultas por requisição, latência p50/p95 e planos (EXPLAIN)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', type=int, default=2, help='Clientes no conjunto de dados')
+        parser.add_argument('--chats', type=int, default=2000, help='Chats no total')
+        parser.add_argument('--mensagens-por-chat', type=int, default=500, help='Mensagens por chat (padrão: ~1M no total)')
+        parser.add_argument('--midia-a-cada', type=int, default=10, help='Uma mídia a cada N mensagens')
+        parser.add_argument('--iteracoes', type=int, default=20, help='Requisições medidas por endpoint')
+        parser.add_argument('--warmup', type=int, default=2, help='Requisições de aquecimento por endpoint')
+        parser.add_argument('--endpoint', action='append', default=None, help='Mede apenas este endpoint (repetível)')
+        parser.add_argument('--seed', type=int, default=42, help='Semente do conjunto de dados')
+        parser.add_argument(
+            '--fator-latencia',
+            type=float,
+            default=1.0,
+            help='Multiplica os orçamentos de p95 (máquinas mais lentas que a de referência)'
+        )
+        parser.add_argument('--sem-explain', action='store_true', help='Não captura os planos das consultas')
+        parser.add_argument('--planos', action='store_true', help='Mostra o plano de cada consulta')
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help='Arquivo JSONL de resultados (padrão: benchmarks/api_endpoints.jsonl)'
+        )
+        parser.add_argument('--label', type=str, default=None, help='Rótulo da execução (ex.: versão)')
+        parser.add_argument('--tolerance', type=float, default=20.0, help='Variação (%%) de p95 tolerada antes de acusar regressão')
+        parser.add_argument('--fail-on-budget', action='store_true', help='Sai com erro se algum endpoint estourar o orçamento')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Sai com erro se houver regressão')
+        parser.add_argument('--no-save', action='store_true', help='Não grava o resultado')
+        parser.add_argument('--verbose', action='store_true', help='Mantém logs/prints das views durante a medição')
+
+    def handle(self, *args, **options):
+        endpoints = ENDPOINTS
+        if options['endpoint']:
+            nomes = {endpoint.name for endpoint in ENDPOINTS}
+            desconhecidos = set(options['endpoint']) - nomes
+            if desconhecidos:
+                raise CommandError(f"Endpoint desconhecido: {', '.join(sorted(desconhecidos))} (use {', '.join(sorted(nomes))})")
+            endpoints = [endpoint for endpoint in ENDPOINTS if endpoint.name in options['endpoint']]
+
+        mode = f"{options['clientes']}x{options['chats']}x{options['mensagens_por_chat']}"
+        self.stdout.write(self.style.SUCCESS(
+            f"🔄 Benchmark de endpoints - {options['chats']} chats x {options['mensagens_por_chat']} mensagens"
+        ))
+
+        old_db_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            dataset = seed_dataset(
+                clientes=options['clientes'],
+                chats=options['chats'],
+                messages_per_chat=options['mensagens_por_chat'],
+                media_every=options['midia_a_cada'],
+                seed=options['seed'],
+                progress=self.stdout.write,
+            )
+            with override_settings(DEBUG=False), self._quiet(options['verbose']):
+                resultados = run(
+                    dataset,
+                    endpoints=endpoints,
+                    iterations=options['iteracoes'],
+                    warmup=options['warmup'],
+                    explain=not options['sem_explain'],
+                    latency_factor=options['fator_latencia'],
+                )
+            record = build_record(resultados, dataset, mode, options['label'])
+        finally:
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+
+        self._print_results(resultados, options['planos'])
+
+        results_file = Path(options['output'] or Path(settings.BASE_DIR) / 'benchmarks' / 'api_endpoints.jsonl')
+        previous = load_previous(results_file, mode)
+        regressions = []
+        if previous:
+            rows = compare_endpoints(record['endpoints'], previous.get('endpoints', []), options['tolerance'])
+            regressions = [row for row in rows if row['regression']]
+            self.stdout.write(f"\n📈 Comparação com {previous.get('revision') or '?'} ({previous.get('timestamp')}):")
+            for row in rows:
+                marker = '❌' if row['regression'] else '✅'
+                self.stdout.write(
+                    f"   {marker} {row['endpoint']} {row['metric']}: {row['previous']} -> {row['current']} "
+                    f"({row['change_pct']:+.1f}%)"
+                )
+
+        if not options['no_save']:
+            save_result(results_file, record)
+            self.stdout.write(f"\n💾 Resultado gravado em {results_file}")
+
+        estouros = [r for r in resultados if r['violations']]
+        if estouros and options['fail_on_budget']:
+            raise CommandError(f"{len(estouros)} endpoint(s) fora do orçamento: {', '.join(r['endpoint'] for r in estouros)}")
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{len(regressions)} métrica(s) com regressão")
+
+    @contextlib.contextmanager
+    def _quiet(self, verbose):
+        """Silencia prints/logs das views para não medir o custo do terminal."""
+        if verbose:
+            yield
+            return
+        logging.disable(logging.CRITICAL)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            try:
+                yield
+            finally:
+                logging.disable(logging.NOTSET)
+
+    def _print_results(self, resultados, planos):
+        self.stdout.write(f"\n{'endpoint':<24} {'consultas':>9} {'p50 ms':>8} {'p95 ms':>8}  orçamento")
+        for r in resultados:
+            budget = r['budget']
+            marker = '❌' if r['violations'] else '✅'
+            self.stdout.write(
+                f"{r['endpoint']:<24} {r['queries']:>9} {r['latency_ms']['p50']:>8} {r['latency_ms']['p95']:>8}  "
+                f"{marker} ≤{budget['max_queries']} consultas, p95 ≤{budget['max_p95_ms']}ms"
+            )
+            for violacao in r['violations']:
+                self.stdout.write(self.style.WARNING(f"   ⚠️ {violacao}"))
+            for plano in r['plans']:
+                if planos or plano['full_scans']:
+                    self.stdout.write(f"   🔍 {plano['sql'][:160]}")
+                    for linha in plano['plan']:
+                        self.stdout.write(f"      {linha}")
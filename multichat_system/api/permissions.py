@@ -1,5 +1,12 @@
 from rest_framework import permissions
 from core.models import Cliente
+from core.principal import principal_for
+
+
+def _tem_papel(request, *tipos):
+    """Usuário autenticado e superusuário ou de um dos ``tipos`` (papel lido do principal em cache)."""
+    principal = principal_for(request.user)
+    return principal is not None and principal.has_role(*tipos)
 
 
 class IsAdminOrReadOnly(permissions.BasePermission):
@@ -13,8 +20,7 @@ class IsAdminOrReadOnly(permissions.BasePermission):
             return request.user and request.user.is_authenticated
 
         # Permite escrita apenas para administradores
-        return request.user and request.user.is_authenticated and \
-               (request.user.is_superuser or (hasattr(request.user, 'tipo_usuario') and request.user.tipo_usuario == 'admin'))
+        return _tem_papel(request, 'admin')
 
 
 class IsAtendenteOrAdmin(permissions.BasePermission):
@@ -22,12 +28,7 @@ class IsAtendenteOrAdmin(permissions.BasePermission):
     Permissão customizada para permitir acesso a atendentes, clientes e administradores.
     """
     def has_permission(self, request, view):
-        return request.user and request.user.is_authenticated and \
-               (request.user.is_superuser or 
-                (hasattr(request.user, 'tipo_usuario') and 
-                 (request.user.tipo_usuario == 'admin' or 
-                  request.user.tipo_usuario == 'colaborador' or 
-                  request.user.tipo_usuario == 'cliente')))
+        return _tem_papel(request, 'admin', 'colaborador', 'cliente')
 
 
 class IsClienteOwner(permissions.BasePermission):
@@ -39,24 +40,27 @@ class IsClienteOwner(permissions.BasePermission):
     e se o cliente do usuário logado corresponde ao cliente do objeto.
     """
     def has_object_permission(self, request, view, obj):
+        principal = principal_for(request.user)
+        if principal is None:
+            return False
+
         # Superuser tem acesso total
-        if request.user.is_superuser:
+        if principal.is_superuser:
             return True
 
-        # Verifica se o usuário tem um cliente associado e se o objeto tem um cliente
-        if hasattr(request.user, 'cliente') and hasattr(obj, 'cliente'):
-            return request.user.cliente == obj.cliente
+        # Compara só os ids: não carrega o cliente do usuário nem o do objeto
+        if hasattr(obj, 'cliente_id'):
+            return principal.cliente_id == obj.cliente_id
         
         # Se o objeto for um Cliente, verifica se o usuário é o próprio cliente
-        if isinstance(obj, Cliente) and hasattr(request.user, 'cliente'):
-            return request.user.cliente == obj
+        if isinstance(obj, Cliente):
+            return principal.cliente_id == obj.pk
 
         return False
 
     def has_permission(self, request, view):
-        # Permite acesso se o usuário for superuser ou tiver um objeto 'cliente' associado
-        return request.user and request.user.is_authenticated and \
-               (request.user.is_superuser or hasattr(request.user, 'cliente'))
+        # Todo Usuario tem o campo 'cliente' (mesmo vazio): basta estar autenticado
+        return principal_for(request.user) is not None
 
 
 class IsMasterUser(permissions.BasePermission):
@@ -64,8 +68,7 @@ class IsMasterUser(permissions.BasePermission):
     Permissão para verificar se o usuário é do tipo 'master' ou superuser.
     """
     def has_permission(self, request, view):
-        return request.user and request.user.is_authenticated and \
-               (request.user.is_superuser or (hasattr(request.user, 'tipo_usuario') and request.user.tipo_usuario == 'master'))
+        return _tem_papel(request, 'master')
 
 
 class IsColaboradorUser(permissions.BasePermission):
@@ -73,8 +76,7 @@ class IsColaboradorUser(permissions.BasePermission):
     Permissão para verificar se o usuário é do tipo 'colaborador' ou superuser.
     """
     def has_permission(self, request, view):
-        return request.user and request.user.is_authenticated and \
-               (request.user.is_superuser or (hasattr(request.user, 'tipo_usuario') and request.user.tipo_usuario == 'colaborador'))
+        return _tem_papel(request, 'colaborador')
 
 
 class IsClienteUser(permissions.BasePermission):
@@ -82,8 +84,7 @@ class IsClienteUser(permissions.BasePermission):
     Permissão para verificar se o usuário é do tipo 'cliente' ou superuser.
     """
     def has_permission(self, request, view):
-        return request.user and request.user.is_authenticated and \
-               (request.user.is_superuser or (hasattr(request.user, 'tipo_usuario') and request.user.tipo_usuario == 'cliente'))
+        return _tem_papel(request, 'cliente')
 
 
 class IsAdminOrCliente(permissions.BasePermission):
@@ -91,10 +92,7 @@ class IsAdminOrCliente(permissions.BasePermission):
     Permissão para permitir acesso apenas a administradores e clientes.
     """
     def has_permission(self, request, view):
-        return request.user and request.user.is_authenticated and \
-               (request.user.is_superuser or 
-                (hasattr(request.user, 'tipo_usuario') and 
-                 (request.user.tipo_usuario == 'admin' or request.user.tipo_usuario == 'cliente')))
+        return _tem_papel(request, 'admin', 'cliente')
 
 
 class IsColaboradorOnly(permissions.BasePermission):
@@ -102,9 +100,7 @@ class IsColaboradorOnly(permissions.BasePermission):
     Permissão para permitir acesso apenas a colaboradores (sem acesso a relatórios e configurações).
     """
     def has_permission(self, request, view):
-        return request.user and request.user.is_authenticated and \
-               (request.user.is_superuser or 
-                (hasattr(request.user, 'tipo_usuario') and request.user.tipo_usuario == 'colaborador'))
+        return _tem_papel(request, 'colaborador')
 
 
 class IsClienteOrAdmin(permissions.BasePermission):
@@ -112,10 +108,7 @@ class IsClienteOrAdmin(permissions.BasePermission):
     Permissão para permitir acesso a clientes e administradores (pode criar usuários).
     """
     def has_permission(self, request, view):
-        return request.user and request.user.is_authenticated and \
-               (request.user.is_superuser or 
-                (hasattr(request.user, 'tipo_usuario') and 
-                 (request.user.tipo_usuario == 'admin' or request.user.tipo_usuario == 'cliente')))
+        return _tem_papel(request, 'admin', 'cliente')
 
 
 class IsClienteInstanceOwner(permissions.BasePermission):
@@ -124,24 +117,20 @@ class IsClienteInstanceOwner(permissions.BasePermission):
     Administradores têm acesso total.
     """
     def has_permission(self, request, view):
-        return request.user and request.user.is_authenticated and \
-               (request.user.is_superuser or 
-                (hasattr(request.user, 'tipo_usuario') and 
-                 (request.user.tipo_usuario == 'admin' or request.user.tipo_usuario == 'cliente')))
+        return _tem_papel(request, 'admin', 'cliente')
 
     def has_object_permission(self, request, view, obj):
-        # Superuser tem acesso total
-        if request.user.is_superuser:
-            return True
+        principal = principal_for(request.user)
+        if principal is None:
+            return False
 
-        # Administradores têm acesso total
-        if hasattr(request.user, 'tipo_usuario') and request.user.tipo_usuario == 'admin':
+        # Superuser e administradores têm acesso total
+        if principal.is_admin:
             return True
 
         # Clientes só podem acessar suas próprias instâncias
-        if hasattr(request.user, 'tipo_usuario') and request.user.tipo_usuario == 'cliente':
-            if hasattr(obj, 'cliente') and hasattr(request.user, 'cliente'):
-                return obj.cliente == request.user.cliente
+        if principal.tipo_usuario == 'cliente' and hasattr(obj, 'cliente_id'):
+            return obj.cliente_id == principal.cliente_id
 
         return False
 
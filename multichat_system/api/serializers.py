@@ -1,6 +1,8 @@
 from rest_framework import serializers
 from core.models import Cliente, Departamento, WhatsappInstance, Chat, Mensagem, WebhookEvent, MediaFile
 from authentication.models import Usuario  # Importação corrigida para o modelo de usuário
+from core import tenant_cache
+from core.media_store import get_media_storage_dir
 
 
 class ClienteSerializer(serializers.ModelSerializer):
@@ -13,12 +15,9 @@ class ClienteSerializer(serializers.ModelSerializer):
 
     def get_whatsapp_status(self, obj):
         # Importação lazy para evitar problemas de importação circular e linter
-        from core.utils import get_client_whatsapp_instance
-        instance = get_client_whatsapp_instance(obj, prefer_connected=True)
-        
-        if instance:
-            return instance.status or "desconectado"
-        return "desconectado"
+        # Status lido do cache de instâncias (atualizado pelo poller e pelos webhooks)
+        from core.instance_status import get_cliente_status
+        return get_cliente_status(obj)
 
     class Meta:
         model = Cliente
@@ -112,13 +111,13 @@ class ChatSerializer(serializers.ModelSerializer):
         """
         try:
             # Buscar a última mensagem do chat
-            ultima_mensagem = obj.mensagens.order_by('-data_envio').first()
+            ultima_mensagem = self._ultima_mensagem(obj)
             
             if ultima_mensagem:
                 # Se a última mensagem foi enviada por você (from_me=True)
                 if ultima_mensagem.from_me:
                     # Buscar a última mensagem da pessoa (não from_me)
-                    ultima_pessoa = obj.mensagens.filter(from_me=False).order_by('-data_envio').first()
+                    ultima_pessoa = self._ultima_mensagem(obj, recebida=True)
                     
                     if ultima_pessoa:
                         # Mostrar o nome da pessoa que respondeu
@@ -128,16 +127,7 @@ class ChatSerializer(serializers.ModelSerializer):
                             return ultima_pessoa.remetente
                         else:
                             # Buscar no sender
-                            from webhook.models import Sender
-                            sender = Sender.objects.filter(
-                                sender_id=obj.chat_id,
-                                cliente=obj.cliente
-                            ).order_by('-id').first()
-                            
-                            if sender:
-                                return sender.push_name or sender.verified_name or obj.chat_id
-                            else:
-                                return obj.chat_id
+                            return self._nome_do_sender(obj)
                     else:
                         # Se nunca houve resposta da pessoa, mostrar o número
                         return obj.chat_id
@@ -152,16 +142,7 @@ class ChatSerializer(serializers.ModelSerializer):
                         return ultima_mensagem.remetente
                     
                     # Por último, buscar no sender
-                    from webhook.models import Sender
-                    sender = Sender.objects.filter(
-                        sender_id=obj.chat_id,
-                        cliente=obj.cliente
-                    ).order_by('-id').first()
-                    
-                    if sender:
-                        return sender.push_name or sender.verified_name or obj.chat_id
-                    else:
-                        return obj.chat_id
+                    return self._nome_do_sender(obj)
             
             # Se não há mensagens, mostrar o número de telefone
             return obj.chat_id
@@ -172,9 +153,31 @@ class ChatSerializer(serializers.ModelSerializer):
             logger.error(f"❌ Erro ao buscar nome do contato: {e}")
             return obj.chat_id
 
+    def _nome_do_sender(self, obj):
+        """Nome do Sender do contato (anotado pelo ChatViewSet quando existe), senão o número"""
+        if hasattr(obj, 'sender_nome'):
+            return obj.sender_nome or obj.chat_id
+        from webhook.models import Sender
+        sender = Sender.objects.filter(
+            sender_id=obj.chat_id,
+            cliente=obj.cliente
+        ).order_by('-id').first()
+        if sender:
+            return sender.push_name or sender.verified_name or obj.chat_id
+        return obj.chat_id
+
+    def _ultima_mensagem(self, obj, recebida=False):
+        """Última mensagem (ou última recebida) do chat; usa o prefetch do ChatViewSet quando existe"""
+        atributo = 'ultimas_recebidas' if recebida else 'ultimas_mensagens'
+        if hasattr(obj, atributo):
+            ultimas = getattr(obj, atributo)
+            return ultimas[0] if ultimas else None
+        mensagens = obj.mensagens.filter(from_me=False) if recebida else obj.mensagens
+        return mensagens.order_by('-data_envio').first()
+
     def get_ultima_mensagem(self, obj):
         """Retorna a última mensagem do chat com conteúdo processado"""
-        ultima = obj.mensagens.order_by('-data_envio').first()
+        ultima = self._ultima_mensagem(obj)
         if ultima:
             # Processar o conteúdo para extrair informações legíveis
             conteudo_processado = self._process_message_content(ultima.conteudo, ultima.tipo)
@@ -273,10 +276,14 @@ class ChatSerializer(serializers.ModelSerializer):
 
     def get_total_mensagens(self, obj):
         """Retorna o total de mensagens do chat"""
+        if hasattr(obj, 'total_mensagens_count'):
+            return obj.total_mensagens_count
         return obj.mensagens.count()
 
     def get_unread_count(self, obj):
         """Retorna o número de mensagens não lidas"""
+        if hasattr(obj, 'unread_count_total'):
+            return obj.unread_count_total
         return obj.mensagens.filter(lida=False).count()
 
     def get_profile_picture(self, obj):
@@ -348,9 +355,9 @@ class MensagemSerializer(serializers.ModelSerializer):
         fields = [
             "id", "chat", "remetente", "conteudo", "data_envio", "tipo", "lida", "fromMe", "from_me",
             "sender_display_name", "sender_push_name", "sender_verified_name", "message_id", "reacoes",
-            "media_url"
+            "media_url", "audio_duration_ms", "audio_peaks"
         ]
-        read_only_fields = ["data_envio"]
+        read_only_fields = ["data_envio", "audio_duration_ms", "audio_peaks"]
 
     def get_tipo(self, obj):
         # Mapeamento para garantir compatibilidade frontend (português)
@@ -516,16 +523,32 @@ class MensagemSerializer(serializers.ModelSerializer):
         
         return None
     
+    def _instancia_do_cliente(self, cliente_id):
+        """Primeira instância do cliente, consultada uma vez por serializer (listas usam o mesmo child)"""
+        if not hasattr(self, '_instancias'):
+            self._instancias = {}
+        if cliente_id not in self._instancias:
+            self._instancias[cliente_id] = WhatsappInstance.objects.filter(cliente_id=cliente_id).first()
+        return self._instancias[cliente_id]
+
+    def _cache_do_cliente(self, cliente_id):
+        """Cache do cliente (core.tenant_cache), com a geração lida uma vez por serializer"""
+        if not hasattr(self, '_caches'):
+            self._caches = {}
+        if cliente_id not in self._caches:
+            self._caches[cliente_id] = tenant_cache.TenantCache(cliente_id)
+        return self._caches[cliente_id]
+
     def _get_local_media_url(self, obj, message_id):
         """Busca o arquivo local de mídia e retorna a URL"""
         import os
         from pathlib import Path
         import glob
-        from django.core.cache import cache
         
-        # Cache key para evitar buscas repetitivas
-        cache_key = f"media_url_{obj.tipo}_{message_id}_{obj.chat.chat_id if hasattr(obj, 'chat') else 'no_chat'}"
-        cached_result = cache.get(cache_key)
+        # Cache compartilhado entre os workers, por cliente, para evitar buscas repetitivas
+        cache = self._cache_do_cliente(obj.chat.cliente_id)
+        cache_key = f"{obj.tipo}_{message_id}_{obj.chat.chat_id}"
+        cached_result = cache.get(tenant_cache.MEDIA_URL, cache_key)
         
         # Se temos resultado no cache e não é uma mensagem de áudio com audioMessage, usar o cache
         if cached_result is not None:
@@ -538,7 +561,7 @@ class MensagemSerializer(serializers.ModelSerializer):
                         parsed_content = json.loads(content)
                         if 'audioMessage' in parsed_content:
                             # Cache negativo incorreto - continuar processamento sem logs excessivos
-                            cache.delete(cache_key)
+                            cache.delete(tenant_cache.MEDIA_URL, cache_key)
                         else:
                             return None  # Cache negativo correto
                     except json.JSONDecodeError:
@@ -551,11 +574,11 @@ class MensagemSerializer(serializers.ModelSerializer):
         
         try:
             # Caminho base da instância
-            if not hasattr(obj.chat, 'cliente') or not obj.chat.cliente.whatsapp_instances.first():
+            instance = self._instancia_do_cliente(obj.chat.cliente_id)
+            if instance is None:
                 return None
-                
-            instance = obj.chat.cliente.whatsapp_instances.first()
-            cliente_id = obj.chat.cliente.id
+
+            cliente_id = obj.chat.cliente_id
             instance_id = instance.instance_id
             chat_id = obj.chat.chat_id
             
@@ -573,7 +596,7 @@ class MensagemSerializer(serializers.ModelSerializer):
             tipo_pasta = tipo_map.get(obj.tipo, obj.tipo)
             
             # Caminho da pasta de mídia - CORRIGIDO
-            base_path = Path(__file__).parent.parent / "media_storage" / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / tipo_pasta
+            base_path = get_media_storage_dir() / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / tipo_pasta
             
             if not base_path.exists():
                 return None
@@ -614,7 +637,7 @@ class MensagemSerializer(serializers.ModelSerializer):
                 # Retornar URL usando o padrão correto do urls.py
                 result = f"/api/whatsapp-media/{cliente_id}/{instance_id}/{chat_id}/{tipo_pasta}/{found_file.name}"
                 # Cache o resultado por 24 horas (arquivos físicos não mudam)
-                cache.set(cache_key, result, 86400)
+                cache.set(tenant_cache.MEDIA_URL, cache_key, result, 86400)
                 return result
             else:
                 # Para mensagens com audioMessage, não fazer cache negativo agressivo
@@ -623,10 +646,10 @@ class MensagemSerializer(serializers.ModelSerializer):
                 if (obj.tipo == 'audio' and content and isinstance(content, str) and 
                     content.startswith('{') and 'audioMessage' in content):
                     # Mensagem de áudio com dados JSON - cache negativo curto
-                    cache.set(cache_key, 'NOT_FOUND', 60)  # 1 minuto apenas
+                    cache.set(tenant_cache.MEDIA_URL, cache_key, 'NOT_FOUND', 60)  # 1 minuto apenas
                 else:
                     # Cache resultado negativo por 5 minutos para outros casos
-                    cache.set(cache_key, 'NOT_FOUND', 300)
+                    cache.set(tenant_cache.MEDIA_URL, cache_key, 'NOT_FOUND', 300)
                 return None
                 
         except Exception as e:
@@ -676,12 +699,12 @@ class MediaFileSerializer(serializers.ModelSerializer):
             'id', 'cliente', 'cliente_nome', 'instance', 'instance_id', 'chat',
             'message_id', 'sender_name', 'sender_id', 'media_type', 'mimetype',
             'file_name', 'file_path', 'file_size', 'caption', 'width', 'height',
-            'duration_seconds', 'is_ptt', 'download_status', 'is_group', 'from_me',
+            'duration_seconds', 'preview_path', 'is_ptt', 'download_status', 'is_group', 'from_me',
             'media_key', 'direct_path', 'file_sha256', 'file_enc_sha256',
             'media_key_timestamp', 'message_timestamp', 'download_timestamp',
             'created_at', 'updated_at', 'file_url'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'preview_path', 'created_at', 'updated_at']
     
     def get_file_url(self, obj):
         """Retorna a URL para acessar o arquivo"""
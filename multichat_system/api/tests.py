@@ -1,3 +1,260 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.utils import timezone
+
+from api.endpoint_benchmark import ENDPOINTS, measure_endpoint, seed_dataset
+from authentication.models import Usuario
+from core.exports import MESSAGE_EXPORT_FIELDS, iter_rows
+from core.instance_status import set_cached_status
+from core.models import Chat, Cliente, MediaFile, Mensagem, WhatsappInstance
+
+
+class EndpointQueryBudgetTests(TestCase):
+    """
+    Orçamento de consultas dos endpoints quentes (ver api.endpoint_benchmark).
+
+    A latência é medida pelo comando benchmark_endpoints com o volume real;
+    aqui valem só as consultas por requisição, que não podem crescer com a
+    página nem com os dados (N+1), e os planos sem varredura completa.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dataset = seed_dataset(clientes=2, chats=60, messages_per_chat=12, media_every=4, days=30)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(Usuario.objects.get(pk=self.dataset['usuario_id']))
+
+    def _measure(self, endpoint):
+        return measure_endpoint(self.client, endpoint, self.dataset, iterations=1, warmup=1)
+
+    def test_endpoints_dentro_do_orcamento(self):
+        for endpoint in ENDPOINTS:
+            with self.subTest(endpoint=endpoint.name):
+                resultado = self._measure(endpoint)
+                self.assertEqual(resultado['status_codes'], [endpoint.status])
+                self.assertLessEqual(resultado['queries'], endpoint.max_queries)
+                self.assertEqual(resultado['full_scans'], [])
+
+    def test_consultas_nao_crescem_com_o_volume(self):
+        antes = {endpoint.name: self._measure(endpoint)['queries'] for endpoint in ENDPOINTS}
+
+        # Mais chats, mensagens e não lidas no mesmo cliente
+        cliente_id = self.dataset['cliente_id']
+        agora = timezone.now()
+        novos = Chat.objects.bulk_create([
+            Chat(cliente_id=cliente_id, chat_id=f'55999{n:08d}@s.whatsapp.net', last_message_at=agora)
+            for n in range(40)
+        ])
+        primeiro = Chat.objects.get(cliente_id=cliente_id, chat_id=self.dataset['chat_ids'][0])
+        Mensagem.objects.bulk_create([
+            Mensagem(chat=chat, remetente=chat.chat_id, conteudo=f'pedido extra {n}', from_me=False)
+            for chat in [*novos, primeiro] for n in range(5)
+        ])
+
+        depois = {endpoint.name: self._measure(endpoint)['queries'] for endpoint in ENDPOINTS}
+        self.assertEqual(depois, antes)
+
+
+class MediaPreviewAccessTests(TestCase):
+    """Prévias de mídia só para usuários autenticados do cliente da mensagem."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        instancia = WhatsappInstance.objects.create(cliente=self.cliente, instance_id='INST-A', token='t')
+        chat = Chat.objects.create(cliente=self.cliente, chat_id='5511999990000')
+        self.mensagem = Mensagem.objects.create(chat=chat, remetente='5511999990000', conteudo='video',
+                                                tipo='video', message_id='M1')
+        poster = tempfile.NamedTemporaryFile(suffix='.jpg', delete=False)
+        poster.write(b'\xff\xd8\xff')
+        poster.close()
+        self.addCleanup(os.unlink, poster.name)
+        MediaFile.objects.create(cliente=self.cliente, instance=instancia, message_id='M1', sender_name='Ana',
+                                 sender_id='x', media_type='video', mimetype='video/mp4', preview_path=poster.name)
+        self.url = f'/api/media/message/{self.mensagem.id}/preview/'
+
+    def _usuario(self, username, cliente):
+        usuario = Usuario.objects.create_user(username=username, email=f'{username}@example.com', password='x',
+                                              tipo_usuario='colaborador', cliente=cliente)
+        client = Client()
+        client.force_login(usuario)
+        return client
+
+    def test_outro_cliente_nao_ve_a_previa(self):
+        outro = Cliente.objects.create(nome='Loja B', email='b@example.com')
+        self.assertEqual(self._usuario('bia', outro).get(self.url).status_code, 404)
+        self.assertIn(Client().get(self.url).status_code, (401, 403))
+
+    def test_cliente_da_mensagem_ve_a_previa(self):
+        response = self._usuario('ana', self.cliente).get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+
+class MessageSearchTests(TestCase):
+    """Busca textual restrita ao cliente do usuário, com trecho sobre o texto indexado."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        self.outro = Cliente.objects.create(nome='Loja B', email='b@example.com')
+        for cliente, texto in ((self.cliente, 'orçamento do telhado'), (self.outro, 'orçamento da piscina')):
+            chat = Chat.objects.create(cliente=cliente, chat_id=f'55119999{cliente.id:04d}')
+            Mensagem.objects.create(chat=chat, remetente=chat.chat_id, conteudo=texto, tipo='texto')
+        chat = Chat.objects.get(cliente=self.cliente)
+        Mensagem.objects.create(chat=chat, remetente=chat.chat_id, tipo='imagem',
+                                conteudo='{"imageMessage": {"caption": "foto do orçamento", "url": "https://x/y"}}')
+
+    def _client(self, tipo_usuario, cliente=None):
+        usuario = Usuario.objects.create_user(username=f'u_{tipo_usuario}', email=f'{tipo_usuario}@example.com',
+                                              password='x', tipo_usuario=tipo_usuario, cliente=cliente)
+        client = Client()
+        client.force_login(usuario)
+        return client
+
+    def test_resultados_sao_do_cliente_do_usuario(self):
+        response = self._client('colaborador', self.cliente).get('/api/mensagens/search/', {'q': 'orçamento'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 2)
+        trechos = sorted(item['highlight'] for item in response.json()['results'])
+        self.assertEqual(trechos, ['<mark>orçamento</mark> do telhado', 'foto do <mark>orçamento</mark>'])
+
+    def test_cliente_id_invalido_retorna_400(self):
+        response = self._client('admin').get('/api/mensagens/search/', {'q': 'orçamento', 'cliente_id': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ChatEndpointsTests(TestCase):
+    """Estatísticas dos chats e marcação de leitura respeitando o cliente."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        self.outro = Cliente.objects.create(nome='Loja B', email='b@example.com')
+        self.chats = {}
+        for cliente in (self.cliente, self.outro):
+            chat = Chat.objects.create(cliente=cliente, chat_id='5511999990000', status='active')
+            Mensagem.objects.create(chat=chat, remetente=chat.chat_id, conteudo='oi', tipo='texto', lida=False)
+            self.chats[cliente.id] = chat
+        Chat.objects.create(cliente=self.cliente, chat_id='5511999990001', status='closed')
+        admin = Usuario.objects.create_user(username='admin', email='admin@example.com', password='x',
+                                            tipo_usuario='admin')
+        self.client = Client()
+        self.client.force_login(admin)
+
+    def _nao_lidas(self, cliente):
+        return Mensagem.objects.filter(chat=self.chats[cliente.id], lida=False).count()
+
+    def test_stats_usa_os_grupos_de_status_do_dashboard(self):
+        dados = self.client.get('/api/chats/stats/').json()
+        self.assertEqual((dados['chats_abertos'], dados['chats_fechados'], dados['chats_pendentes']), (2, 1, 0))
+
+    def test_admin_marca_lidas_apenas_no_cliente_informado(self):
+        url = '/api/mensagens/marcar-lidas/'
+        response = self.client.post(url, {'chat_id': '5511999990000'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((self._nao_lidas(self.cliente), self._nao_lidas(self.outro)), (1, 1))
+
+        response = self.client.post(url, {'chat_id': '5511999990000', 'cliente_id': self.cliente.id},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((self._nao_lidas(self.cliente), self._nao_lidas(self.outro)), (0, 1))
+
+
+class InstanceStatusEndpointTests(TestCase):
+    """``/api/wapi/auth/status/`` responde pelo cache de status, sem chamar a W-API a cada leitura."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        WhatsappInstance.objects.create(cliente=cliente, instance_id='INST-A', token='t', status='desconectado')
+        admin = Usuario.objects.create_user(username='admin', email='admin@example.com', password='x',
+                                            tipo_usuario='admin')
+        self.client = Client()
+        self.client.force_login(admin)
+
+    def _status(self, instance_id='INST-A'):
+        return self.client.get('/api/wapi/auth/status/', {'instanceId': instance_id})
+
+    def test_status_em_cache_nao_consulta_a_wapi(self):
+        set_cached_status('INST-A', 'conectado', source='webhook')
+        with mock.patch('api.views.refresh_instance_status') as refresh:
+            dados = self._status().json()
+        refresh.assert_not_called()
+        self.assertEqual((dados['connected'], dados['status'], dados['source']), (True, 'conectado', 'webhook'))
+
+    def test_sem_cache_consulta_uma_vez(self):
+        entrada = {'connected': False, 'status': 'desconectado', 'checked_at': None, 'source': 'manual'}
+        with mock.patch('api.views.refresh_instance_status', return_value=entrada) as refresh:
+            self.assertEqual(self._status().json()['source'], 'manual')
+        self.assertEqual(refresh.call_count, 1)
+        self.assertEqual(self._status('NAO-EXISTE').status_code, 404)
+
+
+class ExportTests(TestCase):
+    """Exportações em streaming só com os dados do cliente do usuário."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        outro = Cliente.objects.create(nome='Loja B', email='b@example.com')
+        with self.captureOnCommitCallbacks(execute=True):
+            for cliente, quantidade in ((self.cliente, 3), (outro, 1)):
+                chat = Chat.objects.create(cliente=cliente, chat_id=f'55119999{cliente.id:04d}')
+                for indice in range(quantidade):
+                    Mensagem.objects.create(chat=chat, remetente=chat.chat_id, conteudo=f'oi {indice}', tipo='texto')
+
+    def _client(self, tipo_usuario, cliente=None):
+        usuario = Usuario.objects.create_user(username=f'u_{tipo_usuario}', email=f'{tipo_usuario}@example.com',
+                                              password='x', tipo_usuario=tipo_usuario, cliente=cliente)
+        client = Client()
+        client.force_login(usuario)
+        return client
+
+    def _conteudo(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_csv_de_mensagens_do_cliente(self):
+        response = self._client('colaborador', self.cliente).get('/api/mensagens/export/')
+        linhas = list(csv.DictReader(io.StringIO(self._conteudo(response).decode())))
+
+        self.assertEqual([linha['conteudo'] for linha in linhas], ['oi 0', 'oi 1', 'oi 2'])
+        self.assertEqual({linha['cliente_id'] for linha in linhas}, {str(self.cliente.id)})
+
+    def test_ndjson_com_gzip(self):
+        response = self._client('colaborador', self.cliente).get('/api/mensagens/export/',
+                                                                 {'formato': 'ndjson', 'gzip': '1'})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        linhas = gzip.decompress(self._conteudo(response)).decode().splitlines()
+        self.assertEqual([json.loads(linha)['conteudo'] for linha in linhas], ['oi 0', 'oi 1', 'oi 2'])
+
+    def test_relatorio_soma_as_mensagens_do_cliente(self):
+        admin = self._client('admin')
+        response = admin.get('/api/relatorios/export/', {'formato': 'ndjson', 'cliente_id': self.cliente.id})
+        linhas = [json.loads(linha) for linha in self._conteudo(response).decode().splitlines()]
+        self.assertEqual(sum(linha['total'] for linha in linhas), 3)
+
+        self.assertEqual(admin.get('/api/relatorios/export/', {'cliente_id': 'abc'}).status_code, 400)
+
+    def test_lotes_por_keyset_com_datas_iguais(self):
+        Mensagem.objects.update(data_envio=timezone.now())
+        esperado = list(Mensagem.objects.order_by('id').values_list('id', flat=True))
+
+        linhas = list(iter_rows(Mensagem.objects.all(), MESSAGE_EXPORT_FIELDS, ('data_envio', 'id'), chunk_size=2))
+
+        self.assertEqual([linha[0] for linha in linhas], esperado)
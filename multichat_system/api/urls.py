@@ -29,7 +29,8 @@ from .views import (
     serve_sticker_message,
     serve_document_message,
     test_mensagens_public,
-    serve_media_by_message_id
+    serve_media_by_message_id,
+    serve_media_preview
 )
 
 # Router principal para ViewSets
@@ -54,6 +55,7 @@ urlpatterns = [
     
     # Endpoint de relatórios
     path('relatorios/', views.RelatorioView.as_view(), name='relatorios'),
+    path('relatorios/export/', views.exportar_relatorio, name='exportar_relatorio'),
     
     # Endpoint público para teste
     path('test-chats/', test_chats_public, name='test_chats_public'),
@@ -63,6 +65,7 @@ urlpatterns = [
     
     # **NOVO: Endpoint inteligente para servir mídia por message_id**
     path('media/message/<int:message_id>/', serve_media_by_message_id, name='serve_media_by_message_id'),
+    path('media/message/<int:message_id>/preview/', serve_media_preview, name='serve_media_preview'),
     
     # Endpoints de mídia (públicos)
     path('wapi-media/<str:media_type>/<str:filename>/', serve_wapi_media, name='serve_wapi_media'),
@@ -15,11 +15,14 @@ Data: 2025-07-11
 from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.shortcuts import get_object_or_404
 from django.conf import settings
-from django.db.models import Q, Count, Sum
+from django.db.models import (
+    Avg, Count, DurationField, ExpressionWrapper, F, IntegerField, OuterRef, Prefetch, Q, Subquery, Sum, Value,
+)
+from django.db.models.functions import Coalesce, NullIf
 from django.utils import timezone
-from datetime import timedelta
+from collections import defaultdict
+from datetime import datetime, timedelta
 import json
 import logging
 import requests
@@ -39,6 +42,20 @@ from .serializers import (
 )
 from .permissions import IsAdminOrReadOnly, IsAtendenteOrAdmin, IsClienteOwner, IsClienteOrAdmin, IsColaboradorOnly, IsAdminOrCliente, IsClienteInstanceOwner
 from .wapi_integration import WApiIntegration
+from core import dashboard, file_links, tenant_cache
+from core.db_router import read_replica, replica_reads
+from core.principal import principal_for
+from core.instance_status import get_cached_status, get_instance_status, refresh_instance_status
+from core.media_fetch import ensure_local
+from core.media_store import get_media_storage_dir
+from core.previews import schedule_preview
+from core.exports import FORMATS as EXPORT_FORMATS, MESSAGE_EXPORT_FIELDS, ROLLUP_EXPORT_FIELDS, streaming_export
+from core.rollups import rollups_between
+from core.search import search as search_messages
+from core.thumbnails import sized_image
+from core.transcoding import PRIORITY_INTERACTIVE, playable_audio
+from core.utils import get_wapi_base_url
+from webhook.signals import get_realtime_updates
 from django.shortcuts import render
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
@@ -46,7 +63,7 @@ from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.views import View
-from webhook.models import Message, MessageStats, ContactStats
+from webhook.models import Message, MessageStats, ContactStats, Sender
 from .serializers import WebhookMessageSerializer
 from django.http import StreamingHttpResponse
 from django.core.serializers.json import DjangoJSONEncoder
@@ -54,6 +71,7 @@ import time
 import sys
 import os
 from django.http import FileResponse, Http404
+from django.utils.cache import patch_vary_headers
 from django.http import JsonResponse, HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
@@ -71,12 +89,21 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'wapi'))
 
 logger = logging.getLogger(__name__)
 
+
+def _atualizacoes_em_cache(principal):
+    """Atualizações em tempo real do cliente do usuário (administradores: todas)"""
+    if principal is None:
+        return []
+    if principal.is_admin:
+        return get_realtime_updates()
+    return get_realtime_updates(principal.cliente_id) if principal.cliente_id is not None else []
+
 # Classe EnviarImagem integrada para evitar problemas de importação
 class EnviarImagem:
     def __init__(self, instance_id, token):
         self.instance_id = instance_id
         self.token = token
-        self.base_url = "https://api.w-api.app/v1/message/send-image"
+        self.base_url = f"{get_wapi_base_url()}message/send-image"
         self.headers = {
             "Authorization": f"Bearer {self.token}",
             "Content-Type": "application/json"
@@ -175,18 +202,17 @@ class UsuarioViewSet(viewsets.ModelViewSet):
         """
         Retorna o queryset de usuários baseado no tipo de usuário logado.
         """
-        user = self.request.user
-        if user.is_superuser or (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'admin'):
+        principal = principal_for(self.request.user)
+        if principal is None:
+            return Usuario.objects.none()
+        if principal.is_admin:
             return Usuario.objects.all()
-        elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'cliente':
+        elif principal.tipo_usuario == 'cliente':
             # Cliente vê apenas colaboradores associados a ele
-            if hasattr(user, 'cliente') and user.cliente:
-                return Usuario.objects.filter(tipo_usuario='colaborador', cliente=user.cliente)
-            else:
-                return Usuario.objects.none()
-        elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'colaborador':
+            return principal.scope(Usuario.objects.filter(tipo_usuario='colaborador'), roles=('cliente',))
+        elif principal.tipo_usuario == 'colaborador':
             # Colaborador vê apenas a si mesmo
-            return Usuario.objects.filter(id=user.id)
+            return Usuario.objects.filter(id=principal.user_id)
         return Usuario.objects.none()
 
     def create(self, request, *args, **kwargs):
@@ -290,13 +316,16 @@ class ClienteViewSet(viewsets.ModelViewSet):
         Colaboradores veem apenas o cliente ao qual estão associados.
         """
         user = self.request.user
-        if user.is_superuser or (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'admin'):
-            return Cliente.objects.all()
-        elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'cliente':
+        principal = principal_for(user)
+        if principal is None:
+            return Cliente.objects.none()
+        if principal.is_admin:
+            return Cliente.objects.prefetch_related('whatsapp_instances')
+        elif principal.tipo_usuario == 'cliente':
             # Cliente vê apenas a si mesmo
-            return Cliente.objects.filter(email=user.email)
-        elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'colaborador' and hasattr(user, 'cliente') and user.cliente:
-            return Cliente.objects.filter(id=user.cliente.id)
+            return Cliente.objects.filter(email=user.email).prefetch_related('whatsapp_instances')
+        elif principal.tipo_usuario == 'colaborador' and principal.cliente_id:
+            return Cliente.objects.filter(id=principal.cliente_id).prefetch_related('whatsapp_instances')
         return Cliente.objects.none()
 
     def create(self, request, *args, **kwargs):
@@ -381,19 +410,16 @@ class ClienteViewSet(viewsets.ModelViewSet):
         
         try:
             instancia = WhatsappInstance.objects.get(cliente=cliente)
-            wapi = WApiIntegration(instancia.instance_id, instancia.token)
-            status_result = wapi.verificar_status_conexao()
-            
-            # Atualizar status na base de dados
-            instancia.status = status_result.get("status", "erro")
-            if status_result.get("qr_code"):
-                instancia.qr_code = status_result["qr_code"]
-            instancia.save()
+            # Leitura do cache mantido pelo poller/webhooks; ?refresh=true força consulta à W-API
+            if request.query_params.get("refresh") in ("1", "true"):
+                status_result = refresh_instance_status(instancia, source="manual")
+            else:
+                status_result = get_instance_status(instancia)
             
             return Response({
                 "instance_id": instancia.instance_id,
-                "status": instancia.status,
-                "qr_code": instancia.qr_code,
+                "status": status_result["status"],
+                "qr_code": status_result.get("qr_code") or instancia.qr_code,
                 "last_check": status_result
             })
             
@@ -472,13 +498,14 @@ class WhatsappInstanceViewSet(viewsets.ModelViewSet):
         Retorna o queryset de instâncias baseado no tipo de usuário logado.
         """
         user = self.request.user
-        if user.is_superuser or (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'admin'):
+        principal = principal_for(user)
+        if principal is None:
+            return WhatsappInstance.objects.none()
+        if principal.is_admin:
             return WhatsappInstance.objects.all()
-        elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'cliente':
+        elif principal.tipo_usuario == 'cliente':
             return WhatsappInstance.objects.filter(cliente__email=user.email)
-        elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'colaborador' and hasattr(user, 'cliente') and user.cliente:
-            return WhatsappInstance.objects.filter(cliente=user.cliente)
-        return WhatsappInstance.objects.none()
+        return principal.scope(WhatsappInstance.objects.all(), roles=('colaborador',))
 
     @action(detail=True, methods=["get"])
     def get_for_edit(self, request, pk=None):
@@ -500,20 +527,54 @@ class WhatsappInstanceViewSet(viewsets.ModelViewSet):
         instancia = self.get_object()
         
         try:
-            result = WApiIntegration.atualizar_status_instancia(instancia.instance_id)
-            
-            if result["success"]:
-                # Recarregar instância atualizada
-                instancia.refresh_from_db()
-                serializer = self.get_serializer(instancia)
-                return Response({
-                    "message": result["message"],
-                    "data": serializer.data
-                })
-            else:
+            # Consulta explícita: atualiza cache e banco de uma só vez
+            result = refresh_instance_status(instancia, source="manual")
+            serializer = self.get_serializer(instancia)
+            return Response({
+                "message": "Status atualizado com sucesso",
+                "status": result["status"],
+                "data": serializer.data
+            })
+                
+        except Exception as e:
+            return Response({
+                "error": str(e)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=True, methods=["get", "post", "delete"], permission_classes=[IsClienteInstanceOwner])
+    def backfill(self, request, pk=None):
+        """
+        Importação do histórico de chats/mensagens da instância.
+
+        GET: progresso do último job. POST: inicia ou retoma o job.
+        DELETE: cancela o job em execução (pode ser retomado depois).
+        """
+        from core.history_backfill import get_resumable_job, serialize_job, start_backfill
+        from core.models import HistoryBackfillJob
+        instancia = self.get_object()
+        
+        try:
+            if request.method == "POST":
+                job, iniciado = start_backfill(instancia)
+                if job is None:
+                    return Response({"message": "Importação já está sendo iniciada"}, status=status.HTTP_200_OK)
                 return Response({
-                    "error": result["message"]
-                }, status=status.HTTP_400_BAD_REQUEST)
+                    "message": "Importação iniciada" if iniciado else "Importação já está em execução",
+                    "data": serialize_job(job)
+                }, status=status.HTTP_202_ACCEPTED if iniciado else status.HTTP_200_OK)
+            
+            if request.method == "DELETE":
+                job = get_resumable_job(instancia)
+                if not job:
+                    return Response({"error": "Nenhuma importação em andamento"}, status=status.HTTP_404_NOT_FOUND)
+                HistoryBackfillJob.objects.filter(pk=job.pk).update(status="cancelled")
+                job.refresh_from_db()
+                return Response({"message": "Importação cancelada", "data": serialize_job(job)})
+            
+            job = HistoryBackfillJob.objects.filter(instance=instancia).select_related("instance").first()
+            if not job:
+                return Response({"error": "Nenhuma importação encontrada"}, status=status.HTTP_404_NOT_FOUND)
+            return Response(serialize_job(job))
                 
         except Exception as e:
             return Response({
@@ -607,12 +668,10 @@ class DepartamentoViewSet(viewsets.ModelViewSet):
         Administradores veem todos os departamentos. Colaboradores veem apenas
         departamentos do cliente ao qual estão associados.
         """
-        user = self.request.user
-        if user.is_superuser or (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'admin'):
-            return Departamento.objects.all()
-        elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'colaborador' and hasattr(user, 'cliente'):
-            return Departamento.objects.filter(cliente=user.cliente)
-        return Departamento.objects.none()
+        principal = principal_for(self.request.user)
+        if principal is None:
+            return Departamento.objects.none()
+        return principal.scope(Departamento.objects.all(), roles=('colaborador',))
 
 
 class ChatViewSet(viewsets.ModelViewSet):
@@ -626,56 +685,76 @@ class ChatViewSet(viewsets.ModelViewSet):
     serializer_class = ChatSerializer
     permission_classes = [IsAtendenteOrAdmin]
 
+    @read_replica
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     def get_queryset(self):
         """
         Retorna o queryset de chats com mensagens pré-carregadas
         """
-        user = self.request.user
-        base_queryset = Chat.objects.select_related('cliente', 'atendente').prefetch_related('mensagens')
-        if user.is_superuser or (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'admin'):
-            return base_queryset.all()
-        elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'cliente' and hasattr(user, 'cliente') and user.cliente:
-            return base_queryset.filter(cliente=user.cliente)
-        elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'colaborador' and hasattr(user, 'cliente') and user.cliente:
-            return base_queryset.filter(cliente=user.cliente)
-        return Chat.objects.none()
+        return self._com_resumo_mensagens(self._chats_do_usuario().select_related('cliente', 'atendente'))
+
+    def _chats_do_usuario(self):
+        principal = principal_for(self.request.user)
+        if principal is None:
+            return Chat.objects.none()
+        return principal.scope(Chat.objects.all())
+
+    @staticmethod
+    def _com_resumo_mensagens(queryset):
+        """
+        Totais e últimas mensagens usados pelo ChatSerializer, em consultas fixas por página
+        (contagens por subconsulta só nas linhas da página; última mensagem e última
+        recebida por prefetch fatiado) em vez de várias consultas por chat.
+        """
+        def contagem(**filtros):
+            mensagens = (
+                Mensagem.objects.filter(chat=OuterRef('pk'), **filtros)
+                .order_by().values('chat').annotate(n=Count('id')).values('n')
+            )
+            return Coalesce(Subquery(mensagens, output_field=IntegerField()), 0)
+
+        # Nome do contato quando a mensagem não traz nenhum (ChatSerializer.get_contact_name)
+        sender_nome = (
+            Sender.objects.filter(sender_id=OuterRef('chat_id'), cliente=OuterRef('cliente'))
+            .order_by('-id')
+            .values(nome=Coalesce(NullIf('push_name', Value('')), NullIf('verified_name', Value(''))))[:1]
+        )
+        return queryset.annotate(
+            total_mensagens_count=contagem(),
+            unread_count_total=contagem(lida=False),
+            sender_nome=Subquery(sender_nome),
+        ).prefetch_related(
+            Prefetch('mensagens', queryset=Mensagem.objects.order_by('-data_envio')[:1], to_attr='ultimas_mensagens'),
+            Prefetch(
+                'mensagens',
+                queryset=Mensagem.objects.filter(from_me=False).order_by('-data_envio')[:1],
+                to_attr='ultimas_recebidas',
+            ),
+        )
 
     @action(detail=False, methods=["get"])
     def stats(self, request):
         """
         Retorna estatísticas dos chats.
         """
-        queryset = self.get_queryset()
-        
-        # Estatísticas básicas
-        total_chats = queryset.count()
-        chats_abertos = queryset.filter(status="aberto").count()
-        chats_fechados = queryset.filter(status="fechado").count()
-        chats_pendentes = queryset.filter(status="pendente").count()
-        
-        # Chats por período
         hoje = timezone.now().date()
-        chats_hoje = queryset.filter(data_inicio__date=hoje).count()
-        chats_semana = queryset.filter(
-            data_inicio__date__gte=hoje - timedelta(days=7)
-        ).count()
-        
-        return Response({
-            "total_chats": total_chats,
-            "chats_abertos": chats_abertos,
-            "chats_fechados": chats_fechados,
-            "chats_pendentes": chats_pendentes,
-            "chats_hoje": chats_hoje,
-            "chats_semana": chats_semana
-        })
+        # Estatísticas básicas e por período em uma única consulta
+        return Response(self._chats_do_usuario().aggregate(
+            total_chats=Count('id'),
+            # Mesmos grupos de status do dashboard ('active'/'aberto', ...)
+            **{f'chats_{grupo}': Count('id', filter=Q(status__in=valores))
+               for grupo, valores in dashboard.CHAT_STATUS_GROUPS.items()},
+            chats_hoje=Count('id', filter=Q(data_inicio__date=hoje)),
+            chats_semana=Count('id', filter=Q(data_inicio__date__gte=hoje - timedelta(days=7))),
+        ))
 
     @action(detail=False, methods=["get"], url_path='realtime-updates')
     def realtime_updates(self, request):
         """
         Endpoint SSE para atualizações em tempo real dos chats
         """
-        from django.core.cache import cache
-        
         def event_stream():
             """Gera stream de eventos SSE"""
             last_check = timezone.now()
@@ -683,8 +762,9 @@ class ChatViewSet(viewsets.ModelViewSet):
             
             while True:
                 try:
-                    # Verificar cache de atualizações primeiro
-                    updates = cache.get("realtime_updates", [])
+                    # Verificar cache de atualizações primeiro (só as do cliente do usuário)
+                    principal = principal_for(request.user)
+                    updates = _atualizacoes_em_cache(principal)
                     current_time = timezone.now()
                     
                     # Filtrar atualizações novas
@@ -704,18 +784,10 @@ class ChatViewSet(viewsets.ModelViewSet):
                         last_cache_check = current_time
                     
                     # Verificar novas mensagens desde a última verificação (fallback)
-                    user = request.user
                     base_queryset = Chat.objects.select_related('cliente', 'atendente')
                     
                     # Filtrar por permissões do usuário
-                    if user.is_superuser or (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'admin'):
-                        chats = base_queryset.all()
-                    elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'cliente' and hasattr(user, 'cliente') and user.cliente:
-                        chats = base_queryset.filter(cliente=user.cliente)
-                    elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'colaborador' and hasattr(user, 'cliente') and user.cliente:
-                        chats = base_queryset.filter(cliente=user.cliente)
-                    else:
-                        chats = Chat.objects.none()
+                    chats = principal.scope(base_queryset) if principal else Chat.objects.none()
                     
                     # Verificar mensagens novas (apenas se não houver atualizações no cache)
                     if not new_updates:
@@ -802,7 +874,6 @@ class ChatViewSet(viewsets.ModelViewSet):
         Endpoint para verificar atualizações em tempo real
         Busca diretamente do banco de dados para garantir precisão
         """
-        from django.core.cache import cache
         from django.db.models import Q
 
         try:
@@ -828,14 +899,8 @@ class ChatViewSet(viewsets.ModelViewSet):
             # Buscar chats do usuário
             base_queryset = Chat.objects.select_related('cliente', 'atendente')
 
-            if user.is_superuser or (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'admin'):
-                chats = base_queryset.all()
-            elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'cliente' and hasattr(user, 'cliente') and user.cliente:
-                chats = base_queryset.filter(cliente=user.cliente)
-            elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'colaborador' and hasattr(user, 'cliente') and user.cliente:
-                chats = base_queryset.filter(cliente=user.cliente)
-            else:
-                chats = Chat.objects.none()
+            principal = principal_for(user)
+            chats = principal.scope(base_queryset) if principal else Chat.objects.none()
 
             # Buscar novas mensagens diretamente do banco
             novas_mensagens = Mensagem.objects.filter(
@@ -849,6 +914,15 @@ class ChatViewSet(viewsets.ModelViewSet):
                 Q(data_inicio__gt=last_check)
             )
 
+            # Total de mensagens por chat atualizado, em uma consulta
+            novas_mensagens = list(novas_mensagens)
+            chats_atualizados = list(chats_atualizados)
+            chats_com_update = {msg.chat_id for msg in novas_mensagens} | {chat.id for chat in chats_atualizados}
+            totais_por_chat = dict(
+                Mensagem.objects.filter(chat_id__in=chats_com_update).order_by()
+                .values('chat_id').annotate(n=Count('id')).values_list('chat_id', 'n')
+            ) if chats_com_update else {}
+
             # Criar atualizações para novas mensagens
             for msg in novas_mensagens:
                 new_updates.append({
@@ -867,7 +941,7 @@ class ChatViewSet(viewsets.ModelViewSet):
                     'chat_update': {
                         'chat_id': msg.chat.chat_id,
                         'last_message_at': msg.data_envio.isoformat(),
-                        'message_count': msg.chat.mensagens.count(),
+                        'message_count': totais_por_chat.get(msg.chat_id, 0),
                         'chat_name': msg.chat.chat_name or msg.chat.chat_id,
                         'sender_name': msg.remetente
                     }
@@ -881,12 +955,12 @@ class ChatViewSet(viewsets.ModelViewSet):
                         'type': 'chat_updated',
                         'chat_id': chat.chat_id,
                         'last_message_at': chat.last_message_at.isoformat() if chat.last_message_at else None,
-                        'message_count': chat.mensagens.count(),
+                        'message_count': totais_por_chat.get(chat.id, 0),
                         'chat_name': chat.chat_name or chat.chat_id
                     })
 
             # Verificar cache para atualizações em tempo real (backup)
-            cache_updates = cache.get("realtime_updates", [])
+            cache_updates = _atualizacoes_em_cache(principal)
             for update in cache_updates:
                 try:
                     update_timestamp = update.get('timestamp')
@@ -938,15 +1012,11 @@ class MensagemViewSet(viewsets.ModelViewSet):
         if not hasattr(self.request, 'user') or not self.request.user.is_authenticated:
             return Mensagem.objects.none()
         
-        user = self.request.user
-        if user.is_superuser or (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'admin'):
-            return Mensagem.objects.all()
-        elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'colaborador' and hasattr(user, 'cliente'):
-            return Mensagem.objects.filter(chat__cliente=user.cliente)
-        elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'cliente' and hasattr(user, 'cliente'):
-            return Mensagem.objects.filter(chat__cliente=user.cliente)
-        return Mensagem.objects.none()
+        principal = principal_for(self.request.user)
+        # O serializer lê mensagem.chat (nome do remetente, URL da mídia) em toda linha
+        return principal.scope(Mensagem.objects.select_related('chat'), 'chat__cliente')
 
+    @read_replica
     def list(self, request, *args, **kwargs):
         """
         Lista mensagens com filtros opcionais.
@@ -1025,10 +1095,92 @@ class MensagemViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'], url_path='export')
+    def export(self, request):
+        """
+        Exporta as mensagens em streaming (sem paginação, memória constante).
+
+        Parâmetros: formato=csv|ndjson, gzip=1, data_inicio/data_fim
+        (AAAA-MM-DD, padrão últimos 30 dias), chat_id, tipo.
+        """
+        try:
+            data_inicio, data_fim = _periodo_exportacao(request)
+        except ValueError:
+            return Response({"error": "Datas devem estar no formato AAAA-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        formato = request.query_params.get('formato', 'csv')
+        if formato not in EXPORT_FORMATS:
+            return Response({"error": f"Formato inválido: {formato}"}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.get_queryset().filter(
+            data_envio__gte=timezone.make_aware(datetime.combine(data_inicio, datetime.min.time())),
+            data_envio__lt=timezone.make_aware(datetime.combine(data_fim + timedelta(days=1), datetime.min.time())),
+        )
+        if request.query_params.get('chat_id'):
+            queryset = queryset.filter(chat__chat_id=request.query_params['chat_id'])
+        if request.query_params.get('tipo'):
+            queryset = queryset.filter(tipo=request.query_params['tipo'])
+
+        return streaming_export(
+            queryset, MESSAGE_EXPORT_FIELDS, formato,
+            compress=request.query_params.get('gzip') in ('1', 'true'),
+            filename=f"mensagens_{data_inicio:%Y%m%d}_{data_fim:%Y%m%d}",
+            order_by=('data_envio', 'id'),
+        )
+
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        """
+        Busca textual nas mensagens (texto, legendas e nomes de documentos).
+
+        Parâmetros: q, chat_id, page, page_size (máx. 100); administradores
+        podem filtrar por cliente_id. Resultados por relevância, com
+        ``score`` e ``highlight`` (trecho com os termos entre <mark>).
+        """
+        q = (request.query_params.get('q') or '').strip()
+        if not q:
+            return Response({"error": "Parâmetro q é obrigatório"}, status=status.HTTP_400_BAD_REQUEST)
+
+        principal = principal_for(request.user)
+        if principal.is_admin:
+            cliente_id = request.query_params.get('cliente_id') or None
+            if cliente_id is not None and not cliente_id.isdigit():
+                return Response({"error": "cliente_id deve ser um número"}, status=status.HTTP_400_BAD_REQUEST)
+        elif principal.cliente_id:
+            cliente_id = principal.cliente_id
+        else:
+            return Response({"error": "Usuário não possui cliente associado"}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            page = max(1, int(request.query_params.get('page', 1)))
+            page_size = min(100, max(1, int(request.query_params.get('page_size', settings.REST_FRAMEWORK.get('PAGE_SIZE', 20)))))
+        except ValueError:
+            return Response({"error": "page e page_size devem ser números"}, status=status.HTTP_400_BAD_REQUEST)
+
+        resultado = search_messages(
+            q, cliente_id=int(cliente_id) if cliente_id else None, chat_id=request.query_params.get('chat_id'),
+            limit=page_size, offset=(page - 1) * page_size,
+        )
+        # Um serializer para a página inteira (consultas auxiliares não se repetem por resultado)
+        results = self.get_serializer([mensagem for mensagem, _, _ in resultado['results']], many=True).data
+        for data, (_, score, trecho) in zip(results, resultado['results']):
+            data['score'] = score
+            data['highlight'] = trecho
+
+        return Response({
+            'count': resultado['count'],
+            'page': page,
+            'page_size': page_size,
+            'has_next': page * page_size < resultado['count'],
+            'results': results,
+        })
+
     @action(detail=False, methods=['post'], url_path='marcar-lidas')
     def marcar_lidas(self, request):
         """
         Marca todas as mensagens de um chat como lidas.
+
+        Administradores informam cliente_id quando o chat_id existe em mais
+        de um cliente.
         """
         try:
             chat_id = request.data.get('chat_id')
@@ -1037,28 +1189,37 @@ class MensagemViewSet(viewsets.ModelViewSet):
                     'error': 'chat_id é obrigatório'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            # Buscar o chat
-            chat = get_object_or_404(Chat, chat_id=chat_id)
-            
-            # Verificar permissões
-            user = request.user
-            if not (user.is_superuser or 
-                    (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'admin') or
-                    (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'cliente' and chat.cliente == user.cliente) or
-                    (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'colaborador' and chat.cliente == user.cliente)):
+            # chat_id só é único por cliente: buscar dentro do escopo do usuário
+            principal = principal_for(request.user)
+            if not principal.is_admin and not (principal.tipo_usuario in ('cliente', 'colaborador') and principal.cliente_id):
                 return Response({
                     'error': 'Você não tem permissão para marcar mensagens deste chat como lidas'
                 }, status=status.HTTP_403_FORBIDDEN)
+            chats = principal.scope(Chat.objects.filter(chat_id=chat_id))
+            cliente_id = str(request.data.get('cliente_id') or '')
+            if cliente_id:
+                if not cliente_id.isdigit():
+                    return Response({
+                        'error': 'cliente_id deve ser um número'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                chats = chats.filter(cliente_id=int(cliente_id))
+            chat_pks = list(chats.values_list('pk', flat=True))
+            if not chat_pks:
+                return Response({
+                    'error': 'Chat não encontrado'
+                }, status=status.HTTP_404_NOT_FOUND)
+            if len(chat_pks) > 1:
+                # Só acontece para administradores: o mesmo chat_id em mais de um cliente
+                return Response({
+                    'error': 'chat_id existe em mais de um cliente: informe cliente_id'
+                }, status=status.HTTP_400_BAD_REQUEST)
             
-            # Marcar mensagens não lidas como lidas
-            mensagens_nao_lidas = Mensagem.objects.filter(
-                chat=chat,
+            # Marcar mensagens não lidas como lidas (o UPDATE devolve quantas foram marcadas)
+            count = Mensagem.objects.filter(
+                chat_id=chat_pks[0],
                 lida=False,
                 from_me=False  # Apenas mensagens recebidas (não enviadas pelo usuário)
-            )
-            
-            count = mensagens_nao_lidas.count()
-            mensagens_nao_lidas.update(lida=True)
+            ).update(lida=True)
             
             logger.info(f'✅ {count} mensagens marcadas como lidas para o chat {chat_id}')
             
@@ -1132,7 +1293,7 @@ class MensagemViewSet(viewsets.ModelViewSet):
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             
             # Criar instância do deletador
-            deletador = DeletaMensagem(instancia.instance_id, instancia.token)
+            deletador = DeletaMensagem(instancia.instance_id, instancia.token, base_url=f"{get_wapi_base_url()}message")
             
             # Excluir da W-API
             logger.info(f'🔄 Excluindo da W-API: phone_number={mensagem.chat.chat_id}, message_id={mensagem.message_id}')
@@ -1248,10 +1409,9 @@ class MensagemViewSet(viewsets.ModelViewSet):
             
             # Verificar permissões do usuário
             user = request.user
-            if not (user.is_superuser or 
-                    (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'admin') or
-                    (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'cliente' and mensagem.chat.cliente == user.cliente) or
-                    (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'colaborador' and mensagem.chat.cliente == user.cliente)):
+            principal = principal_for(user)
+            if not (principal.is_admin or
+                    (principal.tipo_usuario in ('cliente', 'colaborador') and mensagem.chat.cliente_id == principal.cliente_id)):
                 logger.warning(f'⚠️ Usuário {user.username} tentou editar mensagem sem permissão')
                 return Response({
                     'error': 'Você não tem permissão para editar esta mensagem',
@@ -1287,7 +1447,7 @@ class MensagemViewSet(viewsets.ModelViewSet):
                 }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
             
             # Criar instância do editor
-            editor = EditarMensagem(instancia.instance_id, instancia.token)
+            editor = EditarMensagem(instancia.instance_id, instancia.token, base_url=f"{get_wapi_base_url()}message")
             
             # Editar na W-API
             logger.info(f'🔄 Editando na W-API: phone_number={mensagem.chat.chat_id}, message_id={mensagem.message_id}, novo_texto={novo_texto[:50]}...')
@@ -1376,7 +1536,7 @@ class MensagemViewSet(viewsets.ModelViewSet):
                     # Importar e usar a classe de reação
                     from mensagem.reacao.enviarReacao import EnviarReacao
                     
-                    reacao_wapi = EnviarReacao(instance.instance_id, instance.token)
+                    reacao_wapi = EnviarReacao(instance.instance_id, instance.token, base_url=get_wapi_base_url())
                     
                     # Extrair número do telefone do chat_id
                     phone = mensagem.chat.chat_id.split('@')[0] if '@' in mensagem.chat.chat_id else mensagem.chat.chat_id
@@ -1457,7 +1617,7 @@ class MensagemViewSet(viewsets.ModelViewSet):
                     # Importar e usar a classe de reação
                     from mensagem.reacao.enviarReacao import EnviarReacao
                     
-                    reacao_wapi = EnviarReacao(instance.instance_id, instance.token)
+                    reacao_wapi = EnviarReacao(instance.instance_id, instance.token, base_url=get_wapi_base_url())
                     
                     # Extrair número do telefone do chat_id
                     phone = mensagem.chat.chat_id.split('@')[0] if '@' in mensagem.chat.chat_id else mensagem.chat.chat_id
@@ -1742,82 +1902,31 @@ class DashboardViewSet(viewsets.ViewSet):
     """
     permission_classes = [IsAtendenteOrAdmin]
 
+    @read_replica
     def list(self, request):
         """
         Retorna dados agregados para o dashboard.
         """
         user = request.user
+        principal = principal_for(user)
         
-        # Determinar escopo dos dados baseado no usuário
-        if user.is_superuser or (hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'admin'):
-            clientes = Cliente.objects.all()
-            chats = Chat.objects.all()
-            mensagens = Mensagem.objects.all()
-            instancias = WhatsappInstance.objects.all()
-        elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'cliente':
+        # Determinar escopo dos dados baseado no usuário (resumo em cache por cliente)
+        if principal.is_admin:
+            cliente_id = None
+        elif principal.tipo_usuario == 'cliente':
             # Cliente vê apenas seus próprios dados
-            clientes = Cliente.objects.filter(email=user.email)
-            chats = Chat.objects.filter(cliente__email=user.email)
-            mensagens = Mensagem.objects.filter(chat__cliente__email=user.email)
-            instancias = WhatsappInstance.objects.filter(cliente__email=user.email)
-        elif hasattr(user, 'tipo_usuario') and user.tipo_usuario == 'colaborador' and hasattr(user, 'cliente'):
-            clientes = Cliente.objects.filter(id=user.cliente.id)
-            chats = Chat.objects.filter(cliente=user.cliente)
-            mensagens = Mensagem.objects.filter(chat__cliente=user.cliente)
-            instancias = WhatsappInstance.objects.filter(cliente=user.cliente)
+            cliente_id = Cliente.objects.filter(email=user.email).values_list('id', flat=True).first()
+            if cliente_id is None:
+                return Response(dashboard.as_response(dashboard.empty_snapshot()))
+        elif principal.tipo_usuario == 'colaborador' and principal.cliente_id:
+            cliente_id = principal.cliente_id
         else:
             # Usuário sem permissões adequadas
             return Response({
                 "error": "Usuário não possui permissões para acessar o dashboard"
             }, status=status.HTTP_403_FORBIDDEN)
 
-        # Estatísticas gerais
-        total_clientes = clientes.count()
-        total_chats = chats.count()
-        total_mensagens = mensagens.count()
-        total_instancias = instancias.count()
-        
-        # Chats por status
-        chats_abertos = chats.filter(status="aberto").count()
-        chats_fechados = chats.filter(status="fechado").count()
-        chats_pendentes = chats.filter(status="pendente").count()
-        
-        # Instâncias por status
-        instancias_conectadas = instancias.filter(status="conectado").count()
-        instancias_desconectadas = instancias.filter(status="desconectado").count()
-        
-        # Atividade recente (últimas 24 horas)
-        ontem = timezone.now() - timedelta(days=1)
-        chats_recentes = chats.filter(data_inicio__gte=ontem).count()
-        mensagens_recentes = mensagens.filter(data_envio__gte=ontem).count()
-        
-        # Mensagens por tipo
-        tipos_mensagem = mensagens.values('tipo').annotate(
-            count=Count('tipo')
-        ).order_by('-count')
-        
-        return Response({
-            "resumo": {
-                "total_clientes": total_clientes,
-                "total_chats": total_chats,
-                "total_mensagens": total_mensagens,
-                "total_instancias": total_instancias
-            },
-            "chats": {
-                "abertos": chats_abertos,
-                "fechados": chats_fechados,
-                "pendentes": chats_pendentes
-            },
-            "instancias": {
-                "conectadas": instancias_conectadas,
-                "desconectadas": instancias_desconectadas
-            },
-            "atividade_recente": {
-                "chats_24h": chats_recentes,
-                "mensagens_24h": mensagens_recentes
-            },
-            "tipos_mensagem": list(tipos_mensagem)
-        })
+        return Response(dashboard.as_response(dashboard.get_snapshot(cliente_id)))
 
 
 class WApiProxyViewSet(viewsets.ViewSet):
@@ -1831,8 +1940,8 @@ class WApiProxyViewSet(viewsets.ViewSet):
     
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        # URL da WAPI oficial conforme documentação
-        self.wapi_base_url = "https://api.w-api.app"
+        # URL da WAPI (settings.WAPI_BASE_URL, sem o sufixo /v1)
+        self.wapi_base_url = get_wapi_base_url().rstrip('/').rsplit('/v1', 1)[0]
     
     @action(detail=False, methods=['get'], url_path='auth/status')
     def check_status(self, request):
@@ -1846,47 +1955,25 @@ class WApiProxyViewSet(viewsets.ViewSet):
                     "error": "instanceId é obrigatório"
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            # Buscar token da instância
-            try:
-                instance = WhatsappInstance.objects.get(instance_id=instance_id)
-                token = instance.token
-            except WhatsappInstance.DoesNotExist:
-                return Response({
-                    "error": "Instância não encontrada"
-                }, status=status.HTTP_404_NOT_FOUND)
-            
-            # Fazer requisição para W-API oficial
-            import requests
-            response = requests.get(
-                f"{self.wapi_base_url}/v1/instance/status-instance",
-                headers={
-                    'Authorization': f'Bearer {token}',
-                    'Content-Type': 'application/json'
-                },
-                params={'instanceId': instance_id},
-                timeout=30
-            )
-            
-            logger.info(f"Status response: {response.status_code}")
-            logger.info(f"Response headers: {dict(response.headers)}")
-            logger.info(f"Response text: {response.text[:500]}")  # Primeiros 500 chars
-            
-            if response.status_code == 200:
+            # Cache de status (O(1)); só consulta a W-API quando não há entrada
+            entry = get_cached_status(instance_id)
+            if entry is None:
                 try:
-                    return Response(response.json())
-                except ValueError as e:
-                    logger.error(f"Erro ao fazer parse do JSON: {e}")
-                    logger.error(f"Response text: {response.text}")
+                    instance = WhatsappInstance.objects.get(instance_id=instance_id)
+                except WhatsappInstance.DoesNotExist:
                     return Response({
-                        "error": "Resposta inválida da W-API",
-                        "details": str(e),
-                        "response_text": response.text[:200]
-                    }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            else:
-                return Response({
-                    "error": f"Erro na W-API: {response.status_code}",
-                    "response_text": response.text[:200]
-                }, status=response.status_code)
+                        "error": "Instância não encontrada"
+                    }, status=status.HTTP_404_NOT_FOUND)
+                entry = refresh_instance_status(instance, source="manual")
+            
+            # Mesmo formato da W-API ({"instanceId", "connected"}) + metadados do cache
+            return Response({
+                "instanceId": instance_id,
+                "connected": entry["connected"],
+                "status": entry["status"],
+                "checked_at": entry["checked_at"],
+                "source": entry["source"],
+            })
                 
         except Exception as e:
             logger.error(f"Erro ao verificar status: {str(e)}")
@@ -2116,6 +2203,7 @@ class RelatorioView(View):
     View para gerar relatórios com filtros por data e usuário
     """
     
+    @read_replica
     def get(self, request):
         try:
             # Parâmetros de filtro
@@ -2135,18 +2223,30 @@ class RelatorioView(View):
             else:
                 data_fim = timezone.now().date()
             
-            # Filtros base
+            # Filtros base (Chat); mensagens vêm da consolidação por hora (core.rollups)
             filtros = {}
             if cliente_id:
                 filtros['cliente_id'] = cliente_id
             if usuario_id:
                 filtros['atendente_id'] = usuario_id
             
-            # 1. Quantidade de atendimentos no período
-            atendimentos = Chat.objects.filter(
-                data_inicio__date__range=[data_inicio, data_fim],
-                **filtros
-            ).count()
+            inicio_local = timezone.make_aware(datetime.combine(data_inicio, datetime.min.time()))
+            fim_local = timezone.make_aware(datetime.combine(data_fim + timedelta(days=1), datetime.min.time()))
+            chats_periodo = Chat.objects.filter(
+                data_inicio__gte=inicio_local, data_inicio__lt=fim_local, **filtros
+            )
+            
+            # 1. Quantidade de atendimentos no período + tempo médio (uma consulta)
+            chats_agg = chats_periodo.aggregate(
+                total=Count('id'),
+                duracao_media=Avg(
+                    ExpressionWrapper(F('data_fim') - F('data_inicio'), output_field=DurationField()),
+                    filter=Q(data_fim__isnull=False),
+                ),
+            )
+            atendimentos = chats_agg['total']
+            duracao_media = chats_agg['duracao_media']
+            tempo_medio_atendimento = duracao_media.total_seconds() / 60 if duracao_media else 0  # em minutos
             
             # 2. Quantidade total de clientes no mês
             mes_atual = timezone.now().replace(day=1)
@@ -2154,94 +2254,61 @@ class RelatorioView(View):
                 data_cadastro__gte=mes_atual
             ).count()
             
-            # 3. Quantidade de mensagens enviadas a mais (comparativo)
-            # Mensagens enviadas no período atual
-            mensagens_enviadas_periodo = Mensagem.objects.filter(
-                data_envio__date__range=[data_inicio, data_fim],
-                remetente__icontains='atendente',  # Assumindo que mensagens de atendentes contêm 'atendente'
-                **filtros
-            ).count()
-            
-            # Mensagens enviadas no período anterior (mesmo intervalo)
+            # 3. Mensagens do período atual e do anterior (mesmo intervalo): uma consulta na consolidação
             periodo_anterior_inicio = data_inicio - timedelta(days=(data_fim - data_inicio).days)
             periodo_anterior_fim = data_inicio - timedelta(days=1)
+            linhas = rollups_between(
+                min(periodo_anterior_inicio, data_inicio), data_fim, cliente_id=cliente_id, atendente_id=usuario_id
+            ).values('dia', 'tipo', 'from_me').annotate(
+                soma=Sum('total'), soma_satisfacao=Sum('satisfacao')
+            )
             
-            mensagens_enviadas_anterior = Mensagem.objects.filter(
-                data_envio__date__range=[periodo_anterior_inicio, periodo_anterior_fim],
-                remetente__icontains='atendente',
-                **filtros
-            ).count()
+            por_dia = defaultdict(int)
+            por_tipo = defaultdict(int)
+            total_mensagens = 0
+            mensagens_satisfacao = 0
+            mensagens_enviadas_periodo = 0
+            mensagens_enviadas_anterior = 0
+            for linha in linhas:
+                if data_inicio <= linha['dia'] <= data_fim:
+                    por_dia[linha['dia']] += linha['soma']
+                    por_tipo[linha['tipo']] += linha['soma']
+                    total_mensagens += linha['soma']
+                    mensagens_satisfacao += linha['soma_satisfacao']
+                    if linha['from_me']:
+                        mensagens_enviadas_periodo += linha['soma']
+                elif linha['from_me'] and periodo_anterior_inicio <= linha['dia'] <= periodo_anterior_fim:
+                    mensagens_enviadas_anterior += linha['soma']
             
             mensagens_a_mais = mensagens_enviadas_periodo - mensagens_enviadas_anterior
             
-            # 4. Quantidade total de mensagens no período
-            total_mensagens = Mensagem.objects.filter(
-                data_envio__date__range=[data_inicio, data_fim],
-                **filtros
-            ).count()
-            
             # 5. Dados para gráficos
-            # Mensagens por dia no período
+            # Mensagens por dia no período (dias sem mensagens aparecem com 0)
             mensagens_por_dia = []
             current_date = data_inicio
             while current_date <= data_fim:
-                count = Mensagem.objects.filter(
-                    data_envio__date=current_date,
-                    **filtros
-                ).count()
                 mensagens_por_dia.append({
                     'data': current_date.strftime('%Y-%m-%d'),
-                    'quantidade': count
+                    'quantidade': por_dia[current_date]
                 })
                 current_date += timedelta(days=1)
             
             # Atendimentos por status
-            atendimentos_por_status = Chat.objects.filter(
-                data_inicio__date__range=[data_inicio, data_fim],
-                **filtros
-            ).values('status').annotate(
+            atendimentos_por_status = chats_periodo.values('status').annotate(
                 total=Count('id')
             )
             
             # Top 5 atendentes mais ativos
-            top_atendentes = Chat.objects.filter(
-                data_inicio__date__range=[data_inicio, data_fim],
-                **filtros
-            ).values('atendente__nome').annotate(
+            top_atendentes = chats_periodo.values('atendente__nome').annotate(
                 total_atendimentos=Count('id')
             ).order_by('-total_atendimentos')[:5]
             
             # Tipos de mensagem
-            tipos_mensagem = Mensagem.objects.filter(
-                data_envio__date__range=[data_inicio, data_fim],
-                **filtros
-            ).values('tipo').annotate(
-                total=Count('id')
-            )
-            
-            # 6. Métricas adicionais
-            # Tempo médio de atendimento
-            chats_finalizados = Chat.objects.filter(
-                data_inicio__date__range=[data_inicio, data_fim],
-                data_fim__isnull=False,
-                **filtros
-            )
-            
-            tempo_medio_atendimento = 0
-            if chats_finalizados.exists():
-                total_tempo = sum([
-                    (chat.data_fim - chat.data_inicio).total_seconds() / 60  # em minutos
-                    for chat in chats_finalizados
-                ])
-                tempo_medio_atendimento = total_tempo / chats_finalizados.count()
+            tipos_mensagem = [
+                {'tipo': tipo, 'total': total} for tipo, total in sorted(por_tipo.items(), key=lambda item: -item[1])
+            ]
             
             # Taxa de satisfação (assumindo que mensagens com emoji positivo indicam satisfação)
-            mensagens_satisfacao = Mensagem.objects.filter(
-                data_envio__date__range=[data_inicio, data_fim],
-                conteudo__icontains='👍',
-                **filtros
-            ).count()
-            
             taxa_satisfacao = 0
             if total_mensagens > 0:
                 taxa_satisfacao = (mensagens_satisfacao / total_mensagens) * 100
@@ -2281,13 +2348,59 @@ class RelatorioView(View):
             }, status=500)
 
 
+def _periodo_exportacao(request):
+    """(data_inicio, data_fim) da query string; padrão: últimos 30 dias."""
+    data_inicio = request.GET.get('data_inicio')
+    data_fim = request.GET.get('data_fim')
+    data_fim = datetime.strptime(data_fim, '%Y-%m-%d').date() if data_fim else timezone.localdate()
+    data_inicio = datetime.strptime(data_inicio, '%Y-%m-%d').date() if data_inicio else data_fim - timedelta(days=30)
+    return data_inicio, data_fim
+
+
+@api_view(['GET'])
+@permission_classes([IsAtendenteOrAdmin])
+def exportar_relatorio(request):
+    """
+    Exporta a consolidação por hora do relatório em streaming (CSV ou NDJSON, gzip=1 opcional).
+
+    Administradores podem filtrar por cliente_id; os demais usuários só exportam o próprio cliente.
+    """
+    try:
+        data_inicio, data_fim = _periodo_exportacao(request)
+    except ValueError:
+        return Response({"error": "Datas devem estar no formato AAAA-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+    formato = request.GET.get('formato', 'csv')
+    if formato not in EXPORT_FORMATS:
+        return Response({"error": f"Formato inválido: {formato}"}, status=status.HTTP_400_BAD_REQUEST)
+
+    principal = principal_for(request.user)
+    if principal.is_admin:
+        cliente_id = request.GET.get('cliente_id') or None
+        if cliente_id is not None and not cliente_id.isdigit():
+            return Response({"error": "cliente_id deve ser um número"}, status=status.HTTP_400_BAD_REQUEST)
+    elif principal.cliente_id:
+        cliente_id = principal.cliente_id
+    else:
+        return Response({"error": "Usuário não possui cliente associado"}, status=status.HTTP_403_FORBIDDEN)
+
+    linhas = rollups_between(
+        data_inicio, data_fim, cliente_id=cliente_id, atendente_id=request.GET.get('usuario_id')
+    )
+    return streaming_export(
+        linhas, ROLLUP_EXPORT_FIELDS, formato,
+        compress=request.GET.get('gzip') in ('1', 'true'),
+        filename=f"relatorio_{data_inicio:%Y%m%d}_{data_fim:%Y%m%d}",
+        order_by=('dia', 'hora', 'cliente_id', 'id'),
+    )
+
+
 @api_view(["POST"])
 def recuperar_status_whatsapp(request):
     """
     Endpoint de recuperação: atualiza e retorna o status WhatsApp de todos os clientes.
     """
     from core.models import Cliente
-    clientes = Cliente.objects.all()
+    clientes = Cliente.objects.prefetch_related('whatsapp_instances')
     serializer = ClienteSerializer(clientes, many=True)
     return Response(serializer.data)
 
@@ -2597,11 +2710,18 @@ def serve_whatsapp_media(request, cliente_id, instance_id, chat_id, media_type,
         if not content_type:
             content_type = 'application/octet-stream'
         
-        # Ler e retornar o arquivo
-        with open(base_path, 'rb') as f:
-            response = HttpResponse(f.read(), content_type=content_type)
+        # ?size=96|320|1024: miniatura em vez da imagem original
+        if media_type == 'imagens':
+            served_path, variant_content_type = sized_image(request, base_path)
+            content_type = variant_content_type or content_type
+        else:
+            served_path = base_path
         
+        # Retornar o arquivo
+        response = FileResponse(open(served_path, 'rb'), content_type=content_type)
         response['Content-Disposition'] = f'inline; filename="{filename}"'
+        if media_type == 'imagens':
+            patch_vary_headers(response, ('Accept',))
         
         logger.info(f"✅ Servindo mídia: cliente_{cliente_id}/instance_{instance_id}/chats/{chat_id}/{media_type}/{filename}")
         return response
@@ -2611,6 +2731,15 @@ def serve_whatsapp_media(request, cliente_id, instance_id, chat_id, media_type,
         return Response({'error': 'Erro ao servir mídia'}, status=500)
 
 
+def _arquivo_da_mensagem(mensagem):
+    """Arquivo local da mídia registrada no MediaFile; baixa sob demanda (single-flight) se preciso"""
+    if not mensagem.message_id:
+        return None
+    with replica_reads():
+        media_file = MediaFile.objects.filter(message_id=mensagem.message_id).first()
+    return ensure_local(media_file) if media_file else None
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def serve_audio_message(request, message_id):
@@ -2637,6 +2766,11 @@ def serve_audio_message(request, message_id):
             f"wapi/midias/audios/{message_id}.m4a"
         ]
         
+        # Mídia registrada no MediaFile: baixa sob demanda se ainda pendente ou removida
+        local_path = _arquivo_da_mensagem(message)
+        if local_path:
+            audio_paths.insert(0, str(local_path))
+        
         for audio_path in audio_paths:
             if os.path.exists(audio_path):
                 with open(audio_path, 'rb') as audio_file:
@@ -2677,12 +2811,18 @@ def serve_image_message(request, message_id):
             f"wapi/midias/images/{message_id}.jpeg"
         ]
         
+        # Mídia registrada no MediaFile: baixa sob demanda se ainda pendente ou removida
+        local_path = _arquivo_da_mensagem(message)
+        if local_path:
+            image_paths.insert(0, str(local_path))
+        
         for image_path in image_paths:
             if os.path.exists(image_path):
-                with open(image_path, 'rb') as image_file:
-                    response = HttpResponse(image_file.read(), content_type='image/jpeg')
-                    response['Content-Disposition'] = f'attachment; filename="image_{message_id}.jpg"'
-                    return response
+                served_path, variant_content_type = sized_image(request, image_path)
+                response = FileResponse(open(served_path, 'rb'), content_type=variant_content_type or 'image/jpeg')
+                response['Content-Disposition'] = f'attachment; filename="image_{message_id}.jpg"'
+                patch_vary_headers(response, ('Accept',))
+                return response
         
         return Response({'error': 'Arquivo de imagem não encontrado'}, status=404)
         
@@ -2717,6 +2857,11 @@ def serve_video_message(request, message_id):
             f"wapi/midias/videos/{message_id}.mov"
         ]
         
+        # Mídia registrada no MediaFile: baixa sob demanda se ainda pendente ou removida
+        local_path = _arquivo_da_mensagem(message)
+        if local_path:
+            video_paths.insert(0, str(local_path))
+        
         for video_path in video_paths:
             if os.path.exists(video_path):
                 with open(video_path, 'rb') as video_file:
@@ -2757,6 +2902,11 @@ def serve_sticker_message(request, message_id):
             f"wapi/midias/stickers/{message_id}.gif"
         ]
         
+        # Mídia registrada no MediaFile: baixa sob demanda se ainda pendente ou removida
+        local_path = _arquivo_da_mensagem(message)
+        if local_path:
+            sticker_paths.insert(0, str(local_path))
+        
         for sticker_path in sticker_paths:
             if os.path.exists(sticker_path):
                 with open(sticker_path, 'rb') as sticker_file:
@@ -2797,6 +2947,11 @@ def serve_document_message(request, message_id):
             f"wapi/midias/documents/{message_id}.docx"
         ]
         
+        # Mídia registrada no MediaFile: baixa sob demanda se ainda pendente ou removida
+        local_path = _arquivo_da_mensagem(message)
+        if local_path:
+            document_paths.insert(0, str(local_path))
+        
         for document_path in document_paths:
             if os.path.exists(document_path):
                 with open(document_path, 'rb') as document_file:
@@ -2812,6 +2967,47 @@ def serve_document_message(request, message_id):
         return Response({'error': str(e)}, status=500)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def serve_media_preview(request, message_id):
+    """
+    Serve a prévia (poster do vídeo ou primeira página do PDF) de uma mensagem
+    do cliente do usuário.
+
+    A prévia é gerada na ingestão; se ainda não existir, é gerada na hora com
+    prioridade interativa.
+    """
+    try:
+        # Mensagem de outro cliente responde como inexistente
+        principal = principal_for(request.user)
+        mensagem = principal.scope(Mensagem.objects.only('message_id'), 'chat__cliente').get(id=message_id)
+        media = MediaFile.objects.filter(message_id=mensagem.message_id).first()
+        if not media or media.media_type not in ('video', 'document'):
+            return Response({'error': 'Mensagem sem mídia com prévia'}, status=404)
+
+        served_path = media.preview_path
+        if not (served_path and os.path.exists(served_path)):
+            source_path = ensure_local(media)
+            if not source_path:
+                return Response({'error': 'Arquivo de mídia não encontrado'}, status=404)
+            future = schedule_preview(media.message_id, source_path, media.media_type,
+                                      media.mimetype, priority=PRIORITY_INTERACTIVE)
+            if future is None:
+                return Response({'error': 'Prévia indisponível para este arquivo'}, status=404)
+            wait = settings.MULTICHAT_SETTINGS.get('TRANSCODE_INTERACTIVE_WAIT', 30)
+            served_path = future.result(timeout=wait)['preview_path']
+
+        response = FileResponse(open(served_path, 'rb'), content_type='image/jpeg')
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
+
+    except Mensagem.DoesNotExist:
+        return Response({'error': 'Mensagem não encontrada'}, status=404)
+    except Exception as e:
+        logger.warning(f"⚠️ Prévia indisponível para mensagem {message_id}: {e}")
+        return Response({'error': 'Prévia indisponível'}, status=404)
+
+
 class MediaFileViewSet(viewsets.ModelViewSet):
     """
     ViewSet para gerenciar arquivos de mídia.
@@ -2829,16 +3025,14 @@ class MediaFileViewSet(viewsets.ModelViewSet):
         - Clientes veem apenas suas mídias
         - Colaboradores veem mídias do cliente ao qual estão associados
         """
-        user = self.request.user
+        principal = principal_for(self.request.user)
         
-        if user.is_superuser:
-            return MediaFile.objects.all()
-        elif hasattr(user, 'cliente'):
-            return MediaFile.objects.filter(cliente=user.cliente)
-        elif hasattr(user, 'departamento') and user.departamento:
-            return MediaFile.objects.filter(cliente=user.departamento.cliente)
-        else:
+        base_queryset = MediaFile.objects.select_related('cliente', 'instance')
+        if principal is None:
             return MediaFile.objects.none()
+        if principal.is_superuser:
+            return base_queryset.all()
+        return base_queryset.filter(cliente_id=principal.cliente_id)
     
     @action(detail=False, methods=['get'])
     def stats(self, request):
@@ -2854,6 +3048,20 @@ class MediaFileViewSet(viewsets.ModelViewSet):
         
         return Response(stats)
     
+    @action(detail=False, methods=['get'], url_path='file-link-cache')
+    def file_link_cache(self, request):
+        """Acertos do cache de fileLink da W-API (pedidos de download-media evitados)"""
+        if not request.user.is_superuser:
+            return Response({"error": "Apenas administradores podem ver as métricas do cache"}, status=status.HTTP_403_FORBIDDEN)
+        return Response(file_links.get_stats())
+
+    @action(detail=False, methods=['get'], url_path='tenant-cache')
+    def tenant_cache(self, request):
+        """Acertos do cache por cliente (URLs de mídia e atualizações em tempo real) e invalidações"""
+        if not request.user.is_superuser:
+            return Response({"error": "Apenas administradores podem ver as métricas do cache"}, status=status.HTTP_403_FORBIDDEN)
+        return Response(tenant_cache.get_stats())
+    
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         """Endpoint para download direto do arquivo"""
@@ -2901,6 +3109,17 @@ def serve_audio_message_public(request, message_id):
         if message.tipo != 'audio':
             return Response({'error': 'Mensagem não é de áudio'}, status=400)
         
+        # Mídia registrada no MediaFile (baixa sob demanda se ainda pendente)
+        local_path = _arquivo_da_mensagem(message)
+        if local_path:
+            served_file, variant_content_type = playable_audio(request, local_path)
+            content_type = variant_content_type or ('audio/ogg' if local_path.suffix == '.ogg' else 'audio/mpeg')
+            response = FileResponse(open(served_file, 'rb'), content_type=content_type)
+            response['Content-Disposition'] = f'inline; filename="{served_file.name}"'
+            response['Access-Control-Allow-Origin'] = '*'
+            patch_vary_headers(response, ('Accept', 'User-Agent'))
+            return response
+        
         # Primeiro, tentar buscar na nova estrutura usando o mesmo método do serializer
         from pathlib import Path
         import glob
@@ -2912,7 +3131,7 @@ def serve_audio_message_public(request, message_id):
             instance_id = instance.instance_id
             chat_id = message.chat.chat_id
             
-            base_path = Path(__file__).parent.parent / "media_storage" / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "audio"
+            base_path = get_media_storage_dir() / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "audio"
             
             if base_path.exists():
                 # Usar os mesmos padrões de busca do serializer
@@ -2931,11 +3150,15 @@ def serve_audio_message_public(request, message_id):
                         found_file = arquivos[0]
                         content_type = 'audio/ogg' if found_file.suffix == '.ogg' else 'audio/mpeg'
                         
-                        with open(found_file, 'rb') as audio_file:
-                            response = HttpResponse(audio_file.read(), content_type=content_type)
-                            response['Content-Disposition'] = f'inline; filename="{found_file.name}"'
-                            response['Access-Control-Allow-Origin'] = '*'
-                            return response
+                        # OGG/Opus em navegador sem suporte: servir a variante MP3 em cache
+                        served_file, variant_content_type = playable_audio(request, found_file)
+                        content_type = variant_content_type or content_type
+                        
+                        response = FileResponse(open(served_file, 'rb'), content_type=content_type)
+                        response['Content-Disposition'] = f'inline; filename="{served_file.name}"'
+                        response['Access-Control-Allow-Origin'] = '*'
+                        patch_vary_headers(response, ('Accept', 'User-Agent'))
+                        return response
         
         # Se não encontrou arquivo local, tentar extrair URL do WhatsApp do conteúdo JSON
         import json
@@ -3157,7 +3380,7 @@ def serve_audio_by_hash_mapping(request, message_id):
         chat_id = chat.chat_id
         
         # Construir caminho base do diretório de áudio
-        base_path = Path(__file__).parent.parent / "media_storage" / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "audio"
+        base_path = get_media_storage_dir() / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "audio"
         
         print(f"🔍 Mapeamento inteligente para message_id: {message_id}")
         print(f"🔍 Chat ID: {chat_id}")
@@ -3333,7 +3556,7 @@ def serve_media_by_message_id(request, message_id):
         logger.info(f"📱 Cliente: {cliente_nome}, Instance: {instance_id}, Chat: {chat_id}")
         
         # Construir caminho base da mídia
-        base_path = Path(settings.BASE_DIR) / 'media_storage' / cliente_nome / f'instance_{instance_id}' / 'chats' / chat_id
+        base_path = get_media_storage_dir() / cliente_nome / f'instance_{instance_id}' / 'chats' / chat_id
         logger.info(f"📁 Caminho base: {base_path}")
         
         # Definir tipos de mídia e extensões possíveis
@@ -3348,7 +3571,17 @@ def serve_media_by_message_id(request, message_id):
         found_file = None
         media_type_found = None
         
+        # Mídia registrada no MediaFile: baixa sob demanda se pendente ou removida pela cota
+        media_file = MediaFile.objects.filter(message_id=mensagem.message_id).first()
+        if media_file:
+            local_path = ensure_local(media_file)
+            if local_path:
+                found_file = local_path
+                media_type_found = 'image' if media_file.media_type == 'sticker' else media_file.media_type
+        
         for media_type, extensions in media_types.items():
+            if found_file:
+                break
             media_dir = base_path / media_type
             if media_dir.exists():
                 logger.info(f"🔍 Verificando diretório: {media_dir}")
@@ -3360,9 +3593,6 @@ def serve_media_by_message_id(request, message_id):
                         found_file = file_path
                         media_type_found = media_type
                         break
-                
-                if found_file:
-                    break
         
         if not found_file:
             logger.warning(f"❌ Arquivo não encontrado para hash: {hash_id}")
@@ -3397,6 +3627,15 @@ def serve_media_by_message_id(request, message_id):
         file_extension = found_file.suffix.lower().lstrip('.')
         content_type = content_types.get(file_extension, 'application/octet-stream')
         
+        # OGG/Opus em navegador sem suporte: servir a variante MP3 em cache
+        if media_type_found == 'audio':
+            found_file, variant_content_type = playable_audio(request, found_file)
+            content_type = variant_content_type or content_type
+        # ?size=96|320|1024: miniatura em vez da imagem original
+        elif media_type_found == 'image':
+            found_file, variant_content_type = sized_image(request, found_file)
+            content_type = variant_content_type or content_type
+        
         # Servir o arquivo
         try:
             response = FileResponse(
@@ -3406,6 +3645,10 @@ def serve_media_by_message_id(request, message_id):
             )
             response['Cache-Control'] = 'public, max-age=3600'
             response['Access-Control-Allow-Origin'] = '*'
+            if media_type_found == 'audio':
+                patch_vary_headers(response, ('Accept', 'User-Agent'))
+            elif media_type_found == 'image':
+                patch_vary_headers(response, ('Accept',))
             
             logger.info(f"✅ Mídia servida com sucesso: {found_file}")
             return response
@@ -18,6 +18,7 @@ import logging
 from typing import Dict, Any, Optional, List
 from django.conf import settings
 from core.models import WhatsappInstance, Cliente
+from core.utils import get_wapi_base_url
 from core.models import Chat as CoreChat, Mensagem as CoreMensagem
 
 
@@ -41,7 +42,7 @@ class WApiIntegration:
             instance_id (str, opcional): ID da instância do WhatsApp.
             token (str, opcional): Token de autenticação da instância.
         """
-        self.base_url = "https://api.w-api.app/v1/"
+        self.base_url = get_wapi_base_url()
         self.instance_id = instance_id
         self.token = token
         self.headers = {
@@ -0,0 +1,411 @@
+"""
+Simulador local da W-API.
+
+Implementa o subconjunto de endpoints usados pelo sistema MultiChat para
+que os fluxos de envio e download de mídia possam ser exercitados (e
+medidos) sem acesso à rede:
+
+- message/send-text, message/send-image, message/send-audio (e sendImage legado)
+- message/download-media + hospedagem dos arquivos em /files/
+- instance/status-instance (e instance/status), instance/qr-code
+- message/edit-message, message/delete-message
+- message/send-reaction, message/remove-reaction
+- chats/fetch-chats, chats/fetch-messages (usados pelo backfill de histórico)
+
+Latência, taxa de erro e limite de requisições (429) são configuráveis.
+Para apontar o sistema para o simulador, defina WAPI_BASE_URL, por exemplo
+``WAPI_BASE_URL=http://127.0.0.1:8900/v1/``.
+
+Uso:
+    python manage.py wapi_simulator --port 8900 --latency lognormal:80,0.5 --error-rate 0.01
+
+Autor: Sistema MultiChat
+"""
+
+import base64
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+logger = logging.getLogger(__name__)
+
+
+# Cabeçalhos mínimos para que os validadores de arquivo (magic numbers) aceitem a mídia
+FILE_SIGNATURES = {
+    'image': (b'\xff\xd8\xff\xe0\x00\x10JFIF\x00', 'image/jpeg', 'jpg'),
+    'sticker': (b'RIFF\x00\x00\x00\x00WEBPVP8 ', 'image/webp', 'webp'),
+    'audio': (b'OggS\x00\x02\x00\x00\x00\x00\x00\x00', 'audio/ogg', 'ogg'),
+    'video': (b'\x00\x00\x00\x18ftypmp42', 'video/mp4', 'mp4'),
+    'document': (b'%PDF-1.4\n', 'application/pdf', 'pdf'),
+}
+
+# PNG 1x1 transparente, usado como QR Code
+QR_CODE_PNG = base64.b64encode(
+    b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x06\x00\x00\x00\x1f\x15\xc4\x89'
+    b'\x00\x00\x00\rIDATx\x9cc\xf8\x0f\x00\x00\x01\x01\x00\x05\x18\xd8N\x00\x00\x00\x00IEND\xaeB`\x82'
+).decode()
+
+
+class LatencyModel:
+    """
+    Distribuição de latência em milissegundos.
+
+    Formatos aceitos (string): ``fixed:50``, ``uniform:20,200``,
+    ``normal:100,30`` e ``lognormal:80,0.5`` (mediana, sigma).
+    """
+
+    def __init__(self, spec: str = "fixed:0", rng: random.Random = None):
+        self.spec = spec
+        self.rng = rng or random.Random()
+        kind, _, params = spec.partition(':')
+        self.kind = kind
+        self.params = [float(p) for p in params.split(',') if p] or [0.0]
+        if kind not in ('fixed', 'uniform', 'normal', 'lognormal'):
+            raise ValueError(f"Distribuição de latência desconhecida: {spec}")
+
+    def sample_ms(self) -> float:
+        p = self.params
+        if self.kind == 'uniform':
+            return self.rng.uniform(p[0], p[1] if len(p) > 1 else p[0])
+        if self.kind == 'normal':
+            return max(0.0, self.rng.gauss(p[0], p[1] if len(p) > 1 else 0))
+        if self.kind == 'lognormal':
+            return self.rng.lognormvariate(math.log(max(p[0], 0.001)), p[1] if len(p) > 1 else 0.5)
+        return p[0]
+
+
+class TokenBucket:
+    """Limite de requisições por segundo (por instância) para simular 429."""
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> Tuple[bool, float]:
+        """Retorna (permitido, segundos até o próximo token)."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True, 0.0
+            return False, (1 - self.tokens) / self.rate
+
+
+class WApiSimulator:
+    """
+    Estado e regras do simulador (independente do servidor HTTP).
+
+    Args:
+        latency: Especificação de latência padrão (ver LatencyModel).
+        endpoint_latency: Latência específica por endpoint, ex.: {'message/download-media': 'uniform:200,800'}.
+        error_rate: Probabilidade (0-1) de responder 500.
+        rate_limit: Requisições/segundo por instância (0 = sem limite).
+        media_size: Tamanho em bytes dos arquivos hospedados.
+        link_ttl: Validade (segundos) dos fileLinks gerados.
+        connected: Status retornado por instance/status-instance.
+        chats / messages_per_chat: Volume sintético para chats/fetch-*.
+        seed: Semente do gerador aleatório (resultados reprodutíveis).
+    """
+
+    def __init__(self, latency: str = "fixed:0", endpoint_latency: Dict[str, str] = None,
+                 error_rate: float = 0.0, rate_limit: float = 0.0, media_size: int = 64 * 1024,
+                 link_ttl: int = 3600, connected: bool = True, chats: int = 20,
+                 messages_per_chat: int = 200, seed: Optional[int] = None):
+        self.rng = random.Random(seed)
+        self.latency = LatencyModel(latency, self.rng)
+        self.endpoint_latency = {
+            path: LatencyModel(spec, self.rng) for path, spec in (endpoint_latency or {}).items()
+        }
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.media_size = media_size
+        self.link_ttl = link_ttl
+        self.connected = connected
+        self.chats = chats
+        self.messages_per_chat = messages_per_chat
+        self.base_url = ""  # preenchido pelo servidor (para montar fileLink)
+
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._files: Dict[str, Tuple[str, float]] = {}  # nome -> (tipo, expira_em)
+        self._lock = threading.Lock()
+        # Requisições chegam em threads do ThreadingHTTPServer: Counter += não é atômico
+        self._stats_lock = threading.Lock()
+        self.stats = Counter()
+
+    # ------------------------------------------------------------------
+    # Regras comuns
+    # ------------------------------------------------------------------
+
+    def _count(self, *keys: str, amount: int = 1):
+        with self._stats_lock:
+            for key in keys:
+                self.stats[key] += amount
+
+    def snapshot_stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return dict(self.stats)
+
+    def _throttle(self, instance_id: str) -> Optional[float]:
+        if not self.rate_limit:
+            return None
+        with self._lock:
+            bucket = self._buckets.get(instance_id)
+            if bucket is None:
+                bucket = self._buckets[instance_id] = TokenBucket(self.rate_limit)
+        allowed, retry_after = bucket.take()
+        return None if allowed else retry_after
+
+    def handle(self, method: str, path: str, query: Dict[str, str], body: Dict[str, Any],
+               authorized: bool) -> Tuple[int, Dict[str, str], Any]:
+        """
+        Processa uma requisição e retorna (status, headers, corpo).
+
+        O corpo é um dict (JSON) ou bytes (arquivo hospedado).
+        """
+        route = path.strip('/')
+        if route.startswith('v1/'):
+            route = route[3:]
+        self._count('requests', f"{method} {'files' if route.startswith('files/') else route}")
+
+        if route.startswith('files/'):
+            return self._serve_file(route[len('files/'):])
+        if route == '__stats':
+            return 200, {}, self.snapshot_stats()
+
+        time.sleep((self.endpoint_latency.get(route) or self.latency).sample_ms() / 1000)
+
+        if not authorized:
+            self._count('401')
+            return 401, {}, {"error": True, "message": "Token inválido"}
+
+        instance_id = query.get('instanceId') or body.get('instanceId') or ''
+        retry_after = self._throttle(instance_id)
+        if retry_after is not None:
+            self._count('429')
+            return 429, {'Retry-After': str(max(1, int(retry_after + 0.999)))}, {
+                "error": True, "message": "Too many requests"
+            }
+
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self._count('500')
+            return 500, {}, {"error": True, "message": "Erro simulado"}
+
+        handler = ROUTES.get((method, route))
+        if handler is None:
+            self._count('404')
+            return 404, {}, {"error": True, "message": f"Endpoint não simulado: {method} {route}"}
+        return handler(self, instance_id, query, body)
+
+    # ------------------------------------------------------------------
+    # Endpoints
+    # ------------------------------------------------------------------
+
+    def _message_id(self) -> str:
+        return "3EB0" + uuid.UUID(int=self.rng.getrandbits(128)).hex[:16].upper()
+
+    def send_message(self, instance_id, query, body):
+        if not body.get('phone'):
+            return 400, {}, {"error": True, "message": "phone é obrigatório"}
+        return 200, {}, {
+            "error": False,
+            "instanceId": instance_id,
+            "messageId": self._message_id(),
+            "insertedId": self._message_id(),
+        }
+
+    def download_media(self, instance_id, query, body):
+        for campo in ('mediaKey', 'directPath', 'type', 'mimetype'):
+            if not body.get(campo):
+                return 200, {}, {"error": True, "message": f"{campo} é obrigatório"}
+        media_type = body['type'] if body['type'] in FILE_SIGNATURES else 'document'
+        expires = time.time() + self.link_ttl
+        name = f"{uuid.UUID(int=self.rng.getrandbits(128)).hex}.{FILE_SIGNATURES[media_type][2]}"
+        with self._lock:
+            self._files[name] = (media_type, expires)
+        return 200, {}, {
+            "error": False,
+            "fileLink": f"{self.base_url}/files/{name}",
+            "expires": int(expires),
+        }
+
+    def _serve_file(self, name: str):
+        with self._lock:
+            entry = self._files.get(name)
+        if entry is None:
+            return 404, {}, {"error": True, "message": "Arquivo não encontrado"}
+        media_type, expires = entry
+        if time.time() > expires:
+            return 410, {}, {"error": True, "message": "Link expirado"}
+        signature, mimetype, _ = FILE_SIGNATURES[media_type]
+        payload = signature + b'\x00' * max(0, self.media_size - len(signature))
+        self._count('bytes_served', amount=len(payload))
+        return 200, {'Content-Type': mimetype}, payload
+
+    def instance_status(self, instance_id, query, body):
+        return 200, {}, {"instanceId": instance_id, "connected": self.connected}
+
+    def qr_code(self, instance_id, query, body):
+        if self.connected:
+            return 200, {}, {"error": True, "message": "Instância já conectada"}
+        return 200, {}, {"error": False, "instanceId": instance_id, "qrcode": f"data:image/png;base64,{QR_CODE_PNG}"}
+
+    def edit_message(self, instance_id, query, body):
+        if not body.get('messageId') or not body.get('text'):
+            return 400, {}, {"error": True, "message": "messageId e text são obrigatórios"}
+        return 200, {}, {"error": False, "instanceId": instance_id, "messageId": body['messageId']}
+
+    def delete_message(self, instance_id, query, body):
+        if not query.get('messageId'):
+            return 400, {}, {"error": True, "message": "messageId é obrigatório"}
+        return 200, {}, {"error": False, "instanceId": instance_id, "messageId": query['messageId']}
+
+    def reaction(self, instance_id, query, body):
+        if not body.get('messageId'):
+            return 400, {}, {"error": True, "message": "messageId é obrigatório"}
+        return 200, {}, {"error": False, "instanceId": instance_id, "messageId": body['messageId']}
+
+    def fetch_chats(self, instance_id, query, body):
+        per_page = int(query.get('perPage') or 20)
+        page = int(query.get('page') or 1)
+        total_pages = max(1, -(-self.chats // per_page))
+        start = (page - 1) * per_page
+        chats = [
+            {
+                "id": f"5569900{i:06d}@s.whatsapp.net",
+                "name": f"Contato {i}",
+                "lastMessageTime": 1748872244 + i,
+            }
+            for i in range(start, min(start + per_page, self.chats))
+        ]
+        return 200, {}, {"totalChats": self.chats, "currentPage": page, "totalPages": total_pages, "chats": chats}
+
+    def fetch_messages(self, instance_id, query, body):
+        chat_id = query.get('chatId') or ''
+        per_page = int(query.get('perPage') or 20)
+        page = int(query.get('page') or 1)
+        total_pages = max(1, -(-self.messages_per_chat // per_page))
+        start = (page - 1) * per_page
+        messages = []
+        for i in range(start, min(start + per_page, self.messages_per_chat)):
+            content = {"conversation": f"Mensagem {i}"}
+            if i % 10 == 0:
+                content = {"imageMessage": {
+                    "url": "https://mmg.whatsapp.net/simulado", "mimetype": "image/jpeg",
+                    "mediaKey": base64.b64encode(f"{chat_id}-{i}".encode()).decode(),
+                    "directPath": f"/v/t62/{chat_id}/{i}", "fileLength": str(self.media_size),
+                }}
+            messages.append({
+                "messageId": f"SIM{zlib.crc32(chat_id.encode()):010d}{i:06d}",
+                "fromMe": i % 3 == 0,
+                "moment": 1748872244 - (self.messages_per_chat - i) * 60,
+                "chat": {"id": chat_id},
+                "sender": {"id": chat_id, "pushName": "Contato Simulado"},
+                "msgContent": content,
+            })
+        return 200, {}, {"currentPage": page, "totalPages": total_pages, "messages": messages}
+
+    def generic_ok(self, instance_id, query, body):
+        return 200, {}, {"error": False, "instanceId": instance_id}
+
+
+ROUTES = {
+    ('POST', 'message/send-text'): WApiSimulator.send_message,
+    ('POST', 'message/send-image'): WApiSimulator.send_message,
+    ('POST', 'message/send-audio'): WApiSimulator.send_message,
+    ('POST', 'sendImage'): WApiSimulator.send_message,
+    ('POST', 'message/download-media'): WApiSimulator.download_media,
+    ('GET', 'instance/status-instance'): WApiSimulator.instance_status,
+    ('GET', 'instance/status'): WApiSimulator.instance_status,
+    ('GET', 'instance/qr-code'): WApiSimulator.qr_code,
+    ('POST', 'message/edit-message'): WApiSimulator.edit_message,
+    ('DELETE', 'message/delete-message'): WApiSimulator.delete_message,
+    ('POST', 'message/send-reaction'): WApiSimulator.reaction,
+    ('POST', 'message/remove-reaction'): WApiSimulator.reaction,
+    ('GET', 'chats/fetch-chats'): WApiSimulator.fetch_chats,
+    ('GET', 'chats/fetch-messages'): WApiSimulator.fetch_messages,
+    ('POST', 'webhook'): WApiSimulator.generic_ok,
+    ('POST', 'instance/disconnect'): WApiSimulator.generic_ok,
+}
+
+
+def _make_handler(simulator: WApiSimulator):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _dispatch(self, method):
+            parsed = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            try:
+                body = json.loads(raw) if raw else {}
+            except ValueError:
+                body = {}
+            if not isinstance(body, dict):
+                body = {}
+            authorized = self.headers.get('Authorization', '').startswith('Bearer ') and \
+                len(self.headers.get('Authorization', '')) > len('Bearer ')
+
+            status, headers, payload = simulator.handle(method, parsed.path, query, body, authorized)
+
+            if isinstance(payload, bytes):
+                data = payload
+            else:
+                data = json.dumps(payload, ensure_ascii=False).encode()
+                headers.setdefault('Content-Type', 'application/json')
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._dispatch('GET')
+
+        def do_POST(self):
+            self._dispatch('POST')
+
+        def do_DELETE(self):
+            self._dispatch('DELETE')
+
+        def log_message(self, format, *args):
+            logger.debug("wapi-simulator: " + format, *args)
+
+    return Handler
+
+
+def create_server(simulator: WApiSimulator, host: str = '127.0.0.1', port: int = 8900) -> ThreadingHTTPServer:
+    """Cria o servidor HTTP do simulador (porta 0 = porta livre aleatória)."""
+    server = ThreadingHTTPServer((host, port), _make_handler(simulator))
+    server.daemon_threads = True
+    simulator.base_url = f"http://{host}:{server.server_address[1]}"
+    return server
+
+
+def start_in_thread(simulator: WApiSimulator = None, host: str = '127.0.0.1', port: int = 0):
+    """
+    Sobe o simulador em uma thread daemon (útil em benchmarks e testes).
+
+    Returns:
+        (server, base_url) — base_url já inclui o sufixo /v1/ para WAPI_BASE_URL.
+    """
+    simulator = simulator or WApiSimulator()
+    server = create_server(simulator, host, port)
+    threading.Thread(target=server.serve_forever, name='wapi-simulator', daemon=True).start()
+    return server, f"{simulator.base_url}/v1/"
@@ -1,6 +1,12 @@
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
 from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from core.principal import get_principal
 
 User = get_user_model()
 
@@ -56,4 +62,31 @@ class EmailBackend(ModelBackend):
         try:
             return User.objects.get(pk=user_id)
         except User.DoesNotExist:
-            return None 
\ No newline at end of file
+            return None
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    Autenticação JWT que monta o usuário a partir do principal em cache
+    (core.principal), sem consultar o banco enquanto a entrada existir.
+
+    ``request.user`` continua sendo um ``Usuario`` (com ``user.cliente`` já
+    carregado); só a senha fica adiada e é lida do banco se alguém usá-la.
+    """
+
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN or api_settings.USER_ID_FIELD != 'id':
+            # A verificação de revogação compara o hash da senha, que não fica no cache
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        principal = get_principal(user_id)
+        if principal is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not principal.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return principal.build_user()
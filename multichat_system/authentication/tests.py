@@ -1,3 +1,88 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import AccessToken
 
-# Create your tests here.
+from authentication.models import Usuario
+from core.models import Chat, Cliente, WhatsappInstance
+from core.principal import _version_key, get_principal, invalidate_user
+
+
+class CachedPrincipalTests(TestCase):
+    """Usuário, papel e cliente da requisição JWT vêm do principal em cache (core.principal)."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        WhatsappInstance.objects.create(cliente=self.cliente, instance_id='INST-A', token='t')
+        Chat.objects.create(cliente=self.cliente, chat_id='5511999990000')
+        outro = Cliente.objects.create(nome='Loja B', email='b@example.com')
+        Chat.objects.create(cliente=outro, chat_id='5511999990001')
+        self.usuario = Usuario.objects.create_user(
+            username='ana', email='ana@example.com', password='x',
+            tipo_usuario='colaborador', cliente=self.cliente,
+        )
+        self.client = Client(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.usuario)}')
+
+    def _consultas(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        return response, [q['sql'] for q in ctx.captured_queries]
+
+    def test_autenticacao_sem_consultas_com_cache_quente(self):
+        self.client.get('/api/chats/')
+        response, consultas = self._consultas('/api/chats/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c['chat_id'] for c in response.json()['results']], ['5511999990000'])
+        tabelas = ('"authentication_usuario"', '"core_cliente"', '"core_whatsappinstance"')
+        self.assertEqual([sql for sql in consultas if sql.split(' WHERE ')[0].endswith(tabelas)], [])
+
+    def test_principal_guarda_papel_cliente_e_instancias(self):
+        principal = get_principal(self.usuario.pk)
+        self.assertEqual(
+            (principal.tipo_usuario, principal.cliente_id, principal.instance_ids),
+            ('colaborador', self.cliente.pk, ('INST-A',)),
+        )
+
+    def test_alteracoes_invalidam_o_principal(self):
+        get_principal(self.usuario.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            WhatsappInstance.objects.create(cliente=self.cliente, instance_id='INST-A2', token='t')
+        self.assertEqual(get_principal(self.usuario.pk).instance_ids, ('INST-A', 'INST-A2'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.usuario.is_active = False
+            self.usuario.save()
+        self.assertEqual(self.client.get('/api/chats/').status_code, 401)
+
+    def test_versao_ausente_comeca_pelo_relogio(self):
+        get_principal(self.usuario.pk)
+        cache.delete(_version_key(self.usuario.pk))
+        invalidate_user(self.usuario.pk)
+        self.assertGreater(cache.get(_version_key(self.usuario.pk)), 1)
+
+    def test_salvar_usuario_do_cache_nao_regrava_colunas_antigas(self):
+        usuario_cache = get_principal(self.usuario.pk).build_user()
+        # Alteração feita por outra requisição depois que o principal entrou no cache
+        Usuario.objects.filter(pk=self.usuario.pk).update(email='nova@example.com')
+
+        usuario_cache.set_password('nova-senha')
+        usuario_cache.save()
+
+        self.usuario.refresh_from_db()
+        self.assertEqual(self.usuario.email, 'nova@example.com')
+        self.assertTrue(self.usuario.check_password('nova-senha'))
+
+    def test_save_sem_senha_nao_reativa_usuario_desativado(self):
+        usuario_cache = get_principal(self.usuario.pk).build_user()
+        Usuario.objects.filter(pk=self.usuario.pk).update(first_name='Novo', is_active=False)
+
+        usuario_cache.nome = 'Ana Maria'
+        usuario_cache.save()
+
+        self.usuario.refresh_from_db()
+        self.assertEqual((self.usuario.nome, self.usuario.first_name, self.usuario.is_active),
+                         ('Ana Maria', 'Novo', False))
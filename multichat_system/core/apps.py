@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Contadores do dashboard e consolidação dos relatórios atualizados por mensagens/chats novos
+        from . import dashboard, rollups  # noqa: F401
+        # Principal em cache invalidado por mudanças de usuário, cliente e instâncias
+        from . import principal  # noqa: F401
@@ -0,0 +1,188 @@
+"""
+Análise de áudio na ingestão: duração exata e picos da forma de onda
+
+O áudio é decodificado uma única vez (ffmpeg -> PCM 16 bits mono 8 kHz via
+pipe, sem arquivo intermediário). Os picos são guardados como uma lista
+curta de inteiros 0..127 (faixa positiva do int8), o suficiente para o
+player desenhar a forma de onda sem baixar o arquivo.
+"""
+
+import logging
+import subprocess
+import tempfile
+import threading
+import wave
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .transcoding import PRIORITY_INGEST, TranscodingError, get_transcoder
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = 8000
+# Janela de 10 ms: os picos são acumulados nela e reagrupados no fim
+WINDOW_SAMPLES = SAMPLE_RATE // 100
+READ_SIZE = WINDOW_SAMPLES * 2 * 64
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+def _bucketize(window_peaks: array, buckets: int) -> List[int]:
+    """Reagrupa os picos por janela em ``buckets`` valores 0..127."""
+    if not window_peaks:
+        return []
+    buckets = min(buckets, len(window_peaks))
+    result = []
+    total = len(window_peaks)
+    for index in range(buckets):
+        start = index * total // buckets
+        end = max(start + 1, (index + 1) * total // buckets)
+        peak = max(window_peaks[start:end])
+        result.append(min(127, (peak * 127 + 32767) // 32768))
+    return result
+
+
+class _PeakAccumulator:
+    def __init__(self):
+        self.window_peaks = array('H')
+        self.samples = 0
+        self._pending = b''
+
+    def feed(self, pcm: bytes):
+        data = self._pending + pcm
+        usable = len(data) - (len(data) % (WINDOW_SAMPLES * 2))
+        self._pending = data[usable:]
+        samples = array('h')
+        samples.frombytes(data[:usable])
+        self.samples += len(samples)
+        for start in range(0, len(samples), WINDOW_SAMPLES):
+            window = samples[start:start + WINDOW_SAMPLES]
+            self.window_peaks.append(min(32767, max(max(window), -min(window))))
+
+    def finish(self):
+        if len(self._pending) >= 2:
+            samples = array('h')
+            samples.frombytes(self._pending[:len(self._pending) - len(self._pending) % 2])
+            self.samples += len(samples)
+            self.window_peaks.append(min(32767, max(max(samples), -min(samples))))
+        self._pending = b''
+
+
+def _decode_with_ffmpeg(path: Path, accumulator: _PeakAccumulator, timeout: int):
+    cmd = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error',
+           '-i', str(path), '-vn', '-ac', '1', '-ar', str(SAMPLE_RATE), '-f', 's16le', '-']
+    # stderr em arquivo: um pipe que ninguém lê enche e trava o ffmpeg
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr)
+        except FileNotFoundError:
+            raise TranscodingError('ffmpeg não encontrado no PATH')
+        # O prazo vale para a leitura inteira: ao expirar o ffmpeg é morto e a leitura recebe EOF
+        expired = threading.Event()
+
+        def expire():
+            expired.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+        try:
+            for chunk in iter(lambda: process.stdout.read(READ_SIZE), b''):
+                accumulator.feed(chunk)
+            process.wait()
+        finally:
+            timer.cancel()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            process.stdout.close()
+        if expired.is_set():
+            raise TranscodingError(f"ffmpeg excedeu {timeout}s")
+        if process.returncode != 0:
+            stderr.seek(0)
+            raise TranscodingError(stderr.read().decode('utf-8', 'replace').strip()[-500:] or 'ffmpeg falhou')
+    accumulator.finish()
+
+
+def _decode_wav(path: Path) -> Optional[Dict]:
+    """WAV PCM 16 bits é lido direto (sem ffmpeg)."""
+    try:
+        with wave.open(str(path), 'rb') as wav:
+            if wav.getsampwidth() != 2:
+                return None
+            rate, channels = wav.getframerate(), wav.getnchannels()
+            window = max(1, rate // 100)
+            accumulator = _PeakAccumulator()
+            frames = wav.getnframes()
+            while True:
+                data = wav.readframes(window * 64)
+                if not data:
+                    break
+                samples = array('h')
+                samples.frombytes(data)
+                for start in range(0, len(samples), window * channels):
+                    chunk = samples[start:start + window * channels]
+                    accumulator.window_peaks.append(min(32767, max(max(chunk), -min(chunk))))
+            return {'duration_ms': int(round(frames * 1000 / rate)), 'window_peaks': accumulator.window_peaks}
+    except (wave.Error, EOFError):
+        return None
+
+
+def analyze_audio(path, buckets: int = None) -> Dict:
+    """Retorna {'duration_ms': int, 'peaks': [0..127, ...]} para o arquivo."""
+    path = Path(path)
+    buckets = buckets or _get_setting('WAVEFORM_BUCKETS', 128)
+
+    if path.suffix.lower() == '.wav':
+        decoded = _decode_wav(path)
+        if decoded:
+            return {'duration_ms': decoded['duration_ms'], 'peaks': _bucketize(decoded['window_peaks'], buckets)}
+
+    accumulator = _PeakAccumulator()
+    _decode_with_ffmpeg(path, accumulator, _get_setting('TRANSCODE_TIMEOUT', 120))
+    return {
+        'duration_ms': int(round(accumulator.samples * 1000 / SAMPLE_RATE)),
+        'peaks': _bucketize(accumulator.window_peaks, buckets),
+    }
+
+
+def store_audio_analysis(message_id: str, result: Dict) -> int:
+    """Grava duração/picos na Mensagem e a duração no MediaFile; retorna mensagens atualizadas."""
+    from .models import MediaFile, Mensagem
+
+    updated = Mensagem.objects.filter(message_id=message_id).update(
+        audio_duration_ms=result['duration_ms'],
+        audio_peaks=result['peaks'],
+    )
+    MediaFile.objects.filter(message_id=message_id).update(
+        duration_seconds=int(round(result['duration_ms'] / 1000))
+    )
+    return updated
+
+
+def analyze_and_store(message_id: str, file_path) -> Optional[Dict]:
+    """Tarefa executada no pool do transcoder."""
+    try:
+        result = analyze_audio(file_path)
+        store_audio_analysis(message_id, result)
+        logger.info(f"🎚️ Áudio analisado: {message_id} ({result['duration_ms']} ms, {len(result['peaks'])} picos)")
+        return result
+    except Exception as e:
+        logger.error(f"❌ Erro ao analisar áudio {message_id}: {e}")
+        raise
+    finally:
+        # Roda numa thread do pool: não deixar conexões abertas para trás
+        close_old_connections()
+
+
+def schedule_audio_analysis(message_id: str, file_path, priority: int = PRIORITY_INGEST):
+    """Enfileira a análise no mesmo pool limitado das conversões ffmpeg."""
+    return get_transcoder().submit_call(analyze_and_store, message_id, str(file_path), priority=priority)
+
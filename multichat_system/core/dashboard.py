@@ -0,0 +1,258 @@
+"""
+Resumo do dashboard por cliente, calculado em poucas consultas e mantido em cache
+
+``compute_snapshot`` monta o resumo com agregações condicionais (uma consulta
+por tabela: clientes, chats, instâncias e mensagens por tipo). O resultado
+fica no cache por ``DASHBOARD_CACHE_TTL`` segundos, separado por escopo
+(``all`` para administradores, ``cliente:<id>`` para cada cliente).
+
+Enquanto a entrada existe, mensagens e chats novos (e mudanças de status de
+chat) somam em contadores próprios no cache, um por campo, com ``incr``
+atômico (vários webhooks ao mesmo tempo não perdem incrementos). Cada
+resumo tem um ``versao`` e os contadores levam essa versão na chave, então
+um resumo recalculado começa com os contadores zerados. Abrir o dashboard
+lê o resumo e os contadores numa única ida ao cache, sem consultar o banco.
+O TTL curto corrige o que não dá para manter incrementalmente (saída de
+mensagens da janela de 24h, exclusões, status das instâncias).
+"""
+
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Chat, Cliente, Mensagem, WhatsappInstance
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'dashboard_snapshot'
+# Chave do resumo -> status gravados no Chat (a interface antiga usava os nomes em português)
+CHAT_STATUS_GROUPS = {
+    'abertos': ('active', 'aberto'),
+    'fechados': ('closed', 'fechado'),
+    'pendentes': ('pending', 'pendente'),
+}
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+def _cache_key(cliente_id: Optional[int]) -> str:
+    return f"{CACHE_PREFIX}:{'all' if cliente_id is None else f'cliente:{cliente_id}'}"
+
+
+def _chat_group(status: Optional[str]) -> Optional[str]:
+    for group, values in CHAT_STATUS_GROUPS.items():
+        if status in values:
+            return group
+    return None
+
+
+def compute_snapshot(cliente_id: Optional[int] = None) -> Dict:
+    """Resumo do dashboard direto do banco (None = todos os clientes)."""
+    ontem = timezone.now() - timedelta(days=1)
+    clientes = Cliente.objects.all()
+    chats = Chat.objects.all()
+    instancias = WhatsappInstance.objects.all()
+    mensagens = Mensagem.objects.all()
+    if cliente_id is not None:
+        clientes = clientes.filter(id=cliente_id)
+        chats = chats.filter(cliente_id=cliente_id)
+        instancias = instancias.filter(cliente_id=cliente_id)
+        mensagens = mensagens.filter(chat__cliente_id=cliente_id)
+
+    chats_agg = chats.aggregate(
+        total=Count('id'),
+        chats_24h=Count('id', filter=Q(data_inicio__gte=ontem)),
+        **{group: Count('id', filter=Q(status__in=values)) for group, values in CHAT_STATUS_GROUPS.items()},
+    )
+    instancias_agg = instancias.aggregate(
+        total=Count('id'),
+        conectadas=Count('id', filter=Q(status='conectado')),
+        desconectadas=Count('id', filter=Q(status='desconectado')),
+    )
+    # Total, últimas 24h e distribuição por tipo saem do mesmo GROUP BY
+    por_tipo = list(
+        mensagens.order_by().values('tipo').annotate(
+            count=Count('id'), recentes=Count('id', filter=Q(data_envio__gte=ontem))
+        )
+    )
+
+    return {
+        'resumo': {
+            'total_clientes': clientes.count(),
+            'total_chats': chats_agg['total'],
+            'total_mensagens': sum(row['count'] for row in por_tipo),
+            'total_instancias': instancias_agg['total'],
+        },
+        'chats': {group: chats_agg[group] for group in CHAT_STATUS_GROUPS},
+        'instancias': {
+            'conectadas': instancias_agg['conectadas'],
+            'desconectadas': instancias_agg['desconectadas'],
+        },
+        'atividade_recente': {
+            'chats_24h': chats_agg['chats_24h'],
+            'mensagens_24h': sum(row['recentes'] for row in por_tipo),
+        },
+        'tipos_mensagem': {row['tipo']: row['count'] for row in por_tipo},
+        'computed_at': timezone.now().isoformat(),
+    }
+
+
+def empty_snapshot() -> Dict:
+    """Resumo zerado (usuário cliente sem cadastro de Cliente)."""
+    return {
+        'resumo': {'total_clientes': 0, 'total_chats': 0, 'total_mensagens': 0, 'total_instancias': 0},
+        'chats': {group: 0 for group in CHAT_STATUS_GROUPS},
+        'instancias': {'conectadas': 0, 'desconectadas': 0},
+        'atividade_recente': {'chats_24h': 0, 'mensagens_24h': 0},
+        'tipos_mensagem': {},
+        'computed_at': timezone.now().isoformat(),
+    }
+
+
+def _delta_key(key: str, versao: str, field: str) -> str:
+    return f"{key}:{versao}:{field}"
+
+
+def _delta_fields():
+    """Campos mantidos por contador (``-`` na frente = subtrai)."""
+    fields = ['resumo.total_mensagens', 'atividade_recente.mensagens_24h',
+              'resumo.total_chats', 'atividade_recente.chats_24h']
+    fields += [f"tipos_mensagem.{tipo}" for tipo, _ in Mensagem.TIPO_CHOICES]
+    for group in CHAT_STATUS_GROUPS:
+        fields += [f"chats.{group}", f"-chats.{group}"]
+    return fields
+
+
+def get_snapshot(cliente_id: Optional[int] = None) -> Dict:
+    """Resumo do cache com os contadores somados; calcula e guarda se não houver."""
+    key = _cache_key(cliente_id)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = compute_snapshot(cliente_id)
+        snapshot['versao'] = uuid.uuid4().hex
+        cache.set(key, snapshot, _get_setting('DASHBOARD_CACHE_TTL', 60))
+        return snapshot
+
+    fields = _delta_fields()
+    deltas = cache.get_many([_delta_key(key, snapshot['versao'], field) for field in fields])
+    for field in fields:
+        value = deltas.get(_delta_key(key, snapshot['versao'], field))
+        if not value:
+            continue
+        section, name = field.lstrip('-').split('.', 1)
+        snapshot[section][name] = snapshot[section].get(name, 0) + (-value if field.startswith('-') else value)
+    return snapshot
+
+
+def as_response(snapshot: Dict) -> Dict:
+    """Formato da resposta do DashboardViewSet (tipos_mensagem como lista ordenada)."""
+    data = {key: value for key, value in snapshot.items() if key not in ('tipos_mensagem', 'versao')}
+    data['tipos_mensagem'] = [
+        {'tipo': tipo, 'count': count}
+        for tipo, count in sorted(snapshot['tipos_mensagem'].items(), key=lambda item: (-item[1], item[0]))
+        if count > 0
+    ]
+    return data
+
+
+def invalidate(cliente_id: Optional[int] = None):
+    """Descarta o resumo do cliente e o geral."""
+    keys = [_cache_key(None)]
+    if cliente_id is not None:
+        keys.append(_cache_key(cliente_id))
+    cache.delete_many(keys)
+
+
+def _incr(key: str, timeout: int):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Primeiro incremento desta versão: add evita sobrescrever o incr de outro processo
+        if not cache.add(key, 1, timeout):
+            cache.incr(key)
+
+
+def _apply(cliente_id: Optional[int], fields):
+    """Soma 1 em cada contador de ``fields`` nos resumos em cache do cliente e geral."""
+    ttl = _get_setting('DASHBOARD_CACHE_TTL', 60)
+    for key in dict.fromkeys((_cache_key(None), _cache_key(cliente_id))):
+        snapshot = cache.get(key)
+        if snapshot is None:
+            continue
+        # Contadores vencem junto com o resumo: o TTL é o que corrige a janela de 24h
+        age = (timezone.now() - datetime.fromisoformat(snapshot['computed_at'])).total_seconds()
+        remaining = int(ttl - age)
+        if remaining <= 0:
+            continue
+        for field in fields:
+            _incr(_delta_key(key, snapshot['versao'], field), remaining)
+
+
+def record_message(cliente_id: int, tipo: str, data_envio: Optional[datetime] = None):
+    if f"tipos_mensagem.{tipo}" not in _delta_fields():
+        # Tipo fora da lista de contadores: recalcula no próximo acesso
+        invalidate(cliente_id)
+        return
+    fields = ['resumo.total_mensagens', f"tipos_mensagem.{tipo}"]
+    # Mensagens antigas (backfill, reprocessamento) não entram na janela de 24h
+    if data_envio is None or data_envio >= timezone.now() - timedelta(days=1):
+        fields.append('atividade_recente.mensagens_24h')
+    _apply(cliente_id, fields)
+
+
+def record_chat(cliente_id: int, status: str, old_status: Optional[str] = None, created: bool = False):
+    new_group, old_group = _chat_group(status), _chat_group(old_status)
+    fields = []
+    if created:
+        fields += ['resumo.total_chats', 'atividade_recente.chats_24h']
+    elif old_group:
+        fields.append(f"-chats.{old_group}")
+    if new_group:
+        fields.append(f"chats.{new_group}")
+    if fields:
+        _apply(cliente_id, fields)
+
+
+@receiver(post_save, sender=Mensagem, dispatch_uid='dashboard_mensagem_criada')
+def _mensagem_criada(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        cliente_id = instance.chat.cliente_id
+        transaction.on_commit(lambda: record_message(cliente_id, instance.tipo, instance.data_envio))
+
+
+@receiver(post_init, sender=Chat, dispatch_uid='dashboard_chat_status_inicial')
+def _chat_carregado(sender, instance, **kwargs):
+    instance._dashboard_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Chat, dispatch_uid='dashboard_chat_salvo')
+def _chat_salvo(sender, instance, created, raw=False, **kwargs):
+    old_status = getattr(instance, '_dashboard_status', None)
+    instance._dashboard_status = instance.status
+    if raw or not (created or old_status != instance.status):
+        return
+    transaction.on_commit(lambda: record_chat(instance.cliente_id, instance.status, old_status, created))
+
+
+@receiver(post_save, sender=WhatsappInstance, dispatch_uid='dashboard_instancia_salva')
+@receiver(post_delete, sender=WhatsappInstance, dispatch_uid='dashboard_instancia_removida')
+@receiver(post_delete, sender=Chat, dispatch_uid='dashboard_chat_removido')
+def _invalidar_cliente(sender, instance, **kwargs):
+    invalidate(instance.cliente_id)
+
+
+@receiver(post_save, sender=Cliente, dispatch_uid='dashboard_cliente_salvo')
+@receiver(post_delete, sender=Cliente, dispatch_uid='dashboard_cliente_removido')
+def _invalidar_geral(sender, instance, **kwargs):
+    invalidate(instance.pk)
@@ -0,0 +1,115 @@
+"""
+Roteamento de leituras para réplicas do banco
+
+As escritas (e tudo que não for marcado) vão para ``default``, o primário.
+Só os caminhos de leitura seguros marcados com ``read_replica`` /
+``replica_reads`` (listas de chats e mensagens, dashboard, relatórios,
+busca do arquivo de mídia) leem de uma réplica, sorteada entre os aliases
+``replica_*`` de ``DATABASES`` (ver ``DB_REPLICA_HOSTS`` nas settings).
+
+Leia-o-que-escreveu: depois de uma escrita o ``ReadYourWritesMiddleware``
+grava um cookie curto (``DB_REPLICA_STICKY_SECONDS``); enquanto ele existir
+as leituras daquele usuário ficam no primário, cobrindo o atraso da
+replicação. Dentro da própria requisição, qualquer escrita ou transação
+aberta no primário também desliga a réplica.
+
+Sem réplicas configuradas (SQLite local) tudo continua em ``default``.
+"""
+
+import contextvars
+import functools
+import random
+from contextlib import contextmanager
+from typing import List, Optional
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+STICKY_COOKIE = 'mc_db_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica_ok = contextvars.ContextVar('multichat_replica_ok', default=False)
+_sticky = contextvars.ContextVar('multichat_db_sticky', default=False)
+_wrote = contextvars.ContextVar('multichat_db_wrote', default=False)
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+def replica_aliases() -> List[str]:
+    return [alias for alias in settings.DATABASES if alias.startswith('replica_')]
+
+
+def _can_use_replica() -> bool:
+    if not _replica_ok.get() or _sticky.get() or _wrote.get():
+        return False
+    # Leitura dentro de uma transação do primário precisa ver o que ela escreveu
+    return not connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+class ReplicaRouter:
+    """Leituras marcadas vão para uma réplica; escritas e migrações só no primário."""
+
+    def db_for_read(self, model, **hints) -> Optional[str]:
+        replicas = replica_aliases()
+        if replicas and _can_use_replica():
+            return random.choice(replicas)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints) -> Optional[str]:
+        _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> Optional[bool]:
+        # Réplicas espelham o primário: objetos de qualquer um se relacionam
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints) -> Optional[bool]:
+        return db == DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def replica_reads():
+    """Leituras deste bloco podem ir para uma réplica (respeitando a aderência ao primário)."""
+    token = _replica_ok.set(True)
+    try:
+        yield
+    finally:
+        _replica_ok.reset(token)
+
+
+def read_replica(view):
+    """Decorador para views/métodos de leitura (function views e métodos de ViewSet/View)."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+class ReadYourWritesMiddleware:
+    """
+    Mantém as leituras do usuário no primário por alguns segundos depois de
+    uma escrita dele (cookie), para não ler da réplica algo ainda não replicado.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sticky_token = _sticky.set(STICKY_COOKIE in request.COOKIES)
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if replica_aliases() and (_wrote.get() or request.method not in SAFE_METHODS):
+                response.set_cookie(
+                    STICKY_COOKIE, '1',
+                    max_age=_get_setting('DB_REPLICA_STICKY_SECONDS', 10),
+                    httponly=True,
+                    samesite='Lax',
+                )
+        finally:
+            _sticky.reset(sticky_token)
+            _wrote.reset(wrote_token)
+        return response
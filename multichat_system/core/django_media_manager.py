@@ -23,7 +23,13 @@ from django.db import transaction
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
 
+from core.media_fetch import MediaFetchError
+from core.media_quota import schedule_quota_check
+from core.media_retry import claim, due_media, record_failure
+from core.media_store import adopt_file, get_media_storage_dir, materialize
 from core.models import Cliente, WhatsappInstance, Chat, MediaFile
+from core.previews import schedule_preview
+from core.utils import get_wapi_base_url
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -47,7 +53,7 @@ class DjangoMediaManager:
         self.mensagens_processadas = set()
         self.contador_mensagens = 0
         self.contador_midias = 0
-        self.base_url = "https://api.w-api.app/v1"
+        self.base_url = get_wapi_base_url().rstrip('/')
 
         # Buscar objetos Django
         try:
@@ -64,7 +70,7 @@ class DjangoMediaManager:
             self.base_path = Path(base_path)
         else:
             # Usar caminho padrão no projeto multichat
-            self.base_path = Path(__file__).parent.parent / "media_storage"
+            self.base_path = get_media_storage_dir()
         
         # Criar estrutura de pastas por cliente e instância
         self.cliente_path = self.base_path / f"cliente_{cliente_id}"
@@ -190,6 +196,14 @@ class DjangoMediaManager:
                 media_file.save()
                 logger.info(f"✅ Status atualizado: {message_id} -> {status}")
 
+            if status == 'failed':
+                # Próxima tentativa com backoff, pelo agendador (core.media_retry)
+                record_failure(media_file, MediaFetchError(f"Falha ao baixar mídia {message_id}"))
+
+            if status == 'success' and file_path:
+                schedule_preview(message_id, file_path, media_file.media_type, media_file.mimetype)
+                schedule_quota_check(self.cliente.id)
+
         except MediaFile.DoesNotExist:
             logger.warning(f"⚠️ Mídia não encontrada: {message_id}")
         except Exception as e:
@@ -316,17 +330,25 @@ class DjangoMediaManager:
                 logger.info(f"✅ Arquivo já existe: {nome_arquivo}")
                 return str(caminho_completo)
 
+            # Mesmo conteúdo já baixado (em qualquer chat/cliente): só cria o link
+            if materialize(info_midia.get('fileSha256'), caminho_completo):
+                return str(caminho_completo)
+
             # Tentar baixar via directPath primeiro
+            arquivo_baixado = None
             if info_midia.get('directPath'):
                 arquivo_baixado = self._baixar_via_direct_path(info_midia, caminho_completo)
-                if arquivo_baixado:
-                    return arquivo_baixado
 
             # Tentar baixar via mediaKey
-            if info_midia.get('mediaKey'):
+            if not arquivo_baixado and info_midia.get('mediaKey'):
                 arquivo_baixado = self._baixar_via_media_key(info_midia, caminho_completo)
-                if arquivo_baixado:
-                    return arquivo_baixado
+
+            if arquivo_baixado:
+                try:
+                    adopt_file(arquivo_baixado, info_midia.get('fileSha256'))
+                except Exception as e:
+                    logger.warning(f"⚠️ Falha ao deduplicar {arquivo_baixado}: {e}")
+                return arquivo_baixado
 
             logger.error(f"❌ Não foi possível baixar mídia: {message_id}")
             return None
@@ -623,7 +645,9 @@ class DjangoMediaManager:
     def reprocessar_midias_pendentes(self):
         """Reprocessa mídias que falharam no download"""
         try:
-            midias_pendentes = self.buscar_midias_pendentes()
+            # Só as que já venceram o backoff, reivindicadas para não concorrer com outros processos
+            vencidas = due_media().filter(cliente=self.cliente, instance=self.instance)[:100]
+            midias_pendentes = [media for media in vencidas if claim(media.pk, media.next_attempt_at)]
             
             if not midias_pendentes:
                 logger.info("ℹ️ Nenhuma mídia pendente para reprocessar")
@@ -0,0 +1,152 @@
+"""
+Exportação em streaming (CSV / NDJSON, opcionalmente gzip)
+
+As linhas saem em lotes por keyset: cada consulta pega as próximas
+``EXPORT_CHUNK_SIZE`` linhas depois da última chave de ordenação lida
+(``(data_envio, id) > (...)``), sem OFFSET. Isso vale igual em qualquer banco,
+inclusive no MySQL, onde ``iterator()`` traria o resultado inteiro para a
+memória do cliente. Cada lote vira alguns KB de texto e é enviado pelo
+``StreamingHttpResponse`` antes do próximo ser lido: a memória fica constante
+mesmo para milhões de mensagens.
+"""
+
+import csv
+import json
+import zlib
+from typing import Iterable, Iterator, List, Sequence, Tuple
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+# Texto acumulado antes de enviar um pedaço da resposta
+FLUSH_BYTES = 64 * 1024
+
+# (coluna no arquivo, campo do values_list)
+MESSAGE_EXPORT_FIELDS: List[Tuple[str, str]] = [
+    ('id', 'id'),
+    ('message_id', 'message_id'),
+    ('cliente_id', 'chat__cliente_id'),
+    ('chat_id', 'chat__chat_id'),
+    ('data_envio', 'data_envio'),
+    ('remetente', 'remetente'),
+    ('from_me', 'from_me'),
+    ('tipo', 'tipo'),
+    ('conteudo', 'conteudo'),
+    ('lida', 'lida'),
+]
+ROLLUP_EXPORT_FIELDS: List[Tuple[str, str]] = [
+    ('cliente_id', 'cliente_id'),
+    ('atendente_id', 'atendente_id'),
+    ('dia', 'dia'),
+    ('hora', 'hora'),
+    ('tipo', 'tipo'),
+    ('from_me', 'from_me'),
+    ('total', 'total'),
+    ('satisfacao', 'satisfacao'),
+]
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+class _Echo:
+    """Buffer do csv.writer que só devolve a linha formatada."""
+
+    def write(self, value):
+        return value
+
+
+def _after(order_by: Sequence[str], last: tuple) -> Q:
+    """Linhas depois de ``last`` na ordem (a, b, c): a > x, ou a = x e b > y, ..."""
+    condition = Q()
+    for index, field in enumerate(order_by):
+        step = Q(**{f"{field}__gt": last[index]})
+        for previous, value in zip(order_by[:index], last):
+            step &= Q(**{previous: value})
+        condition |= step
+    return condition
+
+
+def iter_rows(queryset, fields: Sequence[Tuple[str, str]], order_by: Sequence[str] = ('pk',),
+              chunk_size: int = None) -> Iterator[tuple]:
+    """
+    Linhas de ``fields`` em lotes por keyset sobre ``order_by`` (campos não nulos
+    que, juntos, identificam a linha; termine com ``id``).
+    """
+    chunk_size = chunk_size or _get_setting('EXPORT_CHUNK_SIZE', 2000)
+    columns = [field for _, field in fields]
+    queryset = queryset.order_by(*order_by)
+    last = None
+    while True:
+        batch = queryset if last is None else queryset.filter(_after(order_by, last))
+        rows = list(batch.values_list(*columns, *order_by)[:chunk_size])
+        for row in rows:
+            yield row[:len(columns)]
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1][len(columns):]
+
+
+def _batched(lines: Iterable[str]) -> Iterator[bytes]:
+    """Junta linhas em pedaços de ~FLUSH_BYTES (um write por linha deixaria o streaming lento)."""
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield ''.join(buffer).encode('utf-8')
+            buffer, size = [], 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+
+def csv_lines(rows: Iterable[tuple], header: Sequence[str]) -> Iterator[str]:
+    writer = csv.writer(_Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows: Iterable[tuple], header: Sequence[str]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Comprime em gzip sem segurar a resposta: cada pedaço é enviado com sync flush."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def streaming_export(queryset, fields: Sequence[Tuple[str, str]], fmt: str = 'csv',
+                     compress: bool = False, filename: str = 'export',
+                     order_by: Sequence[str] = ('pk',)) -> StreamingHttpResponse:
+    """Resposta em streaming com as linhas do queryset, na ordem ``order_by``, no formato pedido."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato inválido: {fmt} (use {', '.join(FORMATS)})")
+    content_type, extension = FORMATS[fmt]
+    header = [column for column, _ in fields]
+    lines = (csv_lines if fmt == 'csv' else ndjson_lines)(iter_rows(queryset, fields, order_by), header)
+    chunks = _batched(lines)
+    filename = f"{filename}.{extension}"
+    if compress:
+        chunks = gzip_chunks(chunks)
+        content_type, filename = 'application/gzip', f"{filename}.gz"
+
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'no-cache'
+    # Proxy (nginx) não deve bufferizar a exportação inteira
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,139 @@
+"""
+Cache dos ``fileLink`` devolvidos pelo ``message/download-media`` da W-API
+
+O link temporário vale até ``expires``; enquanto isso o mesmo arquivo pode
+ser baixado de novo sem pedir outro link. Reprocessamentos, re-downloads
+depois da cota e os vários gerenciadores de mídia consultam este cache, por
+(instância, mediaKey), antes de chamar a W-API, e guardam o link obtido até
+``FILE_LINK_EXPIRY_MARGIN`` segundos antes de expirar.
+
+Se um link em cache for recusado antes da hora (W-API revogou), quem baixou
+chama ``invalidate`` e pede um novo. Os contadores de acertos ficam no
+próprio cache (``get_stats``), somando todos os processos quando o backend é
+compartilhado.
+"""
+
+import hashlib
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple, TypeVar
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'wapi_filelink'
+STATS_KEYS = ('hits', 'misses', 'stores', 'invalidations')
+T = TypeVar('T')
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+def _cache_key(instance_id: str, media_key: str) -> str:
+    # mediaKey é base64 (+, /, =): hash para caber em qualquer backend de cache
+    digest = hashlib.sha256(f"{instance_id}:{media_key}".encode()).hexdigest()[:40]
+    return f"{CACHE_PREFIX}:{digest}"
+
+
+def _incr(name: str):
+    key = f"{CACHE_PREFIX}:stats:{name}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Primeira ocorrência (ou expirou): add evita sobrescrever o incr de outro processo
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def parse_expires(expires) -> Optional[float]:
+    """Converte o ``expires`` da W-API (epoch em s ou ms, ou ISO 8601) para epoch em segundos."""
+    if expires in (None, ''):
+        return None
+    try:
+        value = float(expires)
+        return value / 1000 if value > 1e12 else value
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(str(expires).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def get_cached(instance_id: str, media_key: str) -> Optional[str]:
+    """fileLink ainda válido para a mídia, ou None."""
+    if not media_key:
+        return None
+    link = cache.get(_cache_key(instance_id, media_key))
+    _incr('hits' if link else 'misses')
+    return link
+
+
+def store(instance_id: str, media_key: str, file_link: str, expires=None) -> bool:
+    """Guarda o link até pouco antes de expirar; retorna False se não vale a pena guardar."""
+    if not (media_key and file_link):
+        return False
+    margin = _get_setting('FILE_LINK_EXPIRY_MARGIN', 60)
+    expires_at = parse_expires(expires)
+    if expires_at is None:
+        ttl = _get_setting('FILE_LINK_DEFAULT_TTL', 300)
+    else:
+        ttl = int(expires_at - time.time() - margin)
+    if ttl <= 0:
+        return False
+    cache.set(_cache_key(instance_id, media_key), file_link, ttl)
+    _incr('stores')
+    return True
+
+
+def invalidate(instance_id: str, media_key: str):
+    """Descarta o link (foi recusado antes do ``expires``)."""
+    if media_key:
+        cache.delete(_cache_key(instance_id, media_key))
+        _incr('invalidations')
+
+
+def get_or_request(instance_id: str, media_key: str, request_link: Callable[[], Tuple[str, object]]) -> str:
+    """Link do cache ou, se não houver, de ``request_link()`` (que devolve ``(fileLink, expires)``)."""
+    link = get_cached(instance_id, media_key)
+    if link:
+        return link
+    link, expires = request_link()
+    store(instance_id, media_key, link, expires)
+    return link
+
+
+def download_with_link(instance_id: str, media_key: str,
+                       request_link: Callable[[], Tuple[str, object]],
+                       download: Callable[[str], T]) -> T:
+    """
+    Executa ``download(link)`` com o link do cache; se ele for recusado,
+    invalida e tenta uma vez com um link novo da W-API.
+    """
+    link = get_cached(instance_id, media_key)
+    if link:
+        try:
+            return download(link)
+        except Exception as e:
+            logger.info(f"🔗 fileLink em cache recusado, pedindo outro: {e}")
+            invalidate(instance_id, media_key)
+    link, expires = request_link()
+    store(instance_id, media_key, link, expires)
+    return download(link)
+
+
+def get_stats() -> Dict:
+    """Contadores do cache de fileLink e a taxa de acerto."""
+    values = cache.get_many([f"{CACHE_PREFIX}:stats:{name}" for name in STATS_KEYS])
+    stats = {name: values.get(f"{CACHE_PREFIX}:stats:{name}", 0) for name in STATS_KEYS}
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+    return stats
+
+
+def reset_stats():
+    cache.delete_many([f"{CACHE_PREFIX}:stats:{name}" for name in STATS_KEYS])
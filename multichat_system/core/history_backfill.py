@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""
+Importação do histórico de chats e mensagens via W-API
+
+Quando um cliente conecta um número que já possui conversas, o webhook só
+entrega as mensagens novas. Este módulo pagina a lista de chats e o
+histórico de cada chat com paralelismo limitado e grava tudo em lote:
+
+- As requisições HTTP rodam em um pool de threads (BACKFILL_MAX_WORKERS);
+  as escritas no banco ficam na thread principal, evitando disputa de locks.
+- Mensagens entram com ``bulk_create(ignore_conflicts=True)`` usando o
+  ``message_id`` como chave, então reimportar é seguro.
+- Mídias não são baixadas: cada uma vira um MediaFile ``pending`` com os
+  metadados (mediaKey, directPath...) para download posterior.
+- O cursor de cada chat fica em HistoryBackfillJob.chat_cursors, permitindo
+  retomar a importação após falha ou cancelamento.
+"""
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Q
+from django.utils import timezone
+
+from . import locks
+from .models import Chat, Mensagem, MediaFile, WhatsappInstance, HistoryBackfillJob
+from .rollups import record_messages
+
+logger = logging.getLogger(__name__)
+
+# Tipos de conteúdo do WhatsApp que carregam mídia -> tipo interno
+MEDIA_MESSAGE_TYPES = {
+    'imageMessage': 'image',
+    'videoMessage': 'video',
+    'audioMessage': 'audio',
+    'documentMessage': 'document',
+    'stickerMessage': 'sticker',
+}
+
+# Cursor que marca um chat como concluído
+CURSOR_DONE = 0
+
+MAX_HTTP_RETRIES = 3
+
+
+def _backfill_setting(name: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(name, default)
+
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    """Converte epoch (segundos ou milissegundos) em datetime com timezone."""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    if value <= 0:
+        return None
+    if value > 10 ** 12:  # milissegundos
+        value //= 1000
+    return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+
+
+def _is_group(raw_chat_id: str) -> bool:
+    return '@g.us' in (raw_chat_id or '')
+
+
+class HistoryBackfill:
+    """
+    Executa (ou retoma) um HistoryBackfillJob.
+
+    Uso:
+        job = HistoryBackfillJob.objects.create(cliente=..., instance=...)
+        HistoryBackfill(job).run()
+    """
+
+    def __init__(self, job: HistoryBackfillJob, max_workers: int = None, page_size: int = None):
+        # Importação lazy para evitar import circular (api -> core)
+        from api.wapi_integration import WApiIntegration
+
+        self.job = job
+        self.instance = job.instance
+        self.cliente = job.cliente
+        self.max_workers = max_workers or int(_backfill_setting('BACKFILL_MAX_WORKERS', 4))
+        self.page_size = page_size or int(_backfill_setting('BACKFILL_PAGE_SIZE', 100))
+        self.history_endpoint = _backfill_setting('BACKFILL_HISTORY_ENDPOINT', 'chats/fetch-messages')
+
+        wapi = WApiIntegration(self.instance.instance_id, self.instance.token)
+        self.base_url = wapi.base_url
+        self.headers = wapi.headers
+        self._local = threading.local()
+        self._chat_map: Dict[str, Chat] = {}
+
+    # ------------------------------------------------------------------
+    # HTTP (executado nas threads do pool)
+    # ------------------------------------------------------------------
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            self._local.session = session
+        return session
+
+    def _get(self, path: str, params: Dict) -> Dict:
+        """GET na W-API com retry para 429/5xx e backoff exponencial."""
+        url = f"{self.base_url}{path}"
+        params = {'instanceId': self.instance.instance_id, **params}
+        for attempt in range(MAX_HTTP_RETRIES + 1):
+            response = self._session().get(url, params=params, timeout=30)
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code == 429 or response.status_code >= 500:
+                if attempt < MAX_HTTP_RETRIES:
+                    retry_after = response.headers.get('Retry-After')
+                    delay = float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+                    time.sleep(delay)
+                    continue
+            raise RuntimeError(f"W-API {path} retornou {response.status_code}: {response.text[:200]}")
+        raise RuntimeError(f"W-API {path}: tentativas esgotadas")
+
+    def _fetch_chats_page(self, page: int) -> Dict:
+        return self._get('chats/fetch-chats', {'perPage': self.page_size, 'page': page})
+
+    def _fetch_messages_page(self, raw_chat_id: str, page: int) -> Tuple[List[Dict], bool]:
+        """Retorna (mensagens, tem_mais_paginas)."""
+        data = self._get(self.history_endpoint, {
+            'chatId': raw_chat_id,
+            'perPage': self.page_size,
+            'page': page,
+        })
+        messages = data.get('messages') or data.get('data') or []
+        total_pages = data.get('totalPages')
+        if total_pages is not None:
+            has_more = page < int(total_pages)
+        else:
+            has_more = len(messages) >= self.page_size
+        return messages, has_more
+
+    # ------------------------------------------------------------------
+    # Execução
+    # ------------------------------------------------------------------
+
+    def _finish(self, **fields) -> bool:
+        """Grava o resultado só se o job ainda está 'running' (um DELETE pode ter cancelado)."""
+        job = self.job
+        updated = HistoryBackfillJob.objects.filter(pk=job.pk, status='running').update(
+            updated_at=timezone.now(), **fields
+        )
+        if updated:
+            for name, value in fields.items():
+                setattr(job, name, value)
+        else:
+            job.status = HistoryBackfillJob.objects.filter(pk=job.pk).values_list('status', flat=True).first()
+        return bool(updated)
+
+    def run(self) -> HistoryBackfillJob:
+        """Executa o job já reivindicado (``claim_job``) ou recém-criado como 'pending'."""
+        job = self.job
+        now = timezone.now()
+        claimed = HistoryBackfillJob.objects.filter(pk=job.pk, status__in=['pending', 'running']).update(
+            status='running', error_message=None, started_at=job.started_at or now, updated_at=now
+        )
+        if not claimed:
+            logger.info(f"⏸️ Backfill #{job.pk} não está mais pendente, nada a fazer")
+            job.refresh_from_db()
+            return job
+        job.refresh_from_db()
+        logger.info(f"🔄 Backfill iniciado: {self.instance.instance_id} (workers={self.max_workers})")
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                if not job.chats_listed:
+                    self._list_chats(executor)
+                cancelled = self._import_history(executor)
+
+            self._finish(status='cancelled' if cancelled else 'completed', finished_at=timezone.now())
+            logger.info(
+                f"✅ Backfill {job.status}: {job.messages_imported} mensagens, "
+                f"{job.media_queued} mídias enfileiradas"
+            )
+        except Exception as e:
+            logger.error(f"❌ Erro no backfill {self.instance.instance_id}: {e}")
+            self._finish(status='failed', error_message=str(e))
+        return job
+
+    def _list_chats(self, executor: ThreadPoolExecutor) -> None:
+        """Carrega todas as páginas de chats e cria os registros de Chat."""
+        first = self._fetch_chats_page(1)
+        pages = [first]
+        total_pages = int(first.get('totalPages') or 1)
+        if total_pages > 1:
+            pages.extend(executor.map(self._fetch_chats_page, range(2, total_pages + 1)))
+
+        chats_wapi = [c for page in pages for c in page.get('chats', []) if c.get('id')]
+        # Grupos seguem a mesma regra do webhook: não são importados
+        chats_wapi = [c for c in chats_wapi if not _is_group(c['id'])]
+        self._ensure_chats(chats_wapi)
+
+        cursors = dict(self.job.chat_cursors or {})
+        for chat_wapi in chats_wapi:
+            cursors.setdefault(chat_wapi['id'], 1)
+        self.job.chat_cursors = cursors
+        self.job.total_chats = len(cursors)
+        self.job.chats_listed = True
+        self.job.save(update_fields=['chat_cursors', 'total_chats', 'chats_listed', 'updated_at'])
+        logger.info(f"📋 {self.job.total_chats} chats para importar")
+
+    def _ensure_chats(self, chats_wapi: List[Dict]) -> None:
+        """Cria em lote os chats inexistentes e preenche o mapa raw_id -> Chat."""
+        normalized = {c['id']: Chat.normalize_chat_id(c['id']) for c in chats_wapi}
+        novos = []
+        for chat_wapi in chats_wapi:
+            last_message_at = _parse_timestamp(chat_wapi.get('lastMessageTime'))
+            foto = chat_wapi.get('profilePictureUrl')
+            novos.append(Chat(
+                cliente=self.cliente,
+                chat_id=normalized[chat_wapi['id']],
+                chat_name=chat_wapi.get('name'),
+                # URLField tem max_length=200; URLs maiores são descartadas
+                foto_perfil=foto if foto and len(foto) <= 200 else None,
+                status='active',
+                canal='whatsapp',
+                last_message_at=last_message_at,
+            ))
+        Chat.objects.bulk_create(novos, ignore_conflicts=True, batch_size=500)
+        self._load_chat_map(list(normalized.keys()))
+
+    def _load_chat_map(self, raw_chat_ids: List[str]) -> None:
+        normalized = {raw: Chat.normalize_chat_id(raw) for raw in raw_chat_ids}
+        chats = Chat.objects.filter(cliente=self.cliente, chat_id__in=set(normalized.values()))
+        by_chat_id = {chat.chat_id: chat for chat in chats}
+        for raw, chat_id in normalized.items():
+            if chat_id in by_chat_id:
+                self._chat_map[raw] = by_chat_id[chat_id]
+
+    def _import_history(self, executor: ThreadPoolExecutor) -> bool:
+        """
+        Pagina o histórico dos chats pendentes mantendo no máximo
+        ``max_workers`` requisições em voo. Retorna True se cancelado.
+        """
+        cursors = self.job.chat_cursors
+        pending = [raw for raw, page in cursors.items() if page != CURSOR_DONE]
+        if not self._chat_map:
+            self._load_chat_map(pending)
+
+        in_flight = {}
+        queue = iter(pending)
+        pages_since_check = 0
+
+        def submit_next_chat():
+            for raw in queue:
+                if raw in self._chat_map:
+                    page = cursors[raw]
+                    in_flight[executor.submit(self._fetch_messages_page, raw, page)] = (raw, page)
+                    return
+                # Chat não pôde ser criado (ex.: id inválido): marcar como concluído
+                cursors[raw] = CURSOR_DONE
+                self.job.chats_done += 1
+
+        for _ in range(self.max_workers):
+            submit_next_chat()
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                raw, page = in_flight.pop(future)
+                messages, has_more = future.result()
+                inserted, media = self._save_messages(self._chat_map[raw], messages)
+
+                self.job.messages_imported += inserted
+                self.job.media_queued += media
+                if has_more and messages:
+                    cursors[raw] = page + 1
+                    in_flight[executor.submit(self._fetch_messages_page, raw, page + 1)] = (raw, page + 1)
+                else:
+                    cursors[raw] = CURSOR_DONE
+                    self.job.chats_done += 1
+                    submit_next_chat()
+
+                self.job.chat_cursors = cursors
+                self.job.save(update_fields=[
+                    'chat_cursors', 'chats_done', 'messages_imported', 'media_queued', 'updated_at'
+                ])
+
+            pages_since_check += len(done)
+            if pages_since_check >= 10:
+                pages_since_check = 0
+                if HistoryBackfillJob.objects.filter(pk=self.job.pk, status='cancelled').exists():
+                    for future in in_flight:
+                        future.cancel()
+                    return True
+        return False
+
+    # ------------------------------------------------------------------
+    # Persistência
+    # ------------------------------------------------------------------
+
+    def _save_messages(self, chat: Chat, messages: List[Dict]) -> Tuple[int, int]:
+        """
+        Grava uma página de mensagens de um chat.
+
+        Returns:
+            (mensagens_inseridas, midias_enfileiradas)
+        """
+        # Importação lazy: reutiliza o parser do webhook para manter o mesmo formato de conteúdo
+        from webhook.views import detect_message_type, extract_message_content
+
+        rows: Dict[str, Mensagem] = {}
+        timestamps: Dict[str, datetime] = {}
+        media_rows: List[MediaFile] = []
+
+        for msg in messages:
+            key = msg.get('key') or {}
+            message_id = msg.get('messageId') or key.get('id')
+            if not message_id or message_id in rows:
+                continue
+
+            content = msg.get('msgContent') or msg.get('message') or {}
+            if 'extendedTextMessage' in content and 'conversation' not in content:
+                content = {**content, 'conversation': content['extendedTextMessage'].get('text', '')}
+            parsed = {'message': content}
+            tipo = detect_message_type(parsed)
+            from_me = bool(msg.get('fromMe', key.get('fromMe', False)))
+            sender = msg.get('sender') or {}
+            push_name = sender.get('pushName') or ''
+
+            if from_me:
+                remetente = self.cliente.nome
+            else:
+                remetente = push_name or sender.get('verifiedName') or f"Contato {chat.chat_id}"
+
+            rows[message_id] = Mensagem(
+                chat=chat,
+                remetente=remetente,
+                conteudo=extract_message_content(parsed, tipo),
+                tipo=tipo,
+                lida=True,
+                from_me=from_me,
+                message_id=message_id,
+                sender_push_name=push_name or None,
+            )
+            sent_at = _parse_timestamp(msg.get('moment') or msg.get('messageTimestamp'))
+            if sent_at:
+                timestamps[message_id] = sent_at
+
+            for wa_type, media_type in MEDIA_MESSAGE_TYPES.items():
+                media = content.get(wa_type)
+                if media:
+                    media_rows.append(self._media_descriptor(chat, message_id, media_type, media, sender, from_me, sent_at))
+                    break
+
+        if not rows:
+            return 0, 0
+
+        existing = set(Mensagem.objects.filter(message_id__in=rows.keys()).values_list('message_id', flat=True))
+        new_ids = [mid for mid in rows if mid not in existing]
+        if not new_ids:
+            return 0, 0
+
+        Mensagem.objects.bulk_create([rows[mid] for mid in new_ids], ignore_conflicts=True, batch_size=500)
+
+        # data_envio é auto_now_add: corrigir para o horário real da mensagem
+        created = list(Mensagem.objects.filter(message_id__in=[m for m in new_ids if m in timestamps]).only('id', 'message_id'))
+        for obj in created:
+            obj.data_envio = timestamps[obj.message_id]
+        if created:
+            Mensagem.objects.bulk_update(created, ['data_envio'], batch_size=500)
+            latest = max(timestamps[obj.message_id] for obj in created)
+            Chat.objects.filter(pk=chat.pk).filter(
+                Q(last_message_at__isnull=True) | Q(last_message_at__lt=latest)
+            ).update(last_message_at=latest)
+
+        # Relatórios: o histórico entra no bucket do horário real
+        for message_id in new_ids:
+            if message_id in timestamps:
+                rows[message_id].data_envio = timestamps[message_id]
+        record_messages(chat, [rows[mid] for mid in new_ids])
+
+        new_set = set(new_ids)
+        media_rows = [m for m in media_rows if m.message_id in new_set]
+        if media_rows:
+            MediaFile.objects.bulk_create(media_rows, ignore_conflicts=True, batch_size=500)
+
+        return len(new_ids), len(media_rows)
+
+    def _media_descriptor(self, chat, message_id, media_type, media, sender, from_me, sent_at) -> MediaFile:
+        """MediaFile pendente: só metadados, o download acontece depois."""
+        file_length = media.get('fileLength')
+        return MediaFile(
+            cliente=self.cliente,
+            instance=self.instance,
+            chat=chat,
+            message_id=message_id,
+            sender_name=(sender.get('pushName') or '')[:255],
+            sender_id=sender.get('id') or '',
+            media_type=media_type,
+            mimetype=media.get('mimetype') or '',
+            file_name=media.get('fileName'),
+            file_size=int(file_length) if str(file_length or '').isdigit() else None,
+            caption=media.get('caption') or '',
+            width=media.get('width'),
+            height=media.get('height'),
+            duration_seconds=media.get('seconds'),
+            is_ptt=bool(media.get('ptt') or media.get('isPtt')),
+            download_status='pending',
+            is_group=chat.is_group,
+            from_me=from_me,
+            media_key=media.get('mediaKey'),
+            direct_path=media.get('directPath'),
+            file_sha256=media.get('fileSha256'),
+            file_enc_sha256=media.get('fileEncSha256'),
+            media_key_timestamp=str(media.get('mediaKeyTimestamp') or '') or None,
+            message_timestamp=sent_at,
+        )
+
+
+def get_resumable_job(instance: WhatsappInstance) -> Optional[HistoryBackfillJob]:
+    """Último job não concluído da instância (pendente, em execução, com falha ou cancelado)."""
+    return HistoryBackfillJob.objects.filter(
+        instance=instance, status__in=['pending', 'running', 'failed', 'cancelled']
+    ).first()
+
+
+def _stale_before() -> datetime:
+    return timezone.now() - timedelta(seconds=int(_backfill_setting('BACKFILL_STALE_SECONDS', 300)))
+
+
+def _is_running(job: HistoryBackfillJob) -> bool:
+    """
+    'pending' (alguém acabou de criar/reivindicar) e 'running' contam como em
+    execução. Parado há mais de BACKFILL_STALE_SECONDS é tratado como órfão
+    (processo morreu sem finalizar) e pode ser retomado.
+    """
+    return job.status in ('pending', 'running') and job.updated_at > _stale_before()
+
+
+def claim_job(instance: WhatsappInstance, restart: bool = False) -> Tuple[Optional[HistoryBackfillJob], bool]:
+    """
+    Reivindica o job da instância para quem chamou (API ou ``backfill_history``).
+
+    A escolha do job fica sob um ServiceLock por instância e a troca de status
+    é um UPDATE condicional: dois pedidos simultâneos nunca rodam o mesmo job.
+    ``restart`` cria um job novo em vez de retomar o último.
+
+    Returns:
+        (job, reivindicado) — reivindicado=False quando já há um job em execução.
+    """
+    lock_name = f"history_backfill:{instance.pk}"
+    owner = uuid.uuid4().hex
+    # O lock só cobre a escolha do job (milissegundos): espera um pouco antes de desistir
+    for _ in range(50):
+        if locks.acquire(lock_name, owner, 60):
+            break
+        time.sleep(0.1)
+    else:
+        return get_resumable_job(instance), False
+    try:
+        job = get_resumable_job(instance)
+        if job and _is_running(job):
+            return job, False
+        if job is None or restart:
+            now = timezone.now()
+            return HistoryBackfillJob.objects.create(
+                cliente=instance.cliente, instance=instance, status='running', started_at=now
+            ), True
+        claimed = HistoryBackfillJob.objects.filter(pk=job.pk).filter(
+            Q(status__in=['failed', 'cancelled']) | Q(status__in=['pending', 'running'], updated_at__lte=_stale_before())
+        ).update(status='running', error_message=None, updated_at=timezone.now())
+        job.refresh_from_db()
+        return job, bool(claimed)
+    finally:
+        locks.release(lock_name, owner)
+
+
+def start_backfill(instance: WhatsappInstance, background: bool = True) -> Tuple[HistoryBackfillJob, bool]:
+    """
+    Inicia ou retoma o backfill de uma instância.
+
+    Returns:
+        (job, iniciado) — iniciado=False quando já existe um job em execução.
+    """
+    job, claimed = claim_job(instance)
+    if not claimed:
+        return job, False
+
+    if not background:
+        HistoryBackfill(job).run()
+        return job, True
+
+    def _worker():
+        close_old_connections()
+        try:
+            HistoryBackfill(job).run()
+        finally:
+            connection.close()
+
+    threading.Thread(target=_worker, name=f"backfill-{instance.instance_id}", daemon=True).start()
+    return job, True
+
+
+def serialize_job(job: HistoryBackfillJob) -> Dict:
+    """Representação do progresso para a API."""
+    return {
+        'id': job.id,
+        'instance_id': job.instance.instance_id,
+        'status': job.status,
+        'progress_percent': job.progress_percent,
+        'total_chats': job.total_chats,
+        'chats_done': job.chats_done,
+        'messages_imported': job.messages_imported,
+        'media_queued': job.media_queued,
+        'error_message': job.error_message,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'updated_at': job.updated_at.isoformat() if job.updated_at else None,
+    }
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Cache de status de conexão das instâncias do WhatsApp
+
+O status de cada instância é mantido no cache do Django, atualizado por um
+único poller em segundo plano (comando ``poll_instance_status``) e pelos
+webhooks de conexão/desconexão. As leituras das views e serializers são
+O(1) e nunca chamam a W-API diretamente.
+"""
+
+import logging
+from typing import Callable, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from . import locks
+from .models import WhatsappInstance, Cliente
+
+logger = logging.getLogger(__name__)
+
+STATUS_CACHE_PREFIX = "instance_status:"
+POLLER_LOCK_NAME = "instance_status:poller"
+
+# Status que representam uma instância conectada (o sistema usa ambos)
+CONNECTED_STATUSES = ('conectado', 'connected')
+
+DEFAULT_POLL_INTERVAL = 30  # segundos
+
+
+def get_poll_interval() -> int:
+    """Intervalo (segundos) entre ciclos do poller de status."""
+    multichat = getattr(settings, 'MULTICHAT_SETTINGS', {})
+    return int(multichat.get('INSTANCE_STATUS_POLL_INTERVAL', DEFAULT_POLL_INTERVAL))
+
+
+def get_cache_ttl() -> int:
+    """
+    Tempo de vida de uma entrada de status no cache.
+
+    Por padrão vale três ciclos do poller, para que uma falha pontual do
+    poller não derrube as leituras para o banco.
+    """
+    multichat = getattr(settings, 'MULTICHAT_SETTINGS', {})
+    return int(multichat.get('INSTANCE_STATUS_CACHE_TTL', get_poll_interval() * 3))
+
+
+def _cache_key(instance_id: str) -> str:
+    return f"{STATUS_CACHE_PREFIX}{instance_id}"
+
+
+def set_cached_status(instance_id: str, status: str, source: str = 'poller', **extra) -> Dict:
+    """
+    Grava o status de uma instância no cache.
+
+    Args:
+        instance_id: ID da instância W-API
+        status: Status normalizado ('conectado', 'desconectado', 'erro', ...)
+        source: Origem da informação ('poller', 'webhook', 'manual')
+        **extra: Campos adicionais (ex.: qr_code, message)
+
+    Returns:
+        Dict com a entrada gravada
+    """
+    entry = {
+        'instance_id': instance_id,
+        'status': status,
+        'connected': status in CONNECTED_STATUSES,
+        'checked_at': timezone.now().isoformat(),
+        'source': source,
+    }
+    entry.update(extra)
+    cache.set(_cache_key(instance_id), entry, get_cache_ttl())
+    return entry
+
+
+def get_cached_status(instance_id: str) -> Optional[Dict]:
+    """Retorna a entrada de status do cache ou None se não existir."""
+    return cache.get(_cache_key(instance_id))
+
+
+def invalidate_status(instance_id: str) -> None:
+    """Remove o status de uma instância do cache."""
+    cache.delete(_cache_key(instance_id))
+
+
+def get_instance_status(instance: WhatsappInstance) -> Dict:
+    """
+    Leitura O(1) do status de uma instância.
+
+    Usa o cache quando disponível; caso contrário devolve o último status
+    persistido no banco, sem consultar a W-API.
+    """
+    entry = get_cached_status(instance.instance_id)
+    if entry:
+        return entry
+    status = instance.status or 'desconectado'
+    return {
+        'instance_id': instance.instance_id,
+        'status': status,
+        'connected': status in CONNECTED_STATUSES,
+        'checked_at': instance.updated_at.isoformat() if instance.updated_at else None,
+        'source': 'database',
+    }
+
+
+def get_cliente_status(cliente: Cliente) -> str:
+    """
+    Status agregado do WhatsApp de um cliente.
+
+    Considera todas as instâncias do cliente (aproveitando ``prefetch_related``
+    quando presente) e prioriza uma instância conectada.
+    """
+    instances = list(cliente.whatsapp_instances.all())
+    if not instances:
+        return "desconectado"
+
+    cached = cache.get_many([_cache_key(i.instance_id) for i in instances])
+    statuses = []
+    for instance in instances:
+        entry = cached.get(_cache_key(instance.instance_id))
+        statuses.append(entry['status'] if entry else (instance.status or "desconectado"))
+
+    for status in statuses:
+        if status in CONNECTED_STATUSES:
+            return status
+    return statuses[0]
+
+
+def refresh_instance_status(instance: WhatsappInstance, source: str = 'poller') -> Dict:
+    """
+    Consulta a W-API para uma instância e atualiza cache e banco.
+
+    O banco só é escrito quando o status muda, evitando UPDATEs a cada ciclo.
+    """
+    # Importação lazy para evitar import circular (api -> core)
+    from api.wapi_integration import WApiIntegration
+
+    result = WApiIntegration(instance.instance_id, instance.token).verificar_status_conexao()
+    status = result.get("status", "erro")
+
+    update_fields = {}
+    if status != instance.status:
+        update_fields['status'] = status
+    if result.get("qr_code") and result["qr_code"] != instance.qr_code:
+        update_fields['qr_code'] = result["qr_code"]
+    if status in CONNECTED_STATUSES:
+        update_fields['last_seen'] = timezone.now()
+    if update_fields:
+        update_fields['updated_at'] = timezone.now()
+        WhatsappInstance.objects.filter(pk=instance.pk).update(**update_fields)
+        for field, value in update_fields.items():
+            setattr(instance, field, value)
+
+    extra = {'message': result.get("message", "")}
+    if result.get("qr_code"):
+        extra['qr_code'] = result["qr_code"]
+    return set_cached_status(instance.instance_id, status, source=source, **extra)
+
+
+def poll_instances(instances: Optional[Iterable[WhatsappInstance]] = None,
+                   renew_lock: Optional[Callable[[], bool]] = None) -> Dict[str, int]:
+    """
+    Executa um ciclo do poller sobre as instâncias informadas (ou todas).
+
+    O ciclo é serial e pode durar mais que o lock do poller: ``renew_lock`` é
+    chamado antes de cada instância e, se o lock foi perdido para outro
+    poller, o ciclo para ali (``interrompido``) para não rodarem dois.
+
+    Returns:
+        Dict com contadores do ciclo (total, conectadas, erros, interrompido)
+    """
+    if instances is None:
+        instances = WhatsappInstance.objects.exclude(token__isnull=True).exclude(token='')
+
+    stats = {'total': 0, 'conectadas': 0, 'erros': 0, 'interrompido': False}
+    for instance in instances:
+        if renew_lock is not None and not renew_lock():
+            logger.warning("⚠️ Lock do poller perdido para outro processo, ciclo interrompido")
+            stats['interrompido'] = True
+            break
+        stats['total'] += 1
+        try:
+            entry = refresh_instance_status(instance)
+            if entry['connected']:
+                stats['conectadas'] += 1
+            elif entry['status'] == 'erro':
+                stats['erros'] += 1
+        except Exception as e:
+            stats['erros'] += 1
+            logger.error(f"❌ Erro ao verificar status da instância {instance.instance_id}: {e}")
+    return stats
+
+
+def acquire_poller_lock(owner: str, interval: Optional[int] = None) -> bool:
+    """
+    Garante um único poller ativo (lock no banco, core.locks): o lock expira
+    após dois ciclos de ``interval`` segundos caso o processo dono morra sem
+    liberá-lo; o dono o renova a cada chamada.
+    """
+    return locks.acquire(POLLER_LOCK_NAME, owner, (interval or get_poll_interval()) * 2)
+
+
+def release_poller_lock(owner: str) -> None:
+    """Libera o lock do poller se pertencer a ``owner``."""
+    locks.release(POLLER_LOCK_NAME, owner)
@@ -0,0 +1,139 @@
+"""
+Locks entre processos
+
+- ``acquire``/``release``: lock com prazo no banco de dados
+  (core.ServiceLock), para o que roda uma vez no conjunto de máquinas. O
+  cache não serve para isso: no LocMemCache cada processo tem o seu, e nem
+  todo backend tem ``add`` atômico. A posse é tomada por um UPDATE
+  condicional (dono atual ou prazo vencido), atômico em qualquer banco; o
+  dono renova o prazo a cada ciclo e, se morrer sem liberar, outro
+  processo assume quando o prazo vencer.
+- ``host_lock``/``host_slot``: locks de arquivo (flock) em ``LOCK_DIR``,
+  valendo para todos os workers da mesma máquina (ffmpeg, downloads de
+  mídia no disco local). O sistema operacional libera o lock se o processo
+  morrer.
+"""
+
+import contextlib
+import hashlib
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from django.conf import settings
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ServiceLock
+
+
+def acquire(name: str, owner: str, ttl: int) -> bool:
+    """Toma (ou renova) o lock ``name`` para ``owner`` por ``ttl`` segundos."""
+    now = timezone.now()
+    expires_at = now + timedelta(seconds=ttl)
+    if not ServiceLock.objects.filter(name=name).exists():
+        try:
+            with transaction.atomic():
+                ServiceLock.objects.create(name=name, owner=owner, expires_at=expires_at)
+            return True
+        except IntegrityError:
+            # Outro processo criou a linha ao mesmo tempo: disputa pelo UPDATE abaixo
+            pass
+    return ServiceLock.objects.filter(name=name).filter(
+        Q(owner=owner) | Q(expires_at__lte=now)
+    ).update(owner=owner, expires_at=expires_at) == 1
+
+
+def release(name: str, owner: str) -> None:
+    """Libera o lock se pertencer a ``owner``."""
+    ServiceLock.objects.filter(name=name, owner=owner).update(owner='', expires_at=timezone.now())
+
+
+class LockTimeout(Exception):
+    """O lock de arquivo não foi obtido dentro do prazo."""
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+def get_lock_dir() -> Path:
+    path = Path(_get_setting('LOCK_DIR', None) or Path(settings.BASE_DIR) / 'locks')
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _try_lock(fd: int) -> bool:
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+def _lock_any(paths, timeout: Optional[float]) -> Tuple[int, int]:
+    """Espera até travar um dos arquivos; devolve o índice e o descritor."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    delay = 0.01
+    while True:
+        for index, path in enumerate(paths):
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            if _try_lock(fd):
+                return index, fd
+            os.close(fd)
+        if deadline is not None and time.monotonic() >= deadline:
+            raise LockTimeout(f"Lock não obtido em {timeout}s: {paths[0].name}")
+        time.sleep(delay)
+        delay = min(delay * 2, 0.2)
+
+
+@contextlib.contextmanager
+def host_slot(name: str, slots: int, timeout: Optional[float] = None):
+    """
+    Semáforo da máquina: no máximo ``slots`` detentores de ``name`` ao mesmo
+    tempo, somando todos os processos. Devolve o número da vaga.
+    """
+    paths = [get_lock_dir() / f"{name}.{index}.lock" for index in range(max(1, slots))]
+    index, fd = _lock_any(paths, timeout)
+    try:
+        yield index
+    finally:
+        _unlock(fd)
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def host_lock(key: str, timeout: Optional[float] = None, stripes: int = 1024):
+    """
+    Exclusão mútua por ``key`` entre os processos da máquina. As chaves são
+    distribuídas em ``stripes`` arquivos fixos (não cria um arquivo por chave);
+    chaves diferentes no mesmo arquivo só esperam uma pela outra.
+    """
+    stripe = int(hashlib.sha1(key.encode()).hexdigest(), 16) % stripes
+    _, fd = _lock_any([get_lock_dir() / f"key.{stripe}.lock"], timeout)
+    try:
+        yield
+    finally:
+        _unlock(fd)
+        os.close(fd)
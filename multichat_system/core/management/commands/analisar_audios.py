@@ -0,0 +1,68 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand
+
+from core.audio_analysis import analyze_and_store
+from core.models import MediaFile, Mensagem
+from core.transcoding import PRIORITY_BACKFILL, get_transcoder
+
+
+class Command(BaseCommand):
+    help = 'Calcula duração e forma de onda (picos) dos áudios que ainda não foram analisados'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cliente-id', type=int, default=None, help='Apenas mensagens deste cliente')
+        parser.add_argument('--limit', type=int, default=None, help='Máximo de áudios a processar')
+        parser.add_argument('--force', action='store_true', help='Reanalisa mesmo os que já têm picos')
+
+    def handle(self, *args, **options):
+        mensagens = Mensagem.objects.filter(tipo='audio').exclude(message_id__isnull=True)
+        if not options['force']:
+            mensagens = mensagens.filter(audio_peaks__isnull=True)
+        if options['cliente_id']:
+            mensagens = mensagens.filter(chat__cliente_id=options['cliente_id'])
+        mensagens = mensagens.order_by('-data_envio').values_list('message_id', 'conteudo')
+        if options['limit']:
+            mensagens = mensagens[:options['limit']]
+
+        mensagens = list(mensagens)
+        caminhos = dict(
+            MediaFile.objects.filter(message_id__in=[m[0] for m in mensagens], file_path__isnull=False)
+            .values_list('message_id', 'file_path')
+        )
+
+        self.stdout.write(f"🎚️ {len(mensagens)} áudios para analisar")
+        transcoder = get_transcoder()
+        jobs = []
+        sem_arquivo = 0
+        for message_id, conteudo in mensagens:
+            file_path = caminhos.get(message_id) or self.caminho_do_conteudo(conteudo)
+            if not file_path or not os.path.exists(file_path):
+                sem_arquivo += 1
+                continue
+            jobs.append((message_id, transcoder.submit_call(
+                analyze_and_store, message_id, file_path, priority=PRIORITY_BACKFILL
+            )))
+
+        analisados = 0
+        for message_id, future in jobs:
+            try:
+                future.result()
+                analisados += 1
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f"❌ {message_id}: {e}"))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {analisados}/{len(jobs)} áudios analisados ({sem_arquivo} sem arquivo local)"
+        ))
+
+    @staticmethod
+    def caminho_do_conteudo(conteudo):
+        """localPath gravado no JSON da mensagem (áudios sincronizados por comandos)"""
+        if not conteudo or not conteudo.startswith('{'):
+            return None
+        try:
+            return json.loads(conteudo).get('audioMessage', {}).get('localPath')
+        except (ValueError, AttributeError):
+            return None
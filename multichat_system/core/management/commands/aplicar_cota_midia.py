@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from core.media_quota import enforce_quota, get_quota_bytes
+from core.media_store import collect_orphan_blobs
+from core.models import Cliente
+
+
+class Command(BaseCommand):
+    help = 'Aplica a cota de mídias por cliente removendo do disco as menos acessadas (metadados mantidos)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cliente-id', type=int, default=None, help='Apenas este cliente')
+        parser.add_argument('--dry-run', action='store_true', help='Só mostra o que seria removido')
+
+    def handle(self, *args, **options):
+        clientes = Cliente.objects.all()
+        if options['cliente_id']:
+            clientes = clientes.filter(id=options['cliente_id'])
+
+        total_removidos = 0
+        for cliente in clientes:
+            if not get_quota_bytes(cliente):
+                continue
+            resultado = enforce_quota(cliente, dry_run=options['dry_run'])
+            total_removidos += resultado['evicted']
+            self.stdout.write(
+                f"📦 {cliente.nome}: {resultado['usage'] / 1024 / 1024:.1f} MB de "
+                f"{resultado['quota'] / 1024 / 1024:.1f} MB, {resultado['evicted']} removidos "
+                f"({resultado['freed'] / 1024 / 1024:.1f} MB)"
+            )
+
+        if not options['dry_run']:
+            # Arquivos removidos podem ter sido a última referência de um blob
+            orfaos = collect_orphan_blobs()
+            self.stdout.write(f"🗑️ {orfaos['removed']} blobs órfãos removidos")
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Cota aplicada: {total_removidos} arquivos removidos"))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.history_backfill import HistoryBackfill, claim_job, serialize_job
+from core.models import WhatsappInstance
+
+
+class Command(BaseCommand):
+    help = 'Importa (ou retoma) o histórico de chats e mensagens de uma instância via W-API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--instance-id',
+            type=str,
+            required=True,
+            help='ID da instância WhatsApp'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Requisições simultâneas à W-API (padrão: BACKFILL_MAX_WORKERS)'
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=None,
+            help='Itens por página (padrão: BACKFILL_PAGE_SIZE)'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignora jobs anteriores e começa uma nova importação'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            instance = WhatsappInstance.objects.select_related('cliente').get(instance_id=options['instance_id'])
+        except WhatsappInstance.DoesNotExist:
+            raise CommandError(f"Instância {options['instance_id']} não encontrada")
+
+        job, claimed = claim_job(instance, restart=options['restart'])
+        if not claimed:
+            raise CommandError(f"Já existe uma importação em execução para a instância (job #{job.id})")
+        if job.started_at and job.total_chats:
+            self.stdout.write(f"♻️ Retomando job #{job.id} ({job.chats_done}/{job.total_chats} chats)")
+        else:
+            self.stdout.write(f"🆕 Job #{job.id}")
+
+        job = HistoryBackfill(job, max_workers=options['workers'], page_size=options['page_size']).run()
+
+        resumo = serialize_job(job)
+        style = self.style.SUCCESS if job.status == 'completed' else self.style.WARNING
+        self.stdout.write(style(
+            f"✅ Job #{job.id} {job.status}: {resumo['messages_imported']} mensagens, "
+            f"{resumo['media_queued']} mídias pendentes, {resumo['chats_done']}/{resumo['total_chats']} chats"
+        ))
+        if job.error_message:
+            self.stdout.write(self.style.ERROR(f"❌ {job.error_message}"))
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from core.models import Mensagem
+from core.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recalcula a consolidação de mensagens por hora usada pelos relatórios (carga inicial ou correção)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', default=None, help='Primeiro dia (AAAA-MM-DD; padrão: mensagem mais antiga)')
+        parser.add_argument('--ate', default=None, help='Último dia (AAAA-MM-DD; padrão: hoje)')
+        parser.add_argument('--cliente-id', type=int, default=None, help='Apenas este cliente')
+        parser.add_argument('--dias-por-lote', type=int, default=31, help='Dias recalculados por transação')
+
+    def _data(self, valor):
+        try:
+            return datetime.strptime(valor, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f"Data inválida: {valor} (use AAAA-MM-DD)")
+
+    def handle(self, *args, **options):
+        ate = self._data(options['ate']) if options['ate'] else timezone.localdate()
+        if options['desde']:
+            desde = self._data(options['desde'])
+        else:
+            primeira = Mensagem.objects.aggregate(primeira=Min('data_envio'))['primeira']
+            if primeira is None:
+                self.stdout.write('📭 Nenhuma mensagem para consolidar')
+                return
+            desde = timezone.localtime(primeira).date()
+
+        lote = timedelta(days=max(1, options['dias_por_lote']))
+        total = 0
+        inicio = desde
+        while inicio <= ate:
+            fim = min(ate, inicio + lote - timedelta(days=1))
+            linhas = rebuild(inicio, fim, cliente_id=options['cliente_id'])
+            total += linhas
+            self.stdout.write(f"📊 {inicio} a {fim}: {linhas} linhas")
+            inicio = fim + timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(f"✅ Consolidação concluída: {total} linhas de {desde} a {ate}"))
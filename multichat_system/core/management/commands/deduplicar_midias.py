@@ -0,0 +1,62 @@
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.media_store import adopt_file, collect_orphan_blobs, get_blobs_dir, hash_file
+
+
+class Command(BaseCommand):
+    help = 'Move as mídias já baixadas para o armazenamento por conteúdo (SHA-256), trocando duplicatas por hardlinks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None, help='Pasta a varrer (padrão: media_storage)')
+        parser.add_argument('--dry-run', action='store_true', help='Só calcula quanto seria liberado')
+        parser.add_argument('--gc', action='store_true', help='Remove também blobs sem nenhuma referência')
+
+    def handle(self, *args, **options):
+        raiz = Path(options['path'] or Path(settings.BASE_DIR) / 'media_storage')
+        blobs = get_blobs_dir().resolve()
+
+        arquivos = 0
+        duplicados = 0
+        liberados = 0
+        vistos = {}
+        for dirpath, dirnames, filenames in os.walk(raiz):
+            if Path(dirpath).resolve() == blobs:
+                dirnames[:] = []
+                continue
+            # Miniaturas, prévias e temporários são derivados, não conteúdo recebido
+            dirnames[:] = [d for d in dirnames if d not in ('thumbs', 'variants')]
+            for nome in filenames:
+                if nome.startswith('.') or nome.startswith('temp_') or nome.endswith('.db'):
+                    continue
+                caminho = Path(dirpath) / nome
+                arquivos += 1
+                try:
+                    if options['dry_run']:
+                        chave = hash_file(caminho)
+                        stat = caminho.stat()
+                        if chave in vistos and vistos[chave] != stat.st_ino:
+                            duplicados += 1
+                            liberados += stat.st_size
+                        vistos.setdefault(chave, stat.st_ino)
+                        continue
+                    tamanho = caminho.stat().st_size
+                    ino_antes = caminho.stat().st_ino
+                    resultado = adopt_file(caminho)
+                    if resultado['deduplicated'] and caminho.stat().st_ino != ino_antes:
+                        duplicados += 1
+                        liberados += tamanho
+                except OSError as e:
+                    self.stdout.write(self.style.ERROR(f"❌ {caminho}: {e}"))
+
+        acao = 'seriam liberados' if options['dry_run'] else 'liberados'
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {arquivos} arquivos, {duplicados} duplicados, {liberados / 1024 / 1024:.1f} MB {acao}"
+        ))
+
+        if options['gc']:
+            resultado = collect_orphan_blobs(dry_run=options['dry_run'])
+            self.stdout.write(f"🗑️ {resultado['removed']} blobs órfãos ({resultado['bytes'] / 1024 / 1024:.1f} MB)")
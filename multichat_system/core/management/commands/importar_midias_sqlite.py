@@ -0,0 +1,172 @@
+import re
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core.models import Chat, MediaFile, WhatsappInstance
+
+# Tabelas dos bancos antigos: media_database.db por instância (core.media_manager)
+# e whatsapp_webhook_realtime.db dos scripts avulsos (wapi/mensagem/baixarmidias)
+TABELAS = ('midias', 'whatsapp_midias')
+STATUS_VALIDOS = {codigo for codigo, _ in MediaFile.STATUS_CHOICES}
+TIPOS_VALIDOS = {codigo for codigo, _ in MediaFile.TIPO_CHOICES}
+PASTA_INSTANCIA = re.compile(r'cliente_(\d+)[\\/]instance_([^\\/]+)')
+
+
+def _data(valor):
+    """Datas do SQLite (texto ISO ou epoch) como datetime com fuso."""
+    if valor in (None, ''):
+        return None
+    if isinstance(valor, (int, float)):
+        data = datetime.fromtimestamp(valor)
+    else:
+        data = parse_datetime(str(valor).replace('T', ' '))
+        if data is None:
+            return None
+    return timezone.make_aware(data) if timezone.is_naive(data) else data
+
+
+class Command(BaseCommand):
+    help = 'Importa (uma única vez) os bancos SQLite de mídia por instância para core.MediaFile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=None, help='Arquivo .db ou pasta a varrer (padrão: media_storage)')
+        parser.add_argument('--instance', default=None,
+                            help='instance_id para bancos sem cliente/instância (whatsapp_webhook_realtime.db)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Registros por INSERT em lote')
+        parser.add_argument('--dry-run', action='store_true', help='Só conta o que seria importado')
+        parser.add_argument('--keep', action='store_true',
+                            help='Não renomeia o banco importado para .db.importado')
+
+    def handle(self, *args, **options):
+        raiz = Path(options['path'] or Path(settings.BASE_DIR) / 'media_storage')
+        if not raiz.exists():
+            raise CommandError(f"Caminho não encontrado: {raiz}")
+        bancos = [raiz] if raiz.is_file() else sorted(raiz.rglob('*.db'))
+
+        self._instancias = {}
+        total_lidos = total_importados = 0
+        for banco in bancos:
+            try:
+                lidos, importados = self._importar_banco(banco, options)
+            except (sqlite3.Error, CommandError) as e:
+                self.stdout.write(self.style.ERROR(f"❌ {banco}: {e}"))
+                continue
+            if lidos is None:
+                continue
+            total_lidos += lidos
+            total_importados += importados
+            self.stdout.write(f"📦 {banco}: {lidos} registros, {importados} novos")
+            if not options['dry_run'] and not options['keep']:
+                banco.rename(banco.with_name(banco.name + '.importado'))
+
+        acao = 'seriam importados' if options['dry_run'] else 'importados'
+        self.stdout.write(self.style.SUCCESS(f"✅ {total_lidos} registros lidos, {total_importados} {acao}"))
+
+    def _importar_banco(self, banco: Path, options):
+        """Importa um arquivo; devolve (lidos, novos) ou (None, 0) se não for um banco de mídias."""
+        with sqlite3.connect(f"file:{banco}?mode=ro", uri=True) as conn:
+            conn.row_factory = sqlite3.Row
+            existentes = {linha[0] for linha in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            tabela = next((nome for nome in TABELAS if nome in existentes), None)
+            if tabela is None:
+                return None, 0
+            linhas = [dict(linha) for linha in conn.execute(f'SELECT * FROM {tabela}')]
+
+        pasta = PASTA_INSTANCIA.search(str(banco))
+        padrao = (int(pasta.group(1)), pasta.group(2)) if pasta else (None, options['instance'])
+
+        importados = 0
+        tamanho = options['batch_size']
+        for inicio in range(0, len(linhas), tamanho):
+            lote = [self._media_file(linha, padrao) for linha in linhas[inicio:inicio + tamanho]]
+            lote = [media for media in lote if media is not None]
+            ja_existem = set(MediaFile.objects.filter(
+                message_id__in=[media.message_id for media in lote]
+            ).values_list('message_id', flat=True))
+            novos = [media for media in lote if media.message_id not in ja_existem]
+            self._ligar_chats(novos)
+            if not options['dry_run']:
+                # Entregas já gravadas pelo webhook têm prioridade (UNIQUE message_id)
+                MediaFile.objects.bulk_create(novos, ignore_conflicts=True)
+            importados += len(novos)
+        return len(linhas), importados
+
+    def _instancia(self, cliente_id, instance_id):
+        chave = (cliente_id, instance_id)
+        if chave not in self._instancias:
+            filtro = WhatsappInstance.objects.filter(instance_id=instance_id)
+            if cliente_id is not None:
+                filtro = filtro.filter(cliente_id=cliente_id)
+            self._instancias[chave] = filtro.first()
+        return self._instancias[chave]
+
+    def _media_file(self, linha, padrao):
+        cliente_id = linha.get('cliente_id') or padrao[0]
+        instance_id = linha.get('instance_id') or padrao[1]
+        if not instance_id:
+            raise CommandError("banco sem cliente/instância: informe --instance")
+        instancia = self._instancia(int(cliente_id) if cliente_id else None, str(instance_id))
+        if instancia is None:
+            raise CommandError(f"instância {instance_id} (cliente {cliente_id}) não cadastrada")
+        if not linha.get('message_id') or linha.get('media_type') not in TIPOS_VALIDOS:
+            return None
+
+        status = linha.get('download_status') or 'pending'
+        if status not in STATUS_VALIDOS:
+            status = 'failed'
+        media = MediaFile(
+            cliente_id=instancia.cliente_id,
+            instance=instancia,
+            message_id=linha['message_id'],
+            sender_name=linha.get('sender_name') or '',
+            sender_id=linha.get('sender_id') or '',
+            media_type=linha['media_type'],
+            mimetype=linha.get('mimetype') or '',
+            file_name=linha.get('file_name'),
+            file_path=linha.get('file_path'),
+            file_size=linha.get('file_size'),
+            caption=linha.get('caption'),
+            width=linha.get('width'),
+            height=linha.get('height'),
+            duration_seconds=linha.get('duration_seconds'),
+            is_ptt=bool(linha.get('is_ptt')),
+            download_status=status,
+            is_group=bool(linha.get('is_group')),
+            from_me=bool(linha.get('from_me')),
+            media_key=linha.get('media_key'),
+            direct_path=linha.get('direct_path'),
+            file_sha256=linha.get('file_sha256'),
+            file_enc_sha256=linha.get('file_enc_sha256'),
+            media_key_timestamp=linha.get('media_key_timestamp'),
+            message_timestamp=_data(linha.get('message_timestamp')),
+            download_timestamp=_data(linha.get('download_timestamp')),
+            # Falhas antigas entram direto na fila de novas tentativas (core.media_retry)
+            next_attempt_at=timezone.now() if status == 'failed' else None,
+        )
+        media.chat_id_original = linha.get('chat_id') or ''
+        return media
+
+    def _ligar_chats(self, midias):
+        """Liga cada mídia ao chat do cliente (chat_id original ou só os dígitos, como grava o webhook)."""
+        candidatos = []
+        for media in midias:
+            digitos = re.sub(r'\D', '', media.chat_id_original.split('@')[0])
+            candidatos.append((media, [valor for valor in (media.chat_id_original, digitos) if valor]))
+        chaves = {valor for _, valores in candidatos for valor in valores}
+        if not chaves:
+            return
+        chats = {
+            (cliente_id, chat_id): pk
+            for cliente_id, chat_id, pk in Chat.objects.filter(
+                cliente_id__in={media.cliente_id for media in midias}, chat_id__in=chaves
+            ).values_list('cliente_id', 'chat_id', 'pk')
+        }
+        for media, valores in candidatos:
+            media.chat_id = next((chats[(media.cliente_id, valor)] for valor in valores
+                                  if (media.cliente_id, valor) in chats), None)
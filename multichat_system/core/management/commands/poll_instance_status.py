@@ -0,0 +1,57 @@
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.instance_status import (
+    acquire_poller_lock,
+    get_poll_interval,
+    poll_instances,
+    release_poller_lock,
+)
+
+
+class Command(BaseCommand):
+    help = 'Poller único que atualiza periodicamente o cache de status das instâncias W-API'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=None,
+            help='Intervalo entre ciclos em segundos (padrão: MULTICHAT_SETTINGS["INSTANCE_STATUS_POLL_INTERVAL"])'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Executa apenas um ciclo e encerra'
+        )
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or get_poll_interval()
+        owner = f"{socket.gethostname()}:{os.getpid()}"
+
+        self.stdout.write(self.style.SUCCESS(f'🔄 Poller de status iniciado (intervalo: {interval}s)'))
+
+        try:
+            while True:
+                if acquire_poller_lock(owner, interval):
+                    # Renova o lock a cada instância: um ciclo longo não o deixa vencer no meio
+                    stats = poll_instances(renew_lock=lambda: acquire_poller_lock(owner, interval))
+                    self.stdout.write(
+                        f"📊 {stats['total']} instâncias | "
+                        f"{stats['conectadas']} conectadas | {stats['erros']} erros"
+                    )
+                    # Renova o lock para cobrir o intervalo de espera, mesmo se o ciclo foi longo
+                    acquire_poller_lock(owner, interval)
+                else:
+                    self.stdout.write(self.style.WARNING('⚠️ Outro poller está ativo, aguardando...'))
+
+                if options['once']:
+                    break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('⏹️ Poller interrompido'))
+        finally:
+            release_poller_lock(owner)
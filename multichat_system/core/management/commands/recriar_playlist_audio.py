@@ -6,6 +6,7 @@ Conecta arquivos existentes com mensagens do banco e cria estrutura correta
 
 from django.core.management.base import BaseCommand
 from core.models import Mensagem, Chat, Cliente
+from core.transcoding import OPUS_EXTENSIONS, PRIORITY_BACKFILL, get_transcoder
 from django.utils import timezone
 import json
 import os
@@ -33,11 +34,18 @@ class Command(BaseCommand):
             action='store_true',
             help='Forçar recriação mesmo se já existir'
         )
+        parser.add_argument(
+            '--mp3',
+            action='store_true',
+            help='Pré-gera as variantes MP3 dos áudios OGG/Opus (fila de baixa prioridade)'
+        )
 
     def handle(self, *args, **options):
         cliente_id = options['cliente_id']
         instance_id = options['instance_id']
         force = options['force']
+        self.mp3 = options['mp3']
+        self.variantes = []
         
         self.stdout.write("🎵 RECRIANDO PLAYLIST DE ÁUDIO COMPLETO")
         self.stdout.write("=" * 60)
@@ -55,6 +63,8 @@ class Command(BaseCommand):
         
         # Processar áudios
         self.processar_audios_existentes(cliente, instance_id, force)
+        if self.variantes:
+            self.aguardar_variantes()
         self.verificar_estrutura_final(cliente)
 
     def processar_audios_existentes(self, cliente, instance_id, force):
@@ -96,11 +106,27 @@ class Command(BaseCommand):
             for audio_file in audio_files:
                 if self.processar_arquivo_audio(audio_file, chat_id, cliente, force):
                     audios_processados += 1
+                if self.mp3 and audio_file.suffix.lower() in OPUS_EXTENSIONS:
+                    self.variantes.append(
+                        (audio_file, get_transcoder().submit(audio_file, 'mp3', PRIORITY_BACKFILL))
+                    )
         
         self.stdout.write(f"\n✅ Processamento concluído!")
         self.stdout.write(f"📊 Total de áudios: {total_audios}")
         self.stdout.write(f"📊 Áudios processados: {audios_processados}")
 
+    def aguardar_variantes(self):
+        """Aguarda as conversões MP3 enfileiradas (respeitando o limite do pool)"""
+        self.stdout.write(f"\n🎛️ Gerando {len(self.variantes)} variantes MP3...")
+        geradas = 0
+        for audio_file, future in self.variantes:
+            try:
+                future.result()
+                geradas += 1
+            except Exception as e:
+                self.stdout.write(f"  ❌ Falha ao converter {audio_file.name}: {e}")
+        self.stdout.write(f"✅ Variantes MP3 prontas: {geradas}/{len(self.variantes)}")
+
     def processar_arquivo_audio(self, audio_file, chat_id, cliente, force):
         """Processa um arquivo de áudio individual"""
         try:
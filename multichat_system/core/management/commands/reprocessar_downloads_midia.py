@@ -0,0 +1,33 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from core.media_retry import due_media, run_due, run_forever
+
+
+class Command(BaseCommand):
+    help = 'Tenta de novo os downloads de mídia que falharam, com backoff exponencial (pode rodar em vários processos)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Processa uma leva dos itens vencidos e sai')
+        parser.add_argument('--limit', type=int, default=50, help='Itens reivindicados por leva')
+        parser.add_argument('--workers', type=int, default=4, help='Downloads em paralelo')
+        parser.add_argument('--max-wait', type=float, default=60, help='Espera máxima entre levas (segundos)')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write(f"📋 {due_media().count()} downloads vencidos na fila")
+            resultado = run_due(limit=options['limit'], workers=options['workers'])
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ {resultado['claimed']} reprocessados: {resultado['succeeded']} baixados, "
+                f"{resultado['failed']} falharam de novo"
+            ))
+            return
+
+        stop = threading.Event()
+        try:
+            run_forever(limit=options['limit'], workers=options['workers'],
+                        max_wait=options['max_wait'], stop=stop)
+        except KeyboardInterrupt:
+            stop.set()
+            self.stdout.write('⏹️ Agendador interrompido')
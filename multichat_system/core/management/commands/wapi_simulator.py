@@ -0,0 +1,60 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.wapi_simulator import WApiSimulator, create_server
+
+
+class Command(BaseCommand):
+    help = 'Sobe um simulador local da W-API (use WAPI_BASE_URL=http://<host>:<porta>/v1/ para apontar o sistema)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1', help='Endereço de escuta')
+        parser.add_argument('--port', type=int, default=8900, help='Porta de escuta')
+        parser.add_argument(
+            '--latency',
+            type=str,
+            default='fixed:0',
+            help='Latência padrão em ms: fixed:50 | uniform:20,200 | normal:100,30 | lognormal:80,0.5'
+        )
+        parser.add_argument(
+            '--endpoint-latency',
+            type=str,
+            default='{}',
+            help='JSON com latência por endpoint, ex.: \'{"message/download-media": "uniform:200,800"}\''
+        )
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Probabilidade de resposta 500 (0-1)')
+        parser.add_argument('--rate-limit', type=float, default=0.0, help='Requisições/s por instância antes de 429 (0 = sem limite)')
+        parser.add_argument('--media-size', type=int, default=64 * 1024, help='Tamanho (bytes) dos arquivos servidos')
+        parser.add_argument('--link-ttl', type=int, default=3600, help='Validade (s) dos fileLinks')
+        parser.add_argument('--disconnected', action='store_true', help='Reporta a instância como desconectada')
+        parser.add_argument('--chats', type=int, default=20, help='Chats sintéticos em chats/fetch-chats')
+        parser.add_argument('--messages-per-chat', type=int, default=200, help='Mensagens sintéticas por chat')
+        parser.add_argument('--seed', type=int, default=None, help='Semente para resultados reprodutíveis')
+
+    def handle(self, *args, **options):
+        simulator = WApiSimulator(
+            latency=options['latency'],
+            endpoint_latency=json.loads(options['endpoint_latency']),
+            error_rate=options['error_rate'],
+            rate_limit=options['rate_limit'],
+            media_size=options['media_size'],
+            link_ttl=options['link_ttl'],
+            connected=not options['disconnected'],
+            chats=options['chats'],
+            messages_per_chat=options['messages_per_chat'],
+            seed=options['seed'],
+        )
+        server = create_server(simulator, options['host'], options['port'])
+
+        self.stdout.write(self.style.SUCCESS(f'🚀 Simulador W-API em {simulator.base_url}/v1/'))
+        self.stdout.write(f'   WAPI_BASE_URL={simulator.base_url}/v1/')
+        self.stdout.write(f'   Estatísticas: {simulator.base_url}/__stats')
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('⏹️ Simulador encerrado'))
+            self.stdout.write(json.dumps(simulator.snapshot_stats(), indent=2))
+        finally:
+            server.server_close()
@@ -0,0 +1,313 @@
+"""
+Garantir que a mídia de um MediaFile está no disco, baixando sob demanda
+
+Com ``MEDIA_DOWNLOAD_MODE='lazy'`` a ingestão só grava o descritor da mídia
+(``mediaKey``/``directPath``/``mimetype``/``fileSha256``) como ``pending``; os
+tipos em ``MEDIA_PREFETCH_TYPES`` são baixados em background e o resto no
+primeiro acesso. Arquivos removidos pela cota (``expired``) seguem o mesmo
+caminho. ``ensure_local`` recria o arquivo: primeiro a partir do
+armazenamento por conteúdo (sem rede) e, se o blob não existe, pela W-API.
+
+Downloads são single-flight por ``message_id``: vários visualizadores
+pedindo a mesma mídia ao mesmo tempo disparam um único download e todos
+esperam o mesmo resultado. Dentro do processo eles dividem o mesmo Future;
+entre os workers da máquina, um lock de arquivo por ``message_id``
+(core.locks.host_lock) faz o segundo esperar e reaproveitar o arquivo.
+"""
+
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+from concurrent.futures import Future
+from datetime import timedelta
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from . import file_links
+from .locks import host_lock
+from .media_store import adopt_file, get_media_storage_dir, materialize
+from .utils import get_wapi_base_url
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+DEFAULT_EXTENSIONS = {
+    'image': '.jpg',
+    'video': '.mp4',
+    'audio': '.ogg',
+    'document': '.pdf',
+    'sticker': '.webp',
+}
+# Onde o mimetypes da stdlib escolhe uma extensão pouco usada (.oga, .jpe...)
+MIMETYPE_EXTENSIONS = {
+    'audio/ogg': '.ogg',
+    'image/jpeg': '.jpg',
+}
+
+
+class MediaFetchError(Exception):
+    """
+    Mídia não pôde ser baixada (sem chaves, W-API sem fileLink, erro HTTP).
+
+    ``permanent`` True/False força a classificação do agendador de novas
+    tentativas; None deixa ele decidir pela mensagem.
+    """
+
+    def __init__(self, message: str, permanent: Optional[bool] = None):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+class SingleFlight:
+    """Executa ``func`` uma vez por chave; chamadas concorrentes recebem o mesmo resultado."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def do(self, key: str, func: Callable, *args, timeout: float = None, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            return future.result(timeout=timeout)
+        try:
+            result = func(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self, key: str) -> bool:
+        with self._lock:
+            return key in self._calls
+
+
+_downloads = SingleFlight()
+
+
+def media_extension(mimetype: Optional[str], media_type: str) -> str:
+    """Extensão do arquivo pelo mimetype (``audio/ogg; codecs=opus`` -> ``.ogg``)."""
+    mimetype = (mimetype or '').split(';')[0].strip().lower()
+    return (MIMETYPE_EXTENSIONS.get(mimetype) or mimetypes.guess_extension(mimetype) or
+            DEFAULT_EXTENSIONS.get(media_type, '.bin'))
+
+
+def default_media_path(media) -> Path:
+    """Caminho padrão da mídia na estrutura media_storage/<cliente>/instance_<id>/chats/<chat>/<tipo>/."""
+    cliente_nome = "".join(c for c in media.cliente.nome if c.isalnum() or c in (' ', '-', '_')).strip()
+    cliente_nome = cliente_nome.replace(' ', '_')
+    chat_id = media.chat.chat_id if media.chat_id else (media.sender_id or 'unknown_chat').split('@')[0]
+    ext = media_extension(media.mimetype, media.media_type)
+    return (get_media_storage_dir() / cliente_nome / f"instance_{media.instance.instance_id}" /
+            'chats' / str(chat_id) / media.media_type / f"wapi_{media.message_id}{ext}")
+
+
+def request_file_link(media) -> str:
+    """Link temporário do arquivo já descriptografado (do cache enquanto não expira)."""
+    return file_links.get_or_request(media.instance.instance_id, media.media_key,
+                                     lambda: _request_file_link(media))
+
+
+def _request_file_link(media) -> Tuple[str, object]:
+    """Pede à W-API um link novo; retorna ``(fileLink, expires)``."""
+    if not (media.media_key and media.direct_path):
+        raise MediaFetchError(f"Mídia {media.message_id} sem mediaKey/directPath", permanent=True)
+    instance = media.instance
+    response = requests.post(
+        f"{get_wapi_base_url()}message/download-media",
+        params={'instanceId': instance.instance_id},
+        headers={'Authorization': f'Bearer {instance.token}', 'Content-Type': 'application/json'},
+        json={
+            'mediaKey': media.media_key,
+            'directPath': media.direct_path,
+            'type': media.media_type,
+            'mimetype': media.mimetype,
+        },
+        timeout=_get_setting('MEDIA_FETCH_TIMEOUT', 60),
+    )
+    if response.status_code != 200:
+        raise MediaFetchError(f"W-API respondeu {response.status_code}",
+                              permanent=True if response.status_code in (404, 410) else None)
+    data = response.json()
+    if data.get('error') or not data.get('fileLink'):
+        raise MediaFetchError(f"W-API não retornou fileLink: {data.get('message') or data}")
+    return data['fileLink'], data.get('expires')
+
+
+def _download_to(url: str, dest: Path) -> int:
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.fetch_', dir=dest.parent)
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as out, \
+                requests.get(url, stream=True, timeout=_get_setting('MEDIA_FETCH_TIMEOUT', 60)) as response:
+            if response.status_code != 200:
+                raise MediaFetchError(f"Download do fileLink respondeu {response.status_code}")
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                out.write(chunk)
+                size += len(chunk)
+        if not size:
+            raise MediaFetchError('Arquivo vazio recebido')
+        os.replace(tmp, dest)
+        return size
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def fetch_media(media) -> Path:
+    """Recria o arquivo da mídia (blob local ou W-API) e atualiza o MediaFile."""
+    from .models import MediaFile
+
+    dest = Path(media.file_path) if media.file_path else default_media_path(media)
+    # Primeiro download (ingestão sob demanda ou nova tentativa): ainda falta o pós-processamento
+    first_download = media.download_status in ('pending', 'failed')
+    if not materialize(media.file_sha256, dest):
+        logger.info(f"📥 Baixando mídia sob demanda: {media.message_id}")
+        file_links.download_with_link(media.instance.instance_id, media.media_key,
+                                      lambda: _request_file_link(media), lambda link: _download_to(link, dest))
+        try:
+            adopt_file(dest, media.file_sha256)
+        except OSError as e:
+            logger.warning(f"⚠️ Falha ao deduplicar {dest}: {e}")
+
+    now = timezone.now()
+    fields = {
+        'file_path': str(dest),
+        'file_size': dest.stat().st_size,
+        'download_status': 'success',
+        'download_timestamp': now,
+        'last_accessed_at': now,
+        'last_error': None,
+        'next_attempt_at': None,
+    }
+    MediaFile.objects.filter(pk=media.pk).update(**fields)
+    for name, value in fields.items():
+        setattr(media, name, value)
+
+    from .media_quota import schedule_quota_check
+    schedule_quota_check(media.cliente_id)
+    if first_download:
+        schedule_post_processing(media, dest)
+    return dest
+
+
+def lazy_downloads_enabled() -> bool:
+    """``MEDIA_DOWNLOAD_MODE='lazy'``: a ingestão só registra a mídia, o primeiro acesso baixa."""
+    return str(_get_setting('MEDIA_DOWNLOAD_MODE', 'eager')).lower() == 'lazy'
+
+
+def prefetch_types() -> set:
+    """Tipos baixados em background mesmo no modo sob demanda (``MEDIA_PREFETCH_TYPES``)."""
+    value = _get_setting('MEDIA_PREFETCH_TYPES', 'audio,sticker')
+    if isinstance(value, str):
+        value = value.split(',')
+    return {item.strip() for item in value if item.strip()}
+
+
+def _prefetch_task(message_id: str) -> Optional[Path]:
+    from django.db import close_old_connections
+    from .models import MediaFile
+
+    try:
+        media = MediaFile.objects.select_related('cliente', 'instance', 'chat').filter(message_id=message_id).first()
+        if media is None:
+            return None
+        return ensure_local(media)
+    finally:
+        close_old_connections()
+
+
+def schedule_fetch(message_id: str, priority: int = None):
+    """Enfileira o download no pool de background (divide o single-flight com os acessos)."""
+    from .transcoding import PRIORITY_INGEST, get_background_pool
+
+    return get_background_pool().submit_call(
+        _prefetch_task, message_id, priority=PRIORITY_INGEST if priority is None else priority
+    )
+
+
+def schedule_post_processing(media, path):
+    """Forma de onda, miniaturas e prévias da mídia recém-baixada."""
+    from .audio_analysis import schedule_audio_analysis
+    from .previews import schedule_preview
+    from .thumbnails import schedule_thumbnails
+
+    if media.media_type == 'audio':
+        schedule_audio_analysis(media.message_id, path)
+    elif media.media_type == 'image':
+        schedule_thumbnails(path)
+    elif media.media_type in ('video', 'document'):
+        schedule_preview(media.message_id, path, media.media_type, media.mimetype)
+
+
+def touch_access(media):
+    """Marca o último acesso (no máximo uma escrita por intervalo, para não gravar a cada request)."""
+    from .models import MediaFile
+
+    now = timezone.now()
+    interval = timedelta(seconds=_get_setting('MEDIA_ACCESS_TOUCH_INTERVAL', 300))
+    if media.last_accessed_at and now - media.last_accessed_at < interval:
+        return
+    MediaFile.objects.filter(pk=media.pk).update(last_accessed_at=now)
+    media.last_accessed_at = now
+
+
+def ensure_local(media) -> Optional[Path]:
+    """
+    Caminho local da mídia, baixando de novo se ela foi removida pela cota.
+
+    Retorna None se o arquivo não existe e não há como baixá-lo.
+    """
+    if media.file_path and os.path.exists(media.file_path):
+        touch_access(media)
+        return Path(media.file_path)
+    if not (media.file_sha256 or (media.media_key and media.direct_path)):
+        return None
+    try:
+        return download_now(media)
+    except Exception as e:
+        logger.error(f"❌ Não foi possível baixar a mídia {media.message_id}: {e}")
+        # Alguém quis ver a mídia: deixar o agendador continuar tentando (exceto as
+        # removidas pela cota, que ficam 'expired' até o próximo acesso)
+        from .media_retry import record_failure
+        record_failure(media, e)
+        return None
+
+
+def _fetch_once(media) -> Path:
+    """``fetch_media`` sob o lock da máquina; se outro worker baixou enquanto esperava, só reaproveita."""
+    from .models import MediaFile
+
+    with host_lock(f"media_fetch:{media.message_id}", timeout=_get_setting('MEDIA_FETCH_TIMEOUT', 60)):
+        current = MediaFile.objects.filter(pk=media.pk).values('file_path', 'download_status').first()
+        if current and current['download_status'] == 'success' and current['file_path'] \
+                and os.path.exists(current['file_path']):
+            media.file_path = current['file_path']
+            media.download_status = 'success'
+            return Path(current['file_path'])
+        return fetch_media(media)
+
+
+def download_now(media) -> Path:
+    """Baixa já (single-flight por message_id); exceções sobem para quem chamou."""
+    return _downloads.do(media.message_id, _fetch_once, media,
+                         timeout=_get_setting('MEDIA_FETCH_TIMEOUT', 60))
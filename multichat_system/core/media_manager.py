@@ -10,7 +10,6 @@ import json
 import time
 import os
 import base64
-import sqlite3
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
@@ -19,12 +18,22 @@ import hashlib
 import mimetypes
 import logging
 
+from core.django_media_manager import DjangoMediaManager
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-class MultiChatMediaManager:
+class MultiChatMediaManager(DjangoMediaManager):
+    """
+    Gerenciador de mídias com pastas por chat (chats/<numero>/<tipo>).
+
+    Os registros ficam em ``core.MediaFile`` (banco principal), herdados de
+    ``DjangoMediaManager``; o antigo media_database.db por instância não é
+    mais criado (importação única: ``manage.py importar_midias_sqlite``).
+    """
+
     def __init__(self, cliente_id: int, instance_id: str, bearer_token: str, base_path: str = None):
         """
         Inicializa o gerenciador de mídias para um cliente específico
@@ -35,25 +44,7 @@ class MultiChatMediaManager:
             bearer_token: Token de autenticação da API W-APi
             base_path: Caminho base para armazenamento (opcional)
         """
-        self.cliente_id = cliente_id
-        self.instance_id = instance_id
-        self.bearer_token = bearer_token
-        self.mensagens_processadas = set()
-        self.contador_mensagens = 0
-        self.contador_midias = 0
-        self.base_url = "https://api.w-api.app/v1"
-
-        # Configurar caminhos de armazenamento
-        if base_path:
-            self.base_path = Path(base_path)
-        else:
-            # Usar caminho padrão no projeto multichat
-            self.base_path = Path(__file__).parent.parent / "media_storage"
-        
-        # Criar estrutura de pastas por cliente e instância
-        self.cliente_path = self.base_path / f"cliente_{cliente_id}"
-        self.instance_path = self.cliente_path / f"instance_{instance_id}"
-        self.instance_path.mkdir(parents=True, exist_ok=True)
+        super().__init__(cliente_id, instance_id, bearer_token, base_path)
 
         # Configurar pasta base de chats (nova estrutura)
         self.chats_path = self.instance_path / "chats"
@@ -71,10 +62,6 @@ class MultiChatMediaManager:
             'sticker': self.instance_path / "stickers"
         }
 
-        # Configurar banco de dados
-        self.db_path = self.instance_path / "media_database.db"
-        self._init_database()
-
         logger.info(f"✅ MediaManager inicializado para Cliente {cliente_id}, Instância {instance_id}")
 
     def get_chat_media_path(self, chat_id: str, media_type: str) -> Path:
@@ -123,169 +110,6 @@ class MultiChatMediaManager:
         clean_id = re.sub(r'[^\w\-]', '_', str(chat_id))
         return clean_id or "unknown"
 
-    def _init_database(self):
-        """Inicializa o banco de dados SQLite para armazenar informações das mídias"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-
-                # Tabela principal de mídias
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS midias (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        message_id TEXT UNIQUE NOT NULL,
-                        sender_name TEXT NOT NULL,
-                        sender_id TEXT NOT NULL,
-                        chat_id TEXT NOT NULL,
-                        is_group BOOLEAN NOT NULL,
-                        from_me BOOLEAN NOT NULL,
-                        media_type TEXT NOT NULL,
-                        mimetype TEXT NOT NULL,
-                        file_name TEXT,
-                        file_path TEXT,
-                        file_size INTEGER,
-                        caption TEXT,
-                        width INTEGER,
-                        height INTEGER,
-                        duration_seconds INTEGER,
-                        is_ptt BOOLEAN,
-                        download_status TEXT DEFAULT 'pending',
-                        download_timestamp DATETIME,
-                        message_timestamp DATETIME,
-                        media_key TEXT,
-                        direct_path TEXT,
-                        file_sha256 TEXT,
-                        file_enc_sha256 TEXT,
-                        media_key_timestamp TEXT,
-                        cliente_id INTEGER NOT NULL,
-                        instance_id TEXT NOT NULL,
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-
-                # Índices para otimizar consultas
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_id ON midias(message_id)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_media_type ON midias(media_type)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_download_status ON midias(download_status)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_sender_id ON midias(sender_id)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_chat_id ON midias(chat_id)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_cliente_instance ON midias(cliente_id, instance_id)')
-
-                conn.commit()
-                logger.info("✅ Banco de dados de mídias inicializado")
-
-        except Exception as e:
-            logger.error(f"❌ Erro ao inicializar banco de mídias: {e}")
-
-    def salvar_midia_no_banco(self, message_data: Dict, info_midia: Dict, file_path: str = None) -> bool:
-        """Salva informações da mídia no banco de dados local"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-
-                # Extrair informações da mensagem
-                message_id = message_data.get('messageId', '')
-                sender = message_data.get('sender', {})
-                chat = message_data.get('chat', {})
-                moment = message_data.get('moment')
-
-                message_timestamp = None
-                if moment:
-                    message_timestamp = datetime.fromtimestamp(moment)
-
-                # Preparar dados para inserção
-                dados = (
-                    message_id,
-                    sender.get('pushName', 'Sem nome'),
-                    sender.get('id', ''),
-                    chat.get('id', ''),
-                    message_data.get('isGroup', False),
-                    message_data.get('fromMe', False),
-                    info_midia['type'],
-                    info_midia['mimetype'],
-                    info_midia.get('fileName'),
-                    file_path,
-                    info_midia.get('fileLength'),
-                    info_midia.get('caption', ''),
-                    info_midia.get('width'),
-                    info_midia.get('height'),
-                    info_midia.get('seconds'),
-                    info_midia.get('ptt', False),
-                    'success' if file_path else 'pending',
-                    datetime.now() if file_path else None,
-                    message_timestamp,
-                    info_midia.get('mediaKey'),
-                    info_midia.get('directPath'),
-                    info_midia.get('fileSha256'),
-                    info_midia.get('fileEncSha256'),
-                    info_midia.get('mediaKeyTimestamp'),
-                    self.cliente_id,
-                    self.instance_id
-                )
-
-                cursor.execute('''
-                    INSERT OR REPLACE INTO midias (
-                        message_id, sender_name, sender_id, chat_id, is_group, from_me,
-                        media_type, mimetype, file_name, file_path, file_size, caption,
-                        width, height, duration_seconds, is_ptt, download_status,
-                        download_timestamp, message_timestamp, media_key, direct_path,
-                        file_sha256, file_enc_sha256, media_key_timestamp, cliente_id, instance_id
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', dados)
-
-                conn.commit()
-                logger.info(f"✅ Mídia salva no banco: {message_id}")
-                return True
-
-        except Exception as e:
-            logger.error(f"❌ Erro ao salvar mídia no banco: {e}")
-            return False
-
-    def buscar_midias_pendentes(self) -> List[Dict]:
-        """Busca mídias com download pendente no banco local"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT * FROM midias 
-                    WHERE download_status = 'pending' OR download_status = 'failed'
-                    ORDER BY created_at DESC
-                ''')
-
-                colunas = [desc[0] for desc in cursor.description]
-                resultados = cursor.fetchall()
-
-                return [dict(zip(colunas, row)) for row in resultados]
-
-        except Exception as e:
-            logger.error(f"❌ Erro ao buscar mídias pendentes: {e}")
-            return []
-
-    def atualizar_status_download(self, message_id: str, status: str, file_path: str = None):
-        """Atualiza status do download no banco local"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-
-                if file_path:
-                    cursor.execute('''
-                        UPDATE midias 
-                        SET download_status = ?, file_path = ?, download_timestamp = ?, updated_at = CURRENT_TIMESTAMP
-                        WHERE message_id = ?
-                    ''', (status, file_path, datetime.now(), message_id))
-                else:
-                    cursor.execute('''
-                        UPDATE midias 
-                        SET download_status = ?, updated_at = CURRENT_TIMESTAMP
-                        WHERE message_id = ?
-                    ''', (status, message_id))
-
-                conn.commit()
-
-        except Exception as e:
-            logger.error(f"❌ Erro ao atualizar status: {e}")
-
     def extrair_informacoes_midia(self, msg_content: Dict) -> List[Dict]:
         """Extrai informações de mídia de uma mensagem"""
         midias = []
@@ -709,156 +533,6 @@ class MultiChatMediaManager:
             logger.error(f"❌ Erro ao extrair dados da mensagem: {e}")
             return None
 
-    def reprocessar_midias_pendentes(self):
-        """Reprocessa mídias que falharam no download"""
-        try:
-            midias_pendentes = self.buscar_midias_pendentes()
-            
-            if not midias_pendentes:
-                logger.info("ℹ️ Nenhuma mídia pendente para reprocessar")
-                return
-
-            logger.info(f"🔄 Reprocessando {len(midias_pendentes)} mídias pendentes...")
-
-            for midia in midias_pendentes:
-                try:
-                    # Recriar info_midia
-                    info_midia = {
-                        'type': midia['media_type'],
-                        'mimetype': midia['mimetype'],
-                        'fileName': midia['file_name'],
-                        'fileLength': midia['file_size'],
-                        'caption': midia['caption'],
-                        'mediaKey': midia['media_key'],
-                        'directPath': midia['direct_path'],
-                        'fileSha256': midia['file_sha256'],
-                        'fileEncSha256': midia['file_enc_sha256'],
-                        'mediaKeyTimestamp': midia['media_key_timestamp']
-                    }
-
-                    # Tentar baixar novamente
-                    file_path = self.descriptografar_e_baixar_midia(
-                        info_midia,
-                        midia['message_id'],
-                        midia['sender_name']
-                    )
-
-                    if file_path:
-                        self.atualizar_status_download(midia['message_id'], 'success', file_path)
-                        logger.info(f"✅ Mídia reprocessada com sucesso: {midia['message_id']}")
-                    else:
-                        self.atualizar_status_download(midia['message_id'], 'failed')
-                        logger.warning(f"⚠️ Falha ao reprocessar mídia: {midia['message_id']}")
-
-                except Exception as e:
-                    logger.error(f"❌ Erro ao reprocessar mídia {midia['message_id']}: {e}")
-
-        except Exception as e:
-            logger.error(f"❌ Erro ao reprocessar mídias pendentes: {e}")
-
-    def obter_estatisticas(self) -> Dict:
-        """Retorna estatísticas do gerenciador de mídias"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Estatísticas gerais
-                cursor.execute('SELECT COUNT(*) FROM midias')
-                total_midias = cursor.fetchone()[0]
-                
-                cursor.execute('SELECT COUNT(*) FROM midias WHERE download_status = "success"')
-                midias_baixadas = cursor.fetchone()[0]
-                
-                cursor.execute('SELECT COUNT(*) FROM midias WHERE download_status = "pending"')
-                midias_pendentes = cursor.fetchone()[0]
-                
-                cursor.execute('SELECT COUNT(*) FROM midias WHERE download_status = "failed"')
-                midias_falhadas = cursor.fetchone()[0]
-                
-                # Por tipo de mídia
-                cursor.execute('''
-                    SELECT media_type, COUNT(*) 
-                    FROM midias 
-                    GROUP BY media_type
-                ''')
-                por_tipo = dict(cursor.fetchall())
-                
-                # Tamanho total dos arquivos
-                cursor.execute('SELECT SUM(file_size) FROM midias WHERE download_status = "success"')
-                tamanho_total = cursor.fetchone()[0] or 0
-                
-                return {
-                    'cliente_id': self.cliente_id,
-                    'instance_id': self.instance_id,
-                    'total_midias': total_midias,
-                    'midias_baixadas': midias_baixadas,
-                    'midias_pendentes': midias_pendentes,
-                    'midias_falhadas': midias_falhadas,
-                    'por_tipo': por_tipo,
-                    'tamanho_total_bytes': tamanho_total,
-                    'tamanho_total_mb': round(tamanho_total / (1024 * 1024), 2),
-                    'mensagens_processadas': self.contador_mensagens,
-                    'midias_processadas': self.contador_midias
-                }
-
-        except Exception as e:
-            logger.error(f"❌ Erro ao obter estatísticas: {e}")
-            return {}
-
-    def limpar_arquivos_antigos(self, dias: int = 30):
-        """Remove arquivos de mídia mais antigos que X dias"""
-        try:
-            from datetime import timedelta
-            data_limite = datetime.now() - timedelta(days=dias)
-            
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                
-                # Buscar arquivos antigos
-                cursor.execute('''
-                    SELECT file_path FROM midias 
-                    WHERE created_at < ? AND file_path IS NOT NULL
-                ''', (data_limite,))
-                
-                arquivos_antigos = cursor.fetchall()
-                
-                for (file_path,) in arquivos_antigos:
-                    try:
-                        path = Path(file_path)
-                        if path.exists():
-                            path.unlink()
-                            logger.info(f"🗑️ Arquivo removido: {path.name}")
-                    except Exception as e:
-                        logger.error(f"❌ Erro ao remover arquivo {file_path}: {e}")
-                
-                # Atualizar banco
-                cursor.execute('''
-                    UPDATE midias 
-                    SET file_path = NULL, download_status = 'expired'
-                    WHERE created_at < ?
-                ''', (data_limite,))
-                
-                conn.commit()
-                logger.info(f"✅ Limpeza concluída: {len(arquivos_antigos)} arquivos removidos")
-
-        except Exception as e:
-            logger.error(f"❌ Erro na limpeza de arquivos: {e}")
-
-    def executar(self):
-        """Método principal para executar o gerenciador"""
-        logger.info(f"🚀 Iniciando MediaManager para Cliente {self.cliente_id}, Instância {self.instance_id}")
-        
-        try:
-            # Reprocessar mídias pendentes
-            self.reprocessar_midias_pendentes()
-            
-            # Mostrar estatísticas
-            stats = self.obter_estatisticas()
-            logger.info(f"📊 Estatísticas: {stats}")
-            
-        except Exception as e:
-            logger.error(f"❌ Erro na execução: {e}")
-
 
 # Função de conveniência para criar instância
 def criar_media_manager(cliente_id: int, instance_id: str, bearer_token: str, base_path: str = None) -> MultiChatMediaManager:
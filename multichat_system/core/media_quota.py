@@ -0,0 +1,129 @@
+"""
+Cota de armazenamento de mídias por cliente, com remoção LRU
+
+O uso de cada cliente é a soma de ``MediaFile.file_size`` das mídias
+baixadas. Ao passar da cota, as mídias servidas há mais tempo (último acesso,
+ou data do download se nunca foram abertas) são removidas do disco até o uso
+voltar a ``MEDIA_QUOTA_LOW_WATERMARK`` da cota, para não remover uma por vez
+a cada mensagem nova.
+
+A remoção só apaga o arquivo: o registro fica como ``expired`` com
+``mediaKey``/``directPath``/``fileSha256`` e ``file_path``, e o próximo acesso
+baixa de novo (``core.media_fetch.ensure_local``).
+"""
+
+import logging
+import os
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+
+from . import tenant_cache
+from .media_store import blob_in_use, find_blob
+from .transcoding import PRIORITY_BACKFILL, get_background_pool
+
+logger = logging.getLogger(__name__)
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+def get_quota_bytes(cliente) -> int:
+    """Cota do cliente em bytes (0 = ilimitada); ``Cliente.media_quota_bytes`` sobrepõe o padrão."""
+    if cliente.media_quota_bytes is not None:
+        return cliente.media_quota_bytes
+    return _get_setting('MEDIA_QUOTA_BYTES', 0)
+
+
+def stored_media(cliente_id: int):
+    from .models import MediaFile
+
+    return MediaFile.objects.filter(cliente_id=cliente_id, download_status='success', file_path__isnull=False)
+
+
+def usage_bytes(cliente_id: int) -> int:
+    return stored_media(cliente_id).aggregate(total=Sum('file_size'))['total'] or 0
+
+
+def evict(media) -> int:
+    """Remove o arquivo do disco mantendo os metadados; retorna os bytes liberados."""
+    from .models import MediaFile
+
+    freed = 0
+    try:
+        freed = os.path.getsize(media.file_path)
+        os.unlink(media.file_path)
+    except FileNotFoundError:
+        pass
+    # Era a última referência ao blob: apagar o blob para liberar o espaço de fato
+    blob = find_blob(media.file_sha256)
+    if blob is not None and not blob_in_use(blob, exclude_pk=media.pk):
+        blob.unlink()
+    MediaFile.objects.filter(pk=media.pk).update(download_status='expired')
+    return freed or media.file_size or 0
+
+
+def enforce_quota(cliente, dry_run: bool = False) -> Dict:
+    """Aplica a cota do cliente; retorna {'usage', 'quota', 'evicted', 'freed'}."""
+    quota = get_quota_bytes(cliente)
+    usage = usage_bytes(cliente.id)
+    result = {'usage': usage, 'quota': quota, 'evicted': 0, 'freed': 0}
+    if not quota or usage <= quota:
+        return result
+
+    target = int(quota * _get_setting('MEDIA_QUOTA_LOW_WATERMARK', 0.9))
+    candidates = (
+        stored_media(cliente.id)
+        .annotate(last_used=Coalesce('last_accessed_at', 'download_timestamp', 'created_at'))
+        .order_by('last_used', 'id')
+        .only('id', 'file_path', 'file_size', 'file_sha256')
+    )
+    for media in candidates.iterator(chunk_size=200):
+        if usage <= target:
+            break
+        size = media.file_size or 0
+        if not dry_run:
+            size = evict(media)
+        usage -= size
+        result['evicted'] += 1
+        result['freed'] += size
+
+    result['usage'] = usage
+    if result['evicted'] and not dry_run:
+        # URLs de mídia em cache apontam para arquivos removidos: nova geração do cliente
+        tenant_cache.invalidate_tenant(cliente.id)
+    logger.info(
+        f"🧹 Cota de mídia do cliente {cliente.id}: {result['evicted']} arquivos removidos, "
+        f"{result['freed'] / 1024 / 1024:.1f} MB liberados"
+    )
+    return result
+
+
+def _enforce_quota_task(cliente_id: int) -> Optional[Dict]:
+    from django.db import close_old_connections
+    from .models import Cliente
+
+    try:
+        cliente = Cliente.objects.filter(pk=cliente_id).first()
+        return enforce_quota(cliente) if cliente else None
+    finally:
+        close_old_connections()
+
+
+def schedule_quota_check(cliente_id: Optional[int]):
+    """
+    Agenda a verificação da cota depois de um download.
+
+    No máximo uma verificação por cliente a cada ``MEDIA_QUOTA_CHECK_INTERVAL``
+    segundos; roda no pool de background com prioridade de backfill.
+    """
+    if not cliente_id:
+        return None
+    interval = _get_setting('MEDIA_QUOTA_CHECK_INTERVAL', 60)
+    if not cache.add(f"media_quota_check:{cliente_id}", 1, interval):
+        return None
+    return get_background_pool().submit_call(_enforce_quota_task, cliente_id, priority=PRIORITY_BACKFILL)
@@ -0,0 +1,220 @@
+"""
+Agendador persistente de novas tentativas de download de mídia
+
+O estado fica no próprio ``MediaFile``:
+
+- ``download_attempts``: tentativas que falharam até agora;
+- ``last_error``: mensagem da última falha;
+- ``next_attempt_at``: quando tentar de novo (None = não tentar mais).
+
+Falhas transitórias (timeout, 5xx, 429, rede) voltam para a fila com backoff
+exponencial e jitter; falhas permanentes (mediaKey expirada, 404/410, mídia
+mais velha que o WhatsApp guarda) ficam ``failed`` sem ``next_attempt_at``.
+
+Os itens vencidos saem de uma consulta indexada por
+``(download_status, next_attempt_at)``. Para vários processos rodarem ao
+mesmo tempo sem baixar a mesma mídia duas vezes, cada item é "reivindicado"
+com um UPDATE condicional que empurra ``next_attempt_at`` para o fim de um
+prazo (lease): só um processo consegue o UPDATE, e se ele morrer o item
+volta a vencer sozinho quando o prazo acaba.
+"""
+
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, List, Optional
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Trechos de erro da W-API/WhatsApp que indicam que a mídia não volta mais
+PERMANENT_ERROR_MARKERS = (
+    'expired', 'expirad', 'not found', 'não encontrad', 'nao encontrad', 'gone', 'invalid media key',
+)
+PERMANENT_STATUS_CODES = (404, 410)
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+def compute_backoff(attempts: int, rng: random.Random = random) -> timedelta:
+    """
+    Atraso antes da próxima tentativa: base * 2^(n-1), limitado ao máximo,
+    com jitter sorteado entre metade e o valor cheio (evita rajadas
+    sincronizadas contra a W-API depois de uma queda).
+    """
+    base = _get_setting('MEDIA_RETRY_BASE_SECONDS', 30)
+    cap = _get_setting('MEDIA_RETRY_MAX_SECONDS', 6 * 3600)
+    delay = min(cap, base * (2 ** max(0, attempts - 1)))
+    return timedelta(seconds=rng.uniform(delay / 2, delay))
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """Decide se vale a pena tentar de novo."""
+    permanent = getattr(error, 'permanent', None)
+    if permanent is not None:
+        return permanent
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in PERMANENT_STATUS_CODES
+    if isinstance(error, requests.RequestException):
+        return False
+    message = str(error).lower()
+    return any(marker in message for marker in PERMANENT_ERROR_MARKERS)
+
+
+def _media_too_old(media) -> bool:
+    """O WhatsApp só mantém a mídia por um tempo; depois disso nem adianta tentar."""
+    max_age = _get_setting('MEDIA_RETRY_MAX_AGE_DAYS', 30)
+    try:
+        sent_at = datetime.fromtimestamp(int(media.media_key_timestamp), tz=dt_timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        sent_at = media.message_timestamp
+    return bool(max_age and sent_at and timezone.now() - sent_at > timedelta(days=max_age))
+
+
+def record_failure(media, error: Exception) -> Optional[datetime]:
+    """Registra a falha e agenda a próxima tentativa; retorna quando (None = desistiu)."""
+    from .models import MediaFile
+
+    if media.download_status == 'expired':
+        # Removida pela cota: continua 'expired' e só volta num novo acesso. Uma nova
+        # tentativa em background baixaria de novo o que a cota acabou de liberar.
+        MediaFile.objects.filter(pk=media.pk).update(last_error=str(error)[:1000])
+        media.last_error = str(error)[:1000]
+        logger.info(f"🕓 Mídia removida pela cota {media.message_id} indisponível agora: {error}")
+        return None
+
+    attempts = (media.download_attempts or 0) + 1
+    permanent = (
+        is_permanent_error(error)
+        or attempts >= _get_setting('MEDIA_RETRY_MAX_ATTEMPTS', 8)
+        or _media_too_old(media)
+    )
+    next_attempt = None if permanent else timezone.now() + compute_backoff(attempts)
+    fields = {
+        'download_status': 'failed',
+        'download_attempts': attempts,
+        'last_error': str(error)[:1000],
+        'next_attempt_at': next_attempt,
+    }
+    MediaFile.objects.filter(pk=media.pk).update(**fields)
+    for name, value in fields.items():
+        setattr(media, name, value)
+
+    if permanent:
+        logger.warning(f"⛔ Download de {media.message_id} desistido após {attempts} tentativa(s): {error}")
+    else:
+        logger.info(f"🔁 Download de {media.message_id} falhou ({attempts}ª), nova tentativa em {next_attempt:%H:%M:%S}: {error}")
+    return next_attempt
+
+
+def schedule_retry(media, error: Exception = None, delay: timedelta = None):
+    """Coloca na fila uma mídia que ainda nem foi tentada (ex.: download da ingestão falhou sem exceção)."""
+    if error is not None:
+        return record_failure(media, error)
+    from .models import MediaFile
+
+    next_attempt = timezone.now() + (delay or compute_backoff(1))
+    MediaFile.objects.filter(pk=media.pk).update(download_status='failed', next_attempt_at=next_attempt)
+    media.download_status, media.next_attempt_at = 'failed', next_attempt
+    return next_attempt
+
+
+def due_media(now: datetime = None):
+    """Mídias com nova tentativa vencida, mais antigas primeiro (usa o índice status + next_attempt_at)."""
+    from .models import MediaFile
+
+    return MediaFile.objects.filter(
+        download_status='failed', next_attempt_at__lte=now or timezone.now()
+    ).order_by('next_attempt_at')
+
+
+def claim(media_id: int, seen_next_attempt: datetime, lease_seconds: int = None) -> bool:
+    """
+    Reivindica o item para este processo.
+
+    O UPDATE só acontece se ``next_attempt_at`` ainda for o valor lido; quem
+    chegar depois encontra o prazo novo e desiste.
+    """
+    from .models import MediaFile
+
+    lease = timedelta(seconds=lease_seconds or _get_setting('MEDIA_RETRY_LEASE_SECONDS', 300))
+    return MediaFile.objects.filter(
+        pk=media_id, download_status='failed', next_attempt_at=seen_next_attempt
+    ).update(next_attempt_at=timezone.now() + lease) == 1
+
+
+def claim_due(limit: int, now: datetime = None) -> List:
+    """Reivindica até ``limit`` itens vencidos; devolve os MediaFile conquistados."""
+    claimed = []
+    candidates = due_media(now).select_related('cliente', 'instance', 'chat')[:limit * 2]
+    for media in candidates:
+        if len(claimed) >= limit:
+            break
+        if claim(media.pk, media.next_attempt_at):
+            claimed.append(media)
+    return claimed
+
+
+def retry_download(media) -> bool:
+    """Uma tentativa: baixa (single-flight com os acessos) ou registra a falha."""
+    from .media_fetch import download_now
+
+    try:
+        download_now(media)
+        logger.info(f"✅ Download reprocessado: {media.message_id} (tentativa {media.download_attempts + 1})")
+        return True
+    except Exception as e:
+        record_failure(media, e)
+        return False
+    finally:
+        close_old_connections()
+
+
+def run_due(limit: int = 50, workers: int = 4) -> Dict[str, int]:
+    """Processa uma leva de itens vencidos; retorna {'claimed', 'succeeded', 'failed'}."""
+    batch = claim_due(limit)
+    if not batch:
+        return {'claimed': 0, 'succeeded': 0, 'failed': 0}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batch))), thread_name_prefix='media-retry') as pool:
+        results = list(pool.map(retry_download, batch))
+    succeeded = sum(results)
+    return {'claimed': len(batch), 'succeeded': succeeded, 'failed': len(batch) - succeeded}
+
+
+def seconds_until_next_due(max_wait: float) -> float:
+    """Quanto dormir até o próximo item vencer (no máximo ``max_wait``)."""
+    from .models import MediaFile
+
+    upcoming = (
+        MediaFile.objects.filter(download_status='failed', next_attempt_at__isnull=False)
+        .order_by('next_attempt_at').values_list('next_attempt_at', flat=True).first()
+    )
+    if upcoming is None:
+        return max_wait
+    return max(0.0, min(max_wait, (upcoming - timezone.now()).total_seconds()))
+
+
+def run_forever(limit: int = 50, workers: int = 4, max_wait: float = 60, stop=None):
+    """Laço do agendador: processa o que venceu e dorme até o próximo vencimento."""
+    logger.info(f"🚀 Agendador de downloads de mídia iniciado ({workers} workers)")
+    while not (stop and stop.is_set()):
+        result = run_due(limit, workers)
+        if result['claimed']:
+            logger.info(f"📊 Reprocessamento: {result}")
+            # Leva cheia: provavelmente há mais itens vencidos esperando
+            if result['claimed'] >= limit:
+                continue
+        wait = seconds_until_next_due(max_wait)
+        close_old_connections()
+        if stop:
+            stop.wait(wait)
+        else:
+            time.sleep(wait)
@@ -0,0 +1,216 @@
+"""
+Armazenamento de mídias endereçado por conteúdo (SHA-256)
+
+Cada arquivo existe uma única vez em ``media_storage/blobs/``, pelo SHA-256
+do plaintext (o ``fileSha256`` que já vem no webhook):
+
+    media_storage/blobs/3f/3fa9...c1
+
+Os caminhos por cliente/chat continuam existindo, mas são hardlinks para o
+blob. A mesma figurinha ou vídeo encaminhado em vários chats (ou tenants)
+ocupa o disco uma vez só, e quando o blob já existe o download na W-API nem
+é feito: basta criar o link no chat novo.
+
+Apagar o arquivo de um chat só remove aquele link; ``collect_orphan_blobs``
+remove os blobs que ficaram sem nenhuma referência. Sem suporte a hardlink
+(cópia no lugar do link) o blob tem ``st_nlink == 1`` mesmo em uso, então a
+referência que vale é o ``MediaFile.file_sha256`` das mídias ainda no disco
+ou por baixar (``blob_in_use``).
+"""
+
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Optional, Set, Union
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_HEX_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+def get_media_storage_dir() -> Path:
+    """Raiz de ``media_storage/`` (``MEDIA_STORAGE_DIR``, padrão ``BASE_DIR/media_storage``)."""
+    return Path(_get_setting('MEDIA_STORAGE_DIR', None) or Path(settings.BASE_DIR) / 'media_storage')
+
+
+def get_blobs_dir() -> Path:
+    return Path(_get_setting('MEDIA_BLOB_DIR', None) or get_media_storage_dir() / 'blobs')
+
+
+def sha256_key(file_sha256: Union[str, bytes, None]) -> Optional[str]:
+    """Normaliza o SHA-256 (base64 do webhook, hex ou bytes) para hex minúsculo."""
+    if not file_sha256:
+        return None
+    if isinstance(file_sha256, bytes):
+        return file_sha256.hex() if len(file_sha256) == 32 else None
+    value = file_sha256.strip()
+    if _HEX_SHA256.match(value.lower()):
+        return value.lower()
+    decode = base64.urlsafe_b64decode if ('-' in value or '_' in value) else base64.b64decode
+    try:
+        digest = decode(value + '=' * (-len(value) % 4))
+    except (binascii.Error, ValueError):
+        return None
+    return digest.hex() if len(digest) == 32 else None
+
+
+def blob_path(key: str) -> Path:
+    return get_blobs_dir() / key[:2] / key
+
+
+def find_blob(file_sha256) -> Optional[Path]:
+    """Blob já armazenado para esse hash, se existir."""
+    key = sha256_key(file_sha256)
+    if not key:
+        return None
+    path = blob_path(key)
+    return path if path.exists() else None
+
+
+def hash_file(path) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def link_blob(blob: Path, dest) -> Path:
+    """
+    Cria ``dest`` como hardlink do blob (cópia se o sistema de arquivos não
+    permitir). Feito via temporário + rename, então ``dest`` nunca fica pela
+    metade.
+    """
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.link_', dir=dest.parent)
+    os.close(fd)
+    os.unlink(tmp)
+    try:
+        try:
+            os.link(blob, tmp)
+        except OSError:
+            shutil.copyfile(blob, tmp)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return dest
+
+
+def materialize(file_sha256, dest) -> Optional[Path]:
+    """Se o conteúdo já está no armazenamento, cria ``dest`` apontando para ele (sem download)."""
+    blob = find_blob(file_sha256)
+    if blob is None:
+        return None
+    path = link_blob(blob, dest)
+    logger.info(f"♻️ Mídia reaproveitada do armazenamento ({blob.name[:12]}): {path}")
+    return path
+
+
+def adopt_file(path, file_sha256=None) -> Dict:
+    """
+    Registra no armazenamento um arquivo recém-baixado.
+
+    Se o conteúdo ainda não existe, o arquivo vira o blob (hardlink, sem
+    cópia). Se já existe, o arquivo baixado é trocado por um link para o blob
+    e o espaço duplicado é liberado. Retorna {'sha256', 'blob', 'deduplicated'}.
+    """
+    path = Path(path)
+    key = hash_file(path)
+    expected = sha256_key(file_sha256)
+    if expected and expected != key:
+        logger.warning(f"⚠️ fileSha256 do webhook não confere com {path.name}; armazenando pelo hash real")
+
+    blob = blob_path(key)
+    if blob.exists():
+        if not blob.samefile(path):
+            link_blob(blob, path)
+        return {'sha256': key, 'blob': blob, 'deduplicated': True}
+
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.link(path, blob)
+    except FileExistsError:
+        # Outro processo armazenou o mesmo conteúdo agora
+        link_blob(blob, path)
+        return {'sha256': key, 'blob': blob, 'deduplicated': True}
+    except OSError:
+        fd, tmp = tempfile.mkstemp(prefix='.blob_', dir=blob.parent)
+        os.close(fd)
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, blob)
+    return {'sha256': key, 'blob': blob, 'deduplicated': False}
+
+
+def _referencing_media():
+    """Mídias que mantêm o blob: no disco ou ainda por baixar (as ``expired`` saíram pela cota)."""
+    from .models import MediaFile
+
+    return MediaFile.objects.exclude(download_status='expired').exclude(file_sha256__isnull=True).exclude(file_sha256='')
+
+
+def referenced_keys() -> Set[str]:
+    """Hashes (hex) referenciados por algum MediaFile."""
+    values = _referencing_media().values_list('file_sha256', flat=True).distinct().iterator()
+    return {key for key in map(sha256_key, values) if key}
+
+
+def blob_in_use(blob: Path, exclude_pk=None) -> bool:
+    """Se o blob ainda tem outra referência: um link fora do armazenamento ou um MediaFile."""
+    if blob.stat().st_nlink > 1:
+        return True
+    media = _referencing_media()
+    if exclude_pk is not None:
+        media = media.exclude(pk=exclude_pk)
+    return any(sha256_key(value) == blob.name for value in media.filter(
+        file_sha256__in=_encodings(blob.name)
+    ).values_list('file_sha256', flat=True))
+
+
+def _encodings(key: str):
+    """Formas em que o hash aparece no banco: hex e base64 (padrão e url-safe) do webhook."""
+    digest = bytes.fromhex(key)
+    b64 = base64.b64encode(digest).decode()
+    return [key, key.upper(), b64, b64.rstrip('='), base64.urlsafe_b64encode(digest).decode().rstrip('=')]
+
+
+def collect_orphan_blobs(dry_run: bool = False, grace_seconds: int = None) -> Dict[str, int]:
+    """
+    Remove blobs sem link fora do armazenamento e sem nenhum MediaFile que os
+    referencie. Blobs mais novos que ``MEDIA_BLOB_GC_GRACE`` segundos ficam
+    (o download pode ainda não ter gravado o MediaFile).
+    """
+    removed = 0
+    freed = 0
+    root = get_blobs_dir()
+    if not root.exists():
+        return {'removed': 0, 'bytes': 0}
+    if grace_seconds is None:
+        grace_seconds = _get_setting('MEDIA_BLOB_GC_GRACE', 3600)
+    cutoff = time.time() - grace_seconds
+    referenced = referenced_keys()
+    for blob in root.glob('??/*'):
+        if blob.name.startswith('.') or not blob.is_file():
+            continue
+        stat = blob.stat()
+        if stat.st_nlink > 1 or blob.name in referenced or stat.st_mtime > cutoff:
+            continue
+        removed += 1
+        freed += stat.st_size
+        if not dry_run:
+            blob.unlink()
+    return {'removed': removed, 'bytes': freed}
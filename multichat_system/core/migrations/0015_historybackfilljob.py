@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_adicionar_validacao_chat_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HistoryBackfillJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pendente'), ('running', 'Em execução'), ('completed', 'Concluído'), ('failed', 'Falhou'), ('cancelled', 'Cancelado')], default='pending', max_length=20, verbose_name='Status')),
+                ('chats_listed', models.BooleanField(default=False, verbose_name='Lista de Chats Carregada')),
+                ('total_chats', models.IntegerField(default=0, verbose_name='Total de Chats')),
+                ('chats_done', models.IntegerField(default=0, verbose_name='Chats Concluídos')),
+                ('messages_imported', models.IntegerField(default=0, verbose_name='Mensagens Importadas')),
+                ('media_queued', models.IntegerField(default=0, verbose_name='Mídias Enfileiradas')),
+                ('chat_cursors', models.JSONField(blank=True, default=dict, verbose_name='Cursores por Chat')),
+                ('error_message', models.TextField(blank=True, null=True, verbose_name='Mensagem de Erro')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Iniciado em')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Finalizado em')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Criado em')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Atualizado em')),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history_backfills', to='core.cliente', verbose_name='Cliente')),
+                ('instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='history_backfills', to='core.whatsappinstance', verbose_name='Instância')),
+            ],
+            options={
+                'verbose_name': 'Importação de Histórico',
+                'verbose_name_plural': 'Importações de Histórico',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['instance', 'status'], name='core_histor_instanc_4175da_idx')],
+            },
+        ),
+    ]
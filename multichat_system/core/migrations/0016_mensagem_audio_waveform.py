@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_historybackfilljob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mensagem',
+            name='audio_duration_ms',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Duração do Áudio (ms)'),
+        ),
+        migrations.AddField(
+            model_name='mensagem',
+            name='audio_peaks',
+            field=models.JSONField(blank=True, null=True, verbose_name='Picos da Forma de Onda'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_mensagem_audio_waveform'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediafile',
+            name='preview_path',
+            field=models.TextField(blank=True, null=True, verbose_name='Caminho da Prévia'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_mediafile_preview_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cliente',
+            name='media_quota_bytes',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='Cota de Mídia (bytes)'),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='last_accessed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Último Acesso'),
+        ),
+    ]
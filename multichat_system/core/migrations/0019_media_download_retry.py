@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_media_quota'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediafile',
+            name='download_attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='Tentativas de Download'),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='last_error',
+            field=models.TextField(blank=True, null=True, verbose_name='Último Erro'),
+        ),
+        migrations.AddField(
+            model_name='mediafile',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Próxima Tentativa'),
+        ),
+        migrations.AddIndex(
+            model_name='mediafile',
+            index=models.Index(fields=['download_status', 'next_attempt_at'], name='core_mediaf_downloa_d5d067_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0019_media_download_retry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField(verbose_name='Dia')),
+                ('hora', models.PositiveSmallIntegerField(verbose_name='Hora')),
+                ('tipo', models.CharField(max_length=20, verbose_name='Tipo')),
+                ('from_me', models.BooleanField(default=False, verbose_name='Enviada por Mim')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='Mensagens')),
+                ('satisfacao', models.PositiveIntegerField(default=0, verbose_name='Mensagens de Satisfação')),
+                ('atendente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Atendente')),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_rollups', to='core.cliente', verbose_name='Cliente')),
+            ],
+            options={
+                'verbose_name': 'Consolidação de Mensagens',
+                'verbose_name_plural': 'Consolidações de Mensagens',
+                'indexes': [models.Index(fields=['cliente', 'dia'], name='core_messag_cliente_92fbe2_idx'), models.Index(fields=['dia'], name='core_messag_dia_234119_idx')],
+                'unique_together': {('cliente', 'atendente', 'dia', 'hora', 'tipo', 'from_me')},
+            },
+        ),
+    ]
@@ -0,0 +1,96 @@
+# Índice de busca textual em Mensagem (ver core.search)
+
+from django.db import migrations
+
+# Texto pesquisável: legenda/nome do arquivo quando o conteúdo é o JSON da mídia, senão o próprio texto
+SQLITE_TEXTO = """
+CASE WHEN json_valid({c}) THEN
+    CASE WHEN json_type({c}) = 'object' THEN trim(
+        coalesce(json_extract({c}, '$.imageMessage.caption'), '') || ' ' ||
+        coalesce(json_extract({c}, '$.videoMessage.caption'), '') || ' ' ||
+        coalesce(json_extract({c}, '$.documentMessage.fileName'), '') || ' ' ||
+        coalesce(json_extract({c}, '$.documentMessage.caption'), '')
+    ) ELSE {c} END
+ELSE {c} END
+"""
+
+SQLITE_FORWARDS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS core_mensagem_fts USING fts5(texto, tokenize = 'unicode61 remove_diacritics 2')",
+    f"""CREATE TRIGGER IF NOT EXISTS core_mensagem_fts_ai AFTER INSERT ON core_mensagem BEGIN
+        INSERT INTO core_mensagem_fts(rowid, texto) VALUES (new.id, {SQLITE_TEXTO.format(c='new.conteudo')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS core_mensagem_fts_au AFTER UPDATE OF conteudo ON core_mensagem
+        WHEN old.conteudo IS NOT new.conteudo BEGIN
+        DELETE FROM core_mensagem_fts WHERE rowid = old.id;
+        INSERT INTO core_mensagem_fts(rowid, texto) VALUES (new.id, {SQLITE_TEXTO.format(c='new.conteudo')});
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS core_mensagem_fts_ad AFTER DELETE ON core_mensagem BEGIN
+        DELETE FROM core_mensagem_fts WHERE rowid = old.id;
+    END""",
+    f"INSERT INTO core_mensagem_fts(rowid, texto) SELECT id, {SQLITE_TEXTO.format(c='conteudo')} FROM core_mensagem",
+]
+SQLITE_BACKWARDS = [
+    "DROP TRIGGER IF EXISTS core_mensagem_fts_ai",
+    "DROP TRIGGER IF EXISTS core_mensagem_fts_au",
+    "DROP TRIGGER IF EXISTS core_mensagem_fts_ad",
+    "DROP TABLE IF EXISTS core_mensagem_fts",
+]
+
+POSTGRES_FORWARDS = [
+    """CREATE OR REPLACE FUNCTION core_mensagem_texto_busca(conteudo text) RETURNS text AS $$
+    DECLARE dados jsonb;
+    BEGIN
+        IF conteudo IS NULL OR left(ltrim(conteudo), 1) <> '{' THEN
+            RETURN conteudo;
+        END IF;
+        dados := conteudo::jsonb;
+        RETURN concat_ws(' ',
+            dados #>> '{imageMessage,caption}', dados #>> '{videoMessage,caption}',
+            dados #>> '{documentMessage,fileName}', dados #>> '{documentMessage,caption}');
+    EXCEPTION WHEN others THEN
+        RETURN conteudo;
+    END;
+    $$ LANGUAGE plpgsql IMMUTABLE""",
+    """CREATE INDEX IF NOT EXISTS core_mensagem_busca_gin ON core_mensagem
+        USING gin (to_tsvector('portuguese', core_mensagem_texto_busca(conteudo)))""",
+]
+POSTGRES_BACKWARDS = [
+    "DROP INDEX IF EXISTS core_mensagem_busca_gin",
+    "DROP FUNCTION IF EXISTS core_mensagem_texto_busca(text)",
+]
+
+MYSQL_FORWARDS = ["CREATE FULLTEXT INDEX core_mensagem_conteudo_ft ON core_mensagem (conteudo)"]
+MYSQL_BACKWARDS = ["DROP INDEX core_mensagem_conteudo_ft ON core_mensagem"]
+
+STATEMENTS = {
+    'sqlite': (SQLITE_FORWARDS, SQLITE_BACKWARDS),
+    'postgresql': (POSTGRES_FORWARDS, POSTGRES_BACKWARDS),
+    'mysql': (MYSQL_FORWARDS, MYSQL_BACKWARDS),
+}
+
+
+def _run(schema_editor, backwards=False):
+    statements = STATEMENTS.get(schema_editor.connection.vendor)
+    if not statements:
+        return
+    for sql in statements[1 if backwards else 0]:
+        schema_editor.execute(sql, params=None)
+
+
+def forwards(apps, schema_editor):
+    _run(schema_editor)
+
+
+def backwards(apps, schema_editor):
+    _run(schema_editor, backwards=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_message_rollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 11:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_mensagem_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['data_inicio'], name='core_chat_data_in_ed9409_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_chat_data_inicio_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mediafile',
+            index=models.Index(fields=['file_sha256'], name='core_mediaf_file_sh_bf5b36_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_mediafile_file_sha256_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceLock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Nome')),
+                ('owner', models.CharField(blank=True, default='', max_length=255, verbose_name='Dono')),
+                ('expires_at', models.DateTimeField(verbose_name='Expira em')),
+            ],
+            options={
+                'verbose_name': 'Lock de Serviço',
+                'verbose_name_plural': 'Locks de Serviço',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:26
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def juntar_duplicadas(apps, schema_editor):
+    """Soma as linhas sem atendente repetidas no mesmo bucket antes de criar a restrição."""
+    MessageRollup = apps.get_model('core', 'MessageRollup')
+    chave = ('cliente_id', 'dia', 'hora', 'tipo', 'from_me')
+    repetidas = (
+        MessageRollup.objects.filter(atendente__isnull=True).values(*chave)
+        .annotate(n=Count('id'), primeira=Min('id'), soma_total=Sum('total'), soma_satisfacao=Sum('satisfacao'))
+        .filter(n__gt=1)
+    )
+    for linha in repetidas:
+        grupo = MessageRollup.objects.filter(atendente__isnull=True, **{campo: linha[campo] for campo in chave})
+        grupo.filter(id=linha['primeira']).update(total=linha['soma_total'], satisfacao=linha['soma_satisfacao'])
+        grupo.exclude(id=linha['primeira']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_servicelock'),
+    ]
+
+    operations = [
+        migrations.RunPython(juntar_duplicadas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='messagerollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('atendente__isnull', True)), fields=('cliente', 'dia', 'hora', 'tipo', 'from_me'), name='rollup_unico_sem_atendente'),
+        ),
+    ]
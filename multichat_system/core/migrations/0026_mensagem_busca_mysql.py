@@ -0,0 +1,58 @@
+# Busca textual no MySQL sobre o mesmo texto extraído do SQLite/PostgreSQL (ver core.search)
+#
+# O FULLTEXT da 0021 ficava no conteúdo bruto: para mídias isso indexava o JSON
+# inteiro (chaves, URLs, mediaKey). Aqui o índice passa para a coluna gerada
+# ``texto_busca`` (STORED), com a legenda/nome do arquivo quando o conteúdo é o
+# JSON da mídia e o próprio texto nos demais casos. A coluna é calculada pelo
+# banco e fica fora do modelo: o Django nunca a lê nem escreve.
+
+from django.db import migrations
+
+# CASE aninhado: JSON_TYPE falha em JSON inválido, então só roda depois do JSON_VALID
+MYSQL_TEXTO = """
+CASE WHEN JSON_VALID(conteudo) THEN
+    CASE WHEN JSON_TYPE(conteudo) = 'OBJECT' THEN CONCAT_WS(' ',
+        JSON_UNQUOTE(JSON_EXTRACT(conteudo, '$.imageMessage.caption')),
+        JSON_UNQUOTE(JSON_EXTRACT(conteudo, '$.videoMessage.caption')),
+        JSON_UNQUOTE(JSON_EXTRACT(conteudo, '$.documentMessage.fileName')),
+        JSON_UNQUOTE(JSON_EXTRACT(conteudo, '$.documentMessage.caption'))
+    ) ELSE conteudo END
+ELSE conteudo END
+"""
+
+MYSQL_FORWARDS = [
+    "DROP INDEX core_mensagem_conteudo_ft ON core_mensagem",
+    f"ALTER TABLE core_mensagem ADD COLUMN texto_busca LONGTEXT GENERATED ALWAYS AS ({MYSQL_TEXTO}) STORED",
+    "CREATE FULLTEXT INDEX core_mensagem_texto_busca_ft ON core_mensagem (texto_busca)",
+]
+MYSQL_BACKWARDS = [
+    "DROP INDEX core_mensagem_texto_busca_ft ON core_mensagem",
+    "ALTER TABLE core_mensagem DROP COLUMN texto_busca",
+    "CREATE FULLTEXT INDEX core_mensagem_conteudo_ft ON core_mensagem (conteudo)",
+]
+
+
+def _run(schema_editor, backwards=False):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    for sql in MYSQL_BACKWARDS if backwards else MYSQL_FORWARDS:
+        schema_editor.execute(sql, params=None)
+
+
+def forwards(apps, schema_editor):
+    _run(schema_editor)
+
+
+def backwards(apps, schema_editor):
+    _run(schema_editor, backwards=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_messagerollup_unico_sem_atendente'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -22,6 +22,9 @@ class Cliente(models.Model):
     # Novo campo para foto de perfil do cliente/contato
     foto_perfil = models.URLField(blank=True, null=True, verbose_name="Foto de Perfil")
     
+    # Cota de mídias em disco (None = padrão MEDIA_QUOTA_BYTES; 0 = ilimitada)
+    media_quota_bytes = models.BigIntegerField(blank=True, null=True, verbose_name="Cota de Mídia (bytes)")
+    
     class Meta:
         verbose_name = "Cliente"
         verbose_name_plural = "Clientes"
@@ -117,6 +120,8 @@ class Chat(models.Model):
         indexes = [
             models.Index(fields=['cliente', 'chat_id']),
             models.Index(fields=['is_group', 'group_id']),
+            # Relatórios filtram atendimentos pelo período (sem cliente: varria core_chat)
+            models.Index(fields=['data_inicio']),
         ]
     
     def __str__(self):
@@ -195,6 +200,10 @@ class Mensagem(models.Model):
     # Campo para reações (JSON array de emojis)
     reacoes = models.JSONField(default=list, blank=True, verbose_name="Reações")
     
+    # Áudio: calculados na ingestão (core.audio_analysis)
+    audio_duration_ms = models.IntegerField(blank=True, null=True, verbose_name="Duração do Áudio (ms)")
+    audio_peaks = models.JSONField(blank=True, null=True, verbose_name="Picos da Forma de Onda")
+    
     class Meta:
         verbose_name = "Mensagem"
         verbose_name_plural = "Mensagens"
@@ -287,6 +296,7 @@ class MediaFile(models.Model):
     height = models.IntegerField(blank=True, null=True, verbose_name="Altura")
     duration_seconds = models.IntegerField(blank=True, null=True, verbose_name="Duração (segundos)")
     is_ptt = models.BooleanField(default=False, verbose_name="Push to Talk")
+    preview_path = models.TextField(blank=True, null=True, verbose_name="Caminho da Prévia")
     
     # Status e controle
     download_status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="Status do Download")
@@ -303,6 +313,12 @@ class MediaFile(models.Model):
     # Timestamps
     message_timestamp = models.DateTimeField(blank=True, null=True, verbose_name="Timestamp da Mensagem")
     download_timestamp = models.DateTimeField(blank=True, null=True, verbose_name="Timestamp do Download")
+    last_accessed_at = models.DateTimeField(blank=True, null=True, verbose_name="Último Acesso")
+    
+    # Novas tentativas de download (core.media_retry)
+    download_attempts = models.PositiveIntegerField(default=0, verbose_name="Tentativas de Download")
+    next_attempt_at = models.DateTimeField(blank=True, null=True, verbose_name="Próxima Tentativa")
+    last_error = models.TextField(blank=True, null=True, verbose_name="Último Erro")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Criado em")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Atualizado em")
     
@@ -314,7 +330,9 @@ class MediaFile(models.Model):
             models.Index(fields=['cliente', 'instance']),
             models.Index(fields=['message_id']),
             models.Index(fields=['media_type', 'download_status']),
+            models.Index(fields=['download_status', 'next_attempt_at']),
             models.Index(fields=['sender_id', 'chat']),
+            models.Index(fields=['file_sha256']),
         ]
     
     def __str__(self):
@@ -338,4 +356,113 @@ class MediaFile(models.Model):
             # Aqui você pode implementar a lógica para gerar URLs
             # Por exemplo, usando Django Storage ou nginx
             return f"/media/{self.file_path}"
-        return None 
\ No newline at end of file
+        return None 
+
+class HistoryBackfillJob(models.Model):
+    """
+    Importação do histórico de chats/mensagens de uma instância via W-API.
+
+    Guarda o cursor de cada chat para permitir retomar a importação
+    exatamente de onde parou (ver core.history_backfill).
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pendente'),
+        ('running', 'Em execução'),
+        ('completed', 'Concluído'),
+        ('failed', 'Falhou'),
+        ('cancelled', 'Cancelado'),
+    ]
+
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, verbose_name="Cliente", related_name='history_backfills')
+    instance = models.ForeignKey(WhatsappInstance, on_delete=models.CASCADE, verbose_name="Instância", related_name='history_backfills')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="Status")
+
+    # Progresso
+    chats_listed = models.BooleanField(default=False, verbose_name="Lista de Chats Carregada")
+    total_chats = models.IntegerField(default=0, verbose_name="Total de Chats")
+    chats_done = models.IntegerField(default=0, verbose_name="Chats Concluídos")
+    messages_imported = models.IntegerField(default=0, verbose_name="Mensagens Importadas")
+    media_queued = models.IntegerField(default=0, verbose_name="Mídias Enfileiradas")
+    # {chat_id_wapi: próxima página a buscar (0 = concluído)}
+    chat_cursors = models.JSONField(default=dict, blank=True, verbose_name="Cursores por Chat")
+    error_message = models.TextField(blank=True, null=True, verbose_name="Mensagem de Erro")
+
+    # Timestamps
+    started_at = models.DateTimeField(blank=True, null=True, verbose_name="Iniciado em")
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name="Finalizado em")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Criado em")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Atualizado em")
+
+    class Meta:
+        verbose_name = "Importação de Histórico"
+        verbose_name_plural = "Importações de Histórico"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['instance', 'status']),
+        ]
+
+    def __str__(self):
+        return f"Backfill {self.instance.instance_id} - {self.status}"
+
+    @property
+    def progress_percent(self):
+        """Percentual de chats concluídos"""
+        if not self.total_chats:
+            return 100.0 if self.status == 'completed' else 0.0
+        return round(self.chats_done * 100 / self.total_chats, 1)
+
+
+class MessageRollup(models.Model):
+    """
+    Contagem de mensagens por (cliente, atendente, dia, hora, tipo, direção).
+
+    Mantida na ingestão (core.rollups) e reconstruível pelo comando
+    ``consolidar_relatorios``; os relatórios somam linhas desta tabela em vez
+    de contar mensagens. Dia e hora no fuso do projeto (TIME_ZONE).
+    """
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, verbose_name="Cliente", related_name='message_rollups')
+    atendente = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Atendente")
+    dia = models.DateField(verbose_name="Dia")
+    hora = models.PositiveSmallIntegerField(verbose_name="Hora")
+    tipo = models.CharField(max_length=20, verbose_name="Tipo")
+    from_me = models.BooleanField(default=False, verbose_name="Enviada por Mim")
+    total = models.PositiveIntegerField(default=0, verbose_name="Mensagens")
+    # Mensagens com 👍 (indicador de satisfação do relatório)
+    satisfacao = models.PositiveIntegerField(default=0, verbose_name="Mensagens de Satisfação")
+
+    class Meta:
+        verbose_name = "Consolidação de Mensagens"
+        verbose_name_plural = "Consolidações de Mensagens"
+        unique_together = ['cliente', 'atendente', 'dia', 'hora', 'tipo', 'from_me']
+        constraints = [
+            # NULLs são distintos no unique_together: chats sem atendente precisam da própria regra
+            models.UniqueConstraint(
+                fields=['cliente', 'dia', 'hora', 'tipo', 'from_me'],
+                condition=models.Q(atendente__isnull=True),
+                name='rollup_unico_sem_atendente',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['cliente', 'dia']),
+            models.Index(fields=['dia']),
+        ]
+
+    def __str__(self):
+        return f"{self.cliente_id} {self.dia} {self.hora:02d}h {self.tipo}: {self.total}"
+
+
+class ServiceLock(models.Model):
+    """
+    Lock com prazo para processos que devem rodar uma única vez no conjunto
+    de máquinas (ex.: poller de status). Ver core.locks.
+    """
+    name = models.CharField(max_length=100, unique=True, verbose_name="Nome")
+    owner = models.CharField(max_length=255, blank=True, default='', verbose_name="Dono")
+    expires_at = models.DateTimeField(verbose_name="Expira em")
+
+    class Meta:
+        verbose_name = "Lock de Serviço"
+        verbose_name_plural = "Locks de Serviço"
+
+    def __str__(self):
+        return f"{self.name} ({self.owner or 'livre'})"
@@ -0,0 +1,189 @@
+"""
+Pré-visualizações de vídeos e documentos na ingestão
+
+- Vídeo: um quadro (poster) em JPEG, extraído com ffmpeg, mais a duração
+  (ffprobe).
+- PDF: a primeira página rasterizada em JPEG com o ``pdftoppm`` (poppler).
+
+Rodam no mesmo pool limitado do transcoder, com timeout por processo, e o
+resultado fica em ``thumbs/`` ao lado do arquivo original:
+
+    .../chats/<chat>/video/msg_abc.mp4
+    .../chats/<chat>/video/thumbs/msg_abc_poster.jpg
+    .../chats/<chat>/document/thumbs/relatorio_preview.jpg
+
+O caminho é gravado em ``MediaFile.preview_path``: a interface mostra a
+prévia com uma única requisição pequena, sem baixar o arquivo inteiro.
+"""
+
+import logging
+import os
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .thumbnails import THUMBS_DIR
+from .transcoding import PRIORITY_INGEST, TranscodingError, get_transcoder
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_MAX_WIDTH = 640
+# Quadro do poster: 1s evita o quadro preto inicial; vídeos curtos usam o primeiro
+POSTER_OFFSETS = ('1', '0')
+PDF_EXTENSIONS = ('.pdf',)
+PDF_MIMETYPES = ('application/pdf',)
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+def previews_enabled() -> bool:
+    return _get_setting('PREVIEWS_ENABLED', True)
+
+
+def preview_path(original, media_type: str) -> Path:
+    original = Path(original)
+    suffix = 'poster' if media_type == 'video' else 'preview'
+    return original.parent / THUMBS_DIR / f"{original.stem}_{suffix}.jpg"
+
+
+def is_pdf(original, mimetype: str = None) -> bool:
+    return (mimetype or '').split(';')[0].strip().lower() in PDF_MIMETYPES or \
+        Path(original).suffix.lower() in PDF_EXTENSIONS
+
+
+def _run(cmd, timeout: int) -> subprocess.CompletedProcess:
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=timeout)
+    except FileNotFoundError:
+        raise TranscodingError(f"{cmd[0]} não encontrado no PATH")
+    except subprocess.TimeoutExpired:
+        raise TranscodingError(f"{cmd[0]} excedeu {timeout}s")
+    if result.returncode != 0:
+        raise TranscodingError(result.stderr.decode('utf-8', 'replace').strip()[-500:] or f"{cmd[0]} falhou")
+    return result
+
+
+def probe_duration(video) -> Optional[float]:
+    """Duração do vídeo em segundos (None se o ffprobe não souber)."""
+    timeout = _get_setting('TRANSCODE_TIMEOUT', 120)
+    result = _run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+                   '-of', 'csv=p=0', str(video)], timeout)
+    try:
+        return float(result.stdout.decode().strip())
+    except ValueError:
+        return None
+
+
+def extract_poster(video, dest: Path) -> Path:
+    """Grava um quadro do vídeo (largura máxima PREVIEW_MAX_WIDTH) em ``dest``."""
+    timeout = _get_setting('TRANSCODE_TIMEOUT', 120)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.poster_', suffix='.jpg', dir=dest.parent)
+    os.close(fd)
+    try:
+        for offset in POSTER_OFFSETS:
+            _run(['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+                  '-ss', offset, '-i', str(video), '-frames:v', '1',
+                  '-vf', f"scale='min({PREVIEW_MAX_WIDTH},iw)':-2", '-q:v', '4', tmp], timeout)
+            # Com -ss além do fim o ffmpeg termina sem erro e sem quadro
+            if os.path.getsize(tmp) > 0:
+                os.replace(tmp, dest)
+                return dest
+        raise TranscodingError('Nenhum quadro extraído do vídeo')
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def render_pdf_first_page(document, dest: Path) -> Path:
+    """Rasteriza a primeira página do PDF em ``dest``."""
+    timeout = _get_setting('TRANSCODE_TIMEOUT', 120)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmpdir = tempfile.mkdtemp(prefix='.preview_', dir=dest.parent)
+    try:
+        # pdftoppm acrescenta a extensão ao prefixo de saída
+        prefix = os.path.join(tmpdir, 'page')
+        _run(['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-jpeg',
+              '-scale-to', str(PREVIEW_MAX_WIDTH), str(document), prefix], timeout)
+        os.replace(f"{prefix}.jpg", dest)
+        return dest
+    finally:
+        for name in os.listdir(tmpdir):
+            os.unlink(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+
+def generate_preview(original, media_type: str, mimetype: str = None, force: bool = False) -> Dict:
+    """
+    Gera a prévia que faltar; retorna {'preview_path', 'duration_seconds'}.
+
+    Tipos sem prévia (documentos que não são PDF, por exemplo) devolvem
+    ``preview_path`` None.
+    """
+    original = Path(original)
+    result = {'preview_path': None, 'duration_seconds': None}
+    if media_type == 'video':
+        dest = preview_path(original, 'video')
+        if force or not dest.exists():
+            extract_poster(original, dest)
+        result['preview_path'] = str(dest)
+        try:
+            duration = probe_duration(original)
+        except TranscodingError as e:
+            logger.warning(f"⚠️ Duração do vídeo indisponível ({original.name}): {e}")
+            duration = None
+        if duration is not None:
+            result['duration_seconds'] = int(round(duration))
+    elif media_type == 'document' and is_pdf(original, mimetype):
+        dest = preview_path(original, 'document')
+        if force or not dest.exists():
+            render_pdf_first_page(original, dest)
+        result['preview_path'] = str(dest)
+    return result
+
+
+def store_preview(message_id: str, result: Dict) -> int:
+    """Grava a prévia (e a duração, para vídeos) no MediaFile."""
+    from .models import MediaFile
+
+    fields = {'preview_path': result['preview_path']}
+    if result.get('duration_seconds') is not None:
+        fields['duration_seconds'] = result['duration_seconds']
+    return MediaFile.objects.filter(message_id=message_id).update(**fields)
+
+
+def generate_and_store(message_id: Optional[str], file_path, media_type: str, mimetype: str = None) -> Optional[Dict]:
+    """Tarefa executada no pool do transcoder."""
+    try:
+        result = generate_preview(file_path, media_type, mimetype)
+        if result['preview_path'] is None:
+            return result
+        if message_id:
+            store_preview(message_id, result)
+        logger.info(f"🖼️ Prévia gerada: {result['preview_path']}")
+        return result
+    except Exception as e:
+        logger.error(f"❌ Erro ao gerar prévia de {file_path}: {e}")
+        raise
+    finally:
+        close_old_connections()
+
+
+def schedule_preview(message_id: Optional[str], file_path, media_type: str, mimetype: str = None,
+                     priority: int = PRIORITY_INGEST):
+    """Enfileira a prévia de vídeo/PDF no pool de background (None se não se aplica)."""
+    if not previews_enabled() or not file_path:
+        return None
+    if media_type not in ('video', 'document'):
+        return None
+    if media_type == 'document' and not is_pdf(file_path, mimetype):
+        return None
+    return get_transcoder().submit_call(
+        generate_and_store, message_id, str(file_path), media_type, mimetype, priority=priority
+    )
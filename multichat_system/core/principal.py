@@ -0,0 +1,224 @@
+"""
+Principal autenticado em cache: papel, cliente e instâncias do usuário
+
+Cada chamada autenticada da API carregava o ``Usuario`` do banco (JWT) e,
+na maioria das views, também o ``Cliente`` (``user.cliente``) só para
+filtrar por tenant, repetindo as mesmas verificações de ``tipo_usuario``.
+``get_principal`` guarda no cache, por ``PRINCIPAL_CACHE_TTL`` segundos, o
+que essas verificações usam (papel, ``cliente_id``, ``instance_id`` das
+instâncias do cliente) e os campos do usuário e do cliente (sem a senha),
+com os quais ``authentication.backends.CachedJWTAuthentication`` remonta o
+usuário sem consultar o banco.
+
+A chave leva a versão do usuário (``principal:<id>:v<versão>``). Salvar ou
+excluir o usuário, o cliente dele ou uma instância do cliente incrementa a
+versão depois do commit: a próxima requisição monta o principal de novo.
+
+O usuário remontado do cache pode estar defasado: ao salvá-lo, as colunas
+que a requisição não alterou são relidas do banco antes do UPDATE.
+"""
+
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .models import Cliente, WhatsappInstance
+
+CACHE_PREFIX = 'principal'
+TENANT_ROLES = ('cliente', 'colaborador')
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+def _version_key(user_id) -> str:
+    return f"{CACHE_PREFIX}:versao:{user_id}"
+
+
+def _cache_key(user_id, version: int) -> str:
+    return f"{CACHE_PREFIX}:{user_id}:v{version}"
+
+
+def _version(user_id) -> int:
+    version = cache.get(_version_key(user_id))
+    if version is None:
+        # Começa pelo relógio (como tenant_cache.generation): se a versão sair do
+        # cache, não volta para uma versão antiga cujo principal ainda esteja lá
+        cache.add(_version_key(user_id), int(time.time()), None)
+        version = cache.get(_version_key(user_id), 0)
+    return version
+
+
+def _campos(instance, excluir: Iterable[str] = ()) -> Dict:
+    """Campos concretos (attname -> valor), na ordem do modelo, para ``from_db``."""
+    return {
+        f.attname: getattr(instance, f.attname)
+        for f in instance._meta.concrete_fields if f.attname not in excluir
+    }
+
+
+def _from_db(model, campos: Dict):
+    # Campos ausentes (a senha) ficam adiados: só são lidos do banco se alguém usar
+    return model.from_db(DEFAULT_DB_ALIAS, list(campos), list(campos.values()))
+
+
+@dataclass
+class Principal:
+    user_id: int
+    tipo_usuario: str
+    is_superuser: bool
+    is_active: bool
+    cliente_id: Optional[int]
+    instance_ids: Tuple[str, ...] = ()
+    user_fields: Dict = field(default_factory=dict, repr=False)
+    cliente_fields: Optional[Dict] = field(default=None, repr=False)
+
+    @property
+    def is_admin(self) -> bool:
+        return self.is_superuser or self.tipo_usuario == 'admin'
+
+    def has_role(self, *tipos: str) -> bool:
+        """Superusuário ou um dos ``tipos`` de usuário."""
+        return self.is_superuser or self.tipo_usuario in tipos
+
+    def scope(self, queryset, lookup: str = 'cliente', roles: Tuple[str, ...] = TENANT_ROLES):
+        """
+        Restringe ``queryset`` ao cliente do usuário pelo caminho ``lookup``
+        (ex.: ``'chat__cliente'``). Administradores veem tudo; papéis fora
+        de ``roles`` ou usuário sem cliente, nada.
+        """
+        if self.is_admin:
+            return queryset
+        if self.tipo_usuario not in roles or self.cliente_id is None:
+            return queryset.none()
+        return queryset.filter(**{f"{lookup}_id": self.cliente_id})
+
+    def build_user(self):
+        """Usuário montado do cache (sem consulta), com ``user.cliente`` já carregado."""
+        user = _from_db(get_user_model(), self.user_fields)
+        if self.cliente_fields is not None:
+            user._meta.get_field('cliente').set_cached_value(user, _from_db(Cliente, self.cliente_fields))
+        user._principal = self
+        # Valores do cache: o pre_save relê do banco as colunas que ninguém alterou
+        user._campos_do_cache = dict(self.user_fields)
+        return user
+
+
+def build_principal(user) -> Principal:
+    """Principal a partir do usuário (uma consulta para as instâncias do cliente)."""
+    cliente_id = getattr(user, 'cliente_id', None)
+    instance_ids = ()
+    if cliente_id is not None:
+        instance_ids = tuple(
+            WhatsappInstance.objects.filter(cliente_id=cliente_id).order_by('pk').values_list('instance_id', flat=True)
+        )
+    cliente = user._meta.get_field('cliente').get_cached_value(user, None) if cliente_id is not None else None
+    if cliente is None and cliente_id is not None:
+        cliente = Cliente.objects.filter(pk=cliente_id).first()
+    return Principal(
+        user_id=user.pk,
+        tipo_usuario=getattr(user, 'tipo_usuario', '') or '',
+        is_superuser=user.is_superuser,
+        is_active=user.is_active,
+        cliente_id=cliente_id,
+        instance_ids=instance_ids,
+        user_fields=_campos(user, excluir=('password',)),
+        cliente_fields=_campos(cliente) if cliente is not None else None,
+    )
+
+
+def get_principal(user_id, user=None) -> Optional[Principal]:
+    """
+    Principal do usuário ``user_id`` (cache; monta e guarda se faltar).
+    ``user``, se já carregado, evita a consulta do usuário. None se não existir.
+    """
+    key = _cache_key(user_id, _version(user_id))
+    principal = cache.get(key)
+    if principal is not None:
+        return principal
+
+    if user is None:
+        user = get_user_model().objects.filter(pk=user_id).first()
+        if user is None:
+            return None
+    principal = build_principal(user)
+    cache.set(key, principal, _get_setting('PRINCIPAL_CACHE_TTL', 300))
+    return principal
+
+
+def principal_for(user) -> Optional[Principal]:
+    """Principal do usuário da requisição (o da autenticação ou do cache); None se anônimo."""
+    if user is None or not user.is_authenticated:
+        return None
+    principal = getattr(user, '_principal', None)
+    if principal is None:
+        principal = get_principal(user.pk, user=user)
+        user._principal = principal
+    return principal
+
+
+def invalidate_user(user_id) -> None:
+    """Nova versão do principal; a entrada atual é removida (a versão pode sair do cache)."""
+    version_key = _version_key(user_id)
+    version = _version(user_id)
+    cache.delete(_cache_key(user_id, version))
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        cache.set(version_key, version + 1, None)
+
+
+def _invalidate_after_commit(user_ids) -> None:
+    # Só depois do commit: antes disso outra requisição remontaria o principal com o dado antigo
+    user_ids = list(user_ids)
+    transaction.on_commit(lambda: [invalidate_user(user_id) for user_id in user_ids])
+
+
+def _usuarios_do_cliente(cliente_id):
+    # Lidos já no sinal: ao excluir o cliente, o SET_NULL dos usuários vem antes do post_delete
+    return get_user_model().objects.filter(cliente_id=cliente_id).values_list('pk', flat=True)
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def _recarregar_usuario_do_cache(sender, instance, update_fields=None, **kwargs):
+    # Só o usuário montado por build_user. A senha fica adiada, então um save() comum
+    # chega aqui com update_fields = todos os campos carregados: esse caso também é relido.
+    # Um update_fields explícito e menor (ex.: last_login) grava só o que foi pedido.
+    campos = getattr(instance, '_campos_do_cache', None)
+    if campos is None:
+        return
+    if update_fields is not None:
+        carregados = {f.attname for f in sender._meta.concrete_fields if f.attname in campos and not f.primary_key}
+        if not carregados <= set(update_fields):
+            return
+    del instance._campos_do_cache
+    atual = sender._base_manager.filter(pk=instance.pk).values(*campos).first()
+    if atual is None:
+        return
+    for attname, valor in campos.items():
+        if getattr(instance, attname) == valor:
+            setattr(instance, attname, atual[attname])
+
+
+@receiver([post_save, post_delete], sender=settings.AUTH_USER_MODEL)
+def _usuario_alterado(sender, instance, **kwargs):
+    _invalidate_after_commit([instance.pk])
+
+
+@receiver([post_save, pre_delete], sender=Cliente)
+def _cliente_alterado(sender, instance, **kwargs):
+    _invalidate_after_commit(_usuarios_do_cliente(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=WhatsappInstance)
+def _instancia_alterada(sender, instance, **kwargs):
+    if instance.cliente_id is not None:
+        _invalidate_after_commit(_usuarios_do_cliente(instance.cliente_id))
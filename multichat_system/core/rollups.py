@@ -0,0 +1,154 @@
+"""
+Consolidação de mensagens por hora para os relatórios
+
+Cada mensagem nova soma 1 na linha de ``MessageRollup`` do seu
+(cliente, atendente do chat, dia, hora, tipo, direção), dentro da mesma
+ingestão (sinal ``post_save``, depois do commit). A importação de histórico
+usa ``bulk_create`` e chama ``record_messages`` com o lote inteiro. Excluir
+uma mensagem subtrai 1 do bucket (``post_delete``), com o atendente atual
+do chat.
+
+Os relatórios somam linhas da tabela com uma consulta por intervalo de
+``dia`` (indexado), então o custo não cresce com o número de mensagens.
+``rebuild`` recalcula um intervalo a partir de ``Mensagem`` (comando
+``consolidar_relatorios``), para a carga inicial ou para corrigir desvios.
+"""
+
+import logging
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import Iterable, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Greatest, TruncHour
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Chat, Mensagem, MessageRollup
+
+logger = logging.getLogger(__name__)
+
+# Conteúdo contado como satisfação do cliente no relatório
+SATISFACAO_MARCADOR = '👍'
+REBUILD_BATCH_SIZE = 1000
+
+
+def _bucket(data_envio: datetime):
+    local = timezone.localtime(data_envio)
+    return local.date(), local.hour
+
+
+def add_counts(cliente_id: int, atendente_id: Optional[int], dia: date, hora: int, tipo: str,
+               from_me: bool, total: int = 1, satisfacao: int = 0):
+    """Soma na linha do bucket, criando-a se ainda não existe."""
+    chave = {
+        'cliente_id': cliente_id, 'atendente_id': atendente_id, 'dia': dia,
+        'hora': hora, 'tipo': tipo, 'from_me': from_me,
+    }
+    incremento = {'total': F('total') + total, 'satisfacao': F('satisfacao') + satisfacao}
+    if MessageRollup.objects.filter(**chave).update(**incremento):
+        return
+    try:
+        with transaction.atomic():
+            MessageRollup.objects.create(total=total, satisfacao=satisfacao, **chave)
+    except IntegrityError:
+        # Outro processo criou a linha entre o UPDATE e o INSERT
+        MessageRollup.objects.filter(**chave).update(**incremento)
+
+
+def record_messages(chat, mensagens: Iterable[Mensagem]):
+    """Consolida um lote de mensagens do mesmo chat (um UPDATE/INSERT por bucket)."""
+    totais, satisfacao = Counter(), Counter()
+    for mensagem in mensagens:
+        chave = (*_bucket(mensagem.data_envio or timezone.now()), mensagem.tipo, mensagem.from_me)
+        totais[chave] += 1
+        if SATISFACAO_MARCADOR in (mensagem.conteudo or ''):
+            satisfacao[chave] += 1
+    for (dia, hora, tipo, from_me), total in totais.items():
+        add_counts(chat.cliente_id, chat.atendente_id, dia, hora, tipo, from_me,
+                   total=total, satisfacao=satisfacao[(dia, hora, tipo, from_me)])
+
+
+def record_message(mensagem: Mensagem):
+    record_messages(mensagem.chat, [mensagem])
+
+
+def remove_message(cliente_id: int, atendente_id: Optional[int], mensagem: Mensagem):
+    """Desconta a mensagem excluída do seu bucket (nunca abaixo de zero)."""
+    dia, hora = _bucket(mensagem.data_envio or timezone.now())
+    linha = MessageRollup.objects.filter(
+        cliente_id=cliente_id, atendente_id=atendente_id, dia=dia, hora=hora,
+        tipo=mensagem.tipo, from_me=mensagem.from_me, total__gt=0,
+    )
+    campos = {'total': F('total') - 1}
+    if SATISFACAO_MARCADOR in (mensagem.conteudo or ''):
+        campos['satisfacao'] = Greatest(F('satisfacao') - 1, 0)
+    linha.update(**campos)
+
+
+@receiver(post_save, sender=Mensagem, dispatch_uid='rollup_mensagem_criada')
+def _mensagem_criada(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        transaction.on_commit(lambda: record_message(instance))
+
+
+@receiver(post_delete, sender=Mensagem, dispatch_uid='rollup_mensagem_excluida')
+def _mensagem_excluida(sender, instance, **kwargs):
+    # Lido já no sinal: na exclusão em cascata o chat some em seguida
+    chat = Chat.objects.filter(pk=instance.chat_id).values('cliente_id', 'atendente_id').first()
+    if chat is not None:
+        transaction.on_commit(lambda: remove_message(chat['cliente_id'], chat['atendente_id'], instance))
+
+
+def _local_range(desde: date, ate: date):
+    tz = timezone.get_current_timezone()
+    inicio = timezone.make_aware(datetime.combine(desde, time.min), tz)
+    fim = timezone.make_aware(datetime.combine(ate + timedelta(days=1), time.min), tz)
+    return inicio, fim
+
+
+def rebuild(desde: date, ate: date, cliente_id: Optional[int] = None) -> int:
+    """Recalcula as linhas de ``desde`` a ``ate`` (inclusive) a partir das mensagens; retorna quantas gravou."""
+    inicio, fim = _local_range(desde, ate)
+    mensagens = Mensagem.objects.filter(data_envio__gte=inicio, data_envio__lt=fim)
+    existentes = MessageRollup.objects.filter(dia__range=(desde, ate))
+    if cliente_id is not None:
+        mensagens = mensagens.filter(chat__cliente_id=cliente_id)
+        existentes = existentes.filter(cliente_id=cliente_id)
+
+    linhas = (
+        mensagens.order_by()
+        .annotate(hora_local=TruncHour('data_envio', tzinfo=timezone.get_current_timezone()))
+        .values('chat__cliente_id', 'chat__atendente_id', 'hora_local', 'tipo', 'from_me')
+        .annotate(n=Count('id'), n_satisfacao=Count('id', filter=Q(conteudo__contains=SATISFACAO_MARCADOR)))
+    )
+    novas = [
+        MessageRollup(
+            cliente_id=linha['chat__cliente_id'],
+            atendente_id=linha['chat__atendente_id'],
+            dia=linha['hora_local'].date(),
+            hora=linha['hora_local'].hour,
+            tipo=linha['tipo'],
+            from_me=linha['from_me'],
+            total=linha['n'],
+            satisfacao=linha['n_satisfacao'],
+        )
+        for linha in linhas.iterator(chunk_size=REBUILD_BATCH_SIZE)
+    ]
+    with transaction.atomic():
+        existentes.delete()
+        MessageRollup.objects.bulk_create(novas, batch_size=REBUILD_BATCH_SIZE)
+    logger.info(f"📊 Consolidação {desde} a {ate}: {len(novas)} linhas")
+    return len(novas)
+
+
+def rollups_between(desde: date, ate: date, cliente_id=None, atendente_id=None):
+    """Linhas do intervalo (inclusive), já filtradas pelo escopo do relatório."""
+    linhas = MessageRollup.objects.filter(dia__range=(desde, ate))
+    if cliente_id:
+        linhas = linhas.filter(cliente_id=cliente_id)
+    if atendente_id:
+        linhas = linhas.filter(atendente_id=atendente_id)
+    return linhas
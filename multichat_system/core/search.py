@@ -0,0 +1,217 @@
+"""
+Busca textual nas mensagens de um cliente
+
+O índice é criado pela migração ``0021_mensagem_search_index`` conforme o banco:
+
+- SQLite (padrão): tabela FTS5 ``core_mensagem_fts`` com o texto pesquisável
+  (texto da mensagem, ou legenda/nome do arquivo quando o conteúdo é o JSON
+  da mídia), mantida por triggers em insert/update/delete, inclusive
+  ``bulk_create`` da importação de histórico;
+- PostgreSQL: índice GIN em ``to_tsvector('portuguese', ...)`` sobre a mesma
+  extração (função ``core_mensagem_texto_busca``);
+- MySQL: índice FULLTEXT na coluna gerada ``texto_busca`` (STORED, migração
+  ``0026_mensagem_busca_mysql``) com a mesma extração.
+
+``search`` devolve as mensagens por relevância, já filtradas pelo cliente,
+com um trecho destacado (``<mark>``) para a interface.
+"""
+
+import html
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+from django.db import connection
+
+from .models import Mensagem
+
+HIGHLIGHT_START = '<mark>'
+HIGHLIGHT_END = '</mark>'
+SNIPPET_TOKENS = 12
+# Marcadores devolvidos pelo banco, trocados por <mark> depois de escapar o HTML da mensagem
+_MARK_START, _MARK_END = '\x02', '\x03'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+# Campos pesquisáveis quando o conteúdo é o JSON da mídia (mesma extração do índice, migrações 0021 e 0026)
+MEDIA_TEXT_FIELDS = (
+    ('imageMessage', 'caption'), ('videoMessage', 'caption'),
+    ('documentMessage', 'fileName'), ('documentMessage', 'caption'),
+)
+
+
+def searchable_text(conteudo: Optional[str]) -> str:
+    """Texto indexado da mensagem: legenda/nome do arquivo se o conteúdo é o JSON da mídia."""
+    conteudo = conteudo or ''
+    if not conteudo.lstrip().startswith('{'):
+        return conteudo
+    try:
+        dados = json.loads(conteudo)
+    except ValueError:
+        return conteudo
+    if not isinstance(dados, dict):
+        return conteudo
+    partes = []
+    for tipo, campo in MEDIA_TEXT_FIELDS:
+        midia = dados.get(tipo)
+        if isinstance(midia, dict) and midia.get(campo):
+            partes.append(str(midia[campo]))
+    return ' '.join(partes)
+
+
+def _tokens(query: str) -> List[str]:
+    return TOKEN_RE.findall(query or '')
+
+
+def fts5_query(query: str) -> str:
+    """
+    Consulta FTS5 a partir do texto digitado: todos os termos (AND), o último
+    como prefixo (busca enquanto digita). Termos entre aspas para que
+    operadores/caracteres especiais do usuário não quebrem a sintaxe.
+    """
+    tokens = _tokens(query)
+    if not tokens:
+        return ''
+    termos = [f'"{token}"' for token in tokens]
+    termos[-1] += '*'
+    return ' '.join(termos)
+
+
+def _scope_sql(cliente_id: Optional[int], chat_id: Optional[str]) -> Tuple[str, list]:
+    where, params = [], []
+    if cliente_id is not None:
+        where.append('c.cliente_id = %s')
+        params.append(cliente_id)
+    if chat_id:
+        where.append('c.chat_id = %s')
+        params.append(chat_id)
+    return ''.join(f' AND {clause}' for clause in where), params
+
+
+def _search_sqlite(query: str, cliente_id, chat_id, limit: int, offset: int):
+    match = fts5_query(query)
+    if not match:
+        return 0, []
+    scope, scope_params = _scope_sql(cliente_id, chat_id)
+    base = f"""
+        FROM core_mensagem_fts
+        JOIN core_mensagem m ON m.id = core_mensagem_fts.rowid
+        JOIN core_chat c ON c.id = m.chat_id
+        WHERE core_mensagem_fts MATCH %s{scope}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) {base}", [match, *scope_params])
+        total = cursor.fetchone()[0]
+        # bm25 é menor para os mais relevantes; score positivo para a API
+        cursor.execute(
+            f"""SELECT m.id, -bm25(core_mensagem_fts), snippet(core_mensagem_fts, 0, %s, %s, '…', %s)
+                {base} ORDER BY bm25(core_mensagem_fts), m.id DESC LIMIT %s OFFSET %s""",
+            [_MARK_START, _MARK_END, SNIPPET_TOKENS, match, *scope_params, limit, offset],
+        )
+        return total, [(pk, score, _markup(trecho)) for pk, score, trecho in cursor.fetchall()]
+
+
+def _search_postgresql(query: str, cliente_id, chat_id, limit: int, offset: int):
+    if not _tokens(query):
+        return 0, []
+    scope, scope_params = _scope_sql(cliente_id, chat_id)
+    vector = "to_tsvector('portuguese', core_mensagem_texto_busca(m.conteudo))"
+    base = f"""
+        FROM core_mensagem m
+        JOIN core_chat c ON c.id = m.chat_id,
+             websearch_to_tsquery('portuguese', %s) q
+        WHERE {vector} @@ q{scope}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) {base}", [query, *scope_params])
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f"""SELECT m.id, ts_rank({vector}, q) AS score,
+                       ts_headline('portuguese', core_mensagem_texto_busca(m.conteudo), q, %s)
+                {base} ORDER BY score DESC, m.id DESC LIMIT %s OFFSET %s""",
+            [f'StartSel={_MARK_START},StopSel={_MARK_END},MaxWords={SNIPPET_TOKENS * 2},MinWords=5',
+             query, *scope_params, limit, offset],
+        )
+        return total, [(pk, score, _markup(trecho)) for pk, score, trecho in cursor.fetchall()]
+
+
+def _search_mysql(query: str, cliente_id, chat_id, limit: int, offset: int):
+    tokens = _tokens(query)
+    if not tokens:
+        return 0, []
+    scope, scope_params = _scope_sql(cliente_id, chat_id)
+    boolean_query = ' '.join(f'+{token}' for token in tokens[:-1]) + f' +{tokens[-1]}*'
+    base = f"""
+        FROM core_mensagem m
+        JOIN core_chat c ON c.id = m.chat_id
+        WHERE MATCH(m.texto_busca) AGAINST (%s IN BOOLEAN MODE){scope}
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) {base}", [boolean_query, *scope_params])
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f"""SELECT m.id, MATCH(m.texto_busca) AGAINST (%s IN NATURAL LANGUAGE MODE) AS score, m.texto_busca
+                {base} ORDER BY score DESC, m.id DESC LIMIT %s OFFSET %s""",
+            [' '.join(tokens), boolean_query, *scope_params, limit, offset],
+        )
+        return total, [(pk, score, highlight(texto, tokens)) for pk, score, texto in cursor.fetchall()]
+
+
+def _search_fallback(query: str, cliente_id, chat_id, limit: int, offset: int):
+    """Outros bancos: sem índice, icontains em todos os termos (sem ranking)."""
+    tokens = _tokens(query)
+    if not tokens:
+        return 0, []
+    queryset = Mensagem.objects.all()
+    if cliente_id is not None:
+        queryset = queryset.filter(chat__cliente_id=cliente_id)
+    if chat_id:
+        queryset = queryset.filter(chat__chat_id=chat_id)
+    for token in tokens:
+        queryset = queryset.filter(conteudo__icontains=token)
+    total = queryset.count()
+    rows = queryset.order_by('-data_envio', '-id').values_list('id', 'conteudo')[offset:offset + limit]
+    return total, [(pk, 0.0, highlight(searchable_text(conteudo), tokens)) for pk, conteudo in rows]
+
+
+BACKENDS = {
+    'sqlite': _search_sqlite,
+    'postgresql': _search_postgresql,
+    'mysql': _search_mysql,
+}
+
+
+def _markup(fragment: Optional[str]) -> str:
+    fragment = html.escape(fragment or '')
+    return fragment.replace(_MARK_START, HIGHLIGHT_START).replace(_MARK_END, HIGHLIGHT_END)
+
+
+def highlight(text: str, tokens: List[str], width: int = 160) -> str:
+    """Trecho em volta do primeiro termo encontrado, com os termos entre <mark> (HTML escapado)."""
+    text = text or ''
+    lowered = text.lower()
+    positions = [lowered.find(token.lower()) for token in tokens]
+    start = min((pos for pos in positions if pos >= 0), default=0)
+    begin = max(0, start - width // 3)
+    fragment = text[begin:begin + width]
+    fragment = html.escape(fragment)
+    if tokens:
+        pattern = '|'.join(re.escape(html.escape(token)) for token in sorted(set(tokens), key=len, reverse=True))
+        fragment = re.sub(f'({pattern})', rf'{HIGHLIGHT_START}\1{HIGHLIGHT_END}', fragment, flags=re.IGNORECASE)
+    return ('…' if begin else '') + fragment + ('…' if begin + width < len(text) else '')
+
+
+def search(query: str, cliente_id: Optional[int] = None, chat_id: Optional[str] = None,
+           limit: int = 20, offset: int = 0) -> Dict:
+    """
+    Busca ``query`` nas mensagens (``cliente_id`` None = todos os clientes).
+
+    Retorna ``{'count', 'results': [(Mensagem, score, trecho), ...]}`` por relevância.
+    """
+    backend = BACKENDS.get(connection.vendor, _search_fallback)
+    total, rows = backend(query, cliente_id, chat_id, limit, offset)
+    mensagens = Mensagem.objects.select_related('chat').in_bulk([pk for pk, _, _ in rows])
+    return {
+        'count': total,
+        'results': [(mensagens[pk], score, trecho) for pk, score, trecho in rows if pk in mensagens],
+    }
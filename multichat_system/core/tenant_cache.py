@@ -0,0 +1,170 @@
+"""
+Cache por cliente (tenant) sobre o cache compartilhado, com invalidação por geração
+
+As chaves levam o cliente e a geração atual dele
+(``tenant:<cliente>:g<geração>:<namespace>:<chave>``). ``invalidate_tenant``
+só incrementa a geração: todas as entradas antigas do cliente deixam de ser
+lidas de uma vez (O(1), sem listar chaves) e expiram sozinhas pelo TTL.
+
+Com o backend compartilhado (``CACHE_BACKEND`` nas settings) a invalidação e
+os acertos valem para todos os workers. Os contadores de acertos/faltas por
+namespace ficam no próprio cache (``get_stats``), como em ``core.file_links``,
+mas fora do caminho de leitura: cada processo acumula em memória e soma no
+cache a cada ``STATS_FLUSH_EVERY`` eventos ou ``STATS_FLUSH_SECONDS``.
+"""
+
+import hashlib
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from django.core.cache import cache
+
+CACHE_PREFIX = 'tenant'
+# Namespaces com métricas em get_stats
+MEDIA_URL = 'media_url'
+REALTIME = 'realtime'
+NAMESPACES = (MEDIA_URL, REALTIME)
+STATS_KEYS = ('hits', 'misses', 'sets')
+MISSING = object()
+# Contadores do processo levados ao cache a cada N eventos ou N segundos
+STATS_FLUSH_EVERY = 100
+STATS_FLUSH_SECONDS = 10
+
+_pending = Counter()
+_pending_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def _stats_key(namespace: str, name: str) -> str:
+    return f"{CACHE_PREFIX}:stats:{namespace}:{name}"
+
+
+def _incr(key: str, delta: int = 1):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Primeira ocorrência (ou expirou): add evita sobrescrever o incr de outro processo
+        if not cache.add(key, delta, None):
+            cache.incr(key, delta)
+
+
+def _count(namespace: str, name: str) -> None:
+    """Conta o evento em memória; o cache só é tocado quando o lote enche ou o tempo passa."""
+    with _pending_lock:
+        _pending[_stats_key(namespace, name)] += 1
+        pronto = (sum(_pending.values()) >= STATS_FLUSH_EVERY
+                  or time.monotonic() - _last_flush >= STATS_FLUSH_SECONDS)
+    if pronto:
+        flush_stats()
+
+
+def flush_stats() -> None:
+    """Soma no cache os contadores acumulados por este processo."""
+    global _last_flush
+    with _pending_lock:
+        lote = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+    for key, delta in lote.items():
+        _incr(key, delta)
+
+
+def _generation_key(cliente_id) -> str:
+    return f"{CACHE_PREFIX}:{cliente_id}:geracao"
+
+
+def generation(cliente_id) -> int:
+    geracao = cache.get(_generation_key(cliente_id))
+    if geracao is None:
+        # Começa pelo relógio: se o contador for descartado pelo backend, não volta
+        # para uma geração antiga cujas entradas ainda estejam no cache
+        cache.add(_generation_key(cliente_id), int(time.time()), None)
+        geracao = cache.get(_generation_key(cliente_id), 0)
+    return geracao
+
+
+def invalidate_tenant(cliente_id) -> None:
+    """Descarta de uma vez tudo que está em cache para o cliente."""
+    generation(cliente_id)
+    _incr(_generation_key(cliente_id))
+    _incr(_stats_key('all', 'invalidations'))
+
+
+class TenantCache:
+    """
+    Cache de um cliente com a geração lida uma vez (ex.: por requisição ou
+    serializer); uma invalidação feita depois só vale para o próximo escopo.
+    """
+
+    def __init__(self, cliente_id):
+        self.cliente_id = cliente_id
+        self.generation = generation(cliente_id)
+
+    def key(self, namespace: str, key: str) -> str:
+        chave = str(key)
+        if len(chave) > 150 or any(c.isspace() for c in chave):
+            # memcached: até 250 caracteres e sem espaços
+            chave = hashlib.sha256(chave.encode()).hexdigest()[:40]
+        return f"{CACHE_PREFIX}:{self.cliente_id}:g{self.generation}:{namespace}:{chave}"
+
+    def get(self, namespace: str, key: str, default: Any = None) -> Any:
+        valor = cache.get(self.key(namespace, key), MISSING)
+        _count(namespace, 'misses' if valor is MISSING else 'hits')
+        return default if valor is MISSING else valor
+
+    def set(self, namespace: str, key: str, value: Any, timeout: Optional[int] = None) -> None:
+        cache.set(self.key(namespace, key), value, timeout)
+        _count(namespace, 'sets')
+
+    def get_many(self, namespace: str, keys) -> Dict[str, Any]:
+        """Várias chaves em uma ida ao cache; devolve só as encontradas (pela chave original)."""
+        chaves = {self.key(namespace, key): key for key in keys}
+        encontrados = cache.get_many(list(chaves))
+        _count(namespace, 'hits' if encontrados else 'misses')
+        return {chaves[chave]: valor for chave, valor in encontrados.items()}
+
+    def set_many(self, namespace: str, values: Dict[str, Any], timeout: Optional[int] = None) -> None:
+        cache.set_many({self.key(namespace, key): value for key, value in values.items()}, timeout)
+        _count(namespace, 'sets')
+
+    def incr(self, namespace: str, key: str, delta: int = 1) -> int:
+        """Incremento atômico no backend compartilhado; a chave nasce com ``delta``."""
+        chave = self.key(namespace, key)
+        try:
+            return cache.incr(chave, delta)
+        except ValueError:
+            if cache.add(chave, delta, None):
+                return delta
+            return cache.incr(chave, delta)
+
+    def delete(self, namespace: str, key: str) -> None:
+        cache.delete(self.key(namespace, key))
+
+
+def get_stats() -> Dict:
+    """
+    Acertos, faltas e gravações por namespace, com a taxa de acerto (inclui o
+    que este processo ainda não levou ao cache; os outros entram no próximo lote).
+    """
+    flush_stats()
+    chaves = [_stats_key(ns, name) for ns in NAMESPACES for name in STATS_KEYS]
+    valores = cache.get_many(chaves + [_stats_key('all', 'invalidations')])
+    stats = {}
+    for ns in NAMESPACES:
+        item = {name: valores.get(_stats_key(ns, name), 0) for name in STATS_KEYS}
+        lookups = item['hits'] + item['misses']
+        item['hit_rate'] = round(item['hits'] / lookups, 4) if lookups else 0.0
+        stats[ns] = item
+    stats['invalidations'] = valores.get(_stats_key('all', 'invalidations'), 0)
+    return stats
+
+
+def reset_stats():
+    global _last_flush
+    with _pending_lock:
+        _pending.clear()
+        _last_flush = time.monotonic()
+    cache.delete_many([_stats_key(ns, name) for ns in NAMESPACES for name in STATS_KEYS]
+                      + [_stats_key('all', 'invalidations')])
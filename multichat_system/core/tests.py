@@ -1,3 +1,736 @@
-from django.test import TestCase
+import base64
+import json
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from array import array
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, transaction
+from django.test import Client, TestCase, override_settings
+from django.utils import timezone
+
+from core import dashboard, file_links, rollups, tenant_cache, thumbnails
+from core.audio_analysis import analyze_audio, store_audio_analysis
+from core.history_backfill import HistoryBackfill, claim_job, start_backfill
+from core.instance_status import (
+    acquire_poller_lock, get_cached_status, get_cliente_status, poll_instances, release_poller_lock, set_cached_status,
+)
+from core.locks import LockTimeout, host_lock, host_slot
+from core.media_fetch import MediaFetchError, SingleFlight, download_now, ensure_local
+from core.media_quota import enforce_quota
+from core.media_retry import record_failure
+from core.media_store import adopt_file, blob_path, collect_orphan_blobs
+from core.models import (
+    Chat, Cliente, HistoryBackfillJob, MediaFile, Mensagem, MessageRollup, ServiceLock, WhatsappInstance,
+)
+from core.search import highlight, searchable_text
+from core.transcoding import Transcoder, TranscodingError, WorkerPool
+from webhook.signals import REALTIME_MAX_UPDATES, get_realtime_updates, notify_realtime_update
+
+
+class ImportarMidiasSqliteTests(TestCase):
+    """Importação única dos media_database.db por instância para core.MediaFile."""
+
+    def setUp(self):
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        self.instancia = WhatsappInstance.objects.create(cliente=self.cliente, instance_id='INST-A', token='t')
+        self.chat = Chat.objects.create(cliente=self.cliente, chat_id='5511999990000')
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        pasta = Path(self.tmp.name) / f'cliente_{self.cliente.id}' / 'instance_INST-A'
+        pasta.mkdir(parents=True)
+        self.banco = pasta / 'media_database.db'
+        with sqlite3.connect(self.banco) as conn:
+            conn.execute('''
+                CREATE TABLE midias (
+                    id INTEGER PRIMARY KEY, message_id TEXT UNIQUE, sender_name TEXT, sender_id TEXT,
+                    chat_id TEXT, is_group BOOLEAN, from_me BOOLEAN, media_type TEXT, mimetype TEXT,
+                    file_path TEXT, file_sha256 TEXT, download_status TEXT, message_timestamp DATETIME
+                )
+            ''')
+            conn.executemany(
+                'INSERT INTO midias (message_id, sender_name, sender_id, chat_id, is_group, from_me, media_type,'
+                ' mimetype, file_path, file_sha256, download_status, message_timestamp)'
+                ' VALUES (?, ?, ?, ?, 0, 0, ?, ?, ?, ?, ?, ?)',
+                [
+                    ('M1', 'Ana', '5511999990000@c.us', '5511999990000@c.us', 'image', 'image/jpeg',
+                     '/tmp/a.jpg', 'abc', 'success', '2025-07-01 10:00:00'),
+                    ('M2', 'Ana', '5511999990000@c.us', '5511999990000@c.us', 'audio', 'audio/ogg',
+                     None, None, 'failed', None),
+                ]
+            )
+
+    def _importar(self, *args):
+        saida = StringIO()
+        call_command('importar_midias_sqlite', '--path', self.tmp.name, *args, stdout=saida)
+        return saida.getvalue()
+
+    def test_importa_e_liga_ao_chat(self):
+        self._importar()
+
+        imagem = MediaFile.objects.get(message_id='M1')
+        self.assertEqual((imagem.cliente, imagem.instance, imagem.chat), (self.cliente, self.instancia, self.chat))
+        self.assertEqual(imagem.file_sha256, 'abc')
+        self.assertIsNotNone(MediaFile.objects.get(message_id='M2').next_attempt_at)
+        self.assertFalse(self.banco.exists())
+        self.assertTrue(self.banco.with_name('media_database.db.importado').exists())
+
+    def test_reimportar_nao_duplica(self):
+        MediaFile.objects.create(cliente=self.cliente, instance=self.instancia, message_id='M1',
+                                 sender_name='Ana', sender_id='x', media_type='image', mimetype='image/jpeg',
+                                 download_status='pending')
+        self._importar('--keep')
+        self._importar('--keep')
+
+        self.assertEqual(MediaFile.objects.count(), 2)
+        # O registro gravado pelo webhook prevalece
+        self.assertEqual(MediaFile.objects.get(message_id='M1').download_status, 'pending')
+
+
+class TenantCacheTests(TestCase):
+    """Cache por cliente com invalidação por geração (core.tenant_cache)."""
+
+    def setUp(self):
+        cache.clear()
+        tenant_cache.reset_stats()
+        self.addCleanup(cache.clear)
+
+    def test_invalidacao_descarta_so_o_cliente(self):
+        tenant_cache.TenantCache(1).set(tenant_cache.MEDIA_URL, 'image_M1', '/media/a.jpg')
+        tenant_cache.TenantCache(2).set(tenant_cache.MEDIA_URL, 'image_M1', '/media/b.jpg')
+
+        tenant_cache.invalidate_tenant(1)
+
+        self.assertIsNone(tenant_cache.TenantCache(1).get(tenant_cache.MEDIA_URL, 'image_M1'))
+        self.assertEqual(tenant_cache.TenantCache(2).get(tenant_cache.MEDIA_URL, 'image_M1'), '/media/b.jpg')
+        stats = tenant_cache.get_stats()
+        self.assertEqual((stats['media_url']['hits'], stats['media_url']['misses']), (1, 1))
+        self.assertEqual((stats['media_url']['hit_rate'], stats['invalidations']), (0.5, 1))
+
+    def test_contadores_acumulam_no_processo_ate_o_lote(self):
+        tenant = tenant_cache.TenantCache(1)
+        chave = tenant_cache._stats_key(tenant_cache.MEDIA_URL, 'misses')
+        for _ in range(tenant_cache.STATS_FLUSH_EVERY - 1):
+            tenant.get(tenant_cache.MEDIA_URL, 'image_M1')
+        self.assertIsNone(cache.get(chave))
+
+        tenant.get(tenant_cache.MEDIA_URL, 'image_M1')
+        self.assertEqual(cache.get(chave), tenant_cache.STATS_FLUSH_EVERY)
+
+    def test_atualizacoes_em_tempo_real_por_cliente(self):
+        notify_realtime_update('new_message', '5511999990000', {'id': 1}, 1)
+        notify_realtime_update('new_message', '5511999990001', {'id': 2}, 2)
+
+        self.assertEqual([u['chat_id'] for u in get_realtime_updates(1)], ['5511999990000'])
+        self.assertEqual(len(get_realtime_updates()), 2)
+
+    def test_atualizacoes_concorrentes_nao_se_perdem(self):
+        def gravar(worker):
+            for i in range(20):
+                notify_realtime_update('new_message', f'{worker}-{i}', {}, 1)
+
+        threads = [threading.Thread(target=gravar, args=(worker,)) for worker in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({u['chat_id'] for u in get_realtime_updates(1)}), 80)
+
+    def test_anel_guarda_as_ultimas_atualizacoes_em_ordem(self):
+        for i in range(REALTIME_MAX_UPDATES + 30):
+            notify_realtime_update('new_message', str(i), {}, 1)
+
+        chats = [u['chat_id'] for u in get_realtime_updates(1)]
+        self.assertEqual(chats, [str(i) for i in range(30, REALTIME_MAX_UPDATES + 30)])
+
+
+class HistoryBackfillTests(TestCase):
+    """Um job de importação por instância, reivindicado de forma atômica (core.history_backfill)."""
+
+    def setUp(self):
+        cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        self.instancia = WhatsappInstance.objects.create(cliente=cliente, instance_id='INST-A', token='t')
+
+    def test_segundo_inicio_nao_roda_o_mesmo_job(self):
+        job, reivindicado = claim_job(self.instancia)
+        self.assertTrue(reivindicado)
+        self.assertEqual(job.status, 'running')
+
+        with mock.patch('core.history_backfill.HistoryBackfill.run') as run:
+            self.assertEqual(start_backfill(self.instancia, background=False), (job, False))
+            with self.assertRaises(CommandError):
+                call_command('backfill_history', instance_id='INST-A', stdout=StringIO())
+        run.assert_not_called()
+        self.assertEqual(HistoryBackfillJob.objects.count(), 1)
+
+    def test_job_pendente_conta_como_em_execucao(self):
+        HistoryBackfillJob.objects.create(cliente=self.instancia.cliente, instance=self.instancia)
+        self.assertFalse(claim_job(self.instancia)[1])
+
+    def test_cancelamento_depois_da_ultima_verificacao_prevalece(self):
+        job, _ = claim_job(self.instancia)
+
+        def cancelar_no_fim(executor):
+            HistoryBackfillJob.objects.filter(pk=job.pk).update(status='cancelled')
+            return False
+
+        backfill = HistoryBackfill(job)
+        with mock.patch.object(backfill, '_list_chats'), \
+                mock.patch.object(backfill, '_import_history', side_effect=cancelar_no_fim):
+            resultado = backfill.run()
+
+        self.assertEqual(resultado.status, 'cancelled')
+        self.assertEqual(HistoryBackfillJob.objects.get(pk=job.pk).status, 'cancelled')
+
+    def test_job_cancelado_pode_ser_retomado(self):
+        job, _ = claim_job(self.instancia)
+        HistoryBackfillJob.objects.filter(pk=job.pk).update(status='cancelled')
+        self.assertEqual(claim_job(self.instancia), (job, True))
+
+
+class PollerLockTests(TestCase):
+    """Um único poller de status, com o lock no banco (core.locks)."""
+
+    def test_segundo_poller_espera_ate_o_lock_vencer(self):
+        self.assertTrue(acquire_poller_lock('a', 30))
+        self.assertFalse(acquire_poller_lock('b', 30))
+        self.assertTrue(acquire_poller_lock('a', 30))
+
+        ServiceLock.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(acquire_poller_lock('b', 30))
+        self.assertFalse(acquire_poller_lock('a', 30))
+
+    def test_lock_cobre_o_intervalo_informado(self):
+        acquire_poller_lock('a', 600)
+        restante = ServiceLock.objects.get().expires_at - timezone.now()
+        self.assertGreater(restante, timedelta(seconds=1100))
+
+        release_poller_lock('a')
+        self.assertTrue(acquire_poller_lock('b', 30))
+
+    def test_ciclo_renova_o_lock_a_cada_instancia(self):
+        cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        for i in range(3):
+            WhatsappInstance.objects.create(cliente=cliente, instance_id=f'INST-{i}', token='t')
+        acquire_poller_lock('a', 30)
+        renovar = mock.Mock(side_effect=lambda: acquire_poller_lock('a', 30))
+
+        entrada = {'connected': True, 'status': 'conectado'}
+        with mock.patch('core.instance_status.refresh_instance_status', return_value=entrada) as refresh:
+            stats = poll_instances(renew_lock=renovar)
+        self.assertEqual((stats['total'], stats['interrompido'], refresh.call_count), (3, False, 3))
+        self.assertEqual(renovar.call_count, 3)
+
+    def test_ciclo_para_quando_outro_poller_assume(self):
+        cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        for i in range(3):
+            WhatsappInstance.objects.create(cliente=cliente, instance_id=f'INST-{i}', token='t')
+        acquire_poller_lock('a', 30)
+
+        def outro_assume(instance, **kwargs):
+            ServiceLock.objects.update(owner='b')
+            return {'connected': False, 'status': 'desconectado'}
+
+        with mock.patch('core.instance_status.refresh_instance_status', side_effect=outro_assume) as refresh:
+            stats = poll_instances(renew_lock=lambda: acquire_poller_lock('a', 30))
+        self.assertEqual((stats['total'], stats['interrompido'], refresh.call_count), (1, True, 1))
+
+
+class InstanceStatusCacheTests(TestCase):
+    """Leituras de status pelo cache, escrito pelo poller e pelos webhooks (core.instance_status)."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        self.primeira = WhatsappInstance.objects.create(cliente=self.cliente, instance_id='INST-A', token='t',
+                                                        status='desconectado')
+        self.segunda = WhatsappInstance.objects.create(cliente=self.cliente, instance_id='INST-B', token='t',
+                                                       status='desconectado')
+
+    def test_status_do_cliente_vem_do_cache_sem_chamar_a_wapi(self):
+        with mock.patch('api.wapi_integration.WApiIntegration') as wapi:
+            self.assertEqual(get_cliente_status(self.cliente), 'desconectado')
+            set_cached_status('INST-B', 'conectado')
+            self.assertEqual(get_cliente_status(self.cliente), 'conectado')
+        wapi.assert_not_called()
+        # O banco continua com o último status persistido
+        self.assertEqual(WhatsappInstance.objects.get(pk=self.segunda.pk).status, 'desconectado')
+
+    def test_webhook_de_conexao_escreve_no_cache(self):
+        client = Client()
+        for endpoint, esperado in (('/webhook/connect/', 'conectado'), ('/webhook/disconnect/', 'desconectado')):
+            response = client.post(endpoint, json.dumps({'instanceId': 'INST-A'}), content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            entrada = get_cached_status('INST-A')
+            self.assertEqual((entrada['status'], entrada['source']), (esperado, 'webhook'))
+            self.assertEqual(WhatsappInstance.objects.get(pk=self.primeira.pk).status, esperado)
+
+
+class HostLockTests(TestCase):
+    """Locks de arquivo entre os processos da máquina (core.locks)."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(MULTICHAT_SETTINGS={'LOCK_DIR': tmp.name})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_semaforo_limita_as_vagas(self):
+        with host_slot('ffmpeg', 2) as primeira, host_slot('ffmpeg', 2) as segunda:
+            self.assertEqual({primeira, segunda}, {0, 1})
+            with self.assertRaises(LockTimeout):
+                with host_slot('ffmpeg', 2, timeout=0.05):
+                    pass
+        with host_slot('ffmpeg', 2, timeout=0.05):
+            pass
+
+    def test_lock_por_chave(self):
+        with host_lock('media_fetch:M1'):
+            with self.assertRaises(LockTimeout):
+                with host_lock('media_fetch:M1', timeout=0.05):
+                    pass
+
+
+class TranscoderTests(TestCase):
+    """Cada áudio é convertido no máximo uma vez por perfil (core.transcoding)."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.raiz = Path(tmp.name)
+        override = override_settings(MULTICHAT_SETTINGS={
+            'TRANSCODE_CACHE_DIR': str(self.raiz / 'variants'), 'LOCK_DIR': str(self.raiz / 'locks'),
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+        self.origem = self.raiz / 'nota.ogg'
+        self.origem.write_bytes(b'OggS audio')
+
+    def _ffmpeg_falso(self, source_path, output_path, profile, timeout=None):
+        time.sleep(0.05)
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        Path(output_path).write_bytes(profile.encode())
+        return Path(output_path)
+
+    def test_conversao_unica_por_perfil(self):
+        transcoder = Transcoder(workers=2)
+        with mock.patch('core.transcoding.run_ffmpeg', side_effect=self._ffmpeg_falso) as ffmpeg:
+            futuros = [transcoder.submit(self.origem, 'mp3') for _ in range(5)]
+            caminhos = {futuro.result(timeout=5) for futuro in futuros}
+            caminhos.add(transcoder.transcode(self.origem, 'mp3', timeout=5))
+            aac = transcoder.transcode(self.origem, 'aac', timeout=5)
+
+        self.assertEqual(len(caminhos), 1)
+        self.assertEqual(sorted(c.args[2] for c in ffmpeg.call_args_list), ['aac', 'mp3'])
+        self.assertEqual(aac.read_bytes(), b'aac')
+        self.assertEqual((transcoder.stats['deduplicated'], transcoder.stats['cache_hits']), (4, 1))
+
+    def test_so_o_pool_do_ffmpeg_ocupa_vagas_da_maquina(self):
+        with mock.patch('core.transcoding.host_slot') as vaga:
+            self.assertEqual(WorkerPool(1).submit_call(lambda: 'download').result(timeout=5), 'download')
+            vaga.assert_not_called()
+            self.assertEqual(Transcoder(1).submit_call(lambda: 'ffmpeg').result(timeout=5), 'ffmpeg')
+            vaga.assert_called_once_with('ffmpeg', mock.ANY)
+
+
+class AudioAnalysisTests(TestCase):
+    """Duração e picos da forma de onda calculados na ingestão (core.audio_analysis)."""
+
+    def _wav(self, amostras, taxa=8000):
+        tmp = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
+        tmp.close()
+        self.addCleanup(Path(tmp.name).unlink)
+        with wave.open(tmp.name, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(taxa)
+            wav.writeframes(array('h', amostras).tobytes())
+        return tmp.name
+
+    def test_duracao_e_picos_do_wav(self):
+        # 1,5 s: metade com volume máximo, metade em silêncio
+        caminho = self._wav([32767, -32767] * 3000 + [0] * 6000)
+        resultado = analyze_audio(caminho, buckets=4)
+        self.assertEqual(resultado, {'duration_ms': 1500, 'peaks': [127, 127, 0, 0]})
+
+    def _ffmpeg_falso(self, script):
+        """Troca o ffmpeg por um processo Python que roda ``script``."""
+        popen = subprocess.Popen
+        return mock.patch('core.audio_analysis.subprocess.Popen',
+                          side_effect=lambda cmd, **kwargs: popen([sys.executable, '-c', script], **kwargs))
+
+    def test_stderr_volumoso_nao_trava_o_ffmpeg(self):
+        # 1 MB em stderr antes do áudio: com o pipe sem leitura o processo ficaria bloqueado
+        script = ("import sys; sys.stderr.write('x' * (1 << 20)); sys.stderr.flush(); "
+                  "sys.stdout.buffer.write(b'\\xff\\x7f' * 16000); sys.exit(1)")
+        with self._ffmpeg_falso(script), override_settings(MULTICHAT_SETTINGS={'TRANSCODE_TIMEOUT': 20}):
+            with self.assertRaisesMessage(TranscodingError, 'xxxx'):
+                analyze_audio('/tmp/audio.ogg')
+
+    def test_prazo_vale_durante_a_leitura(self):
+        # Processo que nunca termina a saída: o prazo precisa interromper a leitura do stdout
+        script = "import time; time.sleep(30)"
+        inicio = time.monotonic()
+        with self._ffmpeg_falso(script), override_settings(MULTICHAT_SETTINGS={'TRANSCODE_TIMEOUT': 1}):
+            with self.assertRaisesMessage(TranscodingError, 'excedeu 1s'):
+                analyze_audio('/tmp/audio.ogg')
+        self.assertLess(time.monotonic() - inicio, 10)
+
+    def test_resultado_gravado_na_mensagem_e_na_midia(self):
+        cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        instancia = WhatsappInstance.objects.create(cliente=cliente, instance_id='INST-A', token='t')
+        chat = Chat.objects.create(cliente=cliente, chat_id='5511999990000')
+        Mensagem.objects.create(chat=chat, remetente=chat.chat_id, conteudo='audio', tipo='audio', message_id='A1')
+        MediaFile.objects.create(cliente=cliente, instance=instancia, message_id='A1', sender_name='Ana',
+                                 sender_id='x', media_type='audio', mimetype='audio/ogg')
+
+        store_audio_analysis('A1', {'duration_ms': 2600, 'peaks': [10, 127]})
+
+        mensagem = Mensagem.objects.get(message_id='A1')
+        self.assertEqual((mensagem.audio_duration_ms, mensagem.audio_peaks), (2600, [10, 127]))
+        self.assertEqual(MediaFile.objects.get(message_id='A1').duration_seconds, 3)
+
+
+@skipUnless(thumbnails.Image, 'Pillow não instalado')
+class ThumbnailTests(TestCase):
+    """Miniaturas em tamanhos fixos, geradas uma vez (core.thumbnails)."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.original = Path(tmp.name) / 'msg_abc.jpg'
+        thumbnails.Image.new('RGB', (600, 400), 'red').save(self.original, 'JPEG')
+
+    def test_gera_so_os_tamanhos_menores_que_o_original(self):
+        criadas = thumbnails.generate_thumbnails(self.original)
+
+        self.assertEqual(sorted(p.name for p in criadas), [
+            'msg_abc_320.jpg', 'msg_abc_320.webp', 'msg_abc_96.jpg', 'msg_abc_96.webp',
+        ])
+        with thumbnails.Image.open(thumbnails.thumbnail_path(self.original, 320, 'webp')) as miniatura:
+            self.assertEqual(miniatura.size, (320, 213))
+        self.assertEqual(thumbnails.generate_thumbnails(self.original), [])
+
+    def test_tamanho_pedido_vira_o_menor_tamanho_fixo_que_cobre(self):
+        self.assertEqual([thumbnails.parse_size(v) for v in ('100', 'small', '2000', 'abc', None)],
+                         [320, 96, None, None, None])
+
+
+class BlobStoreTests(TestCase):
+    """Armazenamento por conteúdo (core.media_store): dedup e limpeza de blobs órfãos."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.raiz = Path(tmp.name)
+        override = override_settings(MULTICHAT_SETTINGS={'MEDIA_BLOB_DIR': str(self.raiz / 'blobs')})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        self.instancia = WhatsappInstance.objects.create(cliente=self.cliente, instance_id='INST-A', token='t')
+
+    def _arquivo(self, nome, conteudo=b'figurinha'):
+        caminho = self.raiz / 'chats' / nome
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        caminho.write_bytes(conteudo)
+        return caminho
+
+    def test_mesmo_conteudo_vira_um_blob(self):
+        primeiro = adopt_file(self._arquivo('a.webp'))
+        segundo = adopt_file(self._arquivo('b.webp'))
+
+        self.assertFalse(primeiro['deduplicated'])
+        self.assertTrue(segundo['deduplicated'])
+        self.assertEqual(len(list((self.raiz / 'blobs').glob('??/*'))), 1)
+
+    def test_limpeza_usa_as_referencias_do_banco(self):
+        # Sem hardlink (cópia), o blob tem um único link mesmo em uso
+        with mock.patch('core.media_store.os.link', side_effect=OSError):
+            chave = adopt_file(self._arquivo('a.webp'))['sha256']
+            orfao = adopt_file(self._arquivo('b.webp', b'outro conteudo'))['sha256']
+        MediaFile.objects.create(cliente=self.cliente, instance=self.instancia, message_id='M1', sender_name='Ana',
+                                 sender_id='x', media_type='sticker', mimetype='image/webp',
+                                 file_sha256=base64.b64encode(bytes.fromhex(chave)).decode(),
+                                 download_status='success')
+
+        self.assertEqual(collect_orphan_blobs(grace_seconds=0)['removed'], 1)
+        self.assertTrue(blob_path(chave).exists())
+        self.assertFalse(blob_path(orfao).exists())
+
+
+class MediaQuotaTests(TestCase):
+    """Cota por cliente: remove do disco as menos usadas e baixa de novo no acesso (core.media_quota)."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.raiz = Path(tmp.name)
+        override = override_settings(MULTICHAT_SETTINGS={
+            'MEDIA_BLOB_DIR': str(self.raiz / 'blobs'), 'LOCK_DIR': str(self.raiz / 'locks'),
+        })
+        override.enable()
+        self.addCleanup(override.disable)
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com', media_quota_bytes=150)
+        instancia = WhatsappInstance.objects.create(cliente=self.cliente, instance_id='INST-A', token='t')
+        agora = timezone.now()
+        self.media = {}
+        for nome, acesso in (('antiga', agora - timedelta(days=2)), ('recente', agora)):
+            caminho = self.raiz / 'chats' / f'{nome}.ogg'
+            caminho.parent.mkdir(parents=True, exist_ok=True)
+            caminho.write_bytes(b'a' * 100)
+            self.media[nome] = MediaFile.objects.create(
+                cliente=self.cliente, instance=instancia, message_id=nome, sender_name='Ana', sender_id='x',
+                media_type='audio', mimetype='audio/ogg', media_key='k', direct_path=f'/d/{nome}',
+                file_path=str(caminho), file_size=100, download_status='success', last_accessed_at=acesso,
+            )
+
+    def test_remove_a_menos_usada_e_mantem_os_metadados(self):
+        resultado = enforce_quota(self.cliente)
+
+        self.assertEqual((resultado['evicted'], resultado['usage']), (1, 100))
+        antiga = MediaFile.objects.get(message_id='antiga')
+        self.assertEqual((antiga.download_status, antiga.media_key, antiga.direct_path), ('expired', 'k', '/d/antiga'))
+        self.assertFalse(Path(antiga.file_path).exists())
+        self.assertEqual(MediaFile.objects.get(message_id='recente').download_status, 'success')
+
+    def test_acesso_depois_da_remocao_baixa_de_novo(self):
+        enforce_quota(self.cliente)
+        antiga = MediaFile.objects.get(message_id='antiga')
+
+        def baixar(instance_id, media_key, pedir_link, gravar):
+            Path(antiga.file_path).write_bytes(b'b' * 100)
+
+        with mock.patch('core.media_fetch.file_links.download_with_link', side_effect=baixar) as download, \
+                mock.patch('core.media_quota.schedule_quota_check'):
+            caminho = ensure_local(antiga)
+
+        self.assertEqual(download.call_count, 1)
+        self.assertEqual((str(caminho), caminho.read_bytes()), (antiga.file_path, b'b' * 100))
+        self.assertEqual(MediaFile.objects.get(message_id='antiga').download_status, 'success')
+
+
+class FileLinkCacheTests(TestCase):
+    """fileLink da W-API reaproveitado até pouco antes de expirar (core.file_links)."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.pedidos = []
+
+    def _pedir_link(self, expires=None):
+        def pedir():
+            self.pedidos.append(1)
+            return f'https://wapi/file/{len(self.pedidos)}', expires or time.time() + 3600
+        return pedir
+
+    def test_um_pedido_a_w_api_para_varios_downloads(self):
+        baixados = [file_links.download_with_link('INST-A', 'chave', self._pedir_link(), lambda link: link)
+                    for _ in range(3)]
+
+        self.assertEqual(baixados, ['https://wapi/file/1'] * 3)
+        self.assertEqual(len(self.pedidos), 1)
+        self.assertEqual(file_links.get_stats()['hits'], 2)
+
+    def test_link_recusado_pede_outro(self):
+        file_links.store('INST-A', 'chave', 'https://wapi/file/revogado', time.time() + 3600)
+
+        def baixar(link):
+            if link.endswith('revogado'):
+                raise MediaFetchError('403')
+            return link
+
+        self.assertEqual(file_links.download_with_link('INST-A', 'chave', self._pedir_link(), baixar),
+                         'https://wapi/file/1')
+        self.assertEqual(file_links.get_cached('INST-A', 'chave'), 'https://wapi/file/1')
+
+    def test_link_perto_de_expirar_nao_vai_para_o_cache(self):
+        self.assertFalse(file_links.store('INST-A', 'chave', 'https://wapi/file/1', time.time() + 30))
+        self.assertIsNone(file_links.get_cached('INST-A', 'chave'))
+
+
+class LazyFetchTests(TestCase):
+    """Download sob demanda deduplicado no processo e entre workers (core.media_fetch)."""
+
+    def test_chamadas_simultaneas_compartilham_o_download(self):
+        voo = SingleFlight()
+        chamadas = []
+
+        def baixar():
+            chamadas.append(1)
+            time.sleep(0.05)
+            return '/media/a.ogg'
+
+        resultados = []
+        threads = [threading.Thread(target=lambda: resultados.append(voo.do('M1', baixar, timeout=5)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual((len(chamadas), resultados), (1, ['/media/a.ogg'] * 5))
+        self.assertFalse(voo.in_flight('M1'))
+
+    def test_reaproveita_o_que_outro_worker_baixou(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        override = override_settings(MULTICHAT_SETTINGS={'LOCK_DIR': tmp.name})
+        override.enable()
+        self.addCleanup(override.disable)
+        arquivo = Path(tmp.name) / 'a.ogg'
+        arquivo.write_bytes(b'audio')
+        cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        instancia = WhatsappInstance.objects.create(cliente=cliente, instance_id='INST-A', token='t')
+        media = MediaFile.objects.create(cliente=cliente, instance=instancia, message_id='M1', sender_name='Ana',
+                                         sender_id='x', media_type='audio', mimetype='audio/ogg',
+                                         media_key='k', direct_path='/d', download_status='pending')
+        # Outro worker terminou o download depois que este leu o registro
+        MediaFile.objects.filter(pk=media.pk).update(download_status='success', file_path=str(arquivo))
+
+        with mock.patch('core.media_fetch.fetch_media') as fetch_media:
+            self.assertEqual(download_now(media), arquivo)
+        fetch_media.assert_not_called()
+
+
+class MediaRetryTests(TestCase):
+    """Novas tentativas de download (core.media_retry) a partir de um acesso que falhou."""
+
+    def setUp(self):
+        cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        instancia = WhatsappInstance.objects.create(cliente=cliente, instance_id='INST-A', token='t')
+        self.media = {
+            status: MediaFile.objects.create(
+                cliente=cliente, instance=instancia, message_id=f'M-{status}', sender_name='Ana', sender_id='x',
+                media_type='audio', mimetype='audio/ogg', media_key='k', direct_path='/d',
+                file_path=f'/nao/existe/{status}.ogg', download_status=status,
+            )
+            for status in ('pending', 'expired')
+        }
+
+    def _acessar(self, status, erro):
+        with mock.patch('core.media_fetch.download_now', side_effect=erro):
+            self.assertIsNone(ensure_local(self.media[status]))
+        return MediaFile.objects.get(pk=self.media[status].pk)
+
+    def test_falha_transitoria_agenda_nova_tentativa(self):
+        media = self._acessar('pending', MediaFetchError('W-API respondeu 503'))
+        self.assertEqual((media.download_status, media.download_attempts), ('failed', 1))
+        self.assertIsNotNone(media.next_attempt_at)
+
+    def test_erro_permanente_encerra_as_tentativas(self):
+        media = self._acessar('pending', MediaFetchError('W-API respondeu 404', permanent=True))
+        self.assertEqual(media.download_status, 'failed')
+        self.assertIsNone(media.next_attempt_at)
+
+    def test_removida_pela_cota_nao_volta_para_a_fila(self):
+        media = self._acessar('expired', MediaFetchError('W-API respondeu 503'))
+        self.assertEqual(media.download_status, 'expired')
+        self.assertIsNone(media.next_attempt_at)
+        self.assertIsNone(record_failure(media, MediaFetchError('de novo')))
+
+
+class DashboardSnapshotTests(TestCase):
+    """Resumo do dashboard em cache mantido por contadores (core.dashboard)."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        self.chat = Chat.objects.create(cliente=self.cliente, chat_id='5511999990000', status='active')
+
+    def _mensagem(self, n, tipo='text'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Mensagem.objects.create(chat=self.chat, remetente='x', conteudo=f'm{n}', tipo=tipo,
+                                           message_id=f'M{n}')
+
+    def test_contadores_batem_com_o_banco(self):
+        dashboard.get_snapshot(self.cliente.id)
+        for n in range(3):
+            self._mensagem(n)
+        self._mensagem(3, 'audio')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chat.status = 'closed'
+            self.chat.save()
+
+        em_cache = dashboard.get_snapshot(self.cliente.id)
+        banco = dashboard.compute_snapshot(self.cliente.id)
+        for secao in ('resumo', 'chats', 'atividade_recente', 'tipos_mensagem'):
+            self.assertEqual(em_cache[secao], banco[secao])
+
+    def test_mensagem_antiga_fora_da_janela_de_24h(self):
+        dashboard.get_snapshot(self.cliente.id)
+        dashboard.record_message(self.cliente.id, 'text', timezone.now() - timedelta(days=3))
+
+        snapshot = dashboard.get_snapshot(self.cliente.id)
+        self.assertEqual(snapshot['resumo']['total_mensagens'], 1)
+        self.assertEqual(snapshot['atividade_recente']['mensagens_24h'], 0)
+
+
+class MessageRollupTests(TestCase):
+    """Consolidação por hora (core.rollups) igual à contagem direta das mensagens."""
+
+    def setUp(self):
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        self.chat = Chat.objects.create(cliente=self.cliente, chat_id='5511999990000')
+
+    def _criar(self, n, **campos):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Mensagem.objects.create(chat=self.chat, remetente='x', message_id=f'M{n}',
+                                           **{'conteudo': f'm{n}', **campos})
+
+    def _por_tipo(self):
+        linhas = rollups.rollups_between(timezone.localdate() - timedelta(days=1), timezone.localdate(),
+                                         cliente_id=self.cliente.id)
+        return {(l.tipo, l.from_me): (l.total, l.satisfacao) for l in linhas if l.total}
+
+    def _contagem_direta(self):
+        contagem = {}
+        for m in Mensagem.objects.filter(chat__cliente=self.cliente):
+            total, satisfacao = contagem.get((m.tipo, m.from_me), (0, 0))
+            contagem[(m.tipo, m.from_me)] = (total + 1, satisfacao + (rollups.SATISFACAO_MARCADOR in m.conteudo))
+        return contagem
+
+    def test_contagem_igual_as_mensagens(self):
+        for n in range(3):
+            self._criar(n)
+        self._criar(3, conteudo='👍 obrigado', from_me=False)
+        self._criar(4, tipo='audio', from_me=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            Mensagem.objects.get(message_id='M3').delete()
+
+        self.assertEqual(self._por_tipo(), self._contagem_direta())
+        self.assertEqual(MessageRollup.objects.filter(atendente__isnull=True).count(), 2)
+
+    def test_linha_sem_atendente_unica_por_bucket(self):
+        chave = {'cliente': self.cliente, 'atendente': None, 'dia': timezone.localdate(), 'hora': 10,
+                 'tipo': 'text', 'from_me': False}
+        MessageRollup.objects.create(**chave)
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                MessageRollup.objects.create(**chave)
+
+
+class SearchTextTests(TestCase):
+    """Trecho destacado sobre o mesmo texto que o índice da busca usa."""
+
+    def test_json_de_midia_usa_legenda_e_nome_do_arquivo(self):
+        conteudo = '{"documentMessage": {"fileName": "contrato.pdf", "caption": "segue o contrato", "url": "https://x"}}'
+        self.assertEqual(searchable_text(conteudo), 'contrato.pdf segue o contrato')
+        self.assertNotIn('https', highlight(searchable_text(conteudo), ['contrato']))
+
+    def test_texto_simples_fica_como_esta(self):
+        self.assertEqual(searchable_text('{não é json'), '{não é json')
+        self.assertEqual(searchable_text('bom dia'), 'bom dia')
+        self.assertEqual(searchable_text(None), '')
@@ -0,0 +1,165 @@
+"""
+Miniaturas de imagens em tamanhos fixos (96/320/1024 px)
+
+Geradas depois do download, no pool de background (fora das vagas do ffmpeg) e gravadas
+em ``thumbs/`` ao lado do arquivo original:
+
+    .../chats/<chat>/image/msg_abc.jpg
+    .../chats/<chat>/image/thumbs/msg_abc_320.webp
+    .../chats/<chat>/image/thumbs/msg_abc_320.jpg
+
+Os endpoints de mídia escolhem a variante pelo parâmetro ``?size=`` (96,
+320, 1024 ou small/medium/large) e servem WebP quando o navegador aceita.
+Sem Pillow instalado as miniaturas ficam desativadas e o original é servido.
+"""
+
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+
+from .transcoding import PRIORITY_INGEST, PRIORITY_INTERACTIVE, get_background_pool
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow é opcional
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZES = (96, 320, 1024)
+SIZE_ALIASES = {'small': 96, 'medium': 320, 'large': 1024}
+FORMATS = {
+    'webp': {'ext': 'webp', 'pil': 'WEBP', 'content_type': 'image/webp', 'options': {'quality': 80, 'method': 4}},
+    'jpeg': {'ext': 'jpg', 'pil': 'JPEG', 'content_type': 'image/jpeg', 'options': {'quality': 82, 'optimize': True, 'progressive': True}},
+}
+THUMBS_DIR = 'thumbs'
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+def thumbnails_enabled() -> bool:
+    return Image is not None and _get_setting('THUMBNAILS_ENABLED', True)
+
+
+def thumbnail_path(original, size: int, fmt: str) -> Path:
+    original = Path(original)
+    return original.parent / THUMBS_DIR / f"{original.stem}_{size}.{FORMATS[fmt]['ext']}"
+
+
+def parse_size(value) -> Optional[int]:
+    """Converte ``?size=`` no menor tamanho fixo que cobre o pedido (None = original)."""
+    if not value:
+        return None
+    value = str(value).lower()
+    if value in SIZE_ALIASES:
+        return SIZE_ALIASES[value]
+    if not value.isdigit():
+        return None
+    requested = int(value)
+    for size in THUMBNAIL_SIZES:
+        if requested <= size:
+            return size
+    return None
+
+
+def _save_atomic(image, dest: Path, fmt: str):
+    spec = FORMATS[fmt]
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix='.thumb_', suffix=f".{spec['ext']}", dir=dest.parent)
+    os.close(fd)
+    try:
+        image.save(tmp, spec['pil'], **spec['options'])
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def generate_thumbnails(original, sizes=THUMBNAIL_SIZES, formats=('webp', 'jpeg'), force: bool = False) -> List[Path]:
+    """
+    Gera as miniaturas que faltam (uma decodificação do original para todas).
+
+    Tamanhos maiores que a própria imagem não são gerados: nesses casos o
+    original já serve.
+    """
+    if Image is None:
+        return []
+    original = Path(original)
+    targets = [(size, fmt) for size in sizes for fmt in formats
+               if force or not thumbnail_path(original, size, fmt).exists()]
+    if not targets:
+        return []
+
+    created = []
+    with Image.open(original) as source:
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+        longest = max(source.size)
+
+        # Do maior para o menor: cada redução parte da anterior (mais barato)
+        working = source
+        for size in sorted({size for size, _ in targets}, reverse=True):
+            if size >= longest:
+                continue
+            working = working.copy()
+            working.thumbnail((size, size), Image.LANCZOS)
+            for fmt in formats:
+                if (size, fmt) not in targets:
+                    continue
+                image = working
+                if FORMATS[fmt]['pil'] == 'JPEG' and image.mode != 'RGB':
+                    image = image.convert('RGB')
+                dest = thumbnail_path(original, size, fmt)
+                _save_atomic(image, dest, fmt)
+                created.append(dest)
+    return created
+
+
+def schedule_thumbnails(original, priority: int = PRIORITY_INGEST):
+    """Enfileira a geração no pool de background (None se desativado)."""
+    if not thumbnails_enabled():
+        return None
+    return get_background_pool().submit_call(generate_thumbnails, str(original), priority=priority)
+
+
+def _preferred_format(request) -> str:
+    accept = request.META.get('HTTP_ACCEPT', '')
+    return 'webp' if 'image/webp' in accept else 'jpeg'
+
+
+def sized_image(request, original) -> Tuple[Path, Optional[str]]:
+    """
+    Devolve (caminho, content_type) para servir a imagem no tamanho pedido.
+
+    Sem ``?size=`` (ou sem Pillow) devolve o original. Se a miniatura ainda
+    não existe, gera na hora com prioridade interativa.
+    """
+    original = Path(original)
+    params = getattr(request, 'query_params', None) or request.GET
+    size = parse_size(params.get('size'))
+    if size is None or not thumbnails_enabled():
+        return original, None
+
+    fmt = _preferred_format(request)
+    thumb = thumbnail_path(original, size, fmt)
+    if not thumb.exists():
+        try:
+            wait = _get_setting('TRANSCODE_INTERACTIVE_WAIT', 30)
+            get_background_pool().submit_call(
+                generate_thumbnails, str(original), priority=PRIORITY_INTERACTIVE
+            ).result(timeout=wait)
+        except Exception as e:
+            logger.warning(f"⚠️ Miniatura indisponível, servindo original: {e}")
+            return original, None
+    if not thumb.exists():
+        # Imagem menor que o tamanho pedido: o original já é a melhor opção
+        return original, None
+    return thumb, FORMATS[fmt]['content_type']
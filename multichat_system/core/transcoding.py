@@ -0,0 +1,340 @@
+"""
+Serviço de transcodificação de áudio (ffmpeg)
+
+- Pool fixo de workers, um ffmpeg por worker (padrão: número de CPUs), para
+  nunca ter mais conversões simultâneas do que núcleos. Cada worker da
+  aplicação (gunicorn/runserver) tem o seu pool, então as tarefas também
+  ocupam uma vaga do semáforo da máquina (``TRANSCODE_HOST_SLOTS``, padrão:
+  número de CPUs; core.locks.host_slot): somando todos os processos, a
+  máquina nunca roda mais ffmpeg do que isso.
+- Fila com prioridade: reprodução interativa passa na frente da ingestão e
+  dos comandos de backfill.
+- Downloads, miniaturas (Pillow) e a cota de mídia não rodam ffmpeg: vão
+  para outro pool (``get_background_pool``, ``BACKGROUND_WORKERS``) e não
+  ocupam as vagas do ffmpeg.
+- Cache de variantes em disco, chaveado por SHA-256 do arquivo de origem +
+  perfil de saída: cada nota de voz é convertida no máximo uma vez e
+  pedidos simultâneos do mesmo arquivo/perfil compartilham a mesma conversão.
+"""
+
+import hashlib
+import itertools
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import Future
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+
+from .locks import host_slot
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_INGEST = 5
+PRIORITY_BACKFILL = 10
+
+PROFILES: Dict[str, Dict] = {
+    'mp3': {
+        'ext': 'mp3',
+        'content_type': 'audio/mpeg',
+        'args': ['-vn', '-acodec', 'libmp3lame', '-ab', '128k', '-ar', '44100'],
+    },
+    'aac': {
+        'ext': 'm4a',
+        'content_type': 'audio/mp4',
+        'args': ['-vn', '-acodec', 'aac', '-ab', '96k', '-movflags', '+faststart'],
+    },
+}
+
+# Formatos que nem todo navegador toca (Safari/iOS antigos não tocam OGG/Opus)
+OPUS_EXTENSIONS = ('.ogg', '.opus', '.oga')
+
+
+class TranscodingError(Exception):
+    """Falha do ffmpeg (código de saída, timeout ou ffmpeg ausente)."""
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+def get_variants_dir() -> Path:
+    return Path(_get_setting('TRANSCODE_CACHE_DIR', None) or Path(settings.MEDIA_ROOT) / 'variants')
+
+
+@lru_cache(maxsize=4096)
+def _hash_file(path: str, size: int, mtime_ns: int) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def source_hash(source_path) -> str:
+    """SHA-256 do arquivo; memorizado por (caminho, tamanho, mtime)."""
+    stat = os.stat(source_path)
+    return _hash_file(str(source_path), stat.st_size, stat.st_mtime_ns)
+
+
+def variant_path(source_path, profile: str) -> Path:
+    digest = source_hash(source_path)
+    return get_variants_dir() / digest[:2] / f"{digest}_{profile}.{PROFILES[profile]['ext']}"
+
+
+def cached_variant(source_path, profile: str) -> Optional[Path]:
+    """Variante já convertida, se existir (não enfileira nada)."""
+    path = variant_path(source_path, profile)
+    return path if path.exists() else None
+
+
+def run_ffmpeg(source_path, output_path, profile: str, timeout: int = None) -> Path:
+    """Executa o ffmpeg gravando num temporário e renomeando no fim (atômico)."""
+    spec = PROFILES[profile]
+    timeout = timeout or _get_setting('TRANSCODE_TIMEOUT', 120)
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.transcode_', suffix=f".{spec['ext']}", dir=output_path.parent)
+    os.close(fd)
+
+    cmd = ['ffmpeg', '-nostdin', '-hide_banner', '-loglevel', 'error', '-y',
+           '-i', str(source_path), *spec['args'], tmp_path]
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=timeout)
+        if result.returncode != 0:
+            raise TranscodingError(result.stderr.decode('utf-8', 'replace').strip()[-500:] or 'ffmpeg falhou')
+        os.replace(tmp_path, output_path)
+        return output_path
+    except FileNotFoundError:
+        raise TranscodingError('ffmpeg não encontrado no PATH')
+    except subprocess.TimeoutExpired:
+        raise TranscodingError(f"ffmpeg excedeu {timeout}s")
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+class WorkerPool:
+    """Pool fixo de threads com fila de prioridade (tarefas com ``key`` são deduplicadas)."""
+
+    name = 'background'
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or 1
+        self._queue: 'queue.PriorityQueue' = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._inflight: Dict[str, Tuple[Future, int, Callable]] = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"{self.name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"🎛️ Pool {self.name} iniciado com {self.workers} workers")
+
+    def _execute(self, func):
+        return func()
+
+    def _worker(self):
+        while True:
+            _, _, key, func, future = self._queue.get()
+            try:
+                with self._lock:
+                    # Entrada duplicada de um job promovido que já foi executado
+                    if future.running() or future.done():
+                        continue
+                    if not future.set_running_or_notify_cancel():
+                        self._inflight.pop(key, None)
+                        continue
+                try:
+                    future.set_result(self._execute(func))
+                except Exception as e:
+                    future.set_exception(e)
+                finally:
+                    if key is not None:
+                        with self._lock:
+                            self._inflight.pop(key, None)
+            finally:
+                self._queue.task_done()
+
+    def submit_call(self, func, *args, priority: int = PRIORITY_INGEST, **kwargs) -> Future:
+        """Enfileira ``func(*args, **kwargs)`` com a prioridade informada."""
+        future: Future = Future()
+        with self._lock:
+            self._ensure_started()
+            self._queue.put((priority, next(self._counter), None, lambda: func(*args, **kwargs), future))
+        return future
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+
+class Transcoder(WorkerPool):
+    """Pool do ffmpeg: cada tarefa ocupa uma vaga da máquina; conversões deduplicadas por variante."""
+
+    name = 'transcoder'
+
+    def __init__(self, workers: int = None):
+        super().__init__(workers or _get_setting('TRANSCODE_WORKERS', 0) or os.cpu_count() or 1)
+        self.host_slots = _get_setting('TRANSCODE_HOST_SLOTS', 0) or os.cpu_count() or 1
+        self.stats = {'cache_hits': 0, 'transcoded': 0, 'failed': 0, 'deduplicated': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name: str):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _execute(self, func):
+        # Vaga da máquina: o limite vale para os pools de todos os processos
+        with host_slot('ffmpeg', self.host_slots):
+            return func()
+
+    def _run_variant(self, source_path, output_path, profile):
+        try:
+            run_ffmpeg(source_path, output_path, profile)
+        except Exception as e:
+            self._count('failed')
+            logger.error(f"❌ Erro ao converter {source_path} ({profile}): {e}")
+            raise
+        self._count('transcoded')
+        return output_path
+
+    def submit_call(self, func, *args, priority: int = PRIORITY_INGEST, **kwargs) -> Future:
+        """
+        Enfileira outra tarefa que roda ffmpeg (análise de áudio, prévias de vídeo/PDF).
+
+        Divide os mesmos workers e vagas com as conversões; downloads, Pillow e
+        consultas ao banco vão para ``get_background_pool()``.
+        """
+        return super().submit_call(func, *args, priority=priority, **kwargs)
+
+    def submit(self, source_path, profile: str = 'mp3', priority: int = PRIORITY_INTERACTIVE) -> Future:
+        """
+        Enfileira a conversão (ou devolve a variante em cache já resolvida).
+
+        Se a mesma variante já estiver na fila, devolve o mesmo Future; um
+        pedido com prioridade maior promove o job já enfileirado.
+        """
+        if profile not in PROFILES:
+            raise ValueError(f"Perfil de transcodificação desconhecido: {profile}")
+
+        output_path = variant_path(source_path, profile)
+        future: Future = Future()
+        if output_path.exists():
+            self._count('cache_hits')
+            future.set_result(output_path)
+            return future
+
+        key = str(output_path)
+        with self._lock:
+            self._ensure_started()
+            existing = self._inflight.get(key)
+            if existing is not None:
+                self._count('deduplicated')
+                future, queued_priority, task = existing
+                if priority < queued_priority and not future.running():
+                    # Promove: reenfileira com a prioridade maior; quem sair primeiro executa
+                    self._inflight[key] = (future, priority, task)
+                    self._queue.put((priority, next(self._counter), key, task, future))
+                return future
+            task = lambda: self._run_variant(source_path, output_path, profile)
+            self._inflight[key] = (future, priority, task)
+            self._queue.put((priority, next(self._counter), key, task, future))
+        return future
+
+    def transcode(self, source_path, profile: str = 'mp3', priority: int = PRIORITY_INTERACTIVE,
+                  timeout: float = None) -> Path:
+        """Versão bloqueante de ``submit``; devolve o caminho da variante."""
+        return self.submit(source_path, profile, priority).result(timeout=timeout)
+
+
+_transcoder: Optional[Transcoder] = None
+_background: Optional[WorkerPool] = None
+_transcoder_lock = threading.Lock()
+
+
+def get_transcoder() -> Transcoder:
+    """Instância única por processo."""
+    global _transcoder
+    with _transcoder_lock:
+        if _transcoder is None:
+            _transcoder = Transcoder()
+        return _transcoder
+
+
+def get_background_pool() -> WorkerPool:
+    """Pool do processo para downloads, miniaturas (Pillow) e cota: não ocupa vagas do ffmpeg."""
+    global _background
+    with _transcoder_lock:
+        if _background is None:
+            _background = WorkerPool(_get_setting('BACKGROUND_WORKERS', 4))
+        return _background
+
+
+def transcode_to_file(source_path, output_path, profile: str = 'mp3',
+                      priority: int = PRIORITY_INGEST, timeout: float = None) -> Path:
+    """Converte via pool/cache e materializa a variante em ``output_path`` (hardlink ou cópia)."""
+    variant = get_transcoder().transcode(source_path, profile, priority, timeout)
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    if output_path.exists():
+        output_path.unlink()
+    try:
+        os.link(variant, output_path)
+    except OSError:
+        shutil.copyfile(variant, output_path)
+    return output_path
+
+
+def browser_needs_mp3(request) -> bool:
+    """
+    Decide se o cliente precisa da variante MP3 de um áudio OGG/Opus.
+
+    ``?format=mp3`` força; ``?format=original`` desativa. Sem parâmetro,
+    usa o Accept e o User-Agent (Safari/iOS não tocam OGG/Opus).
+    """
+    params = getattr(request, 'query_params', None) or request.GET
+    requested = (params.get('format') or '').lower()
+    if requested in ('mp3', 'mpeg'):
+        return True
+    if requested in ('original', 'ogg', 'opus'):
+        return False
+
+    accept = request.META.get('HTTP_ACCEPT', '').lower()
+    if 'audio/ogg' in accept or 'audio/opus' in accept or 'audio/webm' in accept:
+        return False
+    user_agent = request.META.get('HTTP_USER_AGENT', '')
+    is_safari = 'Safari' in user_agent and not any(token in user_agent for token in ('Chrome', 'Chromium', 'Android'))
+    is_ios = any(token in user_agent for token in ('iPhone', 'iPad', 'iPod'))
+    return is_safari or is_ios
+
+
+def playable_audio(request, file_path) -> Tuple[Path, Optional[str]]:
+    """
+    Devolve (caminho, content_type) a servir para um áudio.
+
+    Para OGG/Opus em navegadores sem suporte, converte (prioridade interativa)
+    e devolve a variante MP3 em cache. Se a conversão falhar, serve o original.
+    """
+    file_path = Path(file_path)
+    if file_path.suffix.lower() not in OPUS_EXTENSIONS or not browser_needs_mp3(request):
+        return file_path, None
+    try:
+        wait = _get_setting('TRANSCODE_INTERACTIVE_WAIT', 30)
+        variant = get_transcoder().transcode(file_path, 'mp3', PRIORITY_INTERACTIVE, timeout=wait)
+        return variant, PROFILES['mp3']['content_type']
+    except Exception as e:
+        logger.warning(f"⚠️ Servindo áudio original, variante MP3 indisponível: {e}")
+        return file_path, None
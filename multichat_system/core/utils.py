@@ -7,6 +7,18 @@ Funções para buscar instâncias e garantir isolamento entre clientes
 from typing import Optional
 from .models import WhatsappInstance, Cliente
 
+DEFAULT_WAPI_BASE_URL = "https://api.w-api.app/v1/"
+
+
+def get_wapi_base_url() -> str:
+    """
+    URL base da W-API (sempre terminando em '/').
+
+    Configurável via settings.WAPI_BASE_URL para apontar para o simulador local.
+    """
+    from django.conf import settings
+    return getattr(settings, 'WAPI_BASE_URL', DEFAULT_WAPI_BASE_URL).rstrip('/') + '/'
+
 
 def get_client_whatsapp_instance(cliente: Cliente, prefer_connected: bool = True) -> Optional[WhatsappInstance]:
     """
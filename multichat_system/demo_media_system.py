@@ -263,12 +263,9 @@ def demo_file_management():
             print(f"   📁 {tipo}: pasta vazia")
     
     # 2. Mostrar banco de dados
-    print(f"\n🗄️ 2. Banco de dados: {media_manager.db_path}")
-    if media_manager.db_path.exists():
-        tamanho_db = media_manager.db_path.stat().st_size
-        print(f"   📊 Tamanho: {tamanho_db / 1024:.1f} KB")
-    else:
-        print("   ❌ Banco não existe")
+    print("\n🗄️ 2. Banco de dados: core.MediaFile (banco principal)")
+    stats = media_manager.obter_estatisticas()
+    print(f"   📊 Registros: {stats.get('total_midias', 0)}")
     
     # 3. Testar limpeza (simulação)
     print("\n🧹 3. Simulação de limpeza:")
@@ -337,8 +334,7 @@ def demo_usage_examples():
    │   │   ├── videos/
    │   │   ├── audios/
    │   │   ├── documentos/
-   │   │   ├── stickers/
-   │   │   └── media_database.db
+   │   │   └── stickers/
    │   └── instance_def456/
    └── cliente_2/
        └── instance_ghi789/
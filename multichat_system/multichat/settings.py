@@ -53,6 +53,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.db_router.ReadYourWritesMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -94,21 +95,37 @@ DATABASES = {
     }
 }
 
-# Para usar MySQL/MariaDB remoto (descomente se necessário):
-# DATABASES = {
-#     'default': {
-#         'ENGINE': 'django.db.backends.mysql',
-#         'NAME': config('DB_NAME', default='MultiChatDB'),
-#         'USER': config('DB_USER', default='batiliere'),
-#         'PASSWORD': config('DB_PASSWORD', default='OnE%1330'),
-#         'HOST': config('DB_HOST', default='167.86.75.207'),
-#         'PORT': config('DB_PORT', default='3306'),
-#         'OPTIONS': {
-#             'charset': 'utf8mb4',
-#             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
-#         },
-#     }
-# }
+# Produção: DB_ENGINE=mysql usa MySQL/MariaDB (mysqlclient) com conexões persistentes.
+# DB_REPLICA_HOSTS=host1[:porta],host2 cria réplicas de leitura (ver core.db_router).
+if config('DB_ENGINE', default='sqlite') == 'mysql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': config('DB_NAME', default='MultiChatDB'),
+            'USER': config('DB_USER', default='multichat'),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='127.0.0.1'),
+            'PORT': config('DB_PORT', default='3306'),
+            # Reaproveita a conexão entre requisições; testada antes do reuso
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=300, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'charset': 'utf8mb4',
+                'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
+            },
+        }
+    }
+    _replica_hosts = [h.strip() for h in config('DB_REPLICA_HOSTS', default='').split(',') if h.strip()]
+    for _n, _host in enumerate(_replica_hosts):
+        _host, _, _port = _host.partition(':')
+        DATABASES[f'replica_{_n}'] = {
+            **DATABASES['default'],
+            'HOST': _host,
+            'PORT': _port or DATABASES['default']['PORT'],
+            'TEST': {'MIRROR': 'default'},
+        }
+
+DATABASE_ROUTERS = ['core.db_router.ReplicaRouter']
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -158,7 +175,8 @@ AUTHENTICATION_BACKENDS = [
 # REST Framework configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # JWTAuthentication com o usuário/cliente em cache (core.principal)
+        'authentication.backends.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -265,10 +283,27 @@ LOGGING = {
 os.makedirs(BASE_DIR / 'logs', exist_ok=True)
 
 # Cache configuration
+# Usado por core.tenant_cache, core.principal, fileLinks, dashboard...
+# CACHE_BACKEND: 'locmem' (padrão) vale só para o processo: com mais de um worker
+# cada um tem seu cache e as invalidações de um não chegam aos outros.
+# Em produção com vários workers use 'redis' ou 'memcached' (CACHE_LOCATION com o
+# endereço), que têm add/incr atômicos. 'file' e 'database' (rode createcachetable)
+# são compartilhados, mas add/incr não são atômicos e o file fica lento ao encher.
+CACHE_BACKENDS = {
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', str(BASE_DIR / 'cache')),
+    'database': ('django.core.cache.backends.db.DatabaseCache', 'multichat_cache'),
+    'redis': ('django.core.cache.backends.redis.RedisCache', 'redis://127.0.0.1:6379/1'),
+    'memcached': ('django.core.cache.backends.memcached.PyMemcacheCache', '127.0.0.1:11211'),
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'unique-snowflake'),
+}
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': CACHE_BACKENDS[CACHE_BACKEND][0],
+        'LOCATION': config('CACHE_LOCATION', default=CACHE_BACKENDS[CACHE_BACKEND][1]),
+        'KEY_PREFIX': config('CACHE_KEY_PREFIX', default='multichat'),
+        'OPTIONS': {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=20000, cast=int)}
+        if CACHE_BACKEND in ('file', 'database', 'locmem') else {},
     }
 }
 
@@ -291,5 +326,71 @@ MULTICHAT_SETTINGS = {
     'WEBHOOK_TIMEOUT': 30,
     'MESSAGE_RETENTION_DAYS': 365,
     'MAX_FILE_SIZE': 50 * 1024 * 1024,  # 50MB
+    # Cache de status das instâncias (core.instance_status)
+    'INSTANCE_STATUS_POLL_INTERVAL': config('INSTANCE_STATUS_POLL_INTERVAL', default=30, cast=int),
+    'INSTANCE_STATUS_CACHE_TTL': config('INSTANCE_STATUS_CACHE_TTL', default=90, cast=int),
+    # Importação de histórico (core.history_backfill)
+    'BACKFILL_MAX_WORKERS': config('BACKFILL_MAX_WORKERS', default=4, cast=int),
+    'BACKFILL_PAGE_SIZE': config('BACKFILL_PAGE_SIZE', default=100, cast=int),
+    'BACKFILL_HISTORY_ENDPOINT': config('BACKFILL_HISTORY_ENDPOINT', default='chats/fetch-messages'),
+    'BACKFILL_STALE_SECONDS': 300,
+    # Reprocessamento de webhooks armazenados (webhook.replay)
+    'REPLAY_WORKERS': config('REPLAY_WORKERS', default=4, cast=int),
+    'REPLAY_CHUNK_SIZE': config('REPLAY_CHUNK_SIZE', default=500, cast=int),
+    # Transcodificação de áudio (core.transcoding); 0 workers = número de CPUs
+    'TRANSCODE_WORKERS': config('TRANSCODE_WORKERS', default=0, cast=int),
+    # Máximo de ffmpeg simultâneos na máquina, somando os workers da aplicação (0 = número de CPUs)
+    'TRANSCODE_HOST_SLOTS': config('TRANSCODE_HOST_SLOTS', default=0, cast=int),
+    # Pasta dos locks de arquivo entre processos da máquina (core.locks)
+    'LOCK_DIR': config('LOCK_DIR', default=str(BASE_DIR / 'locks')),
+    # Pool para downloads, miniaturas e cota (core.transcoding.get_background_pool)
+    'BACKGROUND_WORKERS': config('BACKGROUND_WORKERS', default=4, cast=int),
+    'TRANSCODE_TIMEOUT': 120,
+    'TRANSCODE_INTERACTIVE_WAIT': 30,
+    # Forma de onda dos áudios (core.audio_analysis)
+    'WAVEFORM_BUCKETS': config('WAVEFORM_BUCKETS', default=128, cast=int),
+    # Miniaturas de imagens (core.thumbnails; requer Pillow)
+    'THUMBNAILS_ENABLED': config('THUMBNAILS_ENABLED', default=True, cast=bool),
+    # Prévias de vídeo (poster, ffmpeg) e PDF (primeira página, pdftoppm)
+    'PREVIEWS_ENABLED': config('PREVIEWS_ENABLED', default=True, cast=bool),
+    # Raiz das mídias baixadas (pastas por cliente/instância); vazio = BASE_DIR/media_storage
+    'MEDIA_STORAGE_DIR': config('MEDIA_STORAGE_DIR', default=''),
+    # Armazenamento de mídias por conteúdo (core.media_store); vazio = media_storage/blobs
+    'MEDIA_BLOB_DIR': config('MEDIA_BLOB_DIR', default=''),
+    # Blobs mais novos que isto (segundos) não são removidos pela limpeza de órfãos
+    'MEDIA_BLOB_GC_GRACE': 3600,
+    # Cota de mídias por cliente (core.media_quota); 0 = ilimitada
+    'MEDIA_QUOTA_BYTES': config('MEDIA_QUOTA_BYTES', default=0, cast=int),
+    'MEDIA_QUOTA_LOW_WATERMARK': config('MEDIA_QUOTA_LOW_WATERMARK', default=0.9, cast=float),
+    'MEDIA_QUOTA_CHECK_INTERVAL': config('MEDIA_QUOTA_CHECK_INTERVAL', default=60, cast=int),
+    # Download sob demanda de mídias pendentes ou removidas pela cota (core.media_fetch)
+    'MEDIA_FETCH_TIMEOUT': config('MEDIA_FETCH_TIMEOUT', default=60, cast=int),
+    'MEDIA_ACCESS_TOUCH_INTERVAL': config('MEDIA_ACCESS_TOUCH_INTERVAL', default=300, cast=int),
+    # 'eager' baixa na ingestão; 'lazy' só registra e baixa no primeiro acesso
+    'MEDIA_DOWNLOAD_MODE': config('MEDIA_DOWNLOAD_MODE', default='eager'),
+    # Tipos baixados em background mesmo no modo 'lazy'
+    'MEDIA_PREFETCH_TYPES': config('MEDIA_PREFETCH_TYPES', default='audio,sticker'),
+    # Novas tentativas de download com backoff exponencial (core.media_retry)
+    'MEDIA_RETRY_BASE_SECONDS': config('MEDIA_RETRY_BASE_SECONDS', default=30, cast=int),
+    'MEDIA_RETRY_MAX_SECONDS': config('MEDIA_RETRY_MAX_SECONDS', default=21600, cast=int),
+    'MEDIA_RETRY_MAX_ATTEMPTS': config('MEDIA_RETRY_MAX_ATTEMPTS', default=8, cast=int),
+    'MEDIA_RETRY_MAX_AGE_DAYS': config('MEDIA_RETRY_MAX_AGE_DAYS', default=30, cast=int),
+    'MEDIA_RETRY_LEASE_SECONDS': config('MEDIA_RETRY_LEASE_SECONDS', default=300, cast=int),
+    'WAPI_DOWNLOAD_INLINE_RETRIES': config('WAPI_DOWNLOAD_INLINE_RETRIES', default=1, cast=int),
+    # Cache do fileLink da W-API: reaproveitado até FILE_LINK_EXPIRY_MARGIN segundos antes do expires
+    'FILE_LINK_EXPIRY_MARGIN': config('FILE_LINK_EXPIRY_MARGIN', default=60, cast=int),
+    'FILE_LINK_DEFAULT_TTL': config('FILE_LINK_DEFAULT_TTL', default=300, cast=int),
+    # Resumo do dashboard em cache por cliente (core.dashboard), atualizado por mensagens/chats novos
+    'DASHBOARD_CACHE_TTL': config('DASHBOARD_CACHE_TTL', default=60, cast=int),
+    # Linhas lidas do banco por lote nas exportações em streaming (core.exports)
+    'EXPORT_CHUNK_SIZE': config('EXPORT_CHUNK_SIZE', default=2000, cast=int),
+    # Segundos em que as leituras de um usuário ficam no primário depois de uma escrita dele
+    'DB_REPLICA_STICKY_SECONDS': config('DB_REPLICA_STICKY_SECONDS', default=10, cast=int),
+    # Segundos do principal autenticado em cache (core.principal); invalidado ao alterar usuário/cliente
+    'PRINCIPAL_CACHE_TTL': config('PRINCIPAL_CACHE_TTL', default=300, cast=int),
 }
 
+# URL base da W-API. Aponte para o simulador local (comando wapi_simulator)
+# para testes e benchmarks sem rede, ex.: http://127.0.0.1:8900/v1/
+WAPI_BASE_URL = config('WAPI_BASE_URL', default='https://api.w-api.app/v1/')
+
@@ -0,0 +1,16 @@
+"""
+Settings dos testes: ``python manage.py test --settings=multichat.settings_test``
+
+Usa as settings do projeto com cache local ao processo, isolado do cache de
+desenvolvimento (CACHE_BACKEND do .env) e de outros processos.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'multichat-tests',
+        'KEY_PREFIX': 'multichat',
+    }
+}
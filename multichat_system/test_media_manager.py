@@ -58,10 +58,8 @@ def test_media_manager():
         
         # 2. Verificar banco de dados
         print("\n🗄️ Verificando banco de dados...")
-        if media_manager.db_path.exists():
-            print(f"   ✅ Banco de dados: {media_manager.db_path}")
-        else:
-            print(f"   ❌ Banco de dados não existe")
+        stats = media_manager.obter_estatisticas()
+        print(f"   ✅ core.MediaFile: {stats.get('total_midias', 0)} registros")
         
         # 3. Testar busca de mídias pendentes
         print("\n🔍 Testando busca de mídias pendentes...")
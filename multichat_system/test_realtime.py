@@ -14,16 +14,13 @@ django.setup()
 
 from core.models import Chat, Mensagem, Cliente
 from django.utils import timezone
-from django.core.cache import cache
+from core.tenant_cache import invalidate_tenant
+from webhook.signals import get_realtime_updates
 
 def test_realtime_system():
     """Testa o sistema de tempo real completo"""
     print("🧪 Testando sistema de tempo real completo...")
     
-    # Limpar cache
-    cache.delete("realtime_updates")
-    print("🗑️ Cache limpo")
-    
     # Buscar um chat existente
     try:
         chat = Chat.objects.first()
@@ -33,8 +30,12 @@ def test_realtime_system():
         
         print(f"📱 Usando chat: {chat.chat_id}")
         
+        # Limpar cache do cliente do chat
+        invalidate_tenant(chat.cliente_id)
+        print("🗑️ Cache limpo")
+        
         # Verificar cache antes
-        updates_before = cache.get("realtime_updates", [])
+        updates_before = get_realtime_updates(chat.cliente_id)
         print(f"📊 Atualizações no cache antes: {len(updates_before)}")
         
         # Criar uma mensagem de teste
@@ -55,7 +56,7 @@ def test_realtime_system():
         time.sleep(1)
         
         # Verificar cache depois
-        updates_after = cache.get("realtime_updates", [])
+        updates_after = get_realtime_updates(chat.cliente_id)
         print(f"📊 Atualizações no cache depois: {len(updates_after)}")
         
         if len(updates_after) > len(updates_before):
@@ -14,15 +14,13 @@ django.setup()
 from core.models import Chat, Mensagem, Cliente
 from django.utils import timezone
 from django.core.cache import cache
+from core.tenant_cache import invalidate_tenant
+from webhook.signals import get_realtime_updates
 
 def test_signal():
     """Testa se o signal está funcionando"""
     print("🧪 Testando signal de mensagem...")
     
-    # Limpar cache
-    cache.delete("realtime_updates")
-    print("🗑️ Cache limpo")
-    
     # Buscar um chat existente
     try:
         chat = Chat.objects.first()
@@ -32,6 +30,10 @@ def test_signal():
         
         print(f"📱 Usando chat: {chat.chat_id}")
         
+        # Limpar cache do cliente do chat
+        invalidate_tenant(chat.cliente_id)
+        print("🗑️ Cache limpo")
+        
         # Criar uma mensagem de teste
         mensagem = Mensagem.objects.create(
             chat=chat,
@@ -46,7 +48,7 @@ def test_signal():
         print(f"✅ Mensagem criada: {mensagem.id}")
         
         # Verificar se foi salva no cache
-        updates = cache.get("realtime_updates", [])
+        updates = get_realtime_updates(chat.cliente_id)
         print(f"📊 Atualizações no cache: {len(updates)}")
         
         if updates:
@@ -6,17 +6,19 @@ Baixa, converte e salva áudios recebidos via webhook
 
 import os
 import requests
-import base64
-import hashlib
 import json
 import logging
 from pathlib import Path
 from django.conf import settings
 from django.utils import timezone
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.backends import default_backend
 import tempfile
-import subprocess
+
+from core.transcoding import PRIORITY_INGEST, get_transcoder, transcode_to_file
+from .media_crypto import (
+    MediaDecryptionError,
+    decrypt_media_bytes,
+    download_and_decrypt,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -30,116 +32,70 @@ class WhatsAppAudioProcessor:
     
     def decrypt_audio(self, encrypted_data, media_key, file_sha256):
         """
-        Descriptografa o áudio do WhatsApp usando a chave de mídia
+        Descriptografa o áudio do WhatsApp usando a chave de mídia (dados em memória)
         """
         try:
-            # Decodificar a chave de mídia
-            media_key_bytes = base64.b64decode(media_key)
-            
-            # Gerar chaves de criptografia
-            info = b"WhatsApp Audio Keys"
-            key = hashlib.pbkdf2_hmac('sha256', media_key_bytes, info, 256, 32)
-            
-            # Extrair IV e dados criptografados
-            iv = encrypted_data[:16]
-            ciphertext = encrypted_data[16:]
-            
-            # Descriptografar
-            cipher = Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend())
-            decryptor = cipher.decryptor()
-            decrypted_data = decryptor.update(ciphertext) + decryptor.finalize()
-            
-            # Remover padding PKCS7
-            padding_length = decrypted_data[-1]
-            if padding_length <= 16:
-                decrypted_data = decrypted_data[:-padding_length]
-            
-            return decrypted_data
-            
-        except Exception as e:
+            return decrypt_media_bytes(encrypted_data, media_key, 'audio', file_sha256)
+        except (MediaDecryptionError, ValueError) as e:
             logger.error(f"❌ Erro ao descriptografar áudio: {e}")
             return None
     
-    def download_audio(self, url, media_key, file_sha256):
+    def download_audio(self, url, media_key, file_sha256, file_enc_sha256=None):
         """
-        Baixa e descriptografa o áudio do WhatsApp
+        Baixa e descriptografa o áudio do WhatsApp em streaming.
+        
+        Retorna o caminho do arquivo descriptografado (temporário, dentro de
+        media_dir) ou None em caso de falha.
         """
+        fd, temp_path = tempfile.mkstemp(prefix='.audio_', suffix='.ogg', dir=self.media_dir)
+        os.close(fd)
         try:
-            logger.info(f"🎵 Baixando áudio: {url}")
-            
-            # Baixar dados criptografados
-            response = requests.get(url, timeout=30)
-            response.raise_for_status()
-            
-            encrypted_data = response.content
-            
-            # Verificar hash se fornecido
-            if file_sha256:
-                actual_sha256 = base64.b64encode(hashlib.sha256(encrypted_data).digest()).decode()
-                if actual_sha256 != file_sha256:
-                    logger.warning(f"⚠️ Hash não confere: esperado {file_sha256}, obtido {actual_sha256}")
-            
-            # Descriptografar
-            decrypted_data = self.decrypt_audio(encrypted_data, media_key, file_sha256)
-            
-            if decrypted_data:
-                logger.info(f"✅ Áudio descriptografado com sucesso: {len(decrypted_data)} bytes")
-                return decrypted_data
-            else:
-                logger.error("❌ Falha ao descriptografar áudio")
-                return None
-                
-        except Exception as e:
+            result = download_and_decrypt(url, temp_path, media_key, 'audio', file_sha256, file_enc_sha256)
+            logger.info(f"✅ Áudio descriptografado com sucesso: {result['file_size']} bytes")
+            return Path(result['file_path'])
+        except (requests.RequestException, MediaDecryptionError, ValueError) as e:
             logger.error(f"❌ Erro ao baixar áudio: {e}")
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
             return None
     
     def convert_to_mp3(self, audio_data, input_format="ogg"):
         """
-        Converte o áudio para MP3 usando ffmpeg
+        Converte o áudio para MP3 usando o pool de transcodificação (core.transcoding)
         """
+        temp_input_path = None
         try:
-            # Criar arquivo temporário de entrada
             with tempfile.NamedTemporaryFile(suffix=f".{input_format}", delete=False) as temp_input:
                 temp_input.write(audio_data)
                 temp_input_path = temp_input.name
             
-            # Criar arquivo temporário de saída
-            with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_output:
-                temp_output_path = temp_output.name
-            
-            # Comando ffmpeg para conversão
-            cmd = [
-                "ffmpeg",
-                "-i", temp_input_path,
-                "-acodec", "libmp3lame",
-                "-ab", "128k",
-                "-ar", "44100",
-                "-y",  # Sobrescrever arquivo de saída
-                temp_output_path
-            ]
-            
-            logger.info(f"🔄 Convertendo áudio para MP3...")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
-            
-            if result.returncode == 0:
-                # Ler arquivo convertido
-                with open(temp_output_path, 'rb') as f:
-                    mp3_data = f.read()
-                
-                logger.info(f"✅ Conversão concluída: {len(mp3_data)} bytes")
-                
-                # Limpar arquivos temporários
-                os.unlink(temp_input_path)
-                os.unlink(temp_output_path)
-                
-                return mp3_data
-            else:
-                logger.error(f"❌ Erro na conversão: {result.stderr}")
-                return None
-                
+            variant = get_transcoder().transcode(temp_input_path, 'mp3', PRIORITY_INGEST)
+            with open(variant, 'rb') as f:
+                mp3_data = f.read()
+            logger.info(f"✅ Conversão concluída: {len(mp3_data)} bytes")
+            return mp3_data
         except Exception as e:
             logger.error(f"❌ Erro ao converter áudio: {e}")
             return None
+        finally:
+            if temp_input_path and os.path.exists(temp_input_path):
+                os.unlink(temp_input_path)
+    
+    def convert_file_to_mp3(self, input_path, output_path):
+        """
+        Converte um arquivo de áudio para MP3 direto no destino.
+        
+        Passa pelo pool de transcodificação: a conversão respeita o limite de
+        ffmpegs simultâneos e a variante fica em cache pelo hash do original.
+        """
+        try:
+            logger.info(f"🔄 Convertendo áudio para MP3...")
+            transcode_to_file(input_path, output_path, 'mp3', PRIORITY_INGEST)
+            logger.info(f"✅ Conversão concluída: {os.path.getsize(output_path)} bytes")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Erro ao converter áudio: {e}")
+            return False
     
     def save_audio(self, audio_data, filename, message_id):
         """
@@ -183,31 +139,24 @@ class WhatsAppAudioProcessor:
                 logger.error("❌ Dados insuficientes para processar áudio")
                 return None
             
-            # Baixar e descriptografar
-            decrypted_data = self.download_audio(url, media_key, file_sha256)
-            if not decrypted_data:
+            # Baixar e descriptografar (streaming direto para o disco)
+            decrypted_path = self.download_audio(url, media_key, file_sha256, audio_data.get('fileEncSha256'))
+            if not decrypted_path:
                 return None
             
-            # Determinar formato de entrada
-            input_format = "ogg"
-            if "opus" in mimetype:
-                input_format = "opus"
-            elif "mp4" in mimetype:
-                input_format = "m4a"
-            
-            # Converter para MP3
-            mp3_data = self.convert_to_mp3(decrypted_data, input_format)
-            if not mp3_data:
-                return None
-            
-            # Salvar arquivo
-            file_path = self.save_audio(mp3_data, f"audio_{message_id}", message_id)
+            # Converter para MP3 direto no destino final
+            safe_filename = f"audio_{message_id}_{int(timezone.now().timestamp())}.mp3"
+            mp3_path = self.media_dir / safe_filename
+            try:
+                converted = self.convert_file_to_mp3(decrypted_path, mp3_path)
+            finally:
+                decrypted_path.unlink(missing_ok=True)
             
-            if file_path:
+            if converted:
                 # Retornar informações do áudio processado
                 return {
-                    'file_path': file_path,
-                    'file_size': len(mp3_data),
+                    'file_path': f"audios/{self.cliente.id}/{safe_filename}",
+                    'file_size': mp3_path.stat().st_size,
                     'duration': seconds,
                     'ptt': ptt,
                     'mimetype': 'audio/mpeg',
@@ -0,0 +1,156 @@
+"""
+Caminho único de escrita de uma mensagem recebida por webhook
+
+``persist_message`` grava a mensagem uma única vez, numa única transação:
+
+- ``core.Chat``: obtido/criado pelo par (chat_id, cliente), nunca só pelo
+  chat_id (o mesmo contato pode existir em mais de um cliente);
+- ``core.Mensagem``: a deduplicação é a própria restrição UNIQUE de
+  ``message_id`` (sem ``exists()`` antes do INSERT): uma entrega repetida
+  desfaz a transação e volta como duplicada;
+- ``last_message_at`` do chat: UPDATE condicional (só avança), sem regravar
+  a linha inteira;
+- ``core.MediaFile``: descritor pendente da mídia, já ligado ao chat. O
+  download (ou o reaproveitamento pelo fileSha256) acontece depois do commit
+  e só para mensagens novas.
+
+As demais cópias deixam de ser escritas por mensagem: o nome do contato sai
+do ``remetente`` da última mensagem recebida (``webhook.Sender`` fica só como
+fallback de exibição) e o ``webhook.Message`` do servidor local só é gravado
+quando esta função criou a mensagem.
+"""
+
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.utils import determine_from_me_saas
+from core.models import Chat, Cliente, MediaFile, Mensagem, WhatsappInstance
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class IngestResult:
+    chat: Optional[Chat]
+    mensagem: Optional[Mensagem]
+    created: bool
+    media_file: Optional[MediaFile] = None
+
+    @property
+    def duplicate(self) -> bool:
+        return not self.created
+
+
+def message_id_from_payload(payload: Dict) -> Optional[str]:
+    """ID da mensagem no WhatsApp (formato Baileys em ``key.id``, W-API em ``messageId``)."""
+    return (payload.get('key') or {}).get('id') or payload.get('messageId') or None
+
+
+def message_time(payload: Dict) -> datetime:
+    """Momento da mensagem (``messageTimestamp``/``moment`` em segundos); agora se ausente."""
+    valor = payload.get('messageTimestamp') or payload.get('moment')
+    try:
+        segundos = int(valor)
+    except (TypeError, ValueError):
+        return timezone.now()
+    if segundos <= 0:
+        return timezone.now()
+    if segundos > 10 ** 12:
+        segundos //= 1000  # milissegundos
+    return datetime.fromtimestamp(segundos, tz=dt_timezone.utc)
+
+
+def sender_name(payload: Dict, from_me: bool, cliente: Cliente, chat_id: str) -> str:
+    if from_me:
+        return cliente.nome
+    sender = payload.get('sender') or {}
+    nome = sender.get('pushName') or sender.get('verifiedName') or sender.get('name')
+    if not nome:
+        return f"Contato {chat_id.split('@')[0]}" if chat_id else "Contato"
+    # Mensagem recebida nunca leva o nome do cliente como remetente
+    if cliente.nome and cliente.nome in nome:
+        logger.warning(f"⚠️ Tentativa de usar nome do cliente para mensagem recebida: {nome}")
+        return "Contato"
+    return nome
+
+
+def persist_message(payload: Dict, cliente: Cliente, instance: Optional[WhatsappInstance] = None,
+                    from_me: Optional[bool] = None) -> Optional[IngestResult]:
+    """
+    Grava a mensagem do ``payload`` (W-API ou Baileys) para o ``cliente``.
+
+    Retorna ``None`` se o chat for inválido/ignorado (grupos); se a mensagem
+    já existir, ``IngestResult`` com ``created=False``. O descritor da mídia
+    só é gravado com a ``instance`` (dona do arquivo).
+    """
+    from webhook.views import detect_message_type, extract_media, extract_message_content, \
+        normalize_chat_id, registrar_midia_pendente
+
+    raw_chat_id = (payload.get('chat') or {}).get('id', '')
+    chat_id = normalize_chat_id(raw_chat_id)
+    if not chat_id:
+        logger.error(f"Chat ID inválido: {raw_chat_id}")
+        return None
+
+    message_id = message_id_from_payload(payload)
+    if from_me is None:
+        from_me = determine_from_me_saas(payload, instance.instance_id if instance else payload.get('instanceId', ''))
+
+    # A W-API manda o conteúdo em msgContent; o formato Baileys em message
+    conteudo_payload = payload if 'message' in payload else {**payload, 'message': payload.get('msgContent') or {}}
+    tipo = detect_message_type(conteudo_payload)
+    conteudo = extract_message_content(conteudo_payload, tipo)
+    remetente = sender_name(payload, from_me, cliente, chat_id)
+    quando = message_time(payload)
+
+    try:
+        with transaction.atomic():
+            chat, chat_criado = Chat.objects.get_or_create(
+                chat_id=chat_id,
+                cliente=cliente,
+                defaults={
+                    'status': 'active',
+                    'canal': 'whatsapp',
+                    'data_inicio': timezone.now(),
+                    'last_message_at': quando,
+                }
+            )
+
+            mensagem = Mensagem.objects.create(
+                chat=chat,
+                remetente=remetente,
+                conteudo=conteudo,
+                tipo=tipo,
+                lida=False,
+                from_me=from_me,
+                message_id=message_id,
+            )
+
+            if not chat_criado and (chat.last_message_at is None or chat.last_message_at < quando):
+                # Condicional também no banco: outra entrega pode ter avançado o chat
+                Chat.objects.filter(pk=chat.pk).filter(
+                    Q(last_message_at__isnull=True) | Q(last_message_at__lt=quando)
+                ).update(last_message_at=quando)
+                chat.last_message_at = quando
+
+            media_file = None
+            media_type, detected_media = extract_media(payload.get('msgContent') or {})
+            if instance is not None and media_type and payload.get('messageId'):
+                media_file = registrar_midia_pendente(
+                    payload, cliente, instance, media_type, detected_media, prefetch=False, chat=chat
+                )
+    except IntegrityError:
+        # Entrega repetida: a restrição UNIQUE de message_id desfez a transação
+        if message_id and Mensagem.objects.filter(message_id=message_id).exists():
+            logger.info(f"Mensagem já existe (message_id): {message_id}")
+            return IngestResult(chat=None, mensagem=None, created=False)
+        raise
+
+    logger.info(f"✅ Mensagem salva: {message_id} - Tipo: {tipo} - FromMe: {from_me} - Cliente: {cliente.nome}")
+    return IngestResult(chat=chat, mensagem=mensagem, created=True, media_file=media_file)
@@ -0,0 +1,416 @@
+"""
+Benchmark de ingestão de webhooks.
+
+Gera payloads sintéticos no formato da W-API (texto, cada tipo de mídia,
+grupos, presença e status) e os envia em ritmo controlado para:
+
+- /webhook/whatsapp/          (eventos genéricos, presença e status)
+- /webhook/receive-message/   (mensagens recebidas)
+- /webhook/send-message/      (mensagens enviadas)
+
+Mede vazão, latência p50/p95/p99, consultas SQL por evento (modo
+in-process) e crescimento de memória. Os resultados são gravados em JSONL
+para comparar execuções entre versões (ver comando benchmark_webhooks).
+
+Autor: Sistema MultiChat
+"""
+
+import base64
+import json
+import os
+import random
+import subprocess
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import resource  # só existe em Unix
+except ImportError:
+    resource = None
+
+
+# Proporção padrão de cada tipo de evento no tráfego sintético
+DEFAULT_MIX = {
+    'text': 60,
+    'image': 10,
+    'audio': 8,
+    'video': 3,
+    'document': 3,
+    'sticker': 3,
+    'group': 5,
+    'presence': 5,
+    'status': 3,
+}
+
+MEDIA_FIELDS = {
+    'image': ('imageMessage', 'image/jpeg'),
+    'audio': ('audioMessage', 'audio/ogg; codecs=opus'),
+    'video': ('videoMessage', 'video/mp4'),
+    'document': ('documentMessage', 'application/pdf'),
+    'sticker': ('stickerMessage', 'image/webp'),
+}
+
+# Métricas comparadas entre execuções: (caminho, maior_é_pior)
+REGRESSION_METRICS = [
+    (('throughput_eps',), False),
+    (('latency_ms', 'p50'), True),
+    (('latency_ms', 'p95'), True),
+    (('latency_ms', 'p99'), True),
+    (('queries_per_event', 'mean'), True),
+]
+
+
+def parse_mix(spec: Optional[str]) -> Dict[str, int]:
+    """Converte 'text=70,image=20,audio=10' em dicionário de pesos."""
+    if not spec:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"Tipo de evento desconhecido: {name}")
+        mix[name] = int(weight or 1)
+    return mix
+
+
+class PayloadFactory:
+    """Gera eventos W-API sintéticos e determinísticos (dada a semente)."""
+
+    def __init__(self, instance_id: str, connected_phone: str = '5511900000000',
+                 contacts: int = 200, seed: int = 42):
+        self.instance_id = instance_id
+        self.connected_phone = connected_phone
+        self.rng = random.Random(seed)
+        self.contacts = [f"55119{n:08d}" for n in range(contacts)]
+        self.counter = 0
+
+    def _message_id(self) -> str:
+        self.counter += 1
+        return f"BENCH{self.counter:010d}{self.rng.getrandbits(32):08X}"
+
+    def _media(self, kind: str) -> Dict:
+        field, mimetype = MEDIA_FIELDS[kind]
+        media = {
+            'url': f"https://mmg.whatsapp.net/v/t62.7118-24/{self.counter}.enc",
+            'mimetype': mimetype,
+            'fileLength': str(self.rng.randint(10_000, 2_000_000)),
+            'mediaKey': base64.b64encode(self.rng.randbytes(32)).decode(),
+            'directPath': f"/v/t62.7118-24/{self.counter}.enc?ccb=11-4",
+            'fileSha256': base64.b64encode(self.rng.randbytes(32)).decode(),
+            'fileEncSha256': base64.b64encode(self.rng.randbytes(32)).decode(),
+            'mediaKeyTimestamp': str(int(time.time())),
+        }
+        if kind == 'image':
+            media.update({'width': 1280, 'height': 960, 'caption': 'Foto', 'jpegThumbnail': ''})
+        elif kind == 'video':
+            media.update({'width': 640, 'height': 360, 'seconds': self.rng.randint(3, 90)})
+        elif kind == 'audio':
+            media.update({'seconds': self.rng.randint(1, 120), 'ptt': True})
+        elif kind == 'document':
+            media.update({'fileName': f"documento_{self.counter}.pdf", 'pageCount': 3})
+        return {field: media}
+
+    def message(self, kind: str, from_me: bool) -> Dict:
+        contact = self.rng.choice(self.contacts)
+        message_id = self._message_id()
+        is_group = kind == 'group'
+        chat_id = f"120363{self.rng.randint(10 ** 11, 10 ** 12 - 1)}@g.us" if is_group else f"{contact}@s.whatsapp.net"
+        content = {'conversation': f"Mensagem de teste {self.counter}"} if kind in ('text', 'group') else self._media(kind)
+        sender_id = f"{self.connected_phone}@s.whatsapp.net" if from_me else f"{contact}@s.whatsapp.net"
+        return {
+            'event': 'webhookDelivery' if from_me else 'webhookReceived',
+            'instanceId': self.instance_id,
+            'connectedPhone': self.connected_phone,
+            'messageId': message_id,
+            'fromMe': from_me,
+            'isGroup': is_group,
+            'moment': int(time.time()),
+            'chat': {'id': chat_id, 'profilePicture': ''},
+            'sender': {'id': sender_id, 'pushName': f"Contato {contact[-4:]}", 'verifiedBizName': ''},
+            'msgContent': content,
+            # Campos no formato Baileys que a ingestão atual também lê
+            'key': {'id': message_id, 'fromMe': from_me, 'remoteJid': chat_id},
+            'message': content,
+            'messageTimestamp': int(time.time()),
+            'data': {'messages': [{'key': {'id': message_id}}]},
+        }
+
+    def presence(self) -> Dict:
+        return {
+            'event': 'presence.update',
+            'instanceId': self.instance_id,
+            'chatId': f"{self.rng.choice(self.contacts)}@s.whatsapp.net",
+            'presence': self.rng.choice(['composing', 'available', 'recording']),
+            'moment': int(time.time()),
+        }
+
+    def status(self) -> Dict:
+        return {
+            'event': 'messages.update',
+            'instanceId': self.instance_id,
+            'messageId': f"BENCH{self.rng.randint(1, max(1, self.counter)):010d}",
+            'status': self.rng.choice(['SENT', 'DELIVERY', 'READ']),
+            'moment': int(time.time()),
+        }
+
+    def event(self, kind: str) -> Tuple[str, Dict]:
+        """Retorna (endpoint, payload) para um tipo de evento."""
+        if kind == 'presence':
+            return '/webhook/whatsapp/', self.presence()
+        if kind == 'status':
+            return '/webhook/whatsapp/', self.status()
+        roll = self.rng.random()
+        if roll < 0.2:
+            # Parte do tráfego chega pelo endpoint genérico
+            payload = self.message(kind, from_me=False)
+            payload['event'] = 'messages.upsert'
+            return '/webhook/whatsapp/', payload
+        from_me = roll < 0.45
+        endpoint = '/webhook/send-message/' if from_me else '/webhook/receive-message/'
+        return endpoint, self.message(kind, from_me=from_me)
+
+    def stream(self, total: int, mix: Dict[str, int]) -> Iterator[Tuple[str, str, Dict]]:
+        kinds = list(mix.keys())
+        weights = list(mix.values())
+        for _ in range(total):
+            kind = self.rng.choices(kinds, weights)[0]
+            endpoint, payload = self.event(kind)
+            yield kind, endpoint, payload
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def current_rss_kb() -> Optional[int]:
+    """RSS atual do processo em KB (Linux); None se indisponível."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+class IngestBenchmark:
+    """
+    Executa o benchmark.
+
+    Args:
+        send: função (endpoint, payload) -> (status_code, consultas_sql | None)
+        rate: eventos/segundo desejados (0 = o mais rápido possível)
+        trace_memory: usa tracemalloc para medir crescimento de memória Python
+    """
+
+    def __init__(self, send, rate: float = 0, trace_memory: bool = False):
+        self.send = send
+        self.rate = rate
+        self.trace_memory = trace_memory
+
+    def run(self, events: Iterator[Tuple[str, str, Dict]], warmup: int = 0) -> Dict:
+        samples = new_samples()
+
+        events = iter(events)
+        for _ in range(warmup):
+            try:
+                _, endpoint, payload = next(events)
+            except StopIteration:
+                break
+            self.send(endpoint, payload)
+
+        if self.trace_memory:
+            tracemalloc.start()
+        rss_before = current_rss_kb()
+        traced_before = tracemalloc.get_traced_memory()[0] if self.trace_memory else 0
+
+        start = time.perf_counter()
+        for index, (kind, endpoint, payload) in enumerate(events):
+            t0 = time.perf_counter()
+            if self.rate:
+                # Agenda fixa e latência contada a partir do horário agendado: se o
+                # envio anterior atrasou, a espera entra na medida (coordinated omission)
+                scheduled = start + index / self.rate
+                delay = scheduled - t0
+                if delay > 0:
+                    time.sleep(delay)
+                t0 = scheduled
+            status, query_count = self.send(endpoint, payload)
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+
+            samples['latencies'].append(elapsed_ms)
+            samples['per_type'].setdefault(kind, []).append(elapsed_ms)
+            samples['status_codes'][str(status)] += 1
+            samples['endpoints'][endpoint] += 1
+            if query_count is not None:
+                samples['queries'].append(query_count)
+        duration = time.perf_counter() - start
+
+        memory = {'rss_growth_kb': None, 'traced_growth_kb': None, 'traced_peak_kb': None, 'max_rss_kb': None}
+        rss_after = current_rss_kb()
+        if rss_before is not None and rss_after is not None:
+            memory['rss_growth_kb'] = rss_after - rss_before
+        if resource is not None:
+            memory['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            memory['traced_growth_kb'] = round((current - traced_before) / 1024, 1)
+            memory['traced_peak_kb'] = round(peak / 1024, 1)
+
+        result = summarize(samples, duration, self.rate, memory)
+        result['samples'] = samples
+        return result
+
+
+def new_samples() -> Dict:
+    """Amostras brutas de uma execução (combináveis entre workers com ``merge_results``)."""
+    return {
+        'latencies': [],
+        'per_type': {},
+        'queries': [],
+        'status_codes': Counter(),
+        'endpoints': Counter(),
+    }
+
+
+def summarize(samples: Dict, duration: float, rate: float, memory: Dict) -> Dict:
+    """Calcula vazão, percentis e contagens a partir das amostras brutas."""
+    latencies = samples['latencies']
+    queries = samples['queries']
+    ordered = sorted(latencies)
+    return {
+        'events': len(latencies),
+        'duration_s': round(duration, 3),
+        'throughput_eps': round(len(latencies) / duration, 2) if duration else 0.0,
+        'target_rate': rate,
+        'latency_ms': {
+            'p50': round(percentile(ordered, 50), 2),
+            'p95': round(percentile(ordered, 95), 2),
+            'p99': round(percentile(ordered, 99), 2),
+            'max': round(ordered[-1], 2) if ordered else 0.0,
+            'mean': round(sum(ordered) / len(ordered), 2) if ordered else 0.0,
+        },
+        'queries_per_event': {
+            'mean': round(sum(queries) / len(queries), 2) if queries else None,
+            'max': max(queries) if queries else None,
+        },
+        'per_type': {
+            kind: {
+                'events': len(values),
+                'p50_ms': round(percentile(sorted(values), 50), 2),
+                'p95_ms': round(percentile(sorted(values), 95), 2),
+            }
+            for kind, values in sorted(samples['per_type'].items())
+        },
+        'status_codes': dict(samples['status_codes']),
+        'endpoints': dict(samples['endpoints']),
+        'memory': memory,
+    }
+
+
+def merge_results(parts: List[Dict], rate: float = 0) -> Dict:
+    """
+    Combina execuções concorrentes juntando as amostras brutas: os percentis
+    são recalculados sobre todas as latências, não estimados pelos workers.
+    """
+    samples = new_samples()
+    for part in parts:
+        raw = part['samples']
+        samples['latencies'].extend(raw['latencies'])
+        for kind, values in raw['per_type'].items():
+            samples['per_type'].setdefault(kind, []).extend(values)
+        samples['queries'].extend(raw['queries'])
+        samples['status_codes'].update(raw['status_codes'])
+        samples['endpoints'].update(raw['endpoints'])
+    # Workers rodam em paralelo: a duração total é a do mais lento
+    duration = max(part['duration_s'] for part in parts)
+    result = summarize(samples, duration, rate, parts[0]['memory'])
+    result['samples'] = samples
+    return result
+
+
+def _metric(result: Dict, path: Tuple[str, ...]):
+    value = result
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def compare_results(current: Dict, previous: Dict, tolerance: float) -> List[Dict]:
+    """
+    Compara métricas principais com a execução anterior.
+
+    Returns:
+        Lista de {metric, previous, current, change_pct, regression}
+    """
+    rows = []
+    for path, higher_is_worse in REGRESSION_METRICS:
+        old, new = _metric(previous, path), _metric(current, path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        regression = change > tolerance if higher_is_worse else change < -tolerance
+        rows.append({
+            'metric': '.'.join(path),
+            'previous': old,
+            'current': new,
+            'change_pct': round(change, 1),
+            'regression': regression,
+        })
+    return rows
+
+
+def load_previous(results_file: Path, mode: str) -> Optional[Dict]:
+    """Última execução gravada no mesmo modo (inprocess/http)."""
+    if not results_file.exists():
+        return None
+    previous = None
+    with open(results_file, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('mode') == mode:
+                previous = record
+    return previous
+
+
+def save_result(results_file: Path, record: Dict) -> None:
+    results_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(results_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def build_record(result: Dict, mode: str, mix: Dict[str, int], label: Optional[str] = None) -> Dict:
+    result = {key: value for key, value in result.items() if key != 'samples'}
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'label': label,
+        'mode': mode,
+        'mix': mix,
+        **result,
+    }
@@ -0,0 +1,234 @@
+import contextlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import warnings
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from webhook.ingest_benchmark import (
+    IngestBenchmark,
+    PayloadFactory,
+    build_record,
+    compare_results,
+    load_previous,
+    merge_results,
+    parse_mix,
+    save_result,
+)
+
+BENCH_INSTANCE_ID = 'BENCH-INGEST-0001'
+BENCH_CLIENTE_NOME = 'Benchmark Ingest'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark de ingestão de webhooks: vazão, latência p50/p95/p99, consultas por evento e memória'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=500, help='Quantidade de eventos medidos')
+        parser.add_argument('--warmup', type=int, default=20, help='Eventos de aquecimento (não medidos)')
+        parser.add_argument('--rate', type=float, default=0, help='Eventos/s desejados (0 = máximo)')
+        parser.add_argument(
+            '--mix',
+            type=str,
+            default=None,
+            help='Pesos por tipo, ex.: text=70,image=10,audio=10,presence=10'
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Semente dos payloads')
+        parser.add_argument(
+            '--url',
+            type=str,
+            default=None,
+            help='Envia via HTTP para um servidor em execução (ex.: http://127.0.0.1:8000). '
+                 'Sem --url roda in-process em um banco de teste descartável.'
+        )
+        parser.add_argument('--instance-id', type=str, default=None, help='instanceId dos payloads no modo --url')
+        parser.add_argument('--concurrency', type=int, default=1, help='Conexões simultâneas no modo --url')
+        parser.add_argument('--trace-memory', action='store_true', help='Mede crescimento de memória com tracemalloc')
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help='Arquivo JSONL de resultados (padrão: benchmarks/webhook_ingest.jsonl)'
+        )
+        parser.add_argument('--label', type=str, default=None, help='Rótulo da execução (ex.: versão)')
+        parser.add_argument('--tolerance', type=float, default=20.0, help='Variação (%%) tolerada antes de acusar regressão')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Sai com erro se houver regressão')
+        parser.add_argument('--no-save', action='store_true', help='Não grava o resultado')
+        parser.add_argument('--verbose', action='store_true', help='Mantém logs/prints das views durante a medição')
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        mode = 'http' if options['url'] else 'inprocess'
+        self.stdout.write(self.style.SUCCESS(f"🔄 Benchmark de webhooks ({mode}) - {options['events']} eventos"))
+
+        if mode == 'http':
+            result = self._run_http(options, mix)
+        else:
+            result = self._run_inprocess(options, mix)
+
+        record = build_record(result, mode, mix, options['label'])
+        self._print_result(record)
+
+        results_file = Path(options['output'] or Path(settings.BASE_DIR) / 'benchmarks' / 'webhook_ingest.jsonl')
+        previous = load_previous(results_file, mode)
+        regressions = []
+        if previous:
+            rows = compare_results(record, previous, options['tolerance'])
+            regressions = [row for row in rows if row['regression']]
+            self.stdout.write(f"\n📈 Comparação com {previous.get('revision') or '?'} ({previous.get('timestamp')}):")
+            for row in rows:
+                marker = '❌' if row['regression'] else '✅'
+                self.stdout.write(
+                    f"   {marker} {row['metric']}: {row['previous']} -> {row['current']} ({row['change_pct']:+.1f}%)"
+                )
+
+        if not options['no_save']:
+            save_result(results_file, record)
+            self.stdout.write(f"\n💾 Resultado gravado em {results_file}")
+
+        if regressions and options['fail_on_regression']:
+            raise CommandError(f"{len(regressions)} métrica(s) com regressão acima de {options['tolerance']}%")
+
+    # ------------------------------------------------------------------
+
+    def _run_inprocess(self, options, mix):
+        """Roda contra um banco de teste descartável, com o simulador W-API para as mídias."""
+        from api.wapi_simulator import WApiSimulator, start_in_thread
+        from core.models import Cliente, WhatsappInstance
+
+        old_db_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        server = None
+        # media_storage inteiro (pastas por cliente e blobs) em pasta própria:
+        # o benchmark nunca mexe no armazenamento compartilhado
+        media_dir = tempfile.mkdtemp(prefix='bench_media_')
+        multichat_settings = {
+            **getattr(settings, 'MULTICHAT_SETTINGS', {}),
+            'MEDIA_STORAGE_DIR': media_dir,
+            'MEDIA_BLOB_DIR': '',
+        }
+        try:
+            cliente = Cliente.objects.create(nome=BENCH_CLIENTE_NOME, email='benchmark@multichat.local')
+            WhatsappInstance.objects.create(
+                instance_id=BENCH_INSTANCE_ID, token='benchmark-token', cliente=cliente, status='conectado'
+            )
+
+            server, wapi_url = start_in_thread(WApiSimulator(seed=options['seed'], media_size=16 * 1024))
+            client = Client()
+
+            def send(endpoint, payload):
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.post(endpoint, data=json.dumps(payload), content_type='application/json')
+                return response.status_code, len(queries.captured_queries)
+
+            factory = PayloadFactory(BENCH_INSTANCE_ID, seed=options['seed'])
+            benchmark = IngestBenchmark(send, rate=options['rate'], trace_memory=options['trace_memory'])
+            events = factory.stream(options['warmup'] + options['events'], mix)
+
+            with override_settings(WAPI_BASE_URL=wapi_url, DEBUG=False, MULTICHAT_SETTINGS=multichat_settings), \
+                    self._quiet(options['verbose']):
+                return benchmark.run(events, warmup=options['warmup'])
+        finally:
+            if server:
+                server.shutdown()
+            shutil.rmtree(media_dir, ignore_errors=True)
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+
+    def _run_http(self, options, mix):
+        """Envia para um servidor em execução (sem contagem de consultas)."""
+        import threading
+        import requests
+
+        if not options['instance_id']:
+            raise CommandError('--instance-id é obrigatório no modo --url (instância existente no servidor)')
+
+        base_url = options['url'].rstrip('/')
+        local = threading.local()
+
+        def session():
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            return local.session
+
+        def send(endpoint, payload):
+            try:
+                response = session().post(f"{base_url}{endpoint}", json=payload, timeout=60)
+                return response.status_code, None
+            except requests.RequestException:
+                return 'erro_conexao', None
+
+        factory = PayloadFactory(options['instance_id'], seed=options['seed'])
+        events = factory.stream(options['warmup'] + options['events'], mix)
+
+        if options['concurrency'] <= 1:
+            benchmark = IngestBenchmark(send, rate=options['rate'], trace_memory=options['trace_memory'])
+            return benchmark.run(events, warmup=options['warmup'])
+
+        # Concorrência: cada worker consome do mesmo gerador; latência medida por requisição
+        from concurrent.futures import ThreadPoolExecutor
+        lock = threading.Lock()
+        events = iter(events)
+        for _ in range(options['warmup']):
+            _, endpoint, payload = next(events)
+            send(endpoint, payload)
+
+        def shared_events():
+            while True:
+                with lock:
+                    try:
+                        item = next(events)
+                    except StopIteration:
+                        return
+                yield item
+
+        per_worker_rate = options['rate'] / options['concurrency'] if options['rate'] else 0
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            parts = list(executor.map(
+                lambda _: IngestBenchmark(send, rate=per_worker_rate).run(shared_events()),
+                range(options['concurrency'])
+            ))
+        return merge_results(parts, rate=options['rate'])
+
+    @contextlib.contextmanager
+    def _quiet(self, verbose):
+        """Silencia prints/logs das views para não medir o custo do terminal."""
+        if verbose:
+            yield
+            return
+        logging.disable(logging.CRITICAL)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            try:
+                yield
+            finally:
+                logging.disable(logging.NOTSET)
+
+    def _print_result(self, record):
+        lat = record['latency_ms']
+        qpe = record['queries_per_event']
+        mem = record['memory']
+        self.stdout.write(f"\n⏱️  Vazão: {record['throughput_eps']} eventos/s ({record['events']} em {record['duration_s']}s)")
+        self.stdout.write(f"📊 Latência (ms): p50={lat['p50']} p95={lat['p95']} p99={lat['p99']} max={lat['max']}")
+        if qpe['mean'] is not None:
+            self.stdout.write(f"🗄️  Consultas SQL por evento: média={qpe['mean']} máx={qpe['max']}")
+        self.stdout.write(
+            f"🧠 Memória: RSS +{mem.get('rss_growth_kb')} KB"
+            + (f", tracemalloc +{mem['traced_growth_kb']} KB (pico {mem['traced_peak_kb']} KB)"
+               if mem.get('traced_growth_kb') is not None else '')
+        )
+        self.stdout.write(f"📬 Status HTTP: {record['status_codes']}")
+        self.stdout.write("📋 Por tipo:")
+        for kind, stats in record['per_type'].items():
+            self.stdout.write(f"   {kind:<9} n={stats['events']:<5} p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms")
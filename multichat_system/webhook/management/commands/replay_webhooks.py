@@ -0,0 +1,109 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from webhook.replay import ReplayCheckpoint, WebhookReplay
+
+
+def _parse_moment(value, option):
+    """Aceita data (2024-01-31) ou data/hora ISO (2024-01-31T10:00:00)."""
+    if not value:
+        return None
+    moment = parse_datetime(value)
+    if moment is None:
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"{option} inválido: {value}")
+        moment = timezone.datetime(day.year, day.month, day.day)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class Command(BaseCommand):
+    help = 'Reprocessa WebhookEvents armazenados pelo pipeline de ingestão (em paralelo por chat, com checkpoint)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=str, default=None, help='Início (inclusivo), ex.: 2024-01-31 ou 2024-01-31T10:00')
+        parser.add_argument('--until', type=str, default=None, help='Fim (exclusivo)')
+        parser.add_argument('--cliente-id', type=int, default=None, help='Apenas eventos deste cliente')
+        parser.add_argument('--instance-id', type=str, default=None, help='Apenas eventos desta instância')
+        parser.add_argument('--event-type', action='append', dest='event_types', default=None,
+                            help='Filtra por event_type (pode repetir)')
+        parser.add_argument('--only-failed', action='store_true',
+                            help='Apenas eventos não processados ou com erro')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processos paralelos (padrão: REPLAY_WORKERS; 1 = no próprio processo)')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Eventos por bloco (padrão: REPLAY_CHUNK_SIZE)')
+        parser.add_argument('--no-media', action='store_true', help='Não baixa mídias ao reprocessar')
+        parser.add_argument('--dry-run', action='store_true', help='Apenas mostra o que seria feito')
+        parser.add_argument('--checkpoint', type=str, default=None,
+                            help='Arquivo de checkpoint (padrão: logs/webhook_replay_checkpoint.json)')
+        parser.add_argument('--restart', action='store_true', help='Ignora o checkpoint existente')
+        parser.add_argument('--no-mark', action='store_true',
+                            help='Não atualiza processed/error_message dos eventos')
+        parser.add_argument('--verbose', action='store_true', help='Mantém logs/prints do pipeline')
+
+    def handle(self, *args, **options):
+        filters = {
+            'since': _parse_moment(options['since'], '--since'),
+            'until': _parse_moment(options['until'], '--until'),
+            'cliente_id': options['cliente_id'],
+            'instance_id': options['instance_id'],
+            'event_types': sorted(options['event_types']) if options['event_types'] else None,
+            'only_failed': options['only_failed'],
+        }
+        # Versão serializável dos filtros para validar o checkpoint
+        signature = {key: (value.isoformat() if hasattr(value, 'isoformat') else value)
+                     for key, value in filters.items()}
+
+        checkpoint_path = Path(options['checkpoint'] or Path(settings.BASE_DIR) / 'logs' / 'webhook_replay_checkpoint.json')
+        checkpoint = ReplayCheckpoint(checkpoint_path, signature)
+        if options['restart']:
+            checkpoint.clear()
+        elif not options['dry_run']:
+            try:
+                if checkpoint.load():
+                    self.stdout.write(f"♻️ Retomando após {checkpoint.last_timestamp} ({checkpoint.last_event_id})")
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        def progress(info):
+            stats = info['stats']
+            self.stdout.write(
+                f"🔄 {info['processed']}/{info['total']} eventos - {info['events_per_second']} eventos/s "
+                f"(ok={stats['ok']} duplicadas={stats['duplicate']} ignoradas={stats['ignored']} falhas={stats['failed']})"
+            )
+
+        replay = WebhookReplay(
+            filters,
+            checkpoint=None if options['dry_run'] else checkpoint,
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            dry_run=options['dry_run'],
+            with_media=not options['no_media'],
+            mark_events=not options['no_mark'],
+            quiet=not options['verbose'],
+            progress=progress,
+        )
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('🔍 Dry-run: nenhuma alteração será gravada'))
+
+        try:
+            result = replay.run()
+        except KeyboardInterrupt:
+            raise CommandError(f"Interrompido; execute novamente para retomar do checkpoint {checkpoint_path}")
+
+        stats = result['stats']
+        label = 'seriam ingeridos' if options['dry_run'] else 'ingeridos'
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {result['processed']} eventos em {result['duration_s']}s ({result['events_per_second']} eventos/s): "
+            f"{stats['ok']} {label}, {stats['duplicate']} duplicados, {stats['ignored']} ignorados, {stats['failed']} falhas"
+        ))
+        for event_id, error in result['errors'][:10]:
+            self.stdout.write(self.style.ERROR(f"❌ {event_id}: {error}"))
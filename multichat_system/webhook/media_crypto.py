@@ -0,0 +1,220 @@
+"""
+Descriptografia em streaming das mídias do WhatsApp
+
+Arquivos ``.enc`` do WhatsApp são ``AES-256-CBC(plaintext) || HMAC[:10]``. As
+chaves saem do ``mediaKey`` via HKDF-SHA256 (112 bytes) com um ``info`` por
+tipo de mídia:
+
+    iv = [0:16]   cipher_key = [16:48]   mac_key = [48:80]   ref_key = [80:112]
+
+O MAC é ``HMAC-SHA256(mac_key, iv + ciphertext)[:10]``. ``fileEncSha256`` é o
+SHA-256 do arquivo criptografado inteiro e ``fileSha256`` o do plaintext.
+
+Aqui tudo é incremental: cada chunk baixado passa pelo AES-CBC, pelo HMAC e
+pelos dois SHA-256 e o plaintext vai direto para o disco. A memória usada não
+depende do tamanho do arquivo e a verificação não precisa de uma segunda
+leitura.
+"""
+
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+import requests
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+logger = logging.getLogger(__name__)
+
+MEDIA_KEY_INFO = {
+    'image': b'WhatsApp Image Keys',
+    'sticker': b'WhatsApp Image Keys',
+    'video': b'WhatsApp Video Keys',
+    'gif': b'WhatsApp Video Keys',
+    'audio': b'WhatsApp Audio Keys',
+    'ptt': b'WhatsApp Audio Keys',
+    'document': b'WhatsApp Document Keys',
+}
+
+MAC_LENGTH = 10
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class MediaDecryptionError(Exception):
+    """Falha de integridade (MAC/hash) ou dados criptografados inválidos."""
+
+
+def _b64(value: Union[str, bytes, None]) -> Optional[bytes]:
+    if value is None or value == '':
+        return None
+    if isinstance(value, bytes):
+        return value
+    return base64.b64decode(value)
+
+
+def hkdf_sha256(key: bytes, length: int, info: bytes, salt: bytes = b'') -> bytes:
+    """HKDF (RFC 5869) com SHA-256."""
+    prk = hmac.new(salt or b'\x00' * 32, key, hashlib.sha256).digest()
+    output = b''
+    block = b''
+    counter = 1
+    while len(output) < length:
+        block = hmac.new(prk, block + info + bytes([counter]), hashlib.sha256).digest()
+        output += block
+        counter += 1
+    return output[:length]
+
+
+def derive_media_keys(media_key: Union[str, bytes], media_type: str) -> Dict[str, bytes]:
+    """Deriva iv/cipher_key/mac_key/ref_key a partir do mediaKey (base64 ou bytes)."""
+    info = MEDIA_KEY_INFO.get(media_type)
+    if info is None:
+        raise ValueError(f"Tipo de mídia sem chave conhecida: {media_type}")
+    expanded = hkdf_sha256(_b64(media_key), 112, info)
+    return {
+        'iv': expanded[:16],
+        'cipher_key': expanded[16:48],
+        'mac_key': expanded[48:80],
+        'ref_key': expanded[80:112],
+    }
+
+
+class StreamingMediaDecryptor:
+    """
+    Descriptografa um arquivo ``.enc`` recebido em pedaços.
+
+    ``update(chunk)`` devolve o plaintext disponível; ``finalize()`` confere
+    MAC e hashes e devolve o último bloco sem padding. Os 10 bytes finais de
+    cada chunk ficam retidos porque podem ser o MAC.
+    """
+
+    def __init__(self, media_key: Union[str, bytes], media_type: str,
+                 file_sha256: Union[str, bytes, None] = None,
+                 file_enc_sha256: Union[str, bytes, None] = None):
+        keys = derive_media_keys(media_key, media_type)
+        self.media_type = media_type
+        self.expected_sha256 = _b64(file_sha256)
+        self.expected_enc_sha256 = _b64(file_enc_sha256)
+
+        self._decryptor = Cipher(
+            algorithms.AES(keys['cipher_key']), modes.CBC(keys['iv']), backend=default_backend()
+        ).decryptor()
+        self._unpadder = padding.PKCS7(128).unpadder()
+        self._mac = hmac.new(keys['mac_key'], keys['iv'], hashlib.sha256)
+        self._enc_sha256 = hashlib.sha256()
+        self._plain_sha256 = hashlib.sha256()
+        self._tail = b''
+        self.encrypted_size = 0
+        self.plaintext_size = 0
+
+    def update(self, chunk: bytes) -> bytes:
+        if not chunk:
+            return b''
+        self._enc_sha256.update(chunk)
+        self.encrypted_size += len(chunk)
+
+        data = self._tail + chunk
+        if len(data) <= MAC_LENGTH:
+            self._tail = data
+            return b''
+        ciphertext, self._tail = data[:-MAC_LENGTH], data[-MAC_LENGTH:]
+
+        self._mac.update(ciphertext)
+        plaintext = self._unpadder.update(self._decryptor.update(ciphertext))
+        self._plain_sha256.update(plaintext)
+        self.plaintext_size += len(plaintext)
+        return plaintext
+
+    def finalize(self) -> bytes:
+        if len(self._tail) < MAC_LENGTH:
+            raise MediaDecryptionError('Arquivo criptografado truncado (sem MAC)')
+
+        if not hmac.compare_digest(self._mac.digest()[:MAC_LENGTH], self._tail):
+            raise MediaDecryptionError('MAC inválido: mediaKey incorreta ou arquivo corrompido')
+
+        if self.expected_enc_sha256 and self._enc_sha256.digest() != self.expected_enc_sha256:
+            raise MediaDecryptionError('fileEncSha256 não confere')
+
+        try:
+            plaintext = self._unpadder.update(self._decryptor.finalize()) + self._unpadder.finalize()
+        except ValueError as e:
+            raise MediaDecryptionError(f"Padding inválido: {e}")
+
+        self._plain_sha256.update(plaintext)
+        self.plaintext_size += len(plaintext)
+
+        if self.expected_sha256 and self._plain_sha256.digest() != self.expected_sha256:
+            raise MediaDecryptionError('fileSha256 não confere')
+        return plaintext
+
+    @property
+    def file_sha256(self) -> str:
+        """SHA-256 do plaintext em base64 (mesmo formato do webhook); válido após finalize()."""
+        return base64.b64encode(self._plain_sha256.digest()).decode()
+
+
+def decrypt_stream_to_file(chunks: Iterable[bytes], dest_path: Union[str, Path],
+                           media_key: Union[str, bytes], media_type: str,
+                           file_sha256: Union[str, bytes, None] = None,
+                           file_enc_sha256: Union[str, bytes, None] = None) -> Dict:
+    """
+    Descriptografa ``chunks`` gravando o plaintext em ``dest_path``.
+
+    Escreve num arquivo temporário ao lado do destino e só renomeia depois da
+    verificação; em caso de falha nada fica no disco.
+    """
+    dest_path = Path(dest_path)
+    dest_path.parent.mkdir(parents=True, exist_ok=True)
+    decryptor = StreamingMediaDecryptor(media_key, media_type, file_sha256, file_enc_sha256)
+
+    fd, tmp_name = tempfile.mkstemp(prefix='.decrypt_', dir=dest_path.parent)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in chunks:
+                out.write(decryptor.update(chunk))
+            out.write(decryptor.finalize())
+        os.replace(tmp_name, dest_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+    return {
+        'file_path': str(dest_path),
+        'file_size': decryptor.plaintext_size,
+        'encrypted_size': decryptor.encrypted_size,
+        'file_sha256': decryptor.file_sha256,
+    }
+
+
+def download_and_decrypt(url: str, dest_path: Union[str, Path], media_key: Union[str, bytes],
+                         media_type: str, file_sha256: Union[str, bytes, None] = None,
+                         file_enc_sha256: Union[str, bytes, None] = None,
+                         timeout: int = 30, session: Optional[requests.Session] = None) -> Dict:
+    """Baixa a mídia criptografada do WhatsApp e descriptografa durante o download."""
+    http = session or requests
+    logger.info(f"🔐 Baixando e descriptografando {media_type}: {url[:80]}")
+    with http.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        result = decrypt_stream_to_file(
+            response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE),
+            dest_path, media_key, media_type, file_sha256, file_enc_sha256
+        )
+    logger.info(f"✅ Mídia descriptografada: {result['file_size']} bytes -> {result['file_path']}")
+    return result
+
+
+def decrypt_media_bytes(encrypted_data: bytes, media_key: Union[str, bytes], media_type: str,
+                        file_sha256: Union[str, bytes, None] = None,
+                        file_enc_sha256: Union[str, bytes, None] = None) -> bytes:
+    """Atalho para dados já em memória (arquivos pequenos e compatibilidade)."""
+    decryptor = StreamingMediaDecryptor(media_key, media_type, file_sha256, file_enc_sha256)
+    return decryptor.update(encrypted_data) + decryptor.finalize()
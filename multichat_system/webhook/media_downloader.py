@@ -21,7 +21,11 @@ from django.utils import timezone
 from django.db import transaction
 
 from .models import WebhookEvent, MessageMedia
+from core import file_links
+from core.media_store import adopt_file, get_media_storage_dir, materialize
 from core.models import Cliente, Chat, Mensagem
+from core.previews import schedule_preview
+from core.utils import get_wapi_base_url
 
 logger = logging.getLogger(__name__)
 
@@ -36,7 +40,7 @@ class MultiChatMediaDownloader:
         self.cliente = cliente
         self.instance_id = instance_id or cliente.wapi_instance_id
         self.bearer_token = bearer_token or cliente.wapi_token
-        self.base_url = "https://api.w-api.app/v1"
+        self.base_url = get_wapi_base_url().rstrip('/')
         
         # Configurar pastas de mídia por cliente (nova estrutura)
         self._setup_media_folders()
@@ -48,7 +52,7 @@ class MultiChatMediaDownloader:
     def _setup_media_folders(self):
         """Configura as pastas de mídia organizadas por cliente"""
         # Pasta base para mídias (usar media_storage como na migração)
-        media_base = Path(__file__).parent.parent / "media_storage"
+        media_base = get_media_storage_dir()
         media_base.mkdir(exist_ok=True)
         
         # Nome do cliente normalizado (igual ao que usamos em reorganizar_arquivo_por_cliente)
@@ -349,6 +353,19 @@ class MultiChatMediaDownloader:
                 logger.error(f"❌ {campo} ausente - necessário para descriptografia")
                 return None
                 
+        # Conteúdo já armazenado (encaminhado de outro chat): só cria o link
+        reaproveitado = self._reaproveitar_midia(info_midia, message_id, sender_name)
+        if reaproveitado:
+            return reaproveitado
+        
+        # fileLink ainda válido de um pedido anterior: baixar sem chamar a W-API
+        link_em_cache = file_links.get_cached(self.instance_id, info_midia['mediaKey'])
+        if link_em_cache:
+            caminho = self._baixar_via_filelink(link_em_cache, info_midia, message_id, sender_name)
+            if caminho:
+                return caminho
+            file_links.invalidate(self.instance_id, info_midia['mediaKey'])
+                
         # URL da API de download
         url = f"{self.base_url}/message/download-media"
         headers = {
@@ -386,6 +403,7 @@ class MultiChatMediaDownloader:
                         # Se há fileLink, tentar download direto
                         if 'fileLink' in result and result['fileLink']:
                             logger.info(f"   🔄 Tentando download direto via fileLink...")
+                            file_links.store(self.instance_id, info_midia['mediaKey'], result['fileLink'], result.get('expires'))
                             return self._baixar_via_filelink(result['fileLink'], info_midia, message_id, sender_name)
                             
                         return None
@@ -403,6 +421,7 @@ class MultiChatMediaDownloader:
                     elif 'fileLink' in result and result['fileLink']:
                         # API retornou link direto
                         logger.info(f"   🔄 API retornou fileLink, fazendo download direto...")
+                        file_links.store(self.instance_id, info_midia['mediaKey'], result['fileLink'], result.get('expires'))
                         return self._baixar_via_filelink(result['fileLink'], info_midia, message_id, sender_name)
                         
                     if not media_data:
@@ -503,6 +522,7 @@ class MultiChatMediaDownloader:
                         
                     # Mover arquivo temporário para definitivo
                     caminho_temp.rename(caminho_arquivo)
+                    self._armazenar_por_conteudo(caminho_arquivo, info_midia)
                     
                     logger.info(f"✅ {info_midia['type'].title()} salvo: {caminho_arquivo}")
                     return str(caminho_arquivo)
@@ -525,6 +545,25 @@ class MultiChatMediaDownloader:
             logger.error(f"❌ Erro na descriptografia: {e}")
             return None
             
+    def _reaproveitar_midia(self, info_midia: Dict, message_id: str, sender_name: str) -> Optional[str]:
+        """Cria o arquivo do chat a partir do armazenamento por conteúdo, sem baixar"""
+        try:
+            chat_id = getattr(self, '_current_chat_id', 'unknown')
+            nome_arquivo = self.gerar_nome_arquivo(info_midia, message_id, sender_name)
+            destino = self.get_chat_media_path(chat_id, info_midia['type']) / nome_arquivo
+            caminho = materialize(info_midia.get('fileSha256'), destino)
+            return str(caminho) if caminho else None
+        except Exception as e:
+            logger.warning(f"⚠️ Não foi possível reaproveitar mídia armazenada: {e}")
+            return None
+            
+    def _armazenar_por_conteudo(self, caminho_arquivo: Path, info_midia: Dict):
+        """Registra o arquivo baixado no armazenamento deduplicado (falha não impede o download)"""
+        try:
+            adopt_file(caminho_arquivo, info_midia.get('fileSha256'))
+        except Exception as e:
+            logger.warning(f"⚠️ Falha ao deduplicar {caminho_arquivo}: {e}")
+            
     def _baixar_via_filelink(self, file_url: str, info_midia: Dict, message_id: str, sender_name: str) -> Optional[str]:
         """Baixa mídia usando URL direta fornecida pela API"""
         try:
@@ -572,6 +611,7 @@ class MultiChatMediaDownloader:
                     
                 # Mover para definitivo
                 caminho_temp.rename(caminho_arquivo)
+                self._armazenar_por_conteudo(caminho_arquivo, info_midia)
                 
                 logger.info(f"✅ {info_midia['type'].title()} baixado via fileLink: {caminho_arquivo}")
                 return str(caminho_arquivo)
@@ -653,6 +693,7 @@ class MultiChatMediaDownloader:
                     message_media.download_status = 'success'
                     message_media.save()
                     logger.info(f"✅ Mídia salva: {caminho_arquivo}")
+                    schedule_preview(message_id, caminho_arquivo, info_midia['type'], info_midia.get('mimetype'))
                 else:
                     message_media.download_status = 'failed'
                     message_media.save()
@@ -17,7 +17,7 @@ sys.path.append(str(Path(__file__).parent.parent))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'multichat.settings')
 django.setup()
 
-from core.models import Cliente, WhatsappInstance
+from core.models import Cliente, MediaFile, WhatsappInstance
 from core.media_manager import MultiChatMediaManager
 from webhook.models import WebhookEvent, Message, MessageMedia
 
@@ -240,17 +240,12 @@ class WebhookMediaProcessor:
             media_manager: Gerenciador de mídias
         """
         try:
-            # Buscar mídias no banco local do gerenciador
-            import sqlite3
-            with sqlite3.connect(media_manager.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT media_type, file_path, mimetype, file_size, download_status
-                    FROM midias 
-                    WHERE message_id = ? AND download_status = 'success'
-                ''', (message_id,))
-                
-                midias = cursor.fetchall()
+            # Mídias já baixadas desta mensagem (core.MediaFile, banco principal)
+            midias = MediaFile.objects.filter(
+                message_id=message_id,
+                cliente_id=media_manager.cliente_id,
+                download_status='success'
+            ).values_list('media_type', 'file_path', 'mimetype', 'file_size', 'download_status')
             
             # Criar registros MessageMedia no Django
             for media_type, file_path, mimetype, file_size, status in midias:
@@ -438,6 +433,7 @@ def run_media_processor():
     Executa o processador de mídias em modo contínuo
     """
     import time
+    from core.media_retry import run_due, seconds_until_next_due
     
     logger.info("🚀 Iniciando processador de mídias em modo contínuo...")
     
@@ -449,13 +445,16 @@ def run_media_processor():
             # Reprocessar eventos com falha
             reprocessed = media_processor.reprocess_failed_events(limit=25)
             
+            # Downloads de mídia com nova tentativa vencida (backoff persistido no MediaFile)
+            retried = run_due(limit=50)
+            
             # Mostrar estatísticas a cada 5 minutos
-            if processed > 0 or reprocessed > 0:
+            if processed > 0 or reprocessed > 0 or retried['claimed'] > 0:
                 stats = media_processor.get_statistics()
-                logger.info(f"📊 Estatísticas: {stats}")
+                logger.info(f"📊 Estatísticas: {stats} | downloads reprocessados: {retried}")
             
-            # Aguardar antes da próxima execução
-            time.sleep(30)  # 30 segundos
+            # Aguardar até o próximo download vencer (no máximo 30 segundos)
+            time.sleep(seconds_until_next_due(30))
             
     except KeyboardInterrupt:
         logger.info("⏹️ Processador de mídias interrompido pelo usuário")
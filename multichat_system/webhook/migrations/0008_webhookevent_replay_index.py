@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhook', '0007_criar_messagemedia_antigos'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['timestamp', 'event_id'], name='webhook_web_timesta_496150_idx'),
+        ),
+    ]
@@ -44,6 +44,8 @@ class WebhookEvent(models.Model):
             models.Index(fields=['cliente', 'timestamp']),
             models.Index(fields=['event_type', 'processed']),
             models.Index(fields=['chat_id', 'sender_id']),
+            # Paginação por keyset do replay (order_by('timestamp', 'event_id'))
+            models.Index(fields=['timestamp', 'event_id']),
         ]
 
     def __str__(self):
@@ -2,14 +2,13 @@
 Processadores de webhook para o MultiChat System
 """
 
-import json
 import logging
 from datetime import datetime, timezone
 from typing import Dict, Any, Optional, List
 from django.db import transaction
 from django.utils import timezone as django_timezone
 
-from core.models import Cliente, Chat as CoreChat, Mensagem as CoreMensagem
+from core.models import Cliente, Chat as CoreChat
 from .models import (
     WebhookEvent, Chat, Sender, Message,
     MessageMedia, MessageStats, ContactStats, RealTimeStats
@@ -17,6 +16,7 @@ from .models import (
 from .media_downloader import processar_midias_automaticamente
 from .audio_processor import process_audio_from_webhook
 from .audio_processor_simple import process_audio_from_webhook_simple
+from .ingest import persist_message
 import subprocess
 
 logger = logging.getLogger(__name__)
@@ -197,6 +197,13 @@ class WhatsAppWebhookProcessor:
             
             # Processar com transação
             with transaction.atomic():
+                # core.Chat/core.Mensagem pelo mesmo caminho de escrita dos webhooks
+                # do Django; o registro detalhado (webhook.Message) só para mensagens novas
+                nova = bool(message_id and text_content)
+                if nova:
+                    resultado = persist_message({**data, **payload}, self.cliente, from_me=from_me)
+                    nova = bool(resultado and resultado.created)
+                
                 # Criar/atualizar chat (agora com foto_perfil e detecção melhorada de grupos)
                 chat = self._get_or_create_chat(chat_id, chat_name, is_group=is_group, foto_perfil=foto_perfil)
                 
@@ -204,7 +211,7 @@ class WhatsAppWebhookProcessor:
                 sender = self._get_or_create_sender(sender_id, sender_name, data)
                 
                 # Criar mensagem
-                if message_id and text_content:
+                if nova:
                     message = self._create_message(
                         message_id, chat, sender, message_type, 
                         message_content, text_content, from_me, timestamp
@@ -351,11 +358,6 @@ class WhatsAppWebhookProcessor:
         """
         Cria uma nova mensagem no modelo webhook.Message, preenchendo todos os campos detalhados de mídia e criando registro em MessageMedia se necessário
         """
-        # Verificação de duplicidade
-        if message_id and CoreMensagem.objects.filter(message_id=message_id).exists():
-            logger.info(f"Mensagem já existe: {message_id}")
-            return None
-            
         # VERIFICAR SE É MENSAGEM DE PROTOCOLO (não deve ser salva)
         is_protocol_message = (
             'protocolMessage' in text_content or
@@ -588,84 +590,6 @@ class WhatsAppWebhookProcessor:
             quoted_message_id=quoted_message_id
         )
         
-        # Também criar mensagem no modelo core.Mensagem para compatibilidade com o frontend
-        if not CoreMensagem.objects.filter(message_id=message_id).exists():
-            # Preparar conteúdo estruturado para diferentes tipos de mídia
-            conteudo_estruturado = text_content or "[Mídia]"
-            
-            # Para mensagens de áudio, criar JSON estruturado que o frontend espera
-            if message_type == 'audio' and message_content.get('audioMessage'):
-                import json
-                audio_data = message_content['audioMessage']
-                conteudo_estruturado = json.dumps({
-                    "audioMessage": {
-                        "url": audio_data.get('url', ''),
-                        "mediaKey": audio_data.get('mediaKey', ''),
-                        "mimetype": audio_data.get('mimetype', 'audio/ogg'),
-                        "fileLength": audio_data.get('fileLength', ''),
-                        "seconds": audio_data.get('seconds', 0),
-                        "ptt": audio_data.get('ptt', False),
-                        "directPath": audio_data.get('directPath', ''),
-                        "fileSha256": audio_data.get('fileSha256', ''),
-                        "fileEncSha256": audio_data.get('fileEncSha256', ''),
-                        "mediaKeyTimestamp": audio_data.get('mediaKeyTimestamp', ''),
-                        "waveform": audio_data.get('waveform', '')
-                    }
-                }, ensure_ascii=False)
-                logger.info(f"OK - Criando mensagem de áudio estruturada para frontend")
-            
-            CoreMensagem.objects.create(
-                chat=chat,
-                remetente=sender.push_name or sender.sender_id,
-                conteudo=conteudo_estruturado,
-                tipo=message_type,
-                data_envio=timestamp,
-                from_me=from_me,
-                lida=False,
-                message_id=message_id,  # Adicionar o message_id do webhook
-                # Campos de mídia
-                media_type=media_type,
-                media_url=media_url,
-                media_size=media_size,
-                media_caption=media_caption,
-                media_height=media_height,
-                media_width=media_width,
-                jpeg_thumbnail=jpeg_thumbnail,
-                file_sha256=file_sha256,
-                media_key=media_key,
-                direct_path=direct_path,
-                media_key_timestamp=media_key_timestamp,
-                # Documento
-                document_url=document_url,
-                document_filename=document_filename,
-                document_mimetype=document_mimetype,
-                document_file_length=document_file_length,
-                document_page_count=document_page_count,
-                # Localização
-                location_latitude=location_latitude,
-                location_longitude=location_longitude,
-                location_name=location_name,
-                location_address=location_address,
-                # Enquete
-                poll_name=poll_name,
-                poll_options=json.dumps(poll_options) if poll_options else None,
-                poll_selectable_count=poll_selectable_count,
-                # Sticker
-                sticker_url=sticker_url,
-                sticker_mimetype=sticker_mimetype,
-                sticker_file_length=sticker_file_length,
-                sticker_is_animated=sticker_is_animated,
-                sticker_is_avatar=sticker_is_avatar,
-                sticker_is_ai=sticker_is_ai,
-                sticker_is_lottie=sticker_is_lottie,
-                # Thumbnails
-                thumbnail_direct_path=thumbnail_direct_path,
-                thumbnail_sha256=thumbnail_sha256,
-                thumbnail_enc_sha256=thumbnail_enc_sha256,
-                thumbnail_height=thumbnail_height,
-                thumbnail_width=thumbnail_width
-            )
-        
         # Atualizar estatísticas
         self._update_stats(chat, sender, message, timestamp)
 
@@ -766,11 +690,6 @@ class WhatsAppWebhookProcessor:
             sender_name = sender_data.get('pushName', '')
             message_id = data.get('messageId', webhook_event.event_id.hex)
             
-            # Verificar se a mensagem já foi processada
-            if message_id and CoreMensagem.objects.filter(message_id=message_id).exists():
-                logger.info(f"[FALLBACK] Mensagem já processada: {message_id}")
-                return
-            
             # PRIORIDADE 1: Usar chat['id'] se disponível (como no exemplo)
             chat_id = None
             if chat_data and chat_data.get('id'):
@@ -884,104 +803,50 @@ class WhatsAppWebhookProcessor:
             webhook_event.message_content = text_content
             webhook_event.save()
 
-            with transaction.atomic():
-                # Criar/atualizar chat (seguindo a estrutura dos dados mockados)
-                chat = self._get_or_create_chat_mock_structure(chat_id, sender_name, is_group, group_name, profile_picture)
-                if not chat or not chat.chat_id:
-                    logger.error(f"[FALLBACK] Falha ao criar chat para chat_id: {chat_id}")
-                    webhook_event.error_message = f'Falha ao criar chat para chat_id: {chat_id}'
-                    webhook_event.save()
-                    return
-                
-                # VERIFICAR SE É MENSAGEM DE PROTOCOLO (não deve ser salva)
-                is_protocol_message = (
-                    'protocolMessage' in text_content or
-                    'APP_STATE_SYNC_KEY_REQUEST' in text_content or
-                    'deviceListMetadata' in text_content or
-                    'messageContextInfo' in text_content or
-                    'senderKeyHash' in text_content or
-                    'senderTimestamp' in text_content or
-                    'deviceListMetadataVersion' in text_content or
-                    'keyIds' in text_content or
-                    'keyId' in text_content or
-                    'AAAAACSE' in text_content
-                )
-                
-                # Criar mensagem usando core.Mensagem (apenas se não existir e não for protocolo)
-                # Para áudios e outras mídias, o text_content pode estar vazio, mas temos msg_content
-                has_valid_content = text_content or (msg_content and any(key in msg_content for key in ['audioMessage', 'imageMessage', 'videoMessage', 'documentMessage']))
-                
-                if message_id and has_valid_content and not is_protocol_message and not CoreMensagem.objects.filter(message_id=message_id).exists():
-                    # Buscar ou criar chat no modelo core.Chat
-                    core_chat, created = CoreChat.objects.get_or_create(
-                        chat_id=chat_id,
-                        cliente=self.cliente,
-                        defaults={
-                            'chat_name': sender_name or sender_id or "desconhecido",
-                            'is_group': is_group,
-                            'canal': 'whatsapp',
-                            'status': 'ativo',
-                            'last_message_at': django_timezone.now(),
-                            'foto_perfil': profile_picture
-                        }
-                    )
-                    
-                    # Atualizar chat se já existia
-                    if not created:
-                        core_chat.chat_name = sender_name or sender_id or "desconhecido"
-                        core_chat.last_message_at = django_timezone.now()
-                        if profile_picture:
-                            core_chat.foto_perfil = profile_picture
-                        core_chat.save()
-                    
-                    # Preparar conteúdo estruturado para diferentes tipos de mídia
-                    conteudo_estruturado = text_content or "[Mídia]"
-                    
-                    # Para mensagens de áudio, criar JSON estruturado que o frontend espera
-                    if message_type == 'audio' and msg_content.get('audioMessage'):
-                        import json
-                        audio_data = msg_content['audioMessage']
-                        conteudo_estruturado = json.dumps({
-                            "audioMessage": {
-                                "url": audio_data.get('url', ''),
-                                "mediaKey": audio_data.get('mediaKey', ''),
-                                "mimetype": audio_data.get('mimetype', 'audio/ogg'),
-                                "fileLength": audio_data.get('fileLength', ''),
-                                "seconds": audio_data.get('seconds', 0),
-                                "ptt": audio_data.get('ptt', False),
-                                "directPath": audio_data.get('directPath', ''),
-                                "fileSha256": audio_data.get('fileSha256', ''),
-                                "fileEncSha256": audio_data.get('fileEncSha256', ''),
-                                "mediaKeyTimestamp": audio_data.get('mediaKeyTimestamp', ''),
-                                "waveform": audio_data.get('waveform', '')
-                            }
-                        }, ensure_ascii=False)
-                        logger.info(f"[FALLBACK] OK - Criando mensagem de áudio estruturada")
-                    
-                    CoreMensagem.objects.create(
-                        chat=core_chat,  # Agora usando o chat do modelo core.Chat
-                        remetente=sender_name or sender_id or "desconhecido",
-                        conteudo=conteudo_estruturado,
-                        tipo=message_type,
-                        lida=False,
-                        from_me=from_me,
-                        message_id=message_id,
-                        data_envio=django_timezone.now()
-                    )
-                    logger.info(f"[FALLBACK] ✅ Mensagem criada com sucesso: {message_id}")
-                    
-                    # CORREÇÃO CRÍTICA: Processar download automático de mídias no fallback
-                    try:
-                        from .media_downloader import processar_midias_automaticamente
-                        logger.info(f"[FALLBACK] 🔄 Iniciando download automático de mídia...")
-                        processar_midias_automaticamente(webhook_event)
-                        logger.info(f"[FALLBACK] ✅ Download automático processado para mensagem {message_id}")
-                    except Exception as e:
-                        logger.error(f"[FALLBACK] ❌ Erro no download automático: {e}")
-                else:
-                    logger.info(f"[FALLBACK] Mensagem já existe ou conteúdo vazio: {message_id}")
-                
-                logger.info(f"[FALLBACK] ✅ Chat processado com sucesso para chat_id: {chat_id}")
+            # VERIFICAR SE É MENSAGEM DE PROTOCOLO (não deve ser salva)
+            is_protocol_message = (
+                'protocolMessage' in text_content or
+                'APP_STATE_SYNC_KEY_REQUEST' in text_content or
+                'deviceListMetadata' in text_content or
+                'messageContextInfo' in text_content or
+                'senderKeyHash' in text_content or
+                'senderTimestamp' in text_content or
+                'deviceListMetadataVersion' in text_content or
+                'keyIds' in text_content or
+                'keyId' in text_content or
+                'AAAAACSE' in text_content
+            )
+            
+            # Para áudios e outras mídias, o text_content pode estar vazio, mas temos msg_content
+            has_valid_content = text_content or (msg_content and any(key in msg_content for key in ['audioMessage', 'imageMessage', 'videoMessage', 'documentMessage']))
+            
+            if not has_valid_content or is_protocol_message:
+                logger.info(f"[FALLBACK] Mensagem de protocolo ou conteúdo vazio: {message_id}")
+                return
+            
+            # Mesmo caminho de escrita dos webhooks do Django (chat, mensagem e descritor da mídia)
+            resultado = persist_message(
+                {**data, 'messageId': message_id, 'chat': {**chat_data, 'id': chat_id}}, self.cliente, from_me=from_me
+            )
+            if resultado is None:
+                webhook_event.error_message = f'Falha ao criar chat para chat_id: {chat_id}'
+                webhook_event.save()
+                return
+            if not resultado.created:
+                logger.info(f"[FALLBACK] Mensagem já processada: {message_id}")
+                return
+            
+            if profile_picture and resultado.chat.foto_perfil != profile_picture:
+                CoreChat.objects.filter(pk=resultado.chat.pk).update(foto_perfil=profile_picture)
+            logger.info(f"[FALLBACK] ✅ Mensagem criada com sucesso: {message_id}")
+            
+            # CORREÇÃO CRÍTICA: Processar download automático de mídias no fallback
+            try:
+                logger.info(f"[FALLBACK] 🔄 Iniciando download automático de mídia...")
+                processar_midias_automaticamente(webhook_event)
+                logger.info(f"[FALLBACK] ✅ Download automático processado para mensagem {message_id}")
+            except Exception as e:
+                logger.error(f"[FALLBACK] ❌ Erro no download automático: {e}")
                 
         except Exception as e:
             logger.error(f"Erro no fallback sender/msgContent: {e}")
@@ -989,53 +854,6 @@ class WhatsAppWebhookProcessor:
             webhook_event.save()
             raise
 
-    def _get_or_create_chat_mock_structure(self, chat_id: str, sender_name: str, is_group: bool = False, group_name: str = None, profile_picture: str = None) -> Chat:
-        """
-        Cria ou obtém um chat seguindo a estrutura dos dados mockados
-        Se já existir, atualiza os campos relevantes com os dados mais recentes
-        """
-        try:
-            logger.info(f"[FALLBACK] Tentando criar/obter chat: chat_id={chat_id}, sender_name={sender_name}, is_group={is_group}, profile_picture={profile_picture}")
-            
-            # VALIDAÇÃO: Garantir que chat_id não seja vazio
-            safe_chat_id = chat_id or "sem_id"
-            if not safe_chat_id or str(safe_chat_id).strip() == '':
-                logger.error(f"[FALLBACK] chat_id está vazio ou None: '{chat_id}' (bloqueado por validação extra)")
-                return None
-            
-            # Usar get_or_create para evitar problemas de duplicação
-            safe_chat_name = sender_name or (group_name if is_group else safe_chat_id)
-            chat, created = CoreChat.objects.get_or_create(
-                chat_id=safe_chat_id,
-                cliente=self.cliente,
-                defaults={
-                    'chat_name': safe_chat_name,
-                    'is_group': is_group,
-                    'canal': 'whatsapp',
-                    'status': 'ativo',
-                    'last_message_at': django_timezone.now(),
-                    'foto_perfil': profile_picture
-                }
-            )
-            
-            # Se chat já existia, atualizar campos relevantes
-            if not created:
-                chat.status = 'ativo'
-                chat.last_message_at = django_timezone.now()
-                # Atualizar foto de perfil se uma nova foi fornecida
-                if profile_picture and chat.foto_perfil != profile_picture:
-                    chat.foto_perfil = profile_picture
-                chat.save()
-                logger.info(f"[FALLBACK] Chat existente atualizado: {chat.chat_id} - Foto: {profile_picture}")
-            else:
-                logger.info(f"[FALLBACK] Chat criado: {chat.chat_id} - Foto: {profile_picture}")
-            
-            return chat
-        except Exception as e:
-            logger.error(f"[FALLBACK] Erro ao criar/obter chat: {e}")
-            logger.error(f"[FALLBACK] Parâmetros: chat_id={chat_id}, sender_name={sender_name}, is_group={is_group}, group_name={group_name}, profile_picture={profile_picture}")
-            return None
-
 
 class WebhookValidator:
     """
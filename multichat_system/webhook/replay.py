@@ -0,0 +1,368 @@
+"""
+Reprocessamento (replay) de eventos de webhook armazenados
+
+Lê ``WebhookEvent.raw_data`` em blocos, ordenados por (timestamp, event_id),
+e reenvia cada payload pelo mesmo pipeline de ingestão dos webhooks
+(``process_webhook_message``). Os eventos de um bloco são divididos por chat
+entre processos: todos os eventos de um mesmo chat caem no mesmo shard e são
+processados em ordem. O checkpoint é gravado ao fim de cada bloco, então uma
+execução interrompida retoma do último bloco concluído.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CONTENT_KEYS = ('imageMessage', 'videoMessage', 'audioMessage', 'documentMessage', 'stickerMessage')
+
+OUTCOMES = ('ok', 'duplicate', 'ignored', 'failed')
+
+
+def _get_setting(key: str, default):
+    return getattr(settings, 'MULTICHAT_SETTINGS', {}).get(key, default)
+
+
+def is_message_payload(raw_data: Dict) -> bool:
+    """Eventos de presença/status/conexão não são reprocessados (só mensagens)."""
+    if not isinstance(raw_data, dict):
+        return False
+    return bool(raw_data.get('msgContent') or (raw_data.get('key') and raw_data.get('chat')))
+
+
+def extract_message_id(raw_data: Dict) -> str:
+    return raw_data.get('messageId') or (raw_data.get('key') or {}).get('id') or ''
+
+
+def chat_key(raw_data: Dict, fallback: str = '') -> str:
+    """Chave de ordenação: eventos com a mesma chave ficam no mesmo shard."""
+    chat = raw_data.get('chat') or {}
+    return chat.get('id') or (raw_data.get('key') or {}).get('remoteJid') or fallback or ''
+
+
+def shard_for(key: str, shards: int) -> int:
+    # crc32 é estável entre processos (hash() não é)
+    return zlib.crc32(key.encode('utf-8')) % shards if shards > 1 else 0
+
+
+def interpret_result(result) -> Tuple[str, Optional[str]]:
+    """Converte o retorno do pipeline (bool ou JsonResponse) em (resultado, erro)."""
+    if result is True:
+        return 'ok', None
+    if result is False or result is None:
+        return 'failed', 'Pipeline retornou falha (instância não encontrada ou erro no processamento)'
+
+    status_code = getattr(result, 'status_code', 200)
+    try:
+        body = json.loads(result.content)
+    except (AttributeError, ValueError):
+        body = {}
+
+    if status_code >= 400:
+        return 'failed', body.get('error') or f"HTTP {status_code}"
+    if body.get('status') == 'ignored':
+        return 'ignored', None
+    return 'ok', None
+
+
+def replay_payload(raw_data: Dict, with_media: bool = True) -> Tuple[str, Optional[str]]:
+    """
+    Reenvia um payload pelo pipeline de ingestão.
+
+    Mensagens já gravadas (mesmo message_id) são puladas antes de chegar ao
+    pipeline, o que também evita baixar a mídia de novo.
+    """
+    from core.models import Mensagem
+    from webhook.views import process_webhook_message, process_whatsapp_message
+
+    if not is_message_payload(raw_data):
+        return 'ignored', None
+
+    message_id = extract_message_id(raw_data)
+    if message_id and Mensagem.objects.filter(message_id=message_id).exists():
+        return 'duplicate', None
+
+    try:
+        if with_media and any(key in (raw_data.get('msgContent') or {}) for key in MEDIA_CONTENT_KEYS):
+            result = process_webhook_message(raw_data, 'replay')
+        else:
+            result = process_whatsapp_message(raw_data, 'replay')
+    except Exception as e:
+        return 'failed', str(e)
+    return interpret_result(result)
+
+
+def classify_payload(raw_data: Dict, known_instances: set) -> Tuple[str, Optional[str]]:
+    """Versão somente-leitura de ``replay_payload`` usada no dry-run."""
+    from core.models import Mensagem
+    from webhook.views import normalize_chat_id
+
+    if not is_message_payload(raw_data):
+        return 'ignored', None
+    message_id = extract_message_id(raw_data)
+    if message_id and Mensagem.objects.filter(message_id=message_id).exists():
+        return 'duplicate', None
+    raw_chat_id = (raw_data.get('chat') or {}).get('id', '')
+    if not normalize_chat_id(raw_chat_id):
+        return 'failed', f"Chat ID inválido: {raw_chat_id}"
+    if raw_data.get('instanceId') not in known_instances:
+        return 'failed', f"Instância {raw_data.get('instanceId')} não encontrada"
+    return 'ok', None
+
+
+# ----------------------------------------------------------------------
+# Worker (processo filho)
+# ----------------------------------------------------------------------
+
+def _init_worker(quiet: bool):
+    """Inicializa o processo filho: Django pronto e conexões próprias."""
+    import django
+    django.setup()
+    # Conexões herdadas via fork não podem ser compartilhadas entre processos
+    connections.close_all()
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+        logging.disable(logging.CRITICAL)
+
+
+def _replay_shard(items: List[Tuple[str, Dict]], with_media: bool) -> List[Tuple[str, str, Optional[str]]]:
+    """Processa um shard em ordem; retorna [(event_id, resultado, erro)]."""
+    results = []
+    for event_id, raw_data in items:
+        outcome, error = replay_payload(raw_data, with_media=with_media)
+        results.append((event_id, outcome, error))
+    return results
+
+
+# ----------------------------------------------------------------------
+# Checkpoint
+# ----------------------------------------------------------------------
+
+class ReplayCheckpoint:
+    """Checkpoint em arquivo JSON, válido apenas para o mesmo conjunto de filtros."""
+
+    def __init__(self, path: Path, filters: Dict):
+        self.path = Path(path)
+        self.filters = filters
+        self.last_timestamp: Optional[str] = None
+        self.last_event_id: Optional[str] = None
+        self.stats: Dict[str, int] = {}
+
+    def load(self) -> bool:
+        if not self.path.exists():
+            return False
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            logger.warning(f"⚠️ Checkpoint ilegível, ignorando: {self.path}")
+            return False
+        if data.get('filters') != self.filters:
+            raise ValueError(
+                f"Checkpoint {self.path} pertence a outros filtros ({data.get('filters')}); "
+                f"use --restart ou outro --checkpoint"
+            )
+        self.last_timestamp = data.get('last_timestamp')
+        self.last_event_id = data.get('last_event_id')
+        self.stats = data.get('stats') or {}
+        return True
+
+    def save(self, last_timestamp: datetime, last_event_id: str, stats: Dict[str, int]):
+        self.last_timestamp = last_timestamp.isoformat()
+        self.last_event_id = str(last_event_id)
+        self.stats = dict(stats)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({
+            'filters': self.filters,
+            'last_timestamp': self.last_timestamp,
+            'last_event_id': self.last_event_id,
+            'stats': self.stats,
+            'updated_at': datetime.now().isoformat(),
+        }, indent=2), encoding='utf-8')
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        with contextlib.suppress(FileNotFoundError):
+            self.path.unlink()
+
+
+# ----------------------------------------------------------------------
+# Engine
+# ----------------------------------------------------------------------
+
+class WebhookReplay:
+    """
+    Reprocessa WebhookEvents em blocos, em paralelo por chat.
+
+    ``workers <= 1`` processa no próprio processo (recomendado com SQLite,
+    que serializa as escritas de qualquer forma).
+    """
+
+    def __init__(self, filters: Dict, checkpoint: Optional[ReplayCheckpoint] = None,
+                 chunk_size: int = None, workers: int = None, dry_run: bool = False,
+                 with_media: bool = True, mark_events: bool = True, quiet: bool = True,
+                 progress: Optional[Callable[[Dict], None]] = None):
+        self.filters = filters
+        self.checkpoint = checkpoint
+        self.chunk_size = chunk_size or _get_setting('REPLAY_CHUNK_SIZE', 500)
+        self.workers = workers if workers is not None else _get_setting('REPLAY_WORKERS', 4)
+        self.dry_run = dry_run
+        self.with_media = with_media
+        self.mark_events = mark_events
+        self.quiet = quiet
+        self.progress = progress
+        self.stats: Dict[str, int] = {outcome: 0 for outcome in OUTCOMES}
+        self.errors: List[Tuple[str, str]] = []
+
+    def queryset(self):
+        from webhook.models import WebhookEvent
+
+        qs = WebhookEvent.objects.all()
+        if self.filters.get('since'):
+            qs = qs.filter(timestamp__gte=self.filters['since'])
+        if self.filters.get('until'):
+            qs = qs.filter(timestamp__lt=self.filters['until'])
+        if self.filters.get('cliente_id'):
+            qs = qs.filter(cliente_id=self.filters['cliente_id'])
+        if self.filters.get('instance_id'):
+            qs = qs.filter(instance_id=self.filters['instance_id'])
+        if self.filters.get('event_types'):
+            qs = qs.filter(event_type__in=self.filters['event_types'])
+        if self.filters.get('only_failed'):
+            qs = qs.filter(Q(processed=False) | Q(error_message__isnull=False)).exclude(error_message='')
+        return qs.order_by('timestamp', 'event_id')
+
+    def iter_chunks(self) -> Iterator[List[Tuple[str, datetime, str, Dict]]]:
+        """Paginação por chave (timestamp, event_id) a partir do checkpoint."""
+        from django.utils.dateparse import parse_datetime
+
+        last_ts = last_id = None
+        if self.checkpoint and self.checkpoint.last_timestamp:
+            last_ts = parse_datetime(self.checkpoint.last_timestamp)
+            last_id = self.checkpoint.last_event_id
+
+        base = self.queryset().values_list('event_id', 'timestamp', 'chat_id', 'raw_data')
+        while True:
+            qs = base
+            if last_ts is not None:
+                qs = qs.filter(Q(timestamp__gt=last_ts) | Q(timestamp=last_ts, event_id__gt=last_id))
+            rows = list(qs[:self.chunk_size])
+            if not rows:
+                return
+            yield rows
+            last_ts, last_id = rows[-1][1], rows[-1][0]
+
+    def _shard(self, rows) -> List[List[Tuple[str, Dict]]]:
+        shards: List[List[Tuple[str, Dict]]] = [[] for _ in range(max(1, self.workers))]
+        for event_id, _, stored_chat_id, raw_data in rows:
+            key = chat_key(raw_data or {}, stored_chat_id or '')
+            shards[shard_for(key, len(shards))].append((str(event_id), raw_data or {}))
+        return [shard for shard in shards if shard]
+
+    def _process_chunk(self, rows, executor) -> List[Tuple[str, str, Optional[str]]]:
+        if self.dry_run:
+            from core.models import WhatsappInstance
+            known = set(WhatsappInstance.objects.values_list('instance_id', flat=True))
+            return [(str(event_id), *classify_payload(raw_data or {}, known)) for event_id, _, _, raw_data in rows]
+
+        shards = self._shard(rows)
+        if executor is None:
+            with self._quiet():
+                return [result for shard in shards for result in _replay_shard(shard, self.with_media)]
+
+        futures = [executor.submit(_replay_shard, shard, self.with_media) for shard in shards]
+        return [result for future in futures for result in future.result()]
+
+    @contextlib.contextmanager
+    def _quiet(self):
+        if not self.quiet:
+            yield
+            return
+        logging.disable(logging.CRITICAL)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            try:
+                yield
+            finally:
+                logging.disable(logging.NOTSET)
+
+    def _mark(self, results):
+        """Atualiza processed/error_message dos eventos reprocessados."""
+        from webhook.models import WebhookEvent
+
+        # Ignorados (presença, status...) também: não há o que reprocessar, e --only-failed não os traz de volta
+        done = [event_id for event_id, outcome, _ in results if outcome in ('ok', 'duplicate', 'ignored')]
+        if done:
+            WebhookEvent.objects.filter(event_id__in=done).update(processed=True, error_message=None)
+        for event_id, outcome, error in results:
+            if outcome == 'failed':
+                WebhookEvent.objects.filter(event_id=event_id).update(error_message=error)
+
+    def run(self) -> Dict:
+        if self.checkpoint:
+            for outcome, count in self.checkpoint.stats.items():
+                if outcome in self.stats:
+                    self.stats[outcome] = count
+
+        total = self.queryset().count()
+        processed = 0
+        started = time.monotonic()
+
+        executor = None
+        if not self.dry_run and self.workers > 1:
+            # Cada processo abre sua própria conexão; fecha as do pai antes do fork
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker, initargs=(self.quiet,)
+            )
+
+        try:
+            for rows in self.iter_chunks():
+                results = self._process_chunk(rows, executor)
+                for event_id, outcome, error in results:
+                    self.stats[outcome] += 1
+                    if error and len(self.errors) < 100:
+                        self.errors.append((event_id, error))
+
+                if not self.dry_run:
+                    if self.mark_events:
+                        self._mark(results)
+                    if self.checkpoint:
+                        self.checkpoint.save(rows[-1][1], rows[-1][0], self.stats)
+
+                processed += len(rows)
+                if self.progress:
+                    elapsed = time.monotonic() - started
+                    self.progress({
+                        'processed': processed,
+                        'total': total,
+                        'events_per_second': round(processed / elapsed, 1) if elapsed else 0.0,
+                        'stats': dict(self.stats),
+                    })
+        finally:
+            if executor:
+                executor.shutdown(wait=True)
+
+        elapsed = time.monotonic() - started
+        if self.checkpoint and not self.dry_run:
+            self.checkpoint.clear()
+        return {
+            'processed': processed,
+            'total': total,
+            'duration_s': round(elapsed, 2),
+            'events_per_second': round(processed / elapsed, 1) if elapsed else 0.0,
+            'stats': dict(self.stats),
+            'errors': self.errors,
+        }
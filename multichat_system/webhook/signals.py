@@ -4,22 +4,68 @@ Signals para o app webhook
 
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.core.cache import cache
 from django.utils import timezone
+from core import tenant_cache
 from core.models import Mensagem, Chat
 
-# Cache para armazenar atualizações pendentes
+# Atualizações pendentes em cache (core.tenant_cache), um anel por cliente e outro
+# com todos os clientes para os administradores. Cada atualização tem chave própria
+# (posição = número de sequência % REALTIME_MAX_UPDATES) e o número vem de um incr
+# atômico: workers gravando ao mesmo tempo não sobrescrevem a lista um do outro.
 REALTIME_CACHE_KEY = "realtime_updates"
 REALTIME_CACHE_TIMEOUT = 300
+REALTIME_MAX_UPDATES = 100
+TODOS_OS_CLIENTES = 'all'
 
-def notify_realtime_update(update_type, chat_id, data):
+
+def _chave_da_posicao(seq):
+    return f"{REALTIME_CACHE_KEY}:{seq % REALTIME_MAX_UPDATES}"
+
+
+def get_realtime_updates(cliente_id=None):
+    """
+    Atualizações recentes do cliente (None = todos, para administradores)
+    """
+    escopo = TODOS_OS_CLIENTES if cliente_id is None else cliente_id
+    cache = tenant_cache.TenantCache(escopo)
+    ultima = cache.get(tenant_cache.REALTIME, f"{REALTIME_CACHE_KEY}:seq")
+    if not ultima:
+        return []
+    sequencias = range(max(1, ultima - REALTIME_MAX_UPDATES + 1), ultima + 1)
+    guardadas = cache.get_many(tenant_cache.REALTIME, [_chave_da_posicao(seq) for seq in sequencias])
+    updates = []
+    for seq in sequencias:
+        item = guardadas.get(_chave_da_posicao(seq))
+        # Posição vazia (expirou ou ainda sendo gravada) ou já reaproveitada por uma mais nova
+        if item and item[0] == seq:
+            updates.append(item[1])
+    return updates
+
+
+def _salvar_atualizacoes(cliente_id, novas):
+    # Anel do cliente e o geral, cada um com as últimas REALTIME_MAX_UPDATES; devolve o total do cliente
+    novas = novas[-REALTIME_MAX_UPDATES:]
+    if not novas:
+        return 0
+    totais = []
+    for escopo in (cliente_id, TODOS_OS_CLIENTES):
+        cache = tenant_cache.TenantCache(escopo)
+        ultima = cache.incr(tenant_cache.REALTIME, f"{REALTIME_CACHE_KEY}:seq", len(novas))
+        primeira = ultima - len(novas) + 1
+        cache.set_many(
+            tenant_cache.REALTIME,
+            {_chave_da_posicao(seq): (seq, update) for seq, update in enumerate(novas, start=primeira)},
+            REALTIME_CACHE_TIMEOUT,
+        )
+        totais.append(min(ultima, REALTIME_MAX_UPDATES))
+    return totais[0]
+
+
+def notify_realtime_update(update_type, chat_id, data, cliente_id):
     """
     Notifica uma atualização em tempo real
     """
     try:
-        # Obter atualizações existentes do cache
-        updates = cache.get(REALTIME_CACHE_KEY, [])
-        
         # Criar nova atualização
         update = {
             'type': update_type,
@@ -28,34 +74,25 @@ def notify_realtime_update(update_type, chat_id, data):
             'data': data
         }
         
-        # Adicionar à lista de atualizações
-        updates.append(update)
-        
-        # Manter apenas as últimas 100 atualizações para evitar overflow
-        if len(updates) > 100:
-            updates = updates[-100:]
-        
-        # Salvar no cache
-        cache.set(REALTIME_CACHE_KEY, updates, REALTIME_CACHE_TIMEOUT)
+        # Adicionar à lista de atualizações (últimas 100) e salvar no cache
+        total = _salvar_atualizacoes(cliente_id, [update])
         
         print(f"OK - Atualização em tempo real salva no cache: {update_type}")
-        print(f"INFO - Total de atualizações no cache: {len(updates)}")
+        print(f"INFO - Total de atualizações no cache: {total}")
         
     except Exception as e:
         print(f"ERRO - Erro ao notificar atualização em tempo real: {e}")
 
-def notify_all_chats_update(update_type, data):
+def notify_all_chats_update(update_type, data, cliente_id):
     """
-    Notifica todos os chats sobre uma atualização global
+    Notifica todos os chats do cliente sobre uma atualização global
     """
     try:
-        # Obter todos os chats ativos
-        all_chats = Chat.objects.filter(status='active')
-        
-        # Obter atualizações existentes do cache
-        updates = cache.get(REALTIME_CACHE_KEY, [])
+        # Obter os chats ativos do cliente (os outros clientes não veem esta mensagem)
+        all_chats = list(Chat.objects.filter(status='active', cliente_id=cliente_id).only('chat_id'))
         
         # Criar atualização para cada chat
+        updates = []
         for chat in all_chats:
             update = {
                 'type': update_type,
@@ -66,14 +103,10 @@ def notify_all_chats_update(update_type, data):
             updates.append(update)
         
         # Manter apenas as últimas 100 atualizações para evitar overflow
-        if len(updates) > 100:
-            updates = updates[-100:]
-        
-        # Salvar no cache
-        cache.set(REALTIME_CACHE_KEY, updates, REALTIME_CACHE_TIMEOUT)
+        total = _salvar_atualizacoes(cliente_id, updates[-100:])
         
-        print(f"OK - Atualização global salva no cache: {update_type} para {all_chats.count()} chats")
-        print(f"INFO - Total de atualizações no cache: {len(updates)}")
+        print(f"OK - Atualização global salva no cache: {update_type} para {len(all_chats)} chats")
+        print(f"INFO - Total de atualizações no cache: {total}")
         
     except Exception as e:
         print(f"ERRO - Erro ao notificar atualização global: {e}")
@@ -99,7 +132,7 @@ def mensagem_saved_handler(sender, instance, created, **kwargs):
         }
         
         # Notificar nova mensagem para o chat específico
-        notify_realtime_update('new_message', instance.chat.chat_id, message_data)
+        notify_realtime_update('new_message', instance.chat.chat_id, message_data, instance.chat.cliente_id)
         
         # ATUALIZAÇÃO GLOBAL: Notificar todos os chats sobre a nova mensagem
         # Isso fará com que todos os chats sejam atualizados na interface
@@ -112,7 +145,7 @@ def mensagem_saved_handler(sender, instance, created, **kwargs):
             'timestamp': instance.data_envio.isoformat()
         }
         
-        notify_all_chats_update('global_new_message', global_update_data)
+        notify_all_chats_update('global_new_message', global_update_data, instance.chat.cliente_id)
         
         print(f"INFO - Dados da atualização: {message_data}")
         print("INFO - Atualizacao global enviada para todos os chats")
@@ -132,4 +165,4 @@ def mensagem_saved_handler(sender, instance, created, **kwargs):
             'message_id': instance.message_id
         }
         
-        notify_realtime_update('message_updated', instance.chat.chat_id, update_data) 
\ No newline at end of file
+        notify_realtime_update('message_updated', instance.chat.chat_id, update_data, instance.chat.cliente_id) 
\ No newline at end of file
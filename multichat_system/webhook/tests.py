@@ -1,3 +1,196 @@
-from django.test import TestCase
+import base64
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from cryptography.hazmat.primitives import padding
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from django.test import Client, TestCase
+
+from core.models import Chat, Cliente, MediaFile, Mensagem, WhatsappInstance
+from webhook.ingest_benchmark import IngestBenchmark, PayloadFactory, build_record, merge_results
+from webhook.media_crypto import MediaDecryptionError, decrypt_stream_to_file, derive_media_keys
+from webhook.models import WebhookEvent
+from webhook.replay import WebhookReplay
+from webhook.views import registrar_midia_pendente
+
+
+class SingleWritePathTests(TestCase):
+    """Cada mensagem é gravada uma única vez (webhook.ingest), seja qual for o endpoint."""
+
+    def setUp(self):
+        self.client = Client()
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        WhatsappInstance.objects.create(cliente=self.cliente, instance_id='INST-A', token='t')
+        self.payloads = PayloadFactory('INST-A', seed=7)
+
+    def _post(self, payload, endpoint='/webhook/receive-message/'):
+        return self.client.post(endpoint, json.dumps(payload), content_type='application/json')
+
+    def test_entrega_repetida_grava_uma_vez(self):
+        payload = self.payloads.message('text', from_me=False)
+        for endpoint in ('/webhook/receive-message/', '/webhook/receive-message/', '/webhook/whatsapp/'):
+            self.assertEqual(self._post({**payload, 'event': 'messages.upsert'}, endpoint).status_code, 200)
+
+        self.assertEqual(Mensagem.objects.filter(message_id=payload['messageId']).count(), 1)
+        self.assertEqual(Chat.objects.filter(cliente=self.cliente).count(), 1)
+
+    def test_chat_separado_por_cliente(self):
+        outro = Cliente.objects.create(nome='Loja B', email='b@example.com')
+        WhatsappInstance.objects.create(cliente=outro, instance_id='INST-B', token='t')
+        payload = self.payloads.message('text', from_me=False)
+        self._post(payload)
+        self._post({**payload, 'instanceId': 'INST-B', 'messageId': 'OUTRO', 'key': {'id': 'OUTRO'}})
+
+        chat_id = Mensagem.objects.get(message_id=payload['messageId']).chat.chat_id
+        self.assertEqual(Chat.objects.filter(chat_id=chat_id).count(), 2)
+        self.assertEqual(Mensagem.objects.get(message_id='OUTRO').chat.cliente, outro)
+
+    def test_ultima_mensagem_so_avanca(self):
+        recente = self.payloads.message('text', from_me=False)
+        antiga = {**recente, 'messageId': 'ANTIGA', 'key': {'id': 'ANTIGA'},
+                  'messageTimestamp': recente['messageTimestamp'] - 3600}
+        self._post(recente)
+        self._post(antiga)
+
+        chat = Mensagem.objects.get(message_id='ANTIGA').chat
+        self.assertEqual(int(chat.last_message_at.timestamp()), recente['messageTimestamp'])
+
+    def test_remetente_de_mensagem_recebida(self):
+        sem_nome = self.payloads.message('text', from_me=False)
+        sem_nome['sender'] = {'id': sem_nome['sender']['id']}
+        com_nome_do_cliente = {**self.payloads.message('text', from_me=False),
+                               'sender': {'pushName': 'Loja A Atendimento'}}
+        self._post(sem_nome)
+        self._post(com_nome_do_cliente)
+
+        numero = Mensagem.objects.get(message_id=sem_nome['messageId']).chat.chat_id
+        self.assertEqual(Mensagem.objects.get(message_id=sem_nome['messageId']).remetente, f'Contato {numero}')
+        self.assertEqual(Mensagem.objects.get(message_id=com_nome_do_cliente['messageId']).remetente, 'Contato')
+
+
+class WebhookReplayTests(TestCase):
+    """Reprocessamento dos WebhookEvents gravados (webhook.replay)."""
+
+    def setUp(self):
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        WhatsappInstance.objects.create(cliente=self.cliente, instance_id='INST-A', token='t')
+        self.payloads = PayloadFactory('INST-A', seed=7)
+
+    def _evento(self, raw_data, event_type):
+        return WebhookEvent.objects.create(cliente=self.cliente, instance_id='INST-A',
+                                           event_type=event_type, raw_data=raw_data)
+
+    def _replay(self):
+        return WebhookReplay({'only_failed': True}, workers=1, with_media=False).run()
+
+    def test_ignorados_nao_voltam_no_only_failed(self):
+        mensagem = self._evento(self.payloads.message('text', from_me=False), 'message')
+        presenca = self._evento(self.payloads.presence(), 'presence')
+
+        self.assertEqual(self._replay()['stats']['ignored'], 1)
+        self.assertEqual(Mensagem.objects.count(), 1)
+        mensagem.refresh_from_db()
+        presenca.refresh_from_db()
+        self.assertTrue(mensagem.processed and presenca.processed)
+        self.assertEqual(self._replay()['processed'], 0)
+
+
+class IngestBenchmarkTests(TestCase):
+    """Percentis do benchmark sobre as amostras brutas, medidos a partir da agenda."""
+
+    def _run(self, latencias_ms, rate=0):
+        atrasos = iter(latencias_ms)
+
+        def send(endpoint, payload):
+            tempo.append(tempo[-1] + next(atrasos) / 1000)
+            return 200, None
+
+        tempo = [100.0]
+        with mock.patch('webhook.ingest_benchmark.time.perf_counter', side_effect=lambda: tempo[-1]), \
+                mock.patch('webhook.ingest_benchmark.time.sleep', side_effect=lambda s: tempo.append(tempo[-1] + s)):
+            eventos = [('text', '/webhook/whatsapp/', {})] * len(latencias_ms)
+            return IngestBenchmark(send, rate=rate).run(eventos)
+
+    def test_merge_recalcula_percentis_das_amostras(self):
+        rapido = self._run([1] * 99)
+        lento = self._run([100])
+        self.assertEqual(lento['latency_ms']['p50'], 100)
+
+        merged = merge_results([rapido, lento])
+        self.assertEqual(merged['events'], 100)
+        self.assertEqual(merged['latency_ms']['p50'], 1)
+        self.assertEqual(merged['latency_ms']['max'], 100)
+        self.assertNotIn('samples', build_record(merged, 'http', {}))
+
+    def test_atraso_acumulado_entra_na_latencia(self):
+        # 10 eventos/s (um a cada 100 ms): o primeiro leva 500 ms e atrasa os seguintes
+        result = self._run([500, 10, 10, 10], rate=10)
+        self.assertEqual(result['latency_ms']['max'], 500)
+        self.assertGreater(result['latency_ms']['p50'], 300)
+
+
+class MidiaPendenteTests(TestCase):
+    """Descritor da mídia gravado sem download (MEDIA_DOWNLOAD_MODE='lazy')."""
+
+    def setUp(self):
+        self.cliente = Cliente.objects.create(nome='Loja A', email='a@example.com')
+        self.instancia = WhatsappInstance.objects.create(cliente=self.cliente, instance_id='INST-A', token='t')
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch('webhook.views.pasta_midia_por_cliente', return_value=Path(tmp.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _registrar(self, message_id, file_length):
+        webhook_data = {'messageId': message_id, 'sender': {'id': '5511999990000@c.us', 'pushName': 'Ana'}}
+        media = {'mimetype': 'image/jpeg', 'fileLength': file_length, 'mediaKey': 'k', 'directPath': '/d'}
+        return registrar_midia_pendente(webhook_data, self.cliente, self.instancia, 'image', media, prefetch=False)
+
+    def test_file_length_em_texto(self):
+        self._registrar('M1', '20718')
+        self._registrar('M2', 'nao-numerico')
+
+        self.assertEqual(MediaFile.objects.get(message_id='M1').file_size, 20718)
+        self.assertIsNone(MediaFile.objects.get(message_id='M2').file_size)
+
+
+class MediaCryptoTests(TestCase):
+    """Descriptografia em streaming das mídias .enc (webhook.media_crypto)."""
+
+    def setUp(self):
+        self.media_key = base64.b64encode(os.urandom(32)).decode()
+        self.plaintext = os.urandom(100_003)
+        keys = derive_media_keys(self.media_key, 'document')
+        padder = padding.PKCS7(128).padder()
+        encryptor = Cipher(algorithms.AES(keys['cipher_key']), modes.CBC(keys['iv'])).encryptor()
+        ciphertext = encryptor.update(padder.update(self.plaintext) + padder.finalize()) + encryptor.finalize()
+        mac = hmac.new(keys['mac_key'], keys['iv'] + ciphertext, hashlib.sha256).digest()[:10]
+        self.encrypted = ciphertext + mac
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def _chunks(self, data, size=4099):
+        return (data[i:i + size] for i in range(0, len(data), size))
+
+    def test_chunks_irregulares_e_hashes_conferidos(self):
+        destino = Path(self.dir.name) / 'doc.bin'
+        resultado = decrypt_stream_to_file(
+            self._chunks(self.encrypted), destino, self.media_key, 'document',
+            file_sha256=base64.b64encode(hashlib.sha256(self.plaintext).digest()).decode(),
+            file_enc_sha256=base64.b64encode(hashlib.sha256(self.encrypted).digest()).decode(),
+        )
+        self.assertEqual(destino.read_bytes(), self.plaintext)
+        self.assertEqual((resultado['file_size'], resultado['encrypted_size']),
+                         (len(self.plaintext), len(self.encrypted)))
+
+    def test_mac_invalido_nao_deixa_arquivo(self):
+        corrompido = self.encrypted[:-1] + bytes([self.encrypted[-1] ^ 1])
+        with self.assertRaises(MediaDecryptionError):
+            decrypt_stream_to_file(self._chunks(corrompido), Path(self.dir.name) / 'doc.bin',
+                                   self.media_key, 'document')
+        self.assertEqual(os.listdir(self.dir.name), [])
@@ -3,15 +3,16 @@ Views para processamento de webhooks do WhatsApp
 Integração com o sistema MultiChat para salvar mensagens nos chats
 """
 
+import base64
 import json
 import logging
 import os
 import re
 from datetime import datetime
+from django.conf import settings
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.db import transaction
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
@@ -21,11 +22,22 @@ from django.core.cache import cache
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
-from core.models import Chat, Mensagem, Cliente, WhatsappInstance
+from core.models import Chat, Cliente, WhatsappInstance, MediaFile
+from core import file_links
+from core.audio_analysis import schedule_audio_analysis
+from core.media_fetch import MediaFetchError, lazy_downloads_enabled, media_extension, prefetch_types, schedule_fetch
+from core.media_quota import schedule_quota_check
+from core.media_retry import record_failure
+from core.media_store import adopt_file, get_media_storage_dir, materialize
+from core.previews import schedule_preview
+from core.thumbnails import schedule_thumbnails
+from core.instance_status import set_cached_status
+from core.utils import get_wapi_base_url
 from webhook.models import WebhookEvent, Sender
 from .media_processor import process_webhook_media
 from core.webhook_media_analyzer import analisar_webhook_whatsapp, processar_webhook_whatsapp
-from api.utils import determine_from_me_saas
+from .ingest import message_id_from_payload, persist_message
+from .replay import is_message_payload
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +45,24 @@ logger = logging.getLogger(__name__)
 REALTIME_CACHE_KEY = "realtime_updates"
 REALTIME_CACHE_TIMEOUT = 300  # 5 minutos
 
+# Extensão dos arquivos baixados via W-API por tipo de mídia
+EXTENSOES_MIDIA = {
+    'image': '.jpg',
+    'video': '.mp4',
+    'audio': '.mp3',
+    'document': '.pdf',
+    'sticker': '.webp'
+}
+
+# Tipo de mídia por chave do msgContent
+TIPOS_MIDIA = {
+    'imageMessage': 'image',
+    'videoMessage': 'video',
+    'audioMessage': 'audio',
+    'documentMessage': 'document',
+    'stickerMessage': 'sticker'
+}
+
 # Signal movido para signals.py
 
 def normalize_chat_id(chat_id):
@@ -329,7 +359,7 @@ def webhook_connect(request):
         print(f"🔗 WEBHOOK CONECTAR: {webhook_data}")
         
         # Processar eventos de conexão
-        return process_webhook_connection(webhook_data, 'connect')
+        return process_webhook_connection(webhook_data, 'connect', request)
             
     except Exception as e:
         logger.error(f"❌ Erro no webhook connect: {e}")
@@ -349,7 +379,7 @@ def webhook_disconnect(request):
         print(f"🔌 WEBHOOK DESCONECTAR: {webhook_data}")
         
         # Processar eventos de desconexão
-        return process_webhook_connection(webhook_data, 'disconnect')
+        return process_webhook_connection(webhook_data, 'disconnect', request)
             
     except Exception as e:
         logger.error(f"❌ Erro no webhook disconnect: {e}")
@@ -362,63 +392,97 @@ def process_webhook_message(webhook_data, event_type):
         print("🎯 WhatsApp detectado!")
         print("🔄 Processando dados do WhatsApp...")
         
-        # Extrair dados básicos
-        instance_id = webhook_data.get('instanceId')
-        message_id = webhook_data.get('messageId')
-        from_me = webhook_data.get('fromMe', False)
-        is_group = webhook_data.get('isGroup', False)
-        
-        # Buscar cliente e instância
-        cliente = None
-        instance = None
-        
-        try:
-            instance = WhatsappInstance.objects.get(instance_id=instance_id)
-            cliente = instance.cliente
-            print(f"👤 Cliente: {cliente.nome}")
-        except WhatsappInstance.DoesNotExist:
-            print(f"❌ Instância não encontrada: {instance_id}")
+        instance = instancia_do_webhook(webhook_data)
+        if instance is None:
             return False
+        cliente = instance.cliente
+        print(f"👤 Cliente: {cliente.nome}")
         
-        # Processar mídia automaticamente se presente
-        msg_content = webhook_data.get('msgContent', {})
-        media_downloaded = process_media_automatically(webhook_data, cliente, instance)
+        # Grava a mensagem (e o descritor da mídia) uma única vez, numa transação
+        response, resultado = salvar_mensagem(webhook_data, instance)
+        if not (resultado and resultado.created and resultado.media_file):
+            # Sem mídia, ou entrega repetida: a mídia já foi tratada na primeira
+            return response
+        
+        # Download/reaproveitamento depois do commit, só para mensagens novas
+        message_id = webhook_data.get('messageId')
+        media_downloaded = process_media_automatically(webhook_data, cliente, instance, media_file=resultado.media_file)
         
         if media_downloaded:
             print(f"✅ Mídia processada automaticamente: {message_id}")
         
-        # Continuar com o processamento normal
-        return process_whatsapp_message(webhook_data, event_type)
+        # Pós-processamento em background, depois que a mensagem existe:
+        # duração/forma de onda dos áudios, miniaturas das imagens e
+        # prévias (poster/primeira página) de vídeos e documentos
+        if media_downloaded and resultado.media_file.media_type in ('audio', 'image', 'video', 'document'):
+            agendar_processamento_midia(message_id, resultado.media_file.media_type)
+        
+        return response
         
     except Exception as e:
         print(f"❌ Erro ao processar webhook: {e}")
         return JsonResponse({'error': 'Erro interno do servidor'}, status=500)
 
-def process_media_automatically(webhook_data, cliente, instance):
-    """Processa mídias automaticamente quando recebidas via webhook - VERSÃO CORRIGIDA"""
+
+def instancia_do_webhook(webhook_data):
+    """Instância (com o cliente) do instanceId do payload; None se não existir"""
+    instance_id = webhook_data.get('instanceId')
+    try:
+        return WhatsappInstance.objects.select_related('cliente').get(instance_id=instance_id)
+    except WhatsappInstance.DoesNotExist:
+        print(f"❌ Instância não encontrada: {instance_id}")
+        return None
+
+
+def salvar_mensagem(webhook_data, instance):
+    """Grava a mensagem pelo caminho único (webhook.ingest); retorna (JsonResponse, resultado)"""
+    if not is_message_payload(webhook_data):
+        logger.warning("Nenhuma mensagem encontrada no webhook")
+        return JsonResponse({'status': 'ignored', 'message': 'Nenhuma mensagem encontrada'}), None
+    
+    resultado = persist_message(webhook_data, instance.cliente, instance=instance)
+    if resultado is None:
+        logger.error(f"Falha ao salvar mensagem: {message_id_from_payload(webhook_data) or 'unknown'}")
+        return JsonResponse({'error': 'Falha ao salvar mensagem'}, status=500), None
+    
+    return JsonResponse({'status': 'success', 'message': 'Mensagem processada com sucesso'}), resultado
+
+def agendar_processamento_midia(message_id, media_type):
+    """Enfileira o pós-processamento (análise de áudio, miniaturas ou prévia) da mídia já salva em disco"""
+    media = MediaFile.objects.filter(message_id=message_id).only('file_path', 'mimetype').first()
+    if not (media and media.file_path and os.path.exists(media.file_path)):
+        logger.warning(f"⚠️ Mídia sem arquivo local para pós-processamento: {message_id}")
+        return
+    if media_type == 'audio':
+        schedule_audio_analysis(message_id, media.file_path)
+    elif media_type == 'image':
+        schedule_thumbnails(media.file_path)
+    elif media_type in ('video', 'document'):
+        schedule_preview(message_id, media.file_path, media_type, media.mimetype)
+
+
+def extract_media(msg_content):
+    """Retorna (tipo, dados da mídia) do msgContent, ou (None, None) se não houver mídia"""
+    for content_key, media_type in TIPOS_MIDIA.items():
+        if content_key in msg_content:
+            return media_type, msg_content[content_key]
+    return None, None
+
+
+def process_media_automatically(webhook_data, cliente, instance, media_file=None):
+    """
+    Processa mídias automaticamente quando recebidas via webhook - VERSÃO CORRIGIDA
+    
+    ``media_file`` é o descritor pendente já gravado junto com a mensagem
+    (webhook.ingest); sem ele o descritor é registrado aqui.
+    """
     try:
         print(f"🔄 INICIANDO DOWNLOAD AUTOMÁTICO - Cliente: {cliente.nome}")
         
-        msg_content = webhook_data.get('msgContent', {})
         message_id = webhook_data.get('messageId')
         
         # Detectar tipo de mídia
-        media_types = {
-            'imageMessage': 'image',
-            'videoMessage': 'video', 
-            'audioMessage': 'audio',
-            'documentMessage': 'document',
-            'stickerMessage': 'sticker'
-        }
-        
-        detected_media = None
-        media_type = None
-        
-        for content_key, media_type_name in media_types.items():
-            if content_key in msg_content:
-                detected_media = msg_content[content_key]
-                media_type = media_type_name
-                break
+        media_type, detected_media = extract_media(webhook_data.get('msgContent', {}))
         
         if not detected_media:
             print(f"❌ Nenhuma mídia detectada no webhook")
@@ -442,6 +506,21 @@ def process_media_automatically(webhook_data, cliente, instance):
         print(f"   directPath: {'✅' if direct_path else '❌'} {direct_path[:50] if direct_path else 'AUSENTE'}...")
         print(f"   mimetype: {'✅' if mimetype else '❌'} {mimetype}")
         
+        # Conteúdo já armazenado (figurinha/encaminhamento visto em outro chat):
+        # cria o arquivo do chat como link e não chama a W-API
+        file_sha256 = detected_media.get('fileSha256')
+        if file_sha256 and reaproveitar_midia_armazenada(webhook_data, cliente, instance, media_type, detected_media):
+            return True
+        
+        # Modo sob demanda: só registra o descritor, o download fica para o
+        # primeiro acesso (ou para o prefetch em background)
+        if lazy_downloads_enabled() and media_key and direct_path and mimetype:
+            if media_file is None:
+                registrar_midia_pendente(webhook_data, cliente, instance, media_type, detected_media)
+            else:
+                agendar_prefetch(media_file)
+            return False
+        
         # Fazer download da mídia
         if media_key and direct_path and mimetype:
             print(f"🔄 Iniciando download da mídia...")
@@ -451,7 +530,9 @@ def process_media_automatically(webhook_data, cliente, instance):
                 'mediaKey': media_key,
                 'directPath': direct_path,
                 'type': media_type,
-                'mimetype': mimetype
+                'mimetype': mimetype,
+                'messageId': message_id,
+                'fileSha256': file_sha256
             }
             
             print(f"📡 Chamando download_media_via_wapi...")
@@ -475,12 +556,20 @@ def process_media_automatically(webhook_data, cliente, instance):
                 
                 if new_file_path:
                     print(f"📂 Arquivo reorganizado: {new_file_path}")
+                    # Manter o MediaFile apontando para o local definitivo
+                    MediaFile.objects.filter(message_id=message_id).update(file_path=new_file_path)
                     return True
                 else:
                     print(f"⚠️ Arquivo baixado mas não reorganizado")
                     return True
             else:
                 print(f"❌ Falha no download via W-API: {file_path}")
+                # Fica registrada para o agendador tentar de novo com backoff
+                if media_file is None:
+                    media_file = registrar_midia_pendente(webhook_data, cliente, instance, media_type, detected_media,
+                                                          prefetch=False)
+                if media_file.download_status != 'success':
+                    record_failure(media_file, MediaFetchError('Falha no download via W-API durante a ingestão'))
                 return False
         else:
             print(f"⚠️ Dados insuficientes para download:")
@@ -496,45 +585,142 @@ def process_media_automatically(webhook_data, cliente, instance):
         return False
 
 
+def reaproveitar_midia_armazenada(webhook_data, cliente, instance, media_type, detected_media):
+    """Cria a mídia do chat a partir do armazenamento por conteúdo (fileSha256), sem download"""
+    try:
+        message_id = webhook_data.get('messageId')
+        pasta = pasta_midia_por_cliente(cliente, instance, media_type, webhook_data)
+        destino = pasta / f"wapi_{message_id}{EXTENSOES_MIDIA.get(media_type, '.bin')}"
+        file_path = materialize(detected_media.get('fileSha256'), destino)
+        if not file_path:
+            return False
+        
+        sender = webhook_data.get('sender', {})
+        MediaFile.objects.update_or_create(
+            message_id=message_id,
+            defaults={
+                'cliente': cliente,
+                'instance': instance,
+                'sender_name': sender.get('pushName', 'Desconhecido'),
+                'sender_id': sender.get('id', ''),
+                'media_type': media_type,
+                'mimetype': detected_media.get('mimetype') or 'application/octet-stream',
+                'file_name': file_path.name,
+                'file_path': str(file_path),
+                'file_size': file_path.stat().st_size,
+                'file_sha256': detected_media.get('fileSha256'),
+                'download_status': 'success',
+                'download_timestamp': timezone.now(),
+                'message_timestamp': timezone.now(),
+                'from_me': webhook_data.get('fromMe', False),
+            }
+        )
+        print(f"♻️ Mídia reaproveitada sem download: {file_path}")
+        schedule_quota_check(cliente.id)
+        return True
+    except Exception as e:
+        print(f"⚠️ Não foi possível reaproveitar mídia armazenada: {e}")
+        return False
+
+
+def registrar_midia_pendente(webhook_data, cliente, instance, media_type, detected_media, prefetch=True, chat=None):
+    """Grava o MediaFile como pendente (sem baixar) e agenda o prefetch dos tipos sempre baixados"""
+    message_id = webhook_data.get('messageId')
+    sender = webhook_data.get('sender', {})
+    mimetype = detected_media.get('mimetype')
+    # A W-API manda o fileLength como string; valor inválido fica sem tamanho
+    file_length = detected_media.get('fileLength')
+    destino = pasta_midia_por_cliente(cliente, instance, media_type, webhook_data) / \
+        f"wapi_{message_id}{media_extension(mimetype, media_type)}"
+    
+    media_file, created = MediaFile.objects.get_or_create(
+        message_id=message_id,
+        defaults={
+            'cliente': cliente,
+            'instance': instance,
+            'chat': chat,
+            'sender_name': sender.get('pushName', 'Desconhecido'),
+            'sender_id': sender.get('id', ''),
+            'media_type': media_type,
+            'mimetype': mimetype,
+            'file_name': destino.name,
+            'file_path': str(destino),
+            'file_size': int(file_length) if str(file_length or '').isdigit() else None,
+            'caption': detected_media.get('caption', ''),
+            'width': detected_media.get('width'),
+            'height': detected_media.get('height'),
+            'duration_seconds': detected_media.get('seconds'),
+            'is_ptt': detected_media.get('ptt', False),
+            'download_status': 'pending',
+            'from_me': webhook_data.get('fromMe', False),
+            'media_key': detected_media.get('mediaKey'),
+            'direct_path': detected_media.get('directPath'),
+            'file_sha256': detected_media.get('fileSha256'),
+            'file_enc_sha256': detected_media.get('fileEncSha256'),
+            'media_key_timestamp': detected_media.get('mediaKeyTimestamp'),
+            'message_timestamp': timezone.now(),
+        }
+    )
+    print(f"🕓 Mídia registrada para download sob demanda: {message_id} ({media_type})")
+    
+    if prefetch and created:
+        agendar_prefetch(media_file)
+    return media_file
+
+
+def agendar_prefetch(media_file):
+    """Agenda em background o download dos tipos sempre baixados (prefetch)"""
+    if media_file.download_status == 'pending' and media_file.media_type in prefetch_types():
+        schedule_fetch(media_file.message_id)
+
+
+def pasta_midia_por_cliente(cliente, instance, media_type, webhook_data):
+    """Pasta final da mídia: media_storage/NOME_CLIENTE/instance_ID/chats/CHAT_ID/TIPO_MIDIA/"""
+    from pathlib import Path
+    
+    # Extrair chat_id do webhook (múltiplas fontes possíveis)
+    chat_id = (
+        webhook_data.get('chatId') or 
+        webhook_data.get('chat', {}).get('id') or
+        webhook_data.get('sender', {}).get('id') or
+        'unknown'
+    )
+    
+    print(f"🔍 DEBUG chat_id: {chat_id} (fonte: {webhook_data.keys()})")
+    
+    # Normalizar chat_id
+    chat_id = normalize_chat_id(chat_id)
+    
+    # Se ainda é None, tentar extrair de sender
+    if not chat_id:
+        sender = webhook_data.get('sender', {})
+        if sender:
+            chat_id = sender.get('id', 'unknown')
+            print(f"🔍 chat_id do sender: {chat_id}")
+    
+    # Fallback final
+    if not chat_id:
+        chat_id = 'unknown_chat'
+        print(f"⚠️ chat_id não encontrado, usando fallback: {chat_id}")
+    
+    # Nome do cliente (remover caracteres especiais)
+    cliente_nome = "".join(c for c in cliente.nome if c.isalnum() or c in (' ', '-', '_')).strip()
+    cliente_nome = cliente_nome.replace(' ', '_')
+    
+    # Nova estrutura: media_storage/NOME_CLIENTE/instance_ID/chats/CHAT_ID/TIPO_MIDIA/
+    # Usar caminho correto a partir da raiz do projeto
+    nova_estrutura = get_media_storage_dir() / cliente_nome / f"instance_{instance.instance_id}" / "chats" / str(chat_id) / media_type
+    nova_estrutura.mkdir(parents=True, exist_ok=True)
+    return nova_estrutura
+
+
 def reorganizar_arquivo_por_cliente(file_path, cliente, instance, media_type, webhook_data):
     """Reorganiza arquivo na estrutura correta por nome do cliente"""
     try:
         from pathlib import Path
         import shutil
         
-        # Extrair chat_id do webhook (múltiplas fontes possíveis)
-        chat_id = (
-            webhook_data.get('chatId') or 
-            webhook_data.get('chat', {}).get('id') or
-            webhook_data.get('sender', {}).get('id') or
-            'unknown'
-        )
-        
-        print(f"🔍 DEBUG chat_id: {chat_id} (fonte: {webhook_data.keys()})")
-        
-        # Normalizar chat_id
-        chat_id = normalize_chat_id(chat_id)
-        
-        # Se ainda é None, tentar extrair de sender
-        if not chat_id:
-            sender = webhook_data.get('sender', {})
-            if sender:
-                chat_id = sender.get('id', 'unknown')
-                print(f"🔍 chat_id do sender: {chat_id}")
-        
-        # Fallback final
-        if not chat_id:
-            chat_id = 'unknown_chat'
-            print(f"⚠️ chat_id não encontrado, usando fallback: {chat_id}")
-        
-        # Nome do cliente (remover caracteres especiais)
-        cliente_nome = "".join(c for c in cliente.nome if c.isalnum() or c in (' ', '-', '_')).strip()
-        cliente_nome = cliente_nome.replace(' ', '_')
-        
-        # Nova estrutura: media_storage/NOME_CLIENTE/instance_ID/chats/CHAT_ID/TIPO_MIDIA/
-        # Usar caminho correto a partir da raiz do projeto
-        nova_estrutura = Path(__file__).parent.parent / "media_storage" / cliente_nome / f"instance_{instance.instance_id}" / "chats" / str(chat_id) / media_type
-        nova_estrutura.mkdir(parents=True, exist_ok=True)
+        nova_estrutura = pasta_midia_por_cliente(cliente, instance, media_type, webhook_data)
         
         # Nome do arquivo
         arquivo_original = Path(file_path)
@@ -543,7 +729,7 @@ def reorganizar_arquivo_por_cliente(file_path, cliente, instance, media_type, we
         # Mover arquivo
         shutil.move(str(arquivo_original), str(novo_caminho))
         
-        print(f"📂 Estrutura criada: {cliente_nome}/instance_{instance.instance_id}/chats/{chat_id}/{media_type}/")
+        print(f"📂 Estrutura criada: {nova_estrutura}")
         
         return str(novo_caminho)
         
@@ -622,7 +808,7 @@ def process_webhook_status(webhook_data):
         return JsonResponse({'error': 'Erro interno do servidor'}, status=500)
 
 
-def process_webhook_connection(webhook_data, connection_type):
+def process_webhook_connection(webhook_data, connection_type, request=None):
     """
     Processa webhook de conexão/desconexão
     """
@@ -649,14 +835,18 @@ def process_webhook_connection(webhook_data, connection_type):
         
         instance.save()
         
+        # Webhook é a fonte mais recente: sobrescreve o cache de status
+        set_cached_status(instance_id, instance.status, source='webhook')
+        
         # Criar evento de webhook
+        meta = request.META if request is not None else {}
         event = WebhookEvent.objects.create(
             cliente=cliente,
             instance_id=instance_id,
             event_type=f"instance_{connection_type}",
             raw_data=webhook_data,
-            ip_address=request.META.get('REMOTE_ADDR'),
-            user_agent=request.META.get('HTTP_USER_AGENT', '')
+            ip_address=meta.get('REMOTE_ADDR'),
+            user_agent=meta.get('HTTP_USER_AGENT', '')
         )
         
         logger.info(f"✅ Evento de {connection_type} processado: {event.event_id}")
@@ -669,25 +859,14 @@ def process_webhook_connection(webhook_data, connection_type):
 
 def process_whatsapp_message(webhook_data, event):
     """
-    Processa uma mensagem do WhatsApp e salva no sistema
+    Processa uma mensagem do WhatsApp e salva no sistema (sem baixar mídia)
     """
     try:
-        with transaction.atomic():
-            # Extrair dados da mensagem
-            messages = webhook_data.get('data', {}).get('messages', [])
-            
-            if not messages:
-                logger.warning("Nenhuma mensagem encontrada no webhook")
-                return JsonResponse({'status': 'ignored', 'message': 'Nenhuma mensagem encontrada'})
-            
-            # Processar cada mensagem
-            for message_data in messages:
-                success = save_message_to_chat(webhook_data, event)
-                if not success:
-                    logger.error(f"Falha ao salvar mensagem: {message_data.get('key', {}).get('id', 'unknown')}")
-                    return JsonResponse({'error': 'Falha ao salvar mensagem'}, status=500)
-            
-            return JsonResponse({'status': 'success', 'message': 'Mensagem processada com sucesso'})
+        instance = instancia_do_webhook(webhook_data)
+        if instance is None:
+            return JsonResponse({'error': 'Instância não encontrada'}, status=500)
+        response, _ = salvar_mensagem(webhook_data, instance)
+        return response
             
     except Exception as e:
         logger.error(f"❌ Erro ao processar mensagem: {e}")
@@ -699,106 +878,10 @@ def save_message_to_chat(payload, event):
     Salva a mensagem no sistema de chats principal
     """
     try:
-        raw_chat_id = payload.get("chat", {}).get("id", "")
-        # Normalizar o chat_id para garantir que seja um número de telefone
-        chat_id = normalize_chat_id(raw_chat_id)
-        
-        if not chat_id:
-            logger.error(f"Chat ID inválido: {raw_chat_id}")
-            return False
-        
-        logger.info(f"📱 Chat ID normalizado: {raw_chat_id} -> {chat_id}")
-        
-        # Extrair informações básicas
-        message_key = payload.get('key', {})
-        message_id = message_key.get('id', '')
-        instance_id = payload.get('instanceId', '')
-        # Usar função centralizada
-        from_me = determine_from_me_saas(payload, instance_id)
-        
-        logger.info(f"🔍 Determinação from_me: sender_id={payload.get('sender', {}).get('id', '')}, instance_id={payload.get('instanceId', '')}, from_me={from_me}")
-        
-        # Verificar se já existe usando message_id (mais confiável)
-        if message_id and Mensagem.objects.filter(message_id=message_id).exists():
-            logger.info(f"Mensagem já existe (message_id): {message_id}")
-            return True
-        
-        # Verificação adicional por chat_id e timestamp (fallback)
-        # Comentado temporariamente para evitar erro de lookup
-        # if Mensagem.objects.filter(chat__chat_id=chat_id, data_envio__timestamp=payload.get('messageTimestamp', 0)).exists():
-        #     logger.info(f"Mensagem já existe (timestamp): {message_id}")
-        #     return True
-        
-        # Encontrar ou criar o chat
-        # Primeiro tentar encontrar um chat existente
-        chat = Chat.objects.filter(chat_id=chat_id).first()
-        
-        if not chat:
-            # Se não existir, criar um novo chat
-            # Buscar o cliente da instância
-            try:
-                instance = WhatsappInstance.objects.get(instance_id=instance_id)
-                cliente = instance.cliente
-            except WhatsappInstance.DoesNotExist:
-                logger.error(f"Instância {instance_id} não encontrada")
-                return False
-            
-            chat = Chat.objects.create(
-                chat_id=chat_id,
-                cliente=cliente,  # Associar ao cliente correto
-                status="active",
-                canal="whatsapp",
-                data_inicio=timezone.now(),
-                last_message_at=timezone.now()
-            )
-            logger.info(f"✅ Chat criado: {chat_id} para cliente: {cliente.nome}")
-        else:
-            # Se o chat existir mas não tiver cliente, associar
-            if not chat.cliente:
-                try:
-                    instance = WhatsappInstance.objects.get(instance_id=instance_id)
-                    chat.cliente = instance.cliente
-                    chat.save()
-                    logger.info(f"✅ Chat {chat_id} associado ao cliente: {instance.cliente.nome}")
-                except WhatsappInstance.DoesNotExist:
-                    logger.error(f"Instância {instance_id} não encontrada para chat {chat_id}")
-                    return False
-        
-        if not chat:
-            logger.error(f"Não foi possível encontrar/criar chat para: {chat_id}")
+        instance = instancia_do_webhook(payload)
+        if instance is None:
             return False
-        
-        # Determinar tipo de mensagem
-        message_type = detect_message_type(payload)
-        
-        # Extrair conteúdo da mensagem
-        content = extract_message_content(payload, message_type)
-        
-        # Determinar remetente
-        if from_me:
-            remetente = "Elizeu Batiliere"  # Nome do usuário atual
-        else:
-            # Usar o nome do remetente do webhook
-            sender_data = payload.get('sender', {})
-            remetente = sender_data.get('pushName', '') or sender_data.get('name', '') or chat_id.split('@')[0]
-        
-        # Criar mensagem
-        mensagem = Mensagem.objects.create(
-            chat=chat,
-            remetente=remetente,
-            conteudo=content,
-            tipo=message_type,
-            lida=False,
-            from_me=from_me,
-            message_id=message_id  # Adicionar message_id para evitar duplicatas
-        )
-        
-        # Atualizar última mensagem do chat
-        chat.last_message_at = datetime.fromtimestamp(payload.get('messageTimestamp', 0))
-        chat.save()
-        
-        logger.info(f"✅ Mensagem salva: {message_id} - Tipo: {message_type} - FromMe: {from_me}")
-        return True
+        return persist_message(payload, instance.cliente, instance=instance) is not None
         
     except Exception as e:
         logger.error(f"❌ Erro ao salvar mensagem: {e}")
@@ -810,136 +893,24 @@ def save_message_to_chat_with_from_me(payload, event, from_me, cliente):
     Salva a mensagem no sistema de chats principal com from_me já determinado
     """
     try:
-        raw_chat_id = payload.get("chat", {}).get("id", "")
-        # Normalizar o chat_id para garantir que seja um número de telefone
-        chat_id = normalize_chat_id(raw_chat_id)
-        
-        if not chat_id:
-            logger.error(f"Chat ID inválido: {raw_chat_id}")
-            return False
-        
-        logger.info(f"📱 Chat ID normalizado: {raw_chat_id} -> {chat_id}")
-        
-        message_key = payload.get('key', {})
-        message_id = message_key.get('id', '')
-        
-        logger.info(f"🔍 Salvando mensagem com from_me={from_me} para cliente: {cliente.nome if cliente else 'N/A'}")
-        
-        # Verificar se já existe usando message_id (mais confiável)
-        if message_id and Mensagem.objects.filter(message_id=message_id).exists():
-            logger.info(f"Mensagem já existe (message_id): {message_id}")
-            return True
-        
-        # Verificação adicional por chat_id e timestamp (fallback)
-        # Comentado temporariamente para evitar erro de lookup
-        # if Mensagem.objects.filter(chat__chat_id=chat_id, data_envio__timestamp=payload.get('messageTimestamp', 0)).exists():
-        #     logger.info(f"Mensagem já existe (timestamp): {message_id}")
-        #     return True
-        
-        # Encontrar ou criar o chat associado ao cliente
-        chat, created = Chat.objects.get_or_create(
-            chat_id=chat_id,
-            cliente=cliente,  # Associar ao cliente correto
-            defaults={
-                "status": "active",
-                "canal": "whatsapp",
-                "data_inicio": timezone.now(),
-                "last_message_at": timezone.now()
-            }
-        )
-        
-        if not chat:
-            logger.error(f"Não foi possível encontrar/criar chat para: {chat_id}")
+        resultado = persist_message(payload, cliente, from_me=from_me)
+        if resultado is None:
             return False
         
-        # Determinar tipo de mensagem
-        message_type = detect_message_type(payload)
-        
-        # Extrair conteúdo da mensagem
-        content = extract_message_content(payload, message_type)
-        
-        # DETERMINAR REMETENTE BASEADO EM from_me E CLIENTE
-        if from_me:
-            remetente = cliente.nome if cliente else "Usuário"  # Usar nome do cliente dinamicamente
-        else:
-            # Usar o nome do remetente do webhook (NUNCA usar o nome do cliente para mensagens recebidas)
-            sender_data = payload.get('sender', {})
-            
-            # Priorizar pushName, depois verifiedName, depois name
-            remetente = (
-                sender_data.get('pushName', '') or 
-                sender_data.get('verifiedName', '') or 
-                sender_data.get('name', '')
-            )
-            
-            # Se não encontrar nome no sender, usar um nome padrão baseado no chat_id
-            if not remetente:
-                if chat_id and '@' in chat_id:
-                    # Para grupos, extrair o número do participante
-                    if 'g.us' in chat_id:
-                        remetente = f"Participante"
-                    else:
-                        remetente = f"Contato {chat_id.split('@')[0]}"
-                else:
-                    remetente = "Contato"
-            
-            # Garantir que não está usando o nome do cliente para mensagens recebidas
-            if cliente and cliente.nome in remetente:
-                logger.warning(f"⚠️ Tentativa de usar nome do cliente para mensagem recebida: {remetente}")
-                remetente = "Contato"
-            
-            # Atualizar o sender com o nome capturado
-            try:
-                from webhook.models import Sender
-                sender, created = Sender.objects.get_or_create(
-                    sender_id=chat_id,
-                    cliente=cliente,
-                    defaults={
-                        'push_name': remetente,
-                        'verified_name': remetente,
-                    }
-                )
-                
-                if not created:
-                    # Atualizar o sender existente se o nome for diferente
-                    if sender.push_name != remetente:
-                        sender.push_name = remetente
-                        sender.save(update_fields=['push_name'])
-                        logger.info(f"🔄 Nome do sender atualizado: {remetente}")
-                
-            except Exception as e:
-                logger.error(f"❌ Erro ao atualizar sender: {e}")
-        
-        # Criar mensagem com from_me já determinado
-        mensagem = Mensagem.objects.create(
-            chat=chat,
-            remetente=remetente,
-            conteudo=content,
-            tipo=message_type,
-            lida=False,
-            from_me=from_me,  # Usar o valor já determinado
-            message_id=message_id
-        )
-        
         # CRIAÇÃO AUTOMÁTICA DE PASTA PARA ÁUDIOS
-        if message_type == 'audio':
+        if resultado.created and resultado.mensagem.tipo == 'audio':
+            chat = resultado.chat
             # Buscar instância do WhatsApp para este chat
             instance = chat.cliente.whatsapp_instances.first()
             if instance:
                 # Criar pasta de áudio automaticamente
-                pasta_criada = criar_pasta_audio_automatica(chat, instance, message_id)
+                pasta_criada = criar_pasta_audio_automatica(chat, instance, resultado.mensagem.message_id)
                 if pasta_criada:
                     logger.info(f"🎵 Pasta de áudio criada automaticamente: {pasta_criada}")
                 else:
-                    logger.warning(f"⚠️ Não foi possível criar pasta de áudio para mensagem {message_id}")
+                    logger.warning(f"⚠️ Não foi possível criar pasta de áudio para mensagem {resultado.mensagem.message_id}")
             else:
                 logger.warning(f"⚠️ Nenhuma instância WhatsApp encontrada para cliente {chat.cliente.nome}")
-        
-        # Atualizar última mensagem do chat
-        chat.last_message_at = datetime.fromtimestamp(payload.get('messageTimestamp', 0))
-        chat.save()
-        
-        logger.info(f"✅ Mensagem salva: {message_id} - Tipo: {message_type} - FromMe: {from_me} - Remetente: {remetente} - Cliente: {cliente.nome if cliente else 'N/A'}")
         return True
         
     except Exception as e:
@@ -1323,7 +1294,7 @@ def download_media_via_wapi(instance_id, bearer_token, media_data):
                 return None
         
         # 2. ENDPOINT CONFORME DOCUMENTAÇÃO
-        url = f"https://api.w-api.app/v1/message/download-media?instanceId={instance_id}"
+        url = f"{get_wapi_base_url()}message/download-media?instanceId={instance_id}"
         
         # 3. HEADERS CONFORME DOCUMENTAÇÃO
         headers = {
@@ -1344,8 +1315,19 @@ def download_media_via_wapi(instance_id, bearer_token, media_data):
         print(f"   Headers: {json.dumps({k: v[:20] + '...' if k == 'Authorization' else v for k, v in headers.items()}, indent=2)}")
         print(f"   Payload: {json.dumps(payload, indent=2)}")
         
-        # Tentar múltiplas vezes
-        max_retries = 3
+        # Link ainda válido de um pedido anterior: baixar sem chamar a W-API
+        link_em_cache = file_links.get_cached(instance_id, media_data['mediaKey'])
+        if link_em_cache:
+            print(f"♻️ fileLink em cache para {media_data.get('messageId') or media_data['mediaKey'][:12]}")
+            file_path = salvar_midia_do_file_link(link_em_cache, instance_id, media_data, 0)
+            if file_path:
+                return file_path
+            # Recusado antes do expires: pedir um novo
+            file_links.invalidate(instance_id, media_data['mediaKey'])
+        
+        # Novas tentativas com espera ficam com o agendador (core.media_retry),
+        # não dentro da requisição do webhook
+        max_retries = settings.MULTICHAT_SETTINGS.get('WAPI_DOWNLOAD_INLINE_RETRIES', 1)
         for attempt in range(max_retries):
             try:
                 response = requests.post(url, headers=headers, json=payload, timeout=30)
@@ -1366,32 +1348,9 @@ def download_media_via_wapi(instance_id, bearer_token, media_data):
                         # CORREÇÃO FINAL: Baixar o arquivo e retornar caminho
                         file_link = data.get('fileLink')
                         if file_link:
-                            # Obter dados para save_media_file
-                            from core.models import WhatsappInstance
-                            try:
-                                instance = WhatsappInstance.objects.get(instance_id=instance_id)
-                                cliente = instance.cliente
-                                
-                                # Salvar arquivo e retornar caminho
-                                file_path = save_media_file(
-                                    file_link=file_link,
-                                    media_type=media_data['type'],
-                                    message_id=f"download_{attempt}_{int(time.time())}",  # ID temporário
-                                    sender_name="Sistema",
-                                    cliente=cliente,
-                                    instance=instance
-                                )
-                                
-                                if file_path:
-                                    print(f"✅ Arquivo baixado e salvo: {file_path}")
-                                    return file_path
-                                else:
-                                    print(f"❌ Falha ao salvar arquivo")
-                                    return None
-                                    
-                            except Exception as e:
-                                print(f"❌ Erro ao salvar arquivo: {e}")
-                                return None
+                            # Reprocessamentos e re-downloads reaproveitam o link até expirar
+                            file_links.store(instance_id, media_data['mediaKey'], file_link, data.get('expires'))
+                            return salvar_midia_do_file_link(file_link, instance_id, media_data, attempt)
                         else:
                             print(f"❌ fileLink não encontrado na resposta")
                             return None
@@ -1433,8 +1392,38 @@ def download_media_via_wapi(instance_id, bearer_token, media_data):
         traceback.print_exc()
         return None
 
-def save_media_file(file_link, media_type, message_id, sender_name, cliente, instance):
-    """Salva arquivo de mídia baixado"""
+def salvar_midia_do_file_link(file_link, instance_id, media_data, attempt):
+    """Baixa o fileLink da W-API e salva a mídia da instância; retorna o caminho ou None"""
+    import time
+    from core.models import WhatsappInstance
+    try:
+        instance = WhatsappInstance.objects.get(instance_id=instance_id)
+        cliente = instance.cliente
+        
+        # Salvar arquivo e retornar caminho
+        file_path = save_media_file(
+            file_link=file_link,
+            media_type=media_data['type'],
+            message_id=media_data.get('messageId') or f"download_{attempt}_{int(time.time())}",  # ID temporário
+            sender_name="Sistema",
+            cliente=cliente,
+            instance=instance,
+            file_sha256=media_data.get('fileSha256')
+        )
+        
+        if file_path:
+            print(f"✅ Arquivo baixado e salvo: {file_path}")
+            return file_path
+        else:
+            print(f"❌ Falha ao salvar arquivo")
+            return None
+            
+    except Exception as e:
+        print(f"❌ Erro ao salvar arquivo: {e}")
+        return None
+
+def save_media_file(file_link, media_type, message_id, sender_name, cliente, instance, file_sha256=None):
+    """Salva arquivo de mídia baixado (e registra no armazenamento deduplicado por conteúdo)"""
     try:
         import requests
         from pathlib import Path
@@ -1449,20 +1438,12 @@ def save_media_file(file_link, media_type, message_id, sender_name, cliente, ins
             return None
         
         # Determinar extensão baseada no tipo
-        extensions = {
-            'image': '.jpg',
-            'video': '.mp4',
-            'audio': '.mp3',
-            'document': '.pdf',
-            'sticker': '.webp'
-        }
-        
-        ext = extensions.get(media_type, '.bin')
+        ext = EXTENSOES_MIDIA.get(media_type, '.bin')
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"wapi_{message_id}_{timestamp}{ext}"
         
         # Criar pasta de destino
-        media_storage_path = Path(__file__).parent.parent / "media_storage" / f"cliente_{cliente.id}" / f"instance_{instance.instance_id}" / media_type
+        media_storage_path = get_media_storage_dir() / f"cliente_{cliente.id}" / f"instance_{instance.instance_id}" / media_type
         media_storage_path.mkdir(parents=True, exist_ok=True)
         
         # Salvar arquivo
@@ -1473,6 +1454,13 @@ def save_media_file(file_link, media_type, message_id, sender_name, cliente, ins
         print(f"✅ Arquivo salvo: {file_path}")
         print(f"📏 Tamanho: {len(response.content)} bytes")
         
+        # Próximas mensagens com o mesmo conteúdo não precisam baixar de novo
+        try:
+            armazenado = adopt_file(file_path, file_sha256)
+            file_sha256 = file_sha256 or base64.b64encode(bytes.fromhex(armazenado['sha256'])).decode()
+        except Exception as e:
+            print(f"⚠️ Falha ao deduplicar arquivo: {e}")
+        
         # Criar registro no banco
         from core.models import MediaFile
         from django.utils import timezone
@@ -1485,6 +1473,7 @@ def save_media_file(file_link, media_type, message_id, sender_name, cliente, ins
             existing_media.file_name = filename
             existing_media.file_path = str(file_path)
             existing_media.file_size = len(response.content)
+            existing_media.file_sha256 = file_sha256 or existing_media.file_sha256
             existing_media.download_status = 'success'
             existing_media.download_timestamp = timezone.now()
             existing_media.save()
@@ -1503,6 +1492,7 @@ def save_media_file(file_link, media_type, message_id, sender_name, cliente, ins
                 file_name=filename,
                 file_path=str(file_path),
                 file_size=len(response.content),
+                file_sha256=file_sha256,
                 download_status='success',
                 download_timestamp=timezone.now(),
                 message_timestamp=timezone.now(),
@@ -1512,6 +1502,7 @@ def save_media_file(file_link, media_type, message_id, sender_name, cliente, ins
             print(f"✅ Registro criado no banco: {media_file.id}")
         
         print(f"✅ Registro criado no banco: {media_file.id}")
+        schedule_quota_check(cliente.id)
         return str(file_path)
         
     except Exception as e:
@@ -1532,7 +1523,7 @@ def criar_pasta_audio_automatica(chat, instance, message_id):
         instance_id = instance.instance_id
         chat_id = chat.chat_id
         
-        audio_path = Path(__file__).parent.parent / "media_storage" / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "audio"
+        audio_path = get_media_storage_dir() / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "audio"
         
         # Criar pasta se não existir
         audio_path.mkdir(parents=True, exist_ok=True)
@@ -1557,7 +1548,7 @@ def criar_pasta_imagem_automatica(chat, instance, message_id):
         instance_id = instance.instance_id
         chat_id = chat.chat_id
         
-        image_path = Path(__file__).parent.parent / "media_storage" / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "imagens"
+        image_path = get_media_storage_dir() / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "imagens"
         
         # Criar pasta se não existir
         image_path.mkdir(parents=True, exist_ok=True)
@@ -1582,7 +1573,7 @@ def criar_pasta_video_automatica(chat, instance, message_id):
         instance_id = instance.instance_id
         chat_id = chat.chat_id
         
-        video_path = Path(__file__).parent.parent / "media_storage" / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "videos"
+        video_path = get_media_storage_dir() / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "videos"
         
         # Criar pasta se não existir
         video_path.mkdir(parents=True, exist_ok=True)
@@ -1607,7 +1598,7 @@ def criar_pasta_documento_automatica(chat, instance, message_id):
         instance_id = instance.instance_id
         chat_id = chat.chat_id
         
-        documento_path = Path(__file__).parent.parent / "media_storage" / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "documentos"
+        documento_path = get_media_storage_dir() / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "documentos"
         
         # Criar pasta se não existir
         documento_path.mkdir(parents=True, exist_ok=True)
@@ -1632,7 +1623,7 @@ def criar_pasta_sticker_automatica(chat, instance, message_id):
         instance_id = instance.instance_id
         chat_id = chat.chat_id
         
-        sticker_path = Path(__file__).parent.parent / "media_storage" / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "stickers"
+        sticker_path = get_media_storage_dir() / f"cliente_{cliente_id}" / f"instance_{instance_id}" / "chats" / str(chat_id) / "stickers"
         
         # Criar pasta se não existir
         sticker_path.mkdir(parents=True, exist_ok=True)
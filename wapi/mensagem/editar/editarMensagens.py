@@ -6,17 +6,18 @@ import logging
 logger = logging.getLogger(__name__)
 
 class EditarMensagem:
-    def __init__(self, instance_id, token):
+    def __init__(self, instance_id, token, base_url="https://api.w-api.app/v1/message"):
         """
         Inicializa o editor de mensagens
 
         Args:
             instance_id (str): ID da instância do WhatsApp
             token (str): Token de autorização da API
+            base_url (str): URL base dos endpoints de mensagem
         """
         self.instance_id = instance_id
         self.token = token
-        self.base_url = "https://api.w-api.app/v1/message"
+        self.base_url = base_url.rstrip('/')
         self.headers = {
             'Content-Type': 'application/json',
             'Authorization': f'Bearer {self.token}'
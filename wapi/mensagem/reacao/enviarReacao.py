@@ -3,18 +3,20 @@ import json
 
 
 class EnviarReacao:
-    def __init__(self, instance_id, token):
+    def __init__(self, instance_id, token, base_url="https://api.w-api.app/v1/"):
         """
         Inicializa o enviador de reações
 
         Args:
             instance_id (str): ID da instância do WhatsApp
             token (str): Token de autorização da API
+            base_url (str): URL base da W-API
         """
         self.instance_id = instance_id
         self.token = token
-        self.base_url = "https://api.w-api.app/v1/message/send-reaction"
-        self.remove_url = "https://api.w-api.app/v1/message/remove-reaction"
+        base_url = base_url.rstrip('/')
+        self.base_url = f"{base_url}/message/send-reaction"
+        self.remove_url = f"{base_url}/message/remove-reaction"
         self.headers = {
             "Authorization": f"Bearer {self.token}",
             "Content-Type": "application/json"